@@ -0,0 +1,138 @@
+"""Measure the CPU time each DynamoDB backend spends on a request.
+
+The resource based ``DynamoDBBackend``, the low level
+``DynamoDBClientBackend`` and the ``DynamoDBHTTPClient`` transport all send
+their requests to a stub HTTP server running in a child process, which
+answers every request with a canned response. Everything each backend does
+to make a request, from building it to parsing the response, happens in
+this process, and its CPU time per call is reported for each kind of
+request and for a whole acquire and release of a lock::
+
+    python -m benchmarks.client_overhead --calls 2000
+"""
+import os
+import time
+import argparse
+import multiprocessing
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import boto3
+
+from lynk.session import Session
+from lynk.backends.dynamodb import DynamoDBBackendBridgeFactory
+from lynk.backends.dynamodb_client import DynamoDBClientBackendBridgeFactory
+from lynk.backends.dynamodb_http import DynamoDBHTTPBackendBridgeFactory
+
+
+GET_RESPONSE = (
+    b'{"Item": {"versionNumber": {"S": "a"}, "leaseDuration": {"N": "20"},'
+    b' "expiresAt": {"N": "1000"}}}'
+)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'{}'
+        if self.headers['X-Amz-Target'].endswith('GetItem'):
+            body = GET_RESPONSE
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    server.serve_forever()
+
+
+def _session():
+    return boto3.session.Session(
+        aws_access_key_id='benchmark',
+        aws_secret_access_key='benchmark',
+        region_name='us-east-1',
+    )
+
+
+def _cpu_time_per_call(calls, fn):
+    fn()
+    start = time.process_time()
+    for _ in range(calls):
+        fn()
+    return (time.process_time() - start) / calls
+
+
+def run(factory, calls):
+    bridge, backend = factory.create('benchmark')
+    item = {
+        'lockKey': 'benchmark', 'versionNumber': 'a', 'leaseDuration': 20,
+        'hostIdentifier': 'host', 'writeTime': 1000, 'expiresAt': 21000,
+    }
+    key = {'lockKey': 'benchmark'}
+    lock = Session(
+        'benchmark', backend_bridge_factory=factory,
+    ).create_lock('benchmark', auto_refresh=False)
+
+    def cycle():
+        lock.acquire()
+        lock.release()
+
+    return {
+        'put': _cpu_time_per_call(calls, lambda: backend.put(
+            item, condition=bridge.lock_free_or_lease_elapsed(1000))),
+        'update': _cpu_time_per_call(calls, lambda: backend.update(
+            key, {'versionNumber': 'b', 'expiresAt': 22000},
+            condition=bridge.we_own_lock('a'))),
+        'delete': _cpu_time_per_call(calls, lambda: backend.delete(
+            key, condition=bridge.we_own_lock('b'))),
+        'get': _cpu_time_per_call(calls, lambda: backend.get(
+            key, ['leaseDuration', 'versionNumber', 'expiresAt'])),
+        'acquire + release': _cpu_time_per_call(calls, cycle),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000,
+                        help='Calls to time for each kind of request.')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    endpoint_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    process = multiprocessing.get_context('fork').Process(
+        target=_serve, args=(server,))
+    process.daemon = True
+    process.start()
+    server.server_close()
+    # The boto3 based backends have no endpoint option of their own.
+    os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = endpoint_url
+
+    factories = [
+        ('resource', DynamoDBBackendBridgeFactory(session=_session())),
+        ('client', DynamoDBClientBackendBridgeFactory(session=_session())),
+        ('http', DynamoDBHTTPBackendBridgeFactory(
+            session=_session(), endpoint_url=endpoint_url)),
+    ]
+    try:
+        results = [(name, run(factory, args.calls))
+                   for name, factory in factories]
+    finally:
+        process.terminate()
+    row = '%18s' + ' %14s' * len(results)
+    print(row % (('request',) + tuple(
+        '%s (us)' % name for name, _ in results)))
+    for request in results[0][1]:
+        print(row % ((request,) + tuple(
+            '%.1f' % (result[request] * 1e6) for _, result in results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Measure write amplification when many clients contend for one lock.
+
+Every contender acquires the same lock once, holds it briefly and releases
+it. The number of backend writes per successful acquire is reported for each
+wait strategy, both when every attempt is a conditional write and when
+waiters poll with reads first, and with the contenders queued locally so the
+lock is handed between them::
+
+    python -m benchmarks.contention --contenders 100
+"""
+import time
+import argparse
+import threading
+
+from lynk.session import Session
+from lynk.wait import LeaseWaitStrategy
+from lynk.wait import ExponentialBackoffWaitStrategy
+
+from benchmarks.counting import CountingBackendBridgeFactory
+
+
+# Combinations of poll_with_reads and coalesce_waiters to run.
+MODES = [(False, False), (True, False), (False, True)]
+
+
+def run(strategy, contenders, lease, hold, latency, poll_with_reads=False,
+        coalesce_waiters=False):
+    backend_bridge_factory = CountingBackendBridgeFactory(latency=latency)
+    backend = backend_bridge_factory.backend
+    session = Session(
+        'benchmark',
+        backend_bridge_factory=backend_bridge_factory,
+        max_clock_skew=0,
+        wait_strategy=strategy,
+        poll_with_reads=poll_with_reads,
+        coalesce_waiters=coalesce_waiters,
+    )
+    barrier = threading.Barrier(contenders)
+    errors = []
+
+    def contend():
+        lock = session.create_lock('hot lock', auto_refresh=False)
+        barrier.wait()
+        try:
+            lock.acquire(lease_duration=lease, max_wait_seconds=3600)
+            time.sleep(hold)
+            lock.release()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=contend) for _ in range(contenders)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    counts = dict(backend.counts)
+    # Locks are not refreshed, so every update is a hand off.
+    acquires = counts['put'] - counts['failed_put'] + counts['update']
+    writes = counts['put'] + counts['update']
+    return {
+        'acquires': acquires,
+        'errors': len(errors),
+        'puts': counts['put'],
+        'failed_puts': counts['failed_put'],
+        'hand_offs': counts['update'],
+        'gets': counts['get'],
+        'writes_per_acquire': float(writes) / max(acquires, 1),
+        'seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--contenders', type=int, default=100)
+    parser.add_argument('--lease', type=float, default=0.05,
+                        help='Lease duration in seconds.')
+    parser.add_argument('--hold', type=float, default=0.002,
+                        help='Seconds each contender holds the lock.')
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help='Simulated backend round trip in seconds.')
+    parser.add_argument('--cap', type=float, default=0.2,
+                        help='Maximum backoff in seconds.')
+    args = parser.parse_args()
+
+    strategies = [
+        ('lease', LeaseWaitStrategy()),
+        ('full jitter', ExponentialBackoffWaitStrategy(
+            base=args.hold, cap=args.cap, min_interval=args.hold / 2)),
+        ('decorrelated jitter', ExponentialBackoffWaitStrategy(
+            base=args.hold, cap=args.cap, min_interval=args.hold / 2,
+            jitter='decorrelated')),
+    ]
+    row = '%-20s %5s %9s %9s %7s %12s %10s %6s %17s %8s'
+    print(row % ('strategy', 'poll', 'coalesce', 'acquires', 'puts',
+                 'failed puts', 'hand offs', 'gets', 'writes / acquire',
+                 'seconds'))
+    for name, strategy in strategies:
+        for poll_with_reads, coalesce_waiters in MODES:
+            result = run(strategy, args.contenders, args.lease, args.hold,
+                         args.latency, poll_with_reads, coalesce_waiters)
+            print(row % (
+                name, 'yes' if poll_with_reads else 'no',
+                'yes' if coalesce_waiters else 'no', result['acquires'],
+                result['puts'], result['failed_puts'], result['hand_offs'],
+                result['gets'], '%.2f' % result['writes_per_acquire'],
+                '%.2f' % result['seconds'],
+            ))
+
+
+if __name__ == '__main__':
+    main()
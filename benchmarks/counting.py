@@ -0,0 +1,76 @@
+"""An in-memory backend that counts the requests made to it."""
+import threading
+import time
+
+from lynk.backends.memory import MemoryBackendBridgeFactory
+
+
+class CountingBackend(object):
+    """Wrap a backend, counting the requests made through it.
+
+    :param backend: The backend requests are passed on to.
+    :param latency: Seconds to sleep before every request, to simulate a
+        network round trip. Requests sleep concurrently, like requests over
+        separate connections would.
+    """
+    def __init__(self, backend, latency=0):
+        self._backend = backend
+        self._latency = latency
+        self.MAX_TRANSACTION_ITEMS = backend.MAX_TRANSACTION_ITEMS
+        self.SUPPORTS_TRANSACTIONS = backend.SUPPORTS_TRANSACTIONS
+        self._lock = threading.Lock()
+        self.counts = {
+            'put': 0, 'failed_put': 0, 'update': 0, 'delete': 0, 'get': 0,
+            'transact_write': 0,
+        }
+
+    def _request(self, name):
+        if self._latency:
+            time.sleep(self._latency)
+        with self._lock:
+            self.counts[name] += 1
+
+    def put(self, item, condition=None):
+        self._request('put')
+        try:
+            self._backend.put(item, condition=condition)
+        except Exception:
+            with self._lock:
+                self.counts['failed_put'] += 1
+            raise
+
+    def update(self, key, updates, condition=None):
+        self._request('update')
+        self._backend.update(key, updates, condition=condition)
+
+    def delete(self, key, condition=None):
+        self._request('delete')
+        self._backend.delete(key, condition=condition)
+
+    def get(self, key, attributes, consistent=True):
+        self._request('get')
+        return self._backend.get(key, attributes, consistent=consistent)
+
+    def transact_write(self, operations):
+        self._request('transact_write')
+        self._backend.transact_write(operations)
+
+
+class CountingBackendBridgeFactory(object):
+    """Create backends that count their requests.
+
+    Every backend created shares one table and one set of counts.
+
+    :param latency: Seconds to sleep before every request.
+    :param backend_bridge_factory: Creates the bridge and backend of the
+        table. By default an in-memory one.
+    """
+    def __init__(self, latency=0, backend_bridge_factory=None):
+        if backend_bridge_factory is None:
+            backend_bridge_factory = MemoryBackendBridgeFactory()
+        bridge, backend = backend_bridge_factory.create('benchmark')
+        self.bridge = bridge
+        self.backend = CountingBackend(backend, latency=latency)
+
+    def create(self, table_name):
+        return self.bridge, self.backend
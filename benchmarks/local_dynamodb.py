@@ -0,0 +1,319 @@
+"""A local stand-in for DynamoDB that benchmarks can run against offline.
+
+Like moto, it answers the DynamoDB JSON protocol over HTTP and keeps items
+in memory, so locks taken through it behave as they would against a real
+table. It only understands the requests lynk makes: ``PutItem``,
+``UpdateItem``, ``DeleteItem``, ``GetItem`` and ``TransactWriteItems`` on
+tables keyed by ``lockKey``, with condition expressions built from
+``attribute_not_exists``, ``attribute_exists`` and comparisons joined by
+``AND`` and ``OR``. Tables spring into existence on first use.
+
+The server runs in a child process, so its work does not compete for the
+GIL with the process being measured.
+"""
+import re
+import json
+import decimal
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import boto3
+
+from lynk.backends.dynamodb_http import DynamoDBHTTPBackendBridgeFactory
+
+
+_ERROR_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+_TOKENS = re.compile(r'\s*(<>|<=|>=|[()=<>,]|[#:]?\w+)')
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+class ConditionalCheckFailed(Exception):
+    def __init__(self, existing_item):
+        super(ConditionalCheckFailed, self).__init__()
+        self.existing_item = existing_item
+
+
+def _comparable(value):
+    if value is None:
+        return None
+    if 'N' in value:
+        return decimal.Decimal(value['N'])
+    return value.get('S')
+
+
+class _Condition(object):
+    # Evaluates a condition expression against an item by recursive descent.
+    def __init__(self, expression, names, values):
+        self._tokens = _TOKENS.findall(expression)
+        self._names = names or {}
+        self._values = values or {}
+
+    def matches(self, item):
+        self._item = item or {}
+        self._position = 0
+        result = self._or()
+        if self._position != len(self._tokens):
+            raise ValueError('Unexpected %r' % self._peek())
+        return result
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _or(self):
+        result = self._and()
+        while self._peek() == 'OR':
+            self._next()
+            # Both sides are parsed whatever the left side was.
+            right = self._and()
+            result = result or right
+        return result
+
+    def _and(self):
+        result = self._operand()
+        while self._peek() == 'AND':
+            self._next()
+            right = self._operand()
+            result = result and right
+        return result
+
+    def _operand(self):
+        token = self._next()
+        if token == '(':
+            result = self._or()
+            self._next()
+            return result
+        if token == 'NOT':
+            return not self._operand()
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self._next()
+            exists = self._names[self._next()] in self._item
+            self._next()
+            return exists == (token == 'attribute_exists')
+        compare = _COMPARISONS[self._next()]
+        left = _comparable(self._item.get(self._names[token]))
+        right = _comparable(self._values[self._next()])
+        if left is None or type(left) is not type(right):
+            return False
+        return compare(left, right)
+
+
+class LocalDynamoDB(object):
+    """The tables of the stand-in and the requests that act on them."""
+    def __init__(self):
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    def handle(self, operation, request):
+        with self._lock:
+            return getattr(self, '_%s' % operation)(request)
+
+    def _table(self, request):
+        return self._tables.setdefault(request['TableName'], {})
+
+    def _check(self, request, item):
+        expression = request.get('ConditionExpression')
+        if expression is None:
+            return
+        condition = _Condition(
+            expression, request.get('ExpressionAttributeNames'),
+            request.get('ExpressionAttributeValues'))
+        if not condition.matches(item):
+            existing_item = None
+            if request.get('ReturnValuesOnConditionCheckFailure') == \
+                    'ALL_OLD':
+                existing_item = item
+            raise ConditionalCheckFailed(existing_item)
+
+    def _key(self, request):
+        if 'Item' in request:
+            return request['Item']['lockKey']['S']
+        return request['Key']['lockKey']['S']
+
+    def _apply(self, kind, request):
+        table = self._table(request)
+        key = self._key(request)
+        if kind == 'Put':
+            table[key] = request['Item']
+        elif kind == 'Delete':
+            table.pop(key, None)
+        elif kind == 'Update':
+            item = dict(table.get(key) or request['Key'])
+            names = request.get('ExpressionAttributeNames', {})
+            values = request['ExpressionAttributeValues']
+            assignments = request['UpdateExpression'][len('SET '):]
+            for assignment in assignments.split(','):
+                name, value = assignment.split('=')
+                item[names[name.strip()]] = values[value.strip()]
+            table[key] = item
+
+    def _write(self, kind, request):
+        self._check(request, self._table(request).get(self._key(request)))
+        self._apply(kind, request)
+        return {}
+
+    def _PutItem(self, request):
+        return self._write('Put', request)
+
+    def _UpdateItem(self, request):
+        return self._write('Update', request)
+
+    def _DeleteItem(self, request):
+        return self._write('Delete', request)
+
+    def _GetItem(self, request):
+        item = self._table(request).get(self._key(request))
+        if item is None:
+            return {}
+        projection = request.get('ProjectionExpression')
+        if projection is not None:
+            names = request.get('ExpressionAttributeNames', {})
+            attributes = [
+                names.get(name.strip(), name.strip())
+                for name in projection.split(',')
+            ]
+            item = dict((name, item[name])
+                        for name in attributes if name in item)
+        return {'Item': item}
+
+    def _TransactWriteItems(self, request):
+        operations = []
+        for transact_item in request['TransactItems']:
+            (kind, operation), = transact_item.items()
+            operations.append((kind, operation))
+        reasons = []
+        failed = False
+        for kind, operation in operations:
+            try:
+                self._check(operation, self._table(operation).get(
+                    self._key(operation)))
+                reasons.append({'Code': 'None'})
+            except ConditionalCheckFailed as e:
+                failed = True
+                reason = {'Code': 'ConditionalCheckFailed'}
+                if e.existing_item is not None:
+                    reason['Item'] = e.existing_item
+                reasons.append(reason)
+        if failed:
+            return _Error('TransactionCanceledException', {
+                'CancellationReasons': reasons})
+        for kind, operation in operations:
+            if kind != 'ConditionCheck':
+                self._apply(kind, operation)
+        return {}
+
+
+class _Error(object):
+    def __init__(self, code, fields):
+        self.code = code
+        self.fields = fields
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        request = json.loads(
+            self.rfile.read(int(self.headers['Content-Length'])))
+        operation = self.headers['X-Amz-Target'].rsplit('.', 1)[-1]
+        try:
+            response = self.server.dynamodb.handle(operation, request)
+        except ConditionalCheckFailed as e:
+            response = _Error('ConditionalCheckFailedException', {})
+            if e.existing_item is not None:
+                response.fields['Item'] = e.existing_item
+        status = 200
+        if isinstance(response, _Error):
+            status = 400
+            response = dict(response.fields, **{
+                '__type': _ERROR_PREFIX + response.code,
+                'message': response.code,
+            })
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    # Every contender of a benchmark may connect at once.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _serve(server):
+    server.serve_forever()
+
+
+class LocalDynamoDBServer(object):
+    """Serve a :class:`LocalDynamoDB` from a child process.
+
+    Use it as a context manager, which starts the server and stops it on
+    exit::
+
+        with LocalDynamoDBServer() as server:
+            session = Session(
+                'locks', backend_bridge_factory=server.bridge_factory())
+    """
+    def __init__(self):
+        self._process = None
+        self.endpoint_url = None
+
+    def start(self):
+        server = _Server(('127.0.0.1', 0), _Handler)
+        server.dynamodb = LocalDynamoDB()
+        self.endpoint_url = 'http://127.0.0.1:%s' % server.server_address[1]
+        self._process = multiprocessing.get_context('fork').Process(
+            target=_serve, args=(server,))
+        self._process.daemon = True
+        self._process.start()
+        server.server_close()
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def bridge_factory(self, max_pool_connections=None):
+        """Create a backend bridge factory sending requests to the server.
+
+        :type max_pool_connections: int or None
+        :param max_pool_connections: The most idle connections kept open.
+        """
+        session = boto3.session.Session(
+            aws_access_key_id='benchmark',
+            aws_secret_access_key='benchmark',
+            region_name='us-east-1',
+        )
+        return DynamoDBHTTPBackendBridgeFactory(
+            session=session, endpoint_url=self.endpoint_url,
+            max_pool_connections=max_pool_connections)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
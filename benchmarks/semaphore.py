@@ -0,0 +1,114 @@
+"""Measure semaphore throughput as permits, shards and contenders scale.
+
+Every contender repeatedly acquires a permit, holds it briefly and releases
+it until the run is over. The number of permits granted per second, the
+backend writes per grant and the most permits ever held at once are
+reported for each combination::
+
+    python -m benchmarks.semaphore --duration 2
+"""
+import time
+import argparse
+import threading
+
+from lynk.session import Session
+from lynk.exceptions import LockNotGrantedError
+
+from benchmarks.counting import CountingBackendBridgeFactory
+
+
+# Combinations of permits, shards and contenders to run. A shard count of
+# None uses the default.
+SCENARIOS = [
+    (10, 1, 20),
+    (10, None, 20),
+    (50, 1, 100),
+    (50, None, 100),
+    (200, 1, 400),
+    (200, None, 400),
+]
+
+
+def run(permits, shards, contenders, hold, latency, duration):
+    backend_bridge_factory = CountingBackendBridgeFactory(latency=latency)
+    backend = backend_bridge_factory.backend
+    session = Session(
+        'benchmark',
+        backend_bridge_factory=backend_bridge_factory,
+        max_clock_skew=0,
+    )
+    semaphore = session.create_semaphore(
+        'partner api', permits, shards=shards, auto_refresh=False)
+    barrier = threading.Barrier(contenders)
+    state = {'held': 0, 'max_held': 0, 'grants': 0}
+    state_lock = threading.Lock()
+
+    def contend(end_time):
+        barrier.wait()
+        while time.time() < end_time:
+            try:
+                permit = semaphore.acquire(
+                    lease_duration=60, max_wait_seconds=end_time - time.time())
+            except LockNotGrantedError:
+                # The run ended while this contender was waiting.
+                return
+            with state_lock:
+                state['held'] += 1
+                state['grants'] += 1
+                state['max_held'] = max(state['max_held'], state['held'])
+            time.sleep(hold)
+            with state_lock:
+                state['held'] -= 1
+            permit.release()
+
+    end_time = time.time() + duration
+    threads = [
+        threading.Thread(target=contend, args=(end_time,))
+        for _ in range(contenders)
+    ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    counts = dict(backend.counts)
+    writes = counts['put']
+    return {
+        'shards': semaphore._technique.shards,
+        'grants': state['grants'],
+        'max_held': state['max_held'],
+        'grants_per_second': state['grants'] / elapsed,
+        'writes_per_grant': float(writes) / max(state['grants'], 1),
+        'failed_writes': counts['failed_put'],
+        'gets': counts['get'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=2,
+                        help='Seconds to run each scenario for.')
+    parser.add_argument('--hold', type=float, default=0.005,
+                        help='Seconds each permit is held.')
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help='Simulated backend round trip in seconds.')
+    args = parser.parse_args()
+
+    row = '%8s %7s %12s %8s %9s %14s %16s %14s %7s'
+    print(row % ('permits', 'shards', 'contenders', 'grants', 'max held',
+                 'grants / sec', 'writes / grant', 'failed writes',
+                 'gets'))
+    for permits, shards, contenders in SCENARIOS:
+        result = run(permits, shards, contenders, args.hold, args.latency,
+                     args.duration)
+        print(row % (
+            permits, result['shards'], contenders, result['grants'],
+            result['max_held'], '%.0f' % result['grants_per_second'],
+            '%.2f' % result['writes_per_grant'], result['failed_writes'],
+            result['gets'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""Measure lock throughput, contention latency, refresh cost and memory.
+
+Every scenario runs without a network, against either the in-memory backend
+or a local stand-in for DynamoDB served from a child process, with a
+simulated round trip added to each backend request:
+
+* ``uncontended`` - One client acquires, refreshes and releases a lock over
+  and over. Reports operations per second and latency percentiles of each.
+* ``contention`` - Groups of 1 to 1,000 clients acquire one lock at once.
+  Reports acquire latency percentiles and writes per acquire at each size.
+* ``refresh`` - One client holds 10,000 locks and refreshes them all, one at
+  a time and then batched the way the background refresher does. Reports
+  the time and backend requests each pass takes.
+* ``memory`` - Bytes of client memory each held lock takes, not counting
+  the in-memory backend's copy of the lock entry.
+
+The stand-in answers from one process on the same machine, so with many
+contenders it can be the bottleneck, and contention results against it are
+only comparable between runs on the same machine.
+
+Results are written as JSON with a flat set of metric names, and a results
+file from another commit can be compared against::
+
+    python -m benchmarks.suite --output after.json --compare before.json
+"""
+import gc
+import copy
+import json
+import time
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+import tracemalloc
+
+from lynk.session import Session
+from lynk.metrics import Histogram
+from lynk.refresh import BatchLockRefresher
+from lynk.wait import ExponentialBackoffWaitStrategy
+from lynk.backends import memory
+
+from benchmarks.counting import CountingBackendBridgeFactory
+from benchmarks.local_dynamodb import LocalDynamoDBServer
+
+
+SCENARIOS = ('uncontended', 'contention', 'refresh', 'memory')
+# Long enough that no lock expires or is refreshed in the background while
+# a scenario runs.
+LEASE = 600
+
+
+def _record_latency(results, prefix, histogram):
+    snapshot = histogram.snapshot()
+    for name in ('p50', 'p99', 'max'):
+        results['%s.%s_seconds' % (prefix, name)] = snapshot[name]
+
+
+def _session(factory, **kwargs):
+    return Session('benchmark', backend_bridge_factory=factory,
+                   max_clock_skew=0, **kwargs)
+
+
+def uncontended(create_factory, iterations):
+    lock = _session(create_factory()).create_lock(
+        'uncontended', auto_refresh=False)
+    operations = [
+        ('acquire', lambda: lock.acquire(lease_duration=LEASE)),
+        ('refresh', lock.refresh),
+        ('release', lock.release),
+    ]
+    histograms = dict((name, Histogram()) for name, _ in operations)
+    totals = dict((name, 0.0) for name, _ in operations)
+    for _ in range(iterations):
+        for name, operation in operations:
+            start = time.perf_counter()
+            operation()
+            elapsed = time.perf_counter() - start
+            histograms[name].record(elapsed)
+            totals[name] += elapsed
+    results = {}
+    for name, _ in operations:
+        prefix = 'uncontended.%s' % name
+        results[prefix + '.ops_per_second'] = iterations / totals[name]
+        _record_latency(results, prefix, histograms[name])
+    return results
+
+
+def contention(create_factory, contenders, hold, cap):
+    factory = create_factory()
+    session = _session(factory, wait_strategy=ExponentialBackoffWaitStrategy(
+        base=hold, cap=cap, min_interval=hold / 2))
+    barrier = threading.Barrier(contenders)
+    histogram = Histogram()
+    errors = []
+
+    def contend():
+        lock = session.create_lock('hot lock', auto_refresh=False)
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            lock.acquire(lease_duration=LEASE, max_wait_seconds=3600)
+            histogram.record(time.perf_counter() - start)
+            time.sleep(hold)
+            lock.release()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=contend) for _ in range(contenders)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    counts = factory.backend.counts
+    prefix = 'contention.%d' % contenders
+    results = {
+        prefix + '.seconds': elapsed,
+        prefix + '.writes_per_acquire': float(
+            counts['put'] + counts['update']) / contenders,
+    }
+    _record_latency(results, prefix + '.acquire', histogram)
+    return results
+
+
+def refresh(create_factory, count):
+    factory = create_factory()
+    session = _session(factory)
+    locks = [session.create_lock('held lock %d' % i, auto_refresh=False)
+             for i in range(count)]
+    for lock in locks:
+        lock.acquire(lease_duration=LEASE)
+
+    def each():
+        for lock in locks:
+            lock.refresh()
+
+    def batched():
+        failures = BatchLockRefresher().refresh(locks)
+        if failures:
+            raise list(failures.values())[0]
+
+    results = {}
+    for name, refresh_all in (('each', each), ('batched', batched)):
+        before = sum(factory.backend.counts.values())
+        start = time.perf_counter()
+        refresh_all()
+        prefix = 'refresh.%d.%s' % (count, name)
+        results[prefix + '.seconds'] = time.perf_counter() - start
+        results[prefix + '.requests'] = \
+            sum(factory.backend.counts.values()) - before
+    for lock in locks:
+        lock.release()
+    return results
+
+
+def memory_per_lock(create_factory, count):
+    session = _session(create_factory())
+    # Open connections and start the refresher before measuring.
+    with session.create_lock('warm up')(LEASE):
+        pass
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    locks = [session.create_lock('held lock %d' % i) for i in range(count)]
+    for lock in locks:
+        lock.acquire(lease_duration=LEASE)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # The in-memory backend's table stands in for DynamoDB's storage.
+    backend_files = [
+        tracemalloc.Filter(False, memory.__file__),
+        tracemalloc.Filter(False, copy.__file__),
+    ]
+    stats = after.filter_traces(backend_files).compare_to(
+        before.filter_traces(backend_files), 'filename')
+    allocated = sum(stat.size_diff for stat in stats)
+    for lock in locks:
+        lock.release()
+    return {'memory.bytes_per_held_lock': float(allocated) / count}
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, create_factory):
+    scenarios = args.scenarios.split(',')
+    results = {}
+    if 'uncontended' in scenarios:
+        results.update(uncontended(create_factory, args.iterations))
+    if 'contention' in scenarios:
+        for contenders in args.contenders:
+            results.update(contention(
+                create_factory, contenders, args.hold, args.cap))
+    if 'refresh' in scenarios:
+        results.update(refresh(create_factory, args.locks))
+    if 'memory' in scenarios:
+        results.update(memory_per_lock(create_factory, args.locks))
+    return results
+
+
+def report(results, baseline=None):
+    if baseline is None:
+        for name in sorted(results):
+            print('%-48s %14.6g' % (name, results[name]))
+        return
+    print('%-48s %14s %14s %8s' % ('metric', 'before', 'after', 'change'))
+    for name in sorted(results):
+        before = baseline.get(name)
+        if not before:
+            print('%-48s %14s %14.6g' % (name, '-', results[name]))
+            continue
+        change = (results[name] - before) * 100.0 / before
+        print('%-48s %14.6g %14.6g %+7.1f%%' % (
+            name, before, results[name], change))
+
+
+def _contenders(value):
+    return [int(count) for count in value.split(',')]
+
+
+def _scenarios(value):
+    for scenario in value.split(','):
+        if scenario not in SCENARIOS:
+            raise argparse.ArgumentTypeError(
+                'Unknown scenario %s, choose from %s' % (
+                    scenario, ', '.join(SCENARIOS)))
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('memory', 'local-dynamodb'),
+                        default='memory')
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help='Simulated backend round trip in seconds.')
+    parser.add_argument('--scenarios', type=_scenarios,
+                        default=','.join(SCENARIOS),
+                        help='Comma separated scenarios to run.')
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='Acquire, refresh and release cycles to time '
+                             'without contention.')
+    parser.add_argument('--contenders', type=_contenders,
+                        default=[1, 10, 100, 1000],
+                        help='Comma separated numbers of contenders.')
+    parser.add_argument('--hold', type=float, default=0.001,
+                        help='Seconds each contender holds the lock.')
+    parser.add_argument('--cap', type=float, default=0.2,
+                        help='Maximum backoff in seconds.')
+    parser.add_argument('--locks', type=int, default=10000,
+                        help='Locks held to measure refreshes and memory.')
+    parser.add_argument('--output', help='File to write JSON results to.')
+    parser.add_argument('--compare',
+                        help='JSON results of an earlier run to compare to.')
+    args = parser.parse_args()
+
+    server = None
+    inner_factory = None
+    if args.backend == 'local-dynamodb':
+        server = LocalDynamoDBServer()
+        server.start()
+        inner_factory = server.bridge_factory(
+            max_pool_connections=max(args.contenders))
+    try:
+        results = run(args, lambda: CountingBackendBridgeFactory(
+            latency=args.latency, backend_bridge_factory=inner_factory))
+    finally:
+        if server is not None:
+            server.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': _commit(),
+                'host': socket.gethostname(),
+                'python': platform.python_version(),
+                'time': time.time(),
+                'arguments': vars(args),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
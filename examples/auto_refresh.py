@@ -21,9 +21,9 @@ class SleepyThread(threading.Thread):
         # We explicitly set the lease duration to be shorter than the ammount
         # of time we hold the lock for. The lease duration is 5 seconds, and
         # we operate on the locked resource for 10 seconds.
-        # This works because we are using an auto refreshing lock, which spins
-        # up a thread to automatically refreshes the lock before the lease
-        # expires. Once the lock is released the refresher thread is destroyed.
+        # This works because we are using an auto refreshing lock, which the
+        # session's background refresher thread refreshes before the lease
+        # expires. Once the lock is released it is no longer refreshed.
         lock = self._session.create_lock('my lock', auto_refresh=True)
         with lock(lease_duration=5):
             LOG.debug('Acquired lock')
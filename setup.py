@@ -26,7 +26,7 @@ def find_version(*file_paths):
 
 
 requires = [
-    'boto3>=1.4.7'
+    'boto3>=1.26.165'
 ]
 
 
@@ -38,6 +38,7 @@ setup_options = dict(
     author='John Carlyle',
     url='https://github.com/stealthycoin/lynk',
     install_requires=requires,
+    python_requires='>=3.6',
     scripts=['bin/lynk'],
     package_dir={"": "src"},
     packages=find_packages(where="src", exclude=['tests*']),
@@ -48,8 +49,6 @@ setup_options = dict(
         'Natural Language :: English',
         'License :: OSI Approved :: Apache Software License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.6',
     ),
@@ -0,0 +1,10 @@
+"""asyncio versions of lynk's sessions and locks.
+
+Everything in this package requires Python 3.5 or newer, so it is not
+imported by :mod:`lynk` itself.
+"""
+from lynk.aio.session import AsyncSession
+from lynk.aio.lock import AsyncLock
+
+
+__all__ = ['AsyncSession', 'AsyncLock']
@@ -0,0 +1,79 @@
+"""Backends that can be used from a running event loop."""
+import asyncio
+import functools
+
+from lynk.backends.base import BaseBackend
+
+
+class AsyncBaseBackend(object):
+    """The asynchronous counterpart of :class:`lynk.backends.base.BaseBackend`.
+
+    Every method has the same arguments and behavior as its synchronous
+    counterpart, but is a coroutine.
+    """
+    MAX_TRANSACTION_ITEMS = BaseBackend.MAX_TRANSACTION_ITEMS
+    SUPPORTS_TRANSACTIONS = BaseBackend.SUPPORTS_TRANSACTIONS
+
+    async def put(self, item, condition=None):
+        raise NotImplementedError('put')
+
+    async def update(self, key, updates, condition=None):
+        raise NotImplementedError('update')
+
+    async def delete(self, key, condition=None):
+        raise NotImplementedError('delete')
+
+    async def get(self, key, attributes, consistent=True):
+        raise NotImplementedError('get')
+
+    async def transact_write(self, operations):
+        raise NotImplementedError('transact_write')
+
+
+class ExecutorBackend(AsyncBaseBackend):
+    """Adapt a synchronous backend by running its calls in an executor.
+
+    This keeps blocking network calls, such as the ones boto3 makes, off the
+    event loop. It is not asynchronous I/O though. Each request in flight
+    occupies one of the executor's threads, so the number of them at once is
+    bounded by the size of the executor, and a request waiting for a thread
+    is delayed however long the ones ahead of it take.
+
+    :type backend: :class:`lynk.backends.base.BaseBackend`
+    :param backend: The synchronous backend to adapt.
+
+    :type executor: :class:`concurrent.futures.Executor`
+    :param executor: The executor to run calls in. If None the event loop's
+        default executor is used.
+    """
+    def __init__(self, backend, executor=None):
+        self._backend = backend
+        self._executor = executor
+        self.MAX_TRANSACTION_ITEMS = getattr(
+            backend, 'MAX_TRANSACTION_ITEMS',
+            BaseBackend.MAX_TRANSACTION_ITEMS)
+        self.SUPPORTS_TRANSACTIONS = getattr(
+            backend, 'SUPPORTS_TRANSACTIONS', False)
+
+    async def put(self, item, condition=None):
+        return await self._run(self._backend.put, item, condition=condition)
+
+    async def update(self, key, updates, condition=None):
+        return await self._run(
+            self._backend.update, key, updates=updates, condition=condition)
+
+    async def delete(self, key, condition=None):
+        return await self._run(self._backend.delete, key, condition=condition)
+
+    async def get(self, key, attributes, consistent=True):
+        return await self._run(
+            self._backend.get, key, attributes=attributes,
+            consistent=consistent)
+
+    async def transact_write(self, operations):
+        return await self._run(self._backend.transact_write, operations)
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(fn, *args, **kwargs))
@@ -0,0 +1,174 @@
+import json
+
+from lynk.exceptions import NoSuchLockError
+
+
+class AsyncLock(object):
+    """The asyncio counterpart of :class:`lynk.lock.Lock`.
+
+    This object should not be initialized directly, but created from a
+    :class:`lynk.aio.session.AsyncSession`. It can be used as an async
+    context manager, either directly or by calling it to pass arguments::
+
+        async with session.create_lock('my lock')(lease_duration=10):
+            ...
+    """
+    _REFRESH_PERIOD_RATIO = 3.0 / 4.0
+
+    def __init__(self, name, technique, refresher_factory=None, holds=None):
+        self._name = name
+        self._technique = technique
+        self._refresher_factory = refresher_factory
+        self._refresher = None
+        self._holds = holds
+
+    async def acquire(self, lease_duration=20, max_wait_seconds=300,
+                      deadline=None):
+        """Try to aquire this lock.
+
+        To give up early, cancel the task awaiting this coroutine.
+
+        :type lease_duration: int
+        :param lease_duration: The number of seconds to hold the lock for
+            initially.
+
+        :type max_wait_seconds: float
+        :param max_wait_seconds: Number of seconds to wait to aquire the lock
+            before giving up and raising a
+            :class:`lynk.exceptions.LockNotGrantedError`.
+
+        :type deadline: float
+        :param deadline: A time, by the clock of this lock's technique, to
+            give up at. If both this and ``max_wait_seconds`` are given,
+            whichever comes first is used.
+        """
+        if self._holds is not None and self._holds.enter(self._name):
+            return
+        await self._technique.acquire(
+            self._name,
+            lease_duration,
+            max_wait_seconds=max_wait_seconds,
+            deadline=deadline,
+        )
+        self._acquired(lease_duration)
+
+    async def try_acquire(self, lease_duration=20):
+        """Make a single attempt to acquire this lock without waiting.
+
+        :rtype: bool
+        :returns: True if the lock was acquired, False if it is in use.
+        """
+        if self._holds is not None and self._holds.enter(self._name):
+            return True
+        if not await self._technique.try_acquire(self._name, lease_duration):
+            return False
+        self._acquired(lease_duration)
+        return True
+
+    async def release(self):
+        """Release this lock.
+
+        A reentrant lock is only released in the backend once every acquire
+        made by the current task has been matched by a release.
+        """
+        if self._holds is None:
+            await self._release()
+            return
+        holder = self._holds.exit(self._name)
+        if holder is not None:
+            await holder._release()
+
+    async def refresh(self):
+        """Refresh this lock."""
+        holder = self._holder()
+        await holder._technique.refresh(self._name)
+
+    @property
+    def supports_batch_refresh(self):
+        """Whether this lock can be refreshed in a batch with others."""
+        return self._technique.SUPPORTS_TRANSACTIONS
+
+    async def prepare_refresh(self):
+        """Prepare a refresh of this lock to be sent later in a batch.
+
+        Only supported if :attr:`supports_batch_refresh` is true.
+
+        :rtype: :class:`lynk.techniques.PendingRefresh`
+        """
+        holder = self._holder()
+        return await holder._technique.prepare_refresh(self._name)
+
+    def __call__(self, lease_duration=20, timeout_seconds=300):
+        return _AsyncLockContext(self, lease_duration, timeout_seconds)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.release()
+
+    def _acquired(self, lease_duration):
+        self._start_refresher(lease_duration)
+        if self._holds is not None:
+            self._holds.claim(self._name, self)
+
+    async def _release(self):
+        self._stop_refresher()
+        await self._technique.release(self._name)
+
+    def _holder(self):
+        if self._holds is None:
+            return self
+        holder = self._holds.holder(self._name, self)
+        if holder is None:
+            raise NoSuchLockError()
+        return holder
+
+    def _start_refresher(self, lease_duration):
+        if self._refresher_factory is None:
+            return
+        self._refresher = self._refresher_factory.create_lock_refresher(
+            self,
+            lease_duration * self._REFRESH_PERIOD_RATIO,
+        )
+        self._refresher.start()
+
+    def _stop_refresher(self):
+        if not self._refresher:
+            return
+        self._refresher.stop()
+        self._refresher = None
+
+    async def serialize(self):
+        """Serialize this lock to a UTF-8 string.
+
+        The serialized lock can be restored by either a
+        :class:`lynk.aio.session.AsyncSession` or a
+        :class:`lynk.session.Session` bound to the same table.
+        """
+        self._stop_refresher()
+        await self.refresh()
+        properties = {
+            '__version': 'Lock.1',
+            'name': self._name,
+            'technique': self._technique.serialize(),
+        }
+        return json.dumps(properties)
+
+
+class _AsyncLockContext(object):
+    def __init__(self, lock, lease_duration, max_wait_seconds):
+        self._lock = lock
+        self._lease_duration = lease_duration
+        self._max_wait_seconds = max_wait_seconds
+
+    async def __aenter__(self):
+        await self._lock.acquire(
+            lease_duration=self._lease_duration,
+            max_wait_seconds=self._max_wait_seconds,
+        )
+        return self._lock
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._lock.release()
@@ -0,0 +1,189 @@
+import asyncio
+import logging
+
+from lynk.exceptions import LockLostError
+from lynk.exceptions import TransactionConflictError
+from lynk.refresh import drop_conflicts
+from lynk.refresh import group_by_backend
+from lynk.refresh import should_retry_refresh
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncScheduledLockRefresher(object):
+    """A handle to a lock refresh run by an AsyncLockRefreshScheduler."""
+    __slots__ = ('_scheduler', 'lock', 'refresh_period_seconds', 'handle',
+                 'cancelled')
+
+    def __init__(self, scheduler, lock, refresh_period_seconds):
+        self._scheduler = scheduler
+        self.lock = lock
+        self.refresh_period_seconds = refresh_period_seconds
+        self.handle = None
+        self.cancelled = False
+
+    def start(self):
+        self._scheduler.register(self)
+
+    def stop(self):
+        self._scheduler.unregister(self)
+
+
+class AsyncLockRefreshScheduler(object):
+    """Refresh locks from timers on the running event loop.
+
+    Each lock refresh is a timer handle on the event loop, which keeps its
+    timers in a heap, so scheduling and cancelling refreshes stays cheap
+    with tens of thousands of locks and no threads are needed. Refreshes that
+    come due within ``batch_window`` seconds of each other are handed to an
+    :class:`lynk.aio.refresh.AsyncBatchLockRefresher` together.
+
+    Like :class:`lynk.refresh.LockRefreshScheduler` it stops refreshing a
+    lock once it turns out to be lost, and tries other failed refreshes
+    again after a tenth of the refresh period.
+
+    :type batch_window: float
+    :param batch_window: Number of seconds to wait after a refresh comes due
+        for others to batch it with. Should be small relative to the refresh
+        period of the locks.
+    """
+    _RETRY_PERIOD_RATIO = 0.1
+
+    def __init__(self, batch_window=0, batch_refresher=None):
+        if batch_refresher is None:
+            batch_refresher = AsyncBatchLockRefresher()
+        self._batch_refresher = batch_refresher
+        self._batch_window = batch_window
+        self._due = []
+        self._flush_handle = None
+        # The event loop only keeps weak references to tasks.
+        self._tasks = set()
+
+    def create_lock_refresher(self, lock, refresh_period_seconds):
+        return AsyncScheduledLockRefresher(self, lock, refresh_period_seconds)
+
+    def register(self, refresher):
+        refresher.cancelled = False
+        self._arm(refresher)
+
+    def unregister(self, refresher):
+        refresher.cancelled = True
+        if refresher.handle is not None:
+            refresher.handle.cancel()
+            refresher.handle = None
+
+    def _arm(self, refresher, delay=None):
+        if delay is None:
+            delay = refresher.refresh_period_seconds
+        loop = asyncio.get_event_loop()
+        refresher.handle = loop.call_later(delay, self._on_due, refresher)
+
+    def _on_due(self, refresher):
+        refresher.handle = None
+        self._due.append(refresher)
+        if self._flush_handle is None:
+            loop = asyncio.get_event_loop()
+            self._flush_handle = loop.call_later(
+                self._batch_window, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        due = [refresher for refresher in self._due if not refresher.cancelled]
+        self._due = []
+        if due:
+            task = asyncio.ensure_future(self._refresh(due))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, refreshers):
+        failures = await self._batch_refresher.refresh(
+            [refresher.lock for refresher in refreshers])
+        for refresher in refreshers:
+            delay = None
+            error = failures.get(refresher.lock)
+            if error is not None:
+                if not should_retry_refresh(error):
+                    continue
+                delay = refresher.refresh_period_seconds * \
+                    self._RETRY_PERIOD_RATIO
+            if not refresher.cancelled and refresher.handle is None:
+                self._arm(refresher, delay)
+
+
+class AsyncBatchLockRefresher(object):
+    """Refresh many async locks using as few backend requests as possible.
+
+    This works the same way as :class:`lynk.refresh.BatchLockRefresher`,
+    with transactional writes sent through an
+    :class:`lynk.aio.backends.AsyncBaseBackend`.
+    """
+    async def refresh(self, locks):
+        """Refresh a list of locks.
+
+        :type locks: list
+        :param locks: The :class:`lynk.aio.lock.AsyncLock` objects to
+            refresh.
+
+        :rtype: dict
+        :returns: A dictionary mapping each lock that could not be refreshed
+            to the exception explaining why.
+        """
+        failures = {}
+        prepared = []
+        for lock in locks:
+            if not getattr(lock, 'supports_batch_refresh', False):
+                await self._refresh_one(lock, failures)
+                continue
+            try:
+                prepared.append((lock, await lock.prepare_refresh()))
+            except Exception as e:
+                failures[lock] = e
+        for chunks in group_by_backend(prepared):
+            for chunk in chunks:
+                if len(chunk) == 1:
+                    lock, pending = chunk[0]
+                    await self._send_one(lock, pending, failures)
+                else:
+                    await self._refresh_chunk(chunk, failures)
+        return failures
+
+    async def _refresh_one(self, lock, failures):
+        try:
+            await lock.refresh()
+        except Exception as e:
+            failures[lock] = e
+
+    async def _send_one(self, lock, pending, failures):
+        # The refresh has already been prepared, so it is sent as it is
+        # rather than through lock.refresh, which would prepare another.
+        key, updates, condition = pending.operation
+        try:
+            await pending.backend.update(
+                key, updates=updates, condition=condition)
+        except pending.condition_failed_error:
+            pending.lost()
+            failures[lock] = LockLostError()
+        except Exception as e:
+            failures[lock] = e
+        else:
+            pending.succeeded()
+
+    async def _refresh_chunk(self, chunk, failures):
+        backend = chunk[0][1].backend
+        while chunk:
+            try:
+                await backend.transact_write(
+                    [pending.operation for _, pending in chunk])
+            except TransactionConflictError as e:
+                chunk = drop_conflicts(chunk, e, failures)
+                continue
+            except Exception:
+                LOG.debug('Failed to refresh locks in a transaction, '
+                          'refreshing them one at a time.', exc_info=True)
+                for lock, pending in chunk:
+                    await self._send_one(lock, pending, failures)
+                return
+            for _, pending in chunk:
+                pending.succeeded()
+            return
@@ -0,0 +1,203 @@
+import json
+import socket
+
+from lynk.backends.dynamodb import DynamoDBBackendBridgeFactory
+from lynk.exceptions import CannotDeserializeError
+from lynk.reentrant import LocalHolds
+from lynk.metrics import InstrumentedBackend
+from lynk.aio.lock import AsyncLock
+from lynk.aio.refresh import AsyncLockRefreshScheduler
+from lynk.aio.backends import AsyncBaseBackend
+from lynk.aio.backends import ExecutorBackend
+from lynk.aio.techniques import AsyncVersionLeaseTechnique
+from lynk.aio.utils import current_task
+
+
+class AsyncSession(object):
+    """The asyncio counterpart of :class:`lynk.session.Session`.
+
+    Locks created by an ``AsyncSession`` never block the event loop. Their
+    backend calls are awaited, waits are :func:`asyncio.sleep` calls, and
+    they are refreshed by timers on the event loop instead of threads.
+
+    lynk does not ship a natively asynchronous backend. The built in
+    backends, DynamoDB's included, are synchronous and run in an executor,
+    so the number of backend requests in flight at once is bounded by the
+    executor's threads rather than by the event loop. Waiting and refreshing
+    cost no threads, so this is usually enough, but a session holding tens
+    of thousands of leases should be given a large enough ``executor``, or
+    a ``backend_bridge_factory`` creating an
+    :class:`lynk.aio.backends.AsyncBaseBackend`.
+
+    :type table_name: str
+    :param table_name: Name of the table in the backend.
+
+    :type host_identifier: str
+    :param host_identifier: A unique identifier for a host, by default the
+        hostname.
+
+    :type backend_bridge_factory: Anything with a create method or None.
+    :param backend_bridge_factory: A factory that creates our backend and
+        its associated bridge class, by default a
+        :class:`lynk.backends.dynamodb.DynamoDBBackendBridgeFactory`. If the
+        backend it creates is not an
+        :class:`lynk.aio.backends.AsyncBaseBackend` its calls are run in an
+        executor by wrapping it in a
+        :class:`lynk.aio.backends.ExecutorBackend`.
+
+    :type max_clock_skew: float
+    :param max_clock_skew: The maximum number of seconds the clocks of any
+        two hosts sharing locks are expected to differ by.
+
+    :type wait_strategy: :class:`lynk.wait.BaseWaitStrategy`
+    :param wait_strategy: Decides how long to wait between attempts to
+        acquire a lock that is in use.
+
+    :type poll_with_reads: bool
+    :param poll_with_reads: If ``True`` waiting locks poll with eventually
+        consistent reads, and only write once the lock looks free.
+
+    :type executor: :class:`concurrent.futures.Executor`
+    :param executor: The executor synchronous backend calls are run in. If
+        None the event loop's default executor is used.
+
+    :type reentrant_locks: bool
+    :param reentrant_locks: If ``True`` locks created by this session are
+        reentrant by default. A task holding a lock name can acquire it again
+        without a backend request, and the name is only released in the
+        backend when the outermost acquire is released.
+
+    :type metrics: :class:`lynk.metrics.MetricsHook`
+    :param metrics: Told the same measurements as by a
+        :class:`lynk.session.Session`. By default nothing is measured.
+    """
+    _REFRESH_BATCH_WINDOW = 0.5
+
+    def __init__(self, table_name, host_identifier=None,
+                 backend_bridge_factory=None, max_clock_skew=None,
+                 wait_strategy=None, poll_with_reads=False, executor=None,
+                 reentrant_locks=False, metrics=None):
+        self._table_name = table_name
+        if host_identifier is None:
+            host_identifier = socket.gethostname()
+        self._host_identifier = host_identifier
+        if backend_bridge_factory is None:
+            backend_bridge_factory = DynamoDBBackendBridgeFactory()
+        self._backend_bridge_factory = backend_bridge_factory
+        self._max_clock_skew = max_clock_skew
+        self._wait_strategy = wait_strategy
+        self._poll_with_reads = poll_with_reads
+        self._executor = executor
+        self._reentrant_locks = reentrant_locks
+        self._holds = LocalHolds(get_owner=current_task)
+        self._metrics = metrics
+        self._bridge_and_backend = None
+        self._refresh_scheduler = AsyncLockRefreshScheduler(
+            batch_window=self._REFRESH_BATCH_WINDOW,
+        )
+
+    def create_lock(self, lock_name, auto_refresh=True, reentrant=None):
+        """Create a new lock object.
+
+        :type lock_name: str
+        :param lock_name: Logical name of the lock in the backend.
+
+        :type auto_refresh: bool
+        :param auto_refresh: If ``True`` the created lock is refreshed by
+            timers on the event loop it is acquired on.
+
+        :type reentrant: bool
+        :param reentrant: If ``True`` the lock is reentrant for the task
+            holding it. By default the session's ``reentrant_locks`` setting
+            is used.
+
+        :rtype: :class:`lynk.aio.lock.AsyncLock`
+        """
+        bridge, backend = self._get_bridge_and_backend()
+        technique = AsyncVersionLeaseTechnique(
+            bridge,
+            backend,
+            host_identifier=self._host_identifier,
+            max_clock_skew=self._max_clock_skew,
+            wait_strategy=self._wait_strategy,
+            poll_with_reads=self._poll_with_reads,
+            metrics=self._metrics,
+        )
+        if reentrant is None:
+            reentrant = self._reentrant_locks
+        holds = None
+        if reentrant:
+            holds = self._holds
+        return self._create_lock(lock_name, technique, auto_refresh, holds)
+
+    async def deserialize_lock(self, serialized_lock, auto_refresh=True):
+        """Create a lock object from a serialized lock.
+
+        Locks serialized by a :class:`lynk.session.Session` can be
+        deserialized here as well. Deserialized locks are never reentrant.
+
+        :type serialized_lock: str
+        :param serialized_lock: The serialized lock.
+
+        :type auto_refresh: bool
+        :param auto_refresh: If ``True`` the created lock will automatically
+            refresh itself.
+
+        :rtype: :class:`lynk.aio.lock.AsyncLock`
+        """
+        bridge, backend = self._get_bridge_and_backend()
+        data = json.loads(serialized_lock)
+        version = data.get('__version')
+        if not version:
+            raise CannotDeserializeError(
+                "Serialized data does not contain a lock.")
+        if version != 'Lock.1':
+            raise CannotDeserializeError(
+                "Unsupported serialized data version. Found %s, expected "
+                "Lock.1" % version)
+        try:
+            lock_name = data['name']
+            serialized_technique = data['technique']
+        except KeyError:
+            raise CannotDeserializeError(
+                "Missing property. Needs both 'name' and 'technique' "
+                "properties."
+            )
+        technique = AsyncVersionLeaseTechnique.from_serialized_technique(
+            serialized_technique,
+            bridge,
+            backend,
+            host_identifier=self._host_identifier,
+            max_clock_skew=self._max_clock_skew,
+            wait_strategy=self._wait_strategy,
+            poll_with_reads=self._poll_with_reads,
+            metrics=self._metrics,
+        )
+        lock = self._create_lock(lock_name, technique, auto_refresh)
+        await lock.refresh()
+        return lock
+
+    def _create_lock(self, lock_name, technique, auto_refresh, holds=None):
+        refresher_factory = None
+        if auto_refresh:
+            refresher_factory = self._refresh_scheduler
+        return AsyncLock(
+            lock_name,
+            technique,
+            refresher_factory=refresher_factory,
+            holds=holds,
+        )
+
+    def _get_bridge_and_backend(self):
+        # Everything happens on one event loop, so unlike Session no lock is
+        # needed around creating the shared backend.
+        if self._bridge_and_backend is None:
+            bridge, backend = self._backend_bridge_factory.create(
+                self._table_name)
+            if not isinstance(backend, AsyncBaseBackend):
+                if self._metrics is not None:
+                    backend = InstrumentedBackend(
+                        backend, self._metrics, bridge.ConditionFailedError)
+                backend = ExecutorBackend(backend, self._executor)
+            self._bridge_and_backend = bridge, backend
+        return self._bridge_and_backend
@@ -0,0 +1,344 @@
+from lynk.techniques import VersionLeaseTechinque
+from lynk.wait import AcquireTimer
+from lynk.wait import limit_to_deadline
+from lynk.exceptions import LockAlreadyInUseError
+from lynk.exceptions import LockLostError
+from lynk.exceptions import TransactionConflictError
+from lynk.aio.utils import AsyncTimeUtils
+
+
+class AsyncVersionLeaseTechnique(object):
+    """The version lease technique for use from a running event loop.
+
+    The algorithm is exactly the one described in
+    :class:`lynk.techniques.VersionLeaseTechinque`, and locks serialized by
+    either one can be deserialized by the other. The difference is that
+    ``acquire``, ``try_acquire``, ``acquire_many``, ``release``,
+    ``release_many``, ``refresh``, ``refresh_many`` and
+    ``prepare_refresh`` are coroutines that await an
+    :class:`lynk.aio.backends.AsyncBaseBackend`, and waiting between attempts
+    is done with :func:`asyncio.sleep`.
+
+    The parts of the algorithm that never talk to the backend, such as
+    building entries and conditions and deciding how long to wait, are those
+    of a :class:`lynk.techniques.VersionLeaseTechinque` it keeps. That
+    technique's own backend calls are never made, so nothing here blocks the
+    event loop.
+
+    An acquire is cancelled by cancelling the task running it. If that
+    happens while a write is in flight the lock may still have been taken,
+    in which case it is freed when its lease runs out.
+
+    Release notifications and local wait queues rely on threads, so they are
+    not supported.
+    """
+    def __init__(self, backend_bridge, backend, host_identifier=None,
+                 time_utils=None, max_clock_skew=None, wait_strategy=None,
+                 poll_with_reads=False, metrics=None):
+        if time_utils is None:
+            time_utils = AsyncTimeUtils()
+        self._core = VersionLeaseTechinque(
+            backend_bridge,
+            backend,
+            host_identifier=host_identifier,
+            time_utils=time_utils,
+            max_clock_skew=max_clock_skew,
+            wait_strategy=wait_strategy,
+            poll_with_reads=poll_with_reads,
+            metrics=metrics,
+        )
+        self._backend_bridge = backend_bridge
+        self._backend = backend
+        self._time_utils = time_utils
+        self._wait_strategy = self._core._wait_strategy
+        self._poll_with_reads = poll_with_reads
+
+    @property
+    def SUPPORTS_TRANSACTIONS(self):
+        return getattr(self._backend, 'SUPPORTS_TRANSACTIONS', False)
+
+    @classmethod
+    def from_serialized_technique(cls, serialized_technique, backend_bridge,
+                                  backend, host_identifier=None,
+                                  time_utils=None, max_clock_skew=None,
+                                  wait_strategy=None, poll_with_reads=False,
+                                  metrics=None):
+        data = VersionLeaseTechinque._load_serialized(serialized_technique)
+        tech = cls(backend_bridge, backend, host_identifier, time_utils,
+                   max_clock_skew, wait_strategy, poll_with_reads, metrics)
+        tech._core._restore(data)
+        return tech
+
+    async def acquire(self, name, lease_duration, max_wait_seconds,
+                      deadline=None):
+        """Acquire a lock.
+
+        :type name: str
+        :param name: Logical name of the lock being aquired.
+
+        :type lease_duration: int
+        :param lease_duration: Number of seconds to acquire the lock.
+
+        :type max_wait_seconds: int
+        :param max_wait_seconds: Maximum number of seconds to wait till
+            giving up on acquiring the lock.
+
+        :type deadline: float
+        :param deadline: A time, by this technique's clock, to give up at.
+            If both this and ``max_wait_seconds`` are given, whichever comes
+            first is used.
+        """
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        version = self._core._create_version_number()
+        attempts, slept = 1, 0
+        try:
+            await self._try_write_lock(
+                name,
+                lease_duration,
+                version,
+                self._backend_bridge.lock_free(),
+            )
+        except LockAlreadyInUseError as prior_lock:
+            timer = AcquireTimer(
+                self._time_utils, self._wait_strategy, max_wait_seconds,
+                start_time)
+            await self._try_steal_lock(
+                name, lease_duration, prior_lock, timer)
+            attempts, slept = timer.attempts + 1, timer.slept
+        self._core._acquired(name, attempts, started, slept)
+
+    async def try_acquire(self, name, lease_duration):
+        """Make a single attempt to acquire a lock without waiting.
+
+        :rtype: bool
+        :returns: True if the lock was acquired.
+        """
+        started = self._time_utils.perf_counter()
+        cutoff = self._core._to_millis(
+            self._time_utils.time() - self._core._max_clock_skew)
+        try:
+            await self._write_lock(
+                name,
+                lease_duration,
+                self._core._create_version_number(),
+                self._backend_bridge.lock_free_or_lease_elapsed(cutoff),
+            )
+        except self._backend_bridge.ConditionFailedError:
+            return False
+        self._core._acquired(name, 1, started, 0)
+        return True
+
+    async def _try_steal_lock(self, name, lease_duration, prior_lock, timer):
+        version = self._core._create_version_number()
+        waited_on_prior = 0
+        attempts_on_prior = 0
+        while True:
+            now = self._time_utils.time()
+            sleep_time = timer.next_sleep(now, self._core._remaining_lease(
+                prior_lock, now, waited_on_prior, attempts_on_prior))
+            await self._time_utils.sleep(sleep_time)
+            timer.waited(sleep_time)
+            waited_on_prior += sleep_time
+            attempts_on_prior += 1
+            try:
+                if self._poll_with_reads:
+                    prior_lock = await self._poll_lock(
+                        name, prior_lock, waited_on_prior)
+                await self._try_write_lock(
+                    name,
+                    lease_duration,
+                    version,
+                    self._core._steal_condition(prior_lock, waited_on_prior),
+                )
+                return
+            except LockAlreadyInUseError as next_prior_lock:
+                if next_prior_lock.version_number != prior_lock.version_number:
+                    waited_on_prior = 0
+                    attempts_on_prior = 0
+                prior_lock = next_prior_lock
+
+    async def _poll_lock(self, name, prior_lock, waited_on_prior):
+        lock_info = await self._backend.get(
+            {'lockKey': name},
+            attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            consistent=False,
+        )
+        return self._core._check_polled_lock(
+            lock_info, prior_lock, waited_on_prior)
+
+    async def _try_write_lock(self, name, lease_duration, version, condition):
+        try:
+            await self._write_lock(name, lease_duration, version, condition)
+        except self._backend_bridge.ConditionFailedError as e:
+            await self._raise_lock_in_use(name, e)
+
+    async def _write_lock(self, name, lease_duration, version, condition):
+        item = self._core._lock_item(name, lease_duration, version)
+        await self._backend.put(item, condition=condition)
+        self._core._lock_written(name, lease_duration, version, item)
+
+    async def _raise_lock_in_use(self, name, error):
+        lock_info = getattr(error, 'existing_item', None)
+        if lock_info is None:
+            lock_info = await self._backend.get(
+                {'lockKey': name},
+                attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            )
+        raise self._core._lock_in_use_error(lock_info)
+
+    async def acquire_many(self, names, lease_duration, max_wait_seconds,
+                           deadline=None):
+        """Atomically acquire several locks.
+
+        :type names: list
+        :param names: Logical names of the locks to acquire. At most the
+            backend's ``MAX_TRANSACTION_ITEMS`` locks can be acquired at once.
+
+        The rest of the arguments are the same as those of :meth:`acquire`.
+        """
+        names = self._core._names_to_acquire(names)
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        timer = AcquireTimer(
+            self._time_utils, self._wait_strategy, max_wait_seconds,
+            start_time)
+        versions = {
+            name: self._core._create_version_number() for name in names
+        }
+        contended = {}
+        while True:
+            in_use = await self._try_write_locks(
+                names, lease_duration, versions, contended)
+            if not in_use:
+                for name in names:
+                    self._core._acquired(
+                        name, timer.attempts + 1, started, timer.slept)
+                return
+            now = self._time_utils.time()
+            sleep_time = timer.next_sleep(
+                now, self._core._contended_lease(contended, in_use, now))
+            await self._time_utils.sleep(sleep_time)
+            timer.waited(sleep_time)
+            self._core._waited_on_contended(contended, sleep_time)
+
+    async def _try_write_locks(self, names, lease_duration, versions,
+                               contended):
+        try:
+            await self._backend.transact_write(self._core._lock_operations(
+                names, lease_duration, versions, contended))
+        except TransactionConflictError as e:
+            in_use = {}
+            for i in e.failed_indexes:
+                lock_info = e.existing_items.get(i)
+                if lock_info is None:
+                    lock_info = await self._backend.get(
+                        {'lockKey': names[i]},
+                        attributes=[
+                            'leaseDuration', 'versionNumber', 'expiresAt'],
+                    )
+                in_use[names[i]] = self._core._lock_in_use_error(lock_info)
+            return in_use
+        self._core._locks_written(names, lease_duration, versions)
+        return {}
+
+    async def release(self, name):
+        """Release a lock.
+
+        :type name: str
+        :param name: Logical name of the lock to release.
+        """
+        try:
+            version_number = self._core._get_version_for_name(name)
+            await self._backend.delete(
+                {'lockKey': name},
+                condition=self._backend_bridge.we_own_lock(version_number),
+            )
+            self._core._forget(name)
+        except self._backend_bridge.ConditionFailedError:
+            self._core._lock_lost(name)
+            raise LockLostError()
+
+    async def release_many(self, names):
+        """Release several locks with a single transaction.
+
+        :type names: list
+        :param names: Logical names of the locks to release.
+
+        :raises: :class:`lynk.exceptions.LockLostError` if any of the locks
+            had been lost. The others are still released.
+        """
+        names = sorted(set(names))
+        lost = await self._transact_write_applicable(
+            self._core._release_operations(names))
+        self._core._released_many(names, lost)
+
+    async def refresh(self, name):
+        """Refresh a lock.
+
+        :type name: str
+        :param name: Logical name of the lock to refresh.
+        """
+        pending = await self.prepare_refresh(name)
+        key, updates, condition = pending.operation
+        try:
+            await self._backend.update(
+                key, updates=updates, condition=condition)
+            pending.succeeded()
+        except self._backend_bridge.ConditionFailedError:
+            pending.lost()
+            raise LockLostError()
+
+    async def refresh_many(self, names):
+        """Refresh several locks with a single transaction.
+
+        :type names: list
+        :param names: Logical names of the locks to refresh.
+
+        :raises: :class:`lynk.exceptions.LockLostError` if any of the locks
+            had been lost. The others are still refreshed.
+        """
+        pending = [
+            await self.prepare_refresh(name) for name in sorted(set(names))
+        ]
+        lost = await self._transact_write_applicable(
+            [refresh.operation for refresh in pending])
+        self._core._refreshed_many(pending, lost)
+
+    async def _transact_write_applicable(self, operations):
+        remaining = list(range(len(operations)))
+        failed = set()
+        while remaining:
+            try:
+                await self._backend.transact_write(
+                    [operations[i] for i in remaining])
+                break
+            except TransactionConflictError as e:
+                conflicts = set(remaining[i] for i in e.failed_indexes)
+                failed.update(conflicts)
+                remaining = [i for i in remaining if i not in conflicts]
+        return failed
+
+    async def prepare_refresh(self, name):
+        """Prepare a refresh of a lock without sending it to the backend.
+
+        :rtype: :class:`lynk.techniques.PendingRefresh`
+        """
+        self._core._get_version_for_name(name)
+        if name not in self._core._leases:
+            lock_info = await self._backend.get(
+                {'lockKey': name},
+                attributes=['leaseDuration'],
+            )
+            if not lock_info:
+                raise LockLostError()
+            self._core._leases[name] = lock_info['leaseDuration']
+        # With the lease known, preparing the refresh needs no more requests.
+        return self._core.prepare_refresh(name)
+
+    def serialize(self):
+        return self._core.serialize()
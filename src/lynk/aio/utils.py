@@ -0,0 +1,17 @@
+import asyncio
+
+from lynk.utils import TimeUtils
+
+
+class AsyncTimeUtils(TimeUtils):
+    async def sleep(self, amt):
+        await asyncio.sleep(amt)
+
+
+def current_task():
+    """Return the task running on the current event loop."""
+    get_current_task = getattr(asyncio, 'current_task', None)
+    if get_current_task is None:
+        # Before Python 3.7 this was only available on Task.
+        get_current_task = asyncio.Task.current_task
+    return get_current_task()
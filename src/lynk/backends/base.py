@@ -1,4 +1,19 @@
+from collections import namedtuple
+
+
+Put = namedtuple('Put', ['item', 'condition'])
+Update = namedtuple('Update', ['key', 'updates', 'condition'])
+Delete = namedtuple('Delete', ['key', 'condition'])
+
+
 class BaseBackend(object):
+    # Maximum number of operations that can be passed to a single call to
+    # transact_write.
+    MAX_TRANSACTION_ITEMS = 100
+    # Whether transact_write is implemented. Callers that can do without
+    # transactions check this rather than calling it to find out.
+    SUPPORTS_TRANSACTIONS = False
+
     def put(self, item, condition=None):
         raise NotImplementedError('put')
 
@@ -8,5 +23,28 @@ class BaseBackend(object):
     def delete(self, key, condition=None):
         raise NotImplementedError('delete')
 
-    def get(self, key, attributes):
+    def get(self, key, attributes, consistent=True):
+        """Get the attributes of an item.
+
+        :type consistent: bool
+        :param consistent: If ``False`` the read may not reflect the most
+            recent writes. Backends that can serve such reads more cheaply
+            should do so.
+        """
         raise NotImplementedError('get')
+
+    def transact_write(self, operations):
+        """Atomically apply a list of write operations.
+
+        Either every operation is applied or none of them are. If the
+        condition on any of the operations fails a
+        :class:`lynk.exceptions.TransactionConflictError` is raised that
+        records the index of each operation whose condition failed.
+
+        :type operations: list
+        :param operations: A list of :class:`lynk.backends.base.Put`,
+            :class:`lynk.backends.base.Update` and
+            :class:`lynk.backends.base.Delete` operations. At most
+            ``MAX_TRANSACTION_ITEMS`` can be provided.
+        """
+        raise NotImplementedError('transact_write')
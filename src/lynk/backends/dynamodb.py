@@ -1,13 +1,27 @@
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
 from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.exceptions import TransactionConflictError
+from lynk.ttl import DELETE_AFTER_ATTRIBUTE
+from lynk.ttl import EXPIRED_ENTRY_RETENTION
+from lynk.utils import TimeUtils
 
 
 class DynamoDBControl(object):
     """Class used to interact with the control plane of DynamoDB."""
-    def __init__(self, table_name, session=None):
+    _DELETE_CONDITION = (
+        '#versionNumber = :versionNumber AND #expiresAt < :cutoff')
+
+    def __init__(self, table_name, session=None, time_utils=None):
         """Initialize DynamoDBControl.
 
         :type table_name: str
@@ -17,10 +31,16 @@ class DynamoDBControl(object):
         :param session: The session to use constructing a dynamodb client.
             By default a new session is created, which will use the standard
             boto3 AWS credential chain to find credentials.
+
+        :type time_utils: :class:`lynk.utils.TimeUtils`
+        :param time_utils: A set of utilities for interacting with time.
         """
         self._table_name = table_name
         if session is None:
             session = boto3.Session()
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
         self._client = session.client('dynamodb')
         self._tags = session.client('resourcegroupstaggingapi')
 
@@ -50,6 +70,7 @@ class DynamoDBControl(object):
         )
         waiter = self._client.get_waiter('table_exists')
         waiter.wait(TableName=self._table_name)
+        self.enable_time_to_live()
 
         table_arn = response['TableDescription']['TableArn']
         self._client.tag_resource(
@@ -62,6 +83,102 @@ class DynamoDBControl(object):
             ]
         )
 
+    def enable_time_to_live(self):
+        """Have DynamoDB delete abandoned lock entries.
+
+        Time to live is enabled on the ``deleteAfter`` attribute every lock
+        entry records, see :func:`lynk.ttl.delete_after`. DynamoDB
+        deletes expired entries in the background, typically within a few
+        days and without using any write capacity. Tables created by
+        :meth:`create` already have it enabled.
+        """
+        self._client.update_time_to_live(
+            TableName=self._table_name,
+            TimeToLiveSpecification={
+                'Enabled': True,
+                'AttributeName': DELETE_AFTER_ATTRIBUTE,
+            },
+        )
+
+    def collect_garbage(self, older_than=EXPIRED_ENTRY_RETENTION,
+                        segments=8):
+        """Delete the lock entries whose lease ran out long ago.
+
+        The table is read by a parallel ``Scan`` split into ``segments``
+        segments, each read by its own thread. Only the entries whose
+        expiresAt is more than ``older_than`` seconds in the past are
+        returned, and each is deleted on the condition that it has not been
+        written since it was read, so a lock acquired in the meantime is
+        left alone. Entries without an expiresAt are never deleted.
+
+        :type older_than: int
+        :param older_than: Seconds since an entry's lease ran out before it
+            is deleted. This must be far more than the clock skew between
+            the agents using the table.
+
+        :type segments: int
+        :param segments: The number of segments to scan in parallel.
+
+        :rtype: int
+        :returns: The number of entries deleted.
+        """
+        cutoff = int((self._time_utils.time() - older_than) * 1000)
+        executor = ThreadPoolExecutor(max_workers=segments)
+        try:
+            deleted = executor.map(
+                lambda segment: self._collect_segment(
+                    segment, segments, cutoff),
+                range(segments),
+            )
+            return sum(deleted)
+        finally:
+            executor.shutdown()
+
+    def _collect_segment(self, segment, segments, cutoff):
+        names = {
+            '#lockKey': 'lockKey',
+            '#versionNumber': 'versionNumber',
+            '#expiresAt': 'expiresAt',
+        }
+        cutoff_value = {'N': str(cutoff)}
+        arguments = {
+            'TableName': self._table_name,
+            'Segment': segment,
+            'TotalSegments': segments,
+            'ProjectionExpression': '#lockKey, #versionNumber, #expiresAt',
+            'FilterExpression': '#expiresAt < :cutoff',
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': {':cutoff': cutoff_value},
+        }
+        deleted = 0
+        while True:
+            response = self._client.scan(**arguments)
+            for item in response.get('Items', []):
+                if self._delete_expired(item, names, cutoff_value):
+                    deleted += 1
+            if 'LastEvaluatedKey' not in response:
+                return deleted
+            arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _delete_expired(self, item, names, cutoff_value):
+        try:
+            self._client.delete_item(
+                TableName=self._table_name,
+                Key={'lockKey': item['lockKey']},
+                ConditionExpression=self._DELETE_CONDITION,
+                ExpressionAttributeNames={
+                    '#versionNumber': names['#versionNumber'],
+                    '#expiresAt': names['#expiresAt'],
+                },
+                ExpressionAttributeValues={
+                    ':versionNumber': item['versionNumber'],
+                    ':cutoff': cutoff_value,
+                },
+            )
+        except self._client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
     def destroy(self):
         """Destroy DymamoDB table.
 
@@ -96,15 +213,86 @@ class DynamoDBControl(object):
 
 
 class DynamoDBBackendBridgeFactory(object):
+    """Create DynamoDB backends and bridges that share one connection pool.
+
+    Building a boto3 session and resource is expensive, it loads service
+    models, resolves credentials and opens new connections. The factory
+    builds the resource lazily the first time it is needed and hands the same
+    one out on every subsequent call to :meth:`create`, so all the backends
+    it creates share a single bounded pool of HTTP connections.
+    """
+    _DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+    def __init__(self, session=None, max_pool_connections=None,
+                 max_attempts=None):
+        """Initialize a DynamoDBBackendBridgeFactory.
+
+        :type session: :class:`boto3.session.Session` or None
+        :param session: The session to use constructing the dynamodb
+            resource. By default a new session is created, which will use the
+            standard boto3 AWS credential chain to find credentials.
+
+        :type max_pool_connections: int or None
+        :param max_pool_connections: The maximum number of HTTP connections
+            kept open to DynamoDB. This bounds the number of concurrent
+            requests all the locks sharing this factory can make. Defaults to
+            10.
+
+        :type max_attempts: int or None
+        :param max_attempts: The most times botocore sends each request,
+            counting the first. Set it to 1 when requests are retried by a
+            :class:`lynk.throttle.RateLimitedBackend`, so that it sees every
+            throttled request. By default botocore's retry configuration is
+            used.
+        """
+        self._session = session
+        if max_pool_connections is None:
+            max_pool_connections = self._DEFAULT_MAX_POOL_CONNECTIONS
+        self._max_pool_connections = max_pool_connections
+        self._max_attempts = max_attempts
+        self._resource = None
+        self._resource_lock = threading.Lock()
+
     def create(self, table_name, session=None):
+        """Create a bridge and backend bound to a DynamoDB table.
+
+        :type table_name: str
+        :param table_name: Name of the DynamoDB table.
+
+        :type session: :class:`boto3.session.Session` or None
+        :param session: If provided a new resource is built from this session
+            rather than using the shared one.
+        """
         if session is None:
-            session = boto3.session.Session()
-        resource = session.resource('dynamodb')
+            resource = self._get_shared_resource()
+        else:
+            resource = self._create_resource(session)
         table = resource.Table(table_name)
         bridge = DynamoDBVersionLeaseBridge(resource)
         backend = DynamoDBBackend(table)
         return bridge, backend
 
+    def _get_shared_resource(self):
+        if self._resource is None:
+            with self._resource_lock:
+                if self._resource is None:
+                    session = self._session
+                    if session is None:
+                        session = boto3.session.Session()
+                    self._resource = self._create_resource(session)
+        return self._resource
+
+    def _create_resource(self, session):
+        # The underlying botocore client is thread safe, and the connection
+        # pool it manages is bounded by max_pool_connections. Table resources
+        # created from it only ever invoke actions on that client, so they can
+        # be shared between threads as well.
+        config = Config(max_pool_connections=self._max_pool_connections)
+        if self._max_attempts is not None:
+            config = config.merge(Config(
+                retries={'total_max_attempts': self._max_attempts}))
+        return session.resource('dynamodb', config=config)
+
 
 class DynamoDBVersionLeaseBridge(object):
     """Acts as a bridge between DynamoDBBackend and VersionLeaseTechinque.
@@ -161,6 +349,26 @@ class DynamoDBVersionLeaseBridge(object):
         """
         return self.lock_free() | self.lock_expired(version_number)
 
+    def lease_elapsed(self, timestamp):
+        """Build the condition that a lock's lease ran out before a time.
+
+        Entries written without an expiresAt never match this condition.
+
+        :type timestamp: int
+        :param timestamp: Milliseconds since the epoch. The lock's expiresAt
+            must be earlier than this.
+        """
+        return Attr('expiresAt').lt(timestamp)
+
+    def lock_free_or_lease_elapsed(self, timestamp):
+        """Build the condition that a lock is free or its lease ran out.
+
+        :type timestamp: int
+        :param timestamp: Milliseconds since the epoch. The lock's expiresAt
+            must be earlier than this.
+        """
+        return self.lock_free() | self.lease_elapsed(timestamp)
+
     def we_own_lock(self, version_number):
         """Build the condition that "we" own this lock.
 
@@ -183,8 +391,23 @@ class DynamoDBVersionLeaseBridge(object):
         own_lock = Attr('versionNumber').eq(version_number)
         return own_lock
 
+    def lock_unchanged(self, version_number):
+        """Build the condition that a lock entry has not been written since
+        it was read.
+
+        Every write to an entry rotates its versionNumber, so this makes a
+        read-modify-write of the entry a compare and swap.
+
+        :type version_number: str
+        :param version_number: The version number of the entry when it was
+            read.
+        """
+        return Attr('versionNumber').eq(version_number)
+
 
 class DynamoDBBackend(BaseBackend):
+    SUPPORTS_TRANSACTIONS = True
+
     def __init__(self, table):
         """Initialize a DynamoDBBackend.
 
@@ -192,15 +415,38 @@ class DynamoDBBackend(BaseBackend):
         :param table: The boto3 table object to operate on.
         """
         self._table = table
+        self._deserializer = TypeDeserializer()
 
     def put(self, item, condition=None):
-        """Put an item into the DynamoDB table."""
+        """Put an item into the DynamoDB table.
+
+        If the condition fails the item that caused it to fail is returned by
+        DynamoDB along with the error, saving a separate read. It is
+        deserialized and attached to the raised exception as
+        ``existing_item``.
+        """
         arguments = {
             'Item': item,
         }
         if condition:
             arguments['ConditionExpression'] = condition
-        self._table.put_item(**arguments)
+            arguments['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+        client = self._table.meta.client
+        try:
+            self._table.put_item(**arguments)
+        except client.exceptions.ConditionalCheckFailedException as e:
+            e.existing_item = self._deserialize_item(e.response.get('Item'))
+            raise
+
+    def _deserialize_item(self, item):
+        # Items returned with errors skip the high level interface's
+        # deserialization, so they are still in the DynamoDB wire format.
+        if item is None:
+            return None
+        return {
+            name: self._deserializer.deserialize(value)
+            for name, value in item.items()
+        }
 
     def update(self, key, updates, condition=None):
         """Update an item in the DynamoDB table.
@@ -217,13 +463,7 @@ class DynamoDBBackend(BaseBackend):
         :param condition: A boto3 dynamodb condition expression to put on the
            update.
         """
-        update_exprs = []
-        update_vals = {}
-        for i, (attr, value) in enumerate(updates.items()):
-            letter = string.ascii_letters[i]
-            update_exprs.append('%s = :%s' % (attr, letter))
-            update_vals[':%s' % letter] = value
-        update_expr = 'set %s' % ', '.join(update_exprs)
+        update_expr, update_vals = self._build_update_expression(updates)
         arguments = {
             'Key': key,
             'UpdateExpression': update_expr,
@@ -233,6 +473,16 @@ class DynamoDBBackend(BaseBackend):
             arguments['ConditionExpression'] = condition
         self._table.update_item(**arguments)
 
+    def _build_update_expression(self, updates):
+        update_exprs = []
+        update_vals = {}
+        for i, (attr, value) in enumerate(updates.items()):
+            letter = string.ascii_letters[i]
+            update_exprs.append('%s = :%s' % (attr, letter))
+            update_vals[':%s' % letter] = value
+        update_expr = 'set %s' % ', '.join(update_exprs)
+        return update_expr, update_vals
+
     def delete(self, key, condition=None):
         """Delete an item from the DynamoDB table."""
         arguments = {
@@ -242,7 +492,7 @@ class DynamoDBBackend(BaseBackend):
             arguments['ConditionExpression'] = condition
         self._table.delete_item(**arguments)
 
-    def get(self, key, attributes):
+    def get(self, key, attributes, consistent=True):
         """Get an item from the DynamoDB Table.
 
         :type name: dict
@@ -251,17 +501,104 @@ class DynamoDBBackend(BaseBackend):
         :type attributes: list
         :param attributes: List of attributes to get from the stored item.
 
+        :type consistent: bool
+        :param consistent: Whether to use a strongly consistent read. An
+            eventually consistent read costs half as many read capacity units.
+
         :rvalue: dict
         :returns: A dictionary of attributeName -> attributeValue for each
-            attribute in the ``attributes`` list.
+            attribute in the ``attributes`` list that the item has.
         """
         result = self._table.get_item(
             Key=key,
             AttributesToGet=attributes,
-            ConsistentRead=True,
+            ConsistentRead=consistent,
         )
 
         if 'Item' not in result:
             return None
         item = result['Item']
-        return {attr: item[attr] for attr in attributes}
+        return {attr: item[attr] for attr in attributes if attr in item}
+
+    def transact_write(self, operations):
+        """Atomically apply write operations with TransactWriteItems.
+
+        :type operations: list
+        :param operations: Up to 100 :class:`lynk.backends.base.Put`,
+            :class:`lynk.backends.base.Update` and
+            :class:`lynk.backends.base.Delete` operations.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any operation fails. The cancellation reasons
+            DynamoDB returns for each item are used to find which ones, and
+            include the existing item for each failed put.
+        """
+        self.transact_write_items([
+            self.build_transact_item(operation) for operation in operations
+        ])
+
+    def transact_write_items(self, transact_items):
+        """Send items built by :meth:`build_transact_item` in a transaction.
+
+        The items can come from the backends of several tables, as long as
+        they share this backend's account and region, so that one transaction
+        writes to all of them.
+
+        :type transact_items: list
+        :param transact_items: Up to 100 TransactItems.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any item fails.
+        """
+        client = self._table.meta.client
+        try:
+            client.transact_write_items(TransactItems=transact_items)
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            failed_indexes = [
+                i for i, reason in enumerate(reasons)
+                if reason.get('Code') == 'ConditionalCheckFailed'
+            ]
+            if not failed_indexes:
+                raise
+            existing_items = {
+                i: self._deserialize_item(reasons[i]['Item'])
+                for i in failed_indexes if 'Item' in reasons[i]
+            }
+            raise TransactionConflictError(failed_indexes, existing_items)
+
+    def build_transact_item(self, operation):
+        """Build the TransactItem that applies an operation to this table.
+
+        :type operation: :class:`lynk.backends.base.Put`,
+            :class:`lynk.backends.base.Update` or
+            :class:`lynk.backends.base.Delete`
+        :param operation: The operation to apply.
+        """
+        # The high level interface that turns condition objects into
+        # expressions only works on top level parameters, so conditions nested
+        # inside TransactItems need to be built explicitly.
+        request = {'TableName': self._table.name}
+        values = {}
+        if isinstance(operation, Put):
+            action = 'Put'
+            request['Item'] = operation.item
+        else:
+            request['Key'] = operation.key
+            action = 'Delete'
+            if isinstance(operation, Update):
+                action = 'Update'
+                request['UpdateExpression'], values = \
+                    self._build_update_expression(operation.updates)
+        if operation.condition:
+            if action == 'Put':
+                request['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+            condition, names, condition_values = \
+                ConditionExpressionBuilder().build_expression(
+                    operation.condition)
+            request['ConditionExpression'] = condition
+            request['ExpressionAttributeNames'] = names
+            values.update(condition_values)
+        if values:
+            request['ExpressionAttributeValues'] = values
+        return {action: request}
@@ -0,0 +1,479 @@
+"""A DynamoDB backend built on the low level client rather than resources.
+
+The boto3 ``Table`` resource builds condition expressions from ``Attr``
+objects and converts every item between Python and DynamoDB types on each
+call. The backend here sends requests straight to the client instead. The
+condition expressions a bridge can build are fixed strings compiled once,
+and update and projection expressions are compiled once for each set of
+attribute names and cached, so each request only fills in values.
+"""
+import threading
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.exceptions import TransactionConflictError
+
+
+class ClientCondition(object):
+    """A compiled condition expression for a :class:`DynamoDBClientBackend`.
+
+    Conditions can be combined with ``|`` and ``&``. The placeholders of the
+    expressions combined must not be bound to different values.
+
+    :type expression: str
+    :param expression: A DynamoDB ConditionExpression.
+
+    :type names: dict
+    :param names: The ExpressionAttributeNames used by the expression.
+
+    :type values: dict
+    :param values: The ExpressionAttributeValues used by the expression, in
+        the DynamoDB wire format.
+    """
+    __slots__ = ('expression', 'names', 'values')
+
+    def __init__(self, expression, names, values=None):
+        self.expression = expression
+        self.names = names
+        if values is None:
+            values = {}
+        self.values = values
+
+    def __or__(self, other):
+        return self._combine('OR', other)
+
+    def __and__(self, other):
+        return self._combine('AND', other)
+
+    def _combine(self, operator, other):
+        values = dict(self.values)
+        for placeholder, value in other.values.items():
+            if values.setdefault(placeholder, value) != value:
+                raise ValueError(
+                    'Conditions bind %s to different values' % placeholder)
+        names = dict(self.names)
+        names.update(other.names)
+        expression = '(%s) %s (%s)' % (
+            self.expression, operator, other.expression)
+        return ClientCondition(expression, names, values)
+
+
+_LOCK_FREE = 'attribute_not_exists(#lockKey)'
+_VERSION_EQUALS = '#versionNumber = :versionNumber'
+_LEASE_ELAPSED = '#expiresAt < :expiresAt'
+_LOCK_FREE_OR_EXPIRED = '%s OR %s' % (_LOCK_FREE, _VERSION_EQUALS)
+_LOCK_FREE_OR_LEASE_ELAPSED = '%s OR %s' % (_LOCK_FREE, _LEASE_ELAPSED)
+
+_LOCK_FREE_NAMES = {'#lockKey': 'lockKey'}
+_VERSION_NAMES = {'#versionNumber': 'versionNumber'}
+_LEASE_NAMES = {'#expiresAt': 'expiresAt'}
+_LOCK_FREE_OR_EXPIRED_NAMES = dict(_LOCK_FREE_NAMES, **_VERSION_NAMES)
+_LOCK_FREE_OR_LEASE_NAMES = dict(_LOCK_FREE_NAMES, **_LEASE_NAMES)
+
+
+class DynamoDBClientBackendBridgeFactory(object):
+    """Create low level client backends and bridges sharing one client.
+
+    Works like :class:`lynk.backends.dynamodb.DynamoDBBackendBridgeFactory`
+    but the backends it creates call the dynamodb client directly, which
+    spends less CPU time on each request.
+
+    :type session: :class:`boto3.session.Session` or None
+    :param session: The session to use constructing the dynamodb client. By
+        default a new session is created, which will use the standard boto3
+        AWS credential chain to find credentials.
+
+    :type max_pool_connections: int or None
+    :param max_pool_connections: The maximum number of HTTP connections kept
+        open to DynamoDB. Defaults to 10.
+
+    :type parameter_validation: bool
+    :param parameter_validation: Whether botocore validates every request
+        against the service model before sending it. The requests built by
+        the backend are always well formed, so this is off by default.
+
+    :type max_attempts: int or None
+    :param max_attempts: The most times botocore sends each request,
+        counting the first. Set it to 1 when requests are retried by a
+        :class:`lynk.throttle.RateLimitedBackend`, so that it sees every
+        throttled request. By default botocore's retry configuration is used.
+    """
+    _DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+    def __init__(self, session=None, max_pool_connections=None,
+                 parameter_validation=False, max_attempts=None):
+        self._session = session
+        if max_pool_connections is None:
+            max_pool_connections = self._DEFAULT_MAX_POOL_CONNECTIONS
+        self._max_pool_connections = max_pool_connections
+        self._parameter_validation = parameter_validation
+        self._max_attempts = max_attempts
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def create(self, table_name, session=None):
+        """Create a bridge and backend bound to a DynamoDB table.
+
+        :type table_name: str
+        :param table_name: Name of the DynamoDB table.
+
+        :type session: :class:`boto3.session.Session` or None
+        :param session: If provided a new client is built from this session
+            rather than using the shared one.
+        """
+        if session is None:
+            client = self._get_shared_client()
+        else:
+            client = self._create_client(session)
+        bridge = DynamoDBClientVersionLeaseBridge(client)
+        backend = DynamoDBClientBackend(client, table_name)
+        return bridge, backend
+
+    def _get_shared_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    session = self._session
+                    if session is None:
+                        session = boto3.session.Session()
+                    self._client = self._create_client(session)
+        return self._client
+
+    def _create_client(self, session):
+        config = Config(
+            max_pool_connections=self._max_pool_connections,
+            parameter_validation=self._parameter_validation,
+        )
+        if self._max_attempts is not None:
+            config = config.merge(Config(
+                retries={'total_max_attempts': self._max_attempts}))
+        return session.client('dynamodb', config=config)
+
+
+class DynamoDBClientVersionLeaseBridge(object):
+    """Acts as a bridge between DynamoDBClientBackend and
+    VersionLeaseTechinque.
+
+    Builds the same conditions as
+    :class:`lynk.backends.dynamodb.DynamoDBVersionLeaseBridge`, as
+    :class:`ClientCondition` objects whose expressions are compiled once.
+
+    :type client: botocore dynamodb client
+    :param client: The client the backend sends requests with.
+    """
+    def __init__(self, client):
+        self.ConditionFailedError = \
+            client.exceptions.ConditionalCheckFailedException
+        self.NoSuchLockError = client.exceptions.ResourceNotFoundException
+
+    def lock_free(self):
+        """Build the condition that the lock is currently free."""
+        return ClientCondition(_LOCK_FREE, _LOCK_FREE_NAMES)
+
+    def lock_expired(self, version_number):
+        """Build the condition that the lock has expired.
+
+        :type version_number: str
+        :param version_number: The version number the agent last saw.
+        """
+        return self._version_equals(version_number)
+
+    def lock_free_or_expired(self, version_number):
+        """Build the condition that a lock is free or expired."""
+        return ClientCondition(
+            _LOCK_FREE_OR_EXPIRED, _LOCK_FREE_OR_EXPIRED_NAMES,
+            {':versionNumber': {'S': version_number}},
+        )
+
+    def lease_elapsed(self, timestamp):
+        """Build the condition that a lock's lease ran out before a time.
+
+        Entries written without an expiresAt never match this condition.
+
+        :type timestamp: int
+        :param timestamp: Milliseconds since the epoch.
+        """
+        return ClientCondition(
+            _LEASE_ELAPSED, _LEASE_NAMES,
+            {':expiresAt': {'N': str(timestamp)}},
+        )
+
+    def lock_free_or_lease_elapsed(self, timestamp):
+        """Build the condition that a lock is free or its lease ran out."""
+        return ClientCondition(
+            _LOCK_FREE_OR_LEASE_ELAPSED, _LOCK_FREE_OR_LEASE_NAMES,
+            {':expiresAt': {'N': str(timestamp)}},
+        )
+
+    def we_own_lock(self, version_number):
+        """Build the condition that "we" own this lock.
+
+        :type version_number: str
+        :param version_number: The version number the agent last wrote.
+        """
+        return self._version_equals(version_number)
+
+    def lock_unchanged(self, version_number):
+        """Build the condition that a lock entry has not been written since
+        it was read.
+
+        :type version_number: str
+        :param version_number: The version number of the entry when it was
+            read.
+        """
+        return self._version_equals(version_number)
+
+    def _version_equals(self, version_number):
+        return ClientCondition(
+            _VERSION_EQUALS, _VERSION_NAMES,
+            {':versionNumber': {'S': version_number}},
+        )
+
+
+class DynamoDBClientBackend(BaseBackend):
+    """A backend sending requests to the low level dynamodb client.
+
+    Behaves like :class:`lynk.backends.dynamodb.DynamoDBBackend`. Items are
+    converted to and from the DynamoDB wire format here, with fast paths for
+    the strings, numbers and maps lock entries are made of, and numbers are
+    read back as :class:`decimal.Decimal` like the resource backend does.
+
+    The static part of each request, the table name, expressions and
+    attribute names, is compiled the first time a kind of request is made
+    with a condition and set of attributes, and reused afterwards.
+
+    :type client: botocore dynamodb client
+    :param client: The client to send requests with.
+
+    :type table_name: str
+    :param table_name: The name of the table to operate on.
+    """
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, client, table_name):
+        self._client = client
+        self._table_name = table_name
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        # Dictionaries are safe to read while another thread adds to them, so
+        # templates are cached without a lock. Two threads compiling the same
+        # template at once build equal ones.
+        self._templates = {}
+
+    def put(self, item, condition=None):
+        """Put an item into the DynamoDB table.
+
+        If the condition fails the item that caused it to fail is attached
+        to the raised exception as ``existing_item``.
+        """
+        request = self._put_template(condition).copy()
+        request['Item'] = self._serialize_item(item)
+        if condition and condition.values:
+            request['ExpressionAttributeValues'] = condition.values
+        client = self._client
+        try:
+            client.put_item(**request)
+        except client.exceptions.ConditionalCheckFailedException as e:
+            e.existing_item = self._deserialize_item(e.response.get('Item'))
+            raise
+
+    def update(self, key, updates, condition=None):
+        """Update an item in the DynamoDB table.
+
+        :type key: dict
+        :param key: The key to update in the table.
+
+        :type updates: dict
+        :param updates: A dictionary of attribute -> new_value updates.
+        """
+        request = self._update_template(tuple(updates), condition).copy()
+        request['Key'] = self._serialize_item(key)
+        request['ExpressionAttributeValues'] = self._update_values(
+            updates, condition)
+        self._client.update_item(**request)
+
+    def delete(self, key, condition=None):
+        """Delete an item from the DynamoDB table."""
+        request = self._delete_template(condition).copy()
+        request['Key'] = self._serialize_item(key)
+        if condition and condition.values:
+            request['ExpressionAttributeValues'] = condition.values
+        self._client.delete_item(**request)
+
+    def get(self, key, attributes, consistent=True):
+        """Get an item from the DynamoDB Table.
+
+        :rvalue: dict
+        :returns: A dictionary of attributeName -> attributeValue for each
+            attribute in the ``attributes`` list that the item has, or None
+            if there is no item.
+        """
+        request = self._get_template(tuple(attributes)).copy()
+        request['Key'] = self._serialize_item(key)
+        request['ConsistentRead'] = consistent
+        result = self._client.get_item(**request)
+        if 'Item' not in result:
+            return None
+        return self._deserialize_item(result['Item'])
+
+    def transact_write(self, operations):
+        """Atomically apply write operations with TransactWriteItems.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any operation fails, recording the existing item
+            for each failed put.
+        """
+        self.transact_write_items([
+            self.build_transact_item(operation) for operation in operations
+        ])
+
+    def transact_write_items(self, transact_items):
+        """Send items built by :meth:`build_transact_item` in a transaction.
+
+        The items can come from the backends of several tables sharing this
+        backend's client, so that one transaction writes to all of them.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any item fails.
+        """
+        client = self._client
+        try:
+            client.transact_write_items(TransactItems=transact_items)
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            failed_indexes = [
+                i for i, reason in enumerate(reasons)
+                if reason.get('Code') == 'ConditionalCheckFailed'
+            ]
+            if not failed_indexes:
+                raise
+            existing_items = {
+                i: self._deserialize_item(reasons[i]['Item'])
+                for i in failed_indexes if 'Item' in reasons[i]
+            }
+            raise TransactionConflictError(failed_indexes, existing_items)
+
+    def build_transact_item(self, operation):
+        """Build the TransactItem that applies an operation to this table."""
+        condition = operation.condition
+        if isinstance(operation, Put):
+            request = self._put_template(condition).copy()
+            request['Item'] = self._serialize_item(operation.item)
+            action = 'Put'
+        elif isinstance(operation, Update):
+            request = self._update_template(
+                tuple(operation.updates), condition).copy()
+            request['Key'] = self._serialize_item(operation.key)
+            request['ExpressionAttributeValues'] = self._update_values(
+                operation.updates, condition)
+            return {'Update': request}
+        else:
+            request = self._delete_template(condition).copy()
+            request['Key'] = self._serialize_item(operation.key)
+            action = 'Delete'
+        if condition and condition.values:
+            request['ExpressionAttributeValues'] = condition.values
+        return {action: request}
+
+    def _put_template(self, condition):
+        cache_key = ('put', self._expression(condition))
+        template = self._templates.get(cache_key)
+        if template is None:
+            template = self._condition_template(condition)
+            if condition:
+                template['ReturnValuesOnConditionCheckFailure'] = 'ALL_OLD'
+            self._templates[cache_key] = template
+        return template
+
+    def _delete_template(self, condition):
+        cache_key = ('delete', self._expression(condition))
+        template = self._templates.get(cache_key)
+        if template is None:
+            template = self._condition_template(condition)
+            self._templates[cache_key] = template
+        return template
+
+    def _update_template(self, attributes, condition):
+        cache_key = ('update', attributes, self._expression(condition))
+        template = self._templates.get(cache_key)
+        if template is None:
+            template = self._condition_template(condition)
+            names = dict(template.get('ExpressionAttributeNames', {}))
+            assignments = []
+            for i, attribute in enumerate(attributes):
+                names['#u%d' % i] = attribute
+                assignments.append('#u%d = :u%d' % (i, i))
+            template['UpdateExpression'] = 'SET %s' % ', '.join(assignments)
+            template['ExpressionAttributeNames'] = names
+            self._templates[cache_key] = template
+        return template
+
+    def _get_template(self, attributes):
+        cache_key = ('get', attributes)
+        template = self._templates.get(cache_key)
+        if template is None:
+            placeholders = ['#p%d' % i for i in range(len(attributes))]
+            template = {
+                'TableName': self._table_name,
+                'ProjectionExpression': ', '.join(placeholders),
+                'ExpressionAttributeNames': dict(
+                    zip(placeholders, attributes)),
+            }
+            self._templates[cache_key] = template
+        return template
+
+    def _condition_template(self, condition):
+        template = {'TableName': self._table_name}
+        if condition:
+            template['ConditionExpression'] = condition.expression
+            template['ExpressionAttributeNames'] = condition.names
+        return template
+
+    def _expression(self, condition):
+        if not condition:
+            return None
+        return condition.expression
+
+    def _update_values(self, updates, condition):
+        values = {
+            ':u%d' % i: self._serialize(value)
+            for i, value in enumerate(updates.values())
+        }
+        if condition:
+            values.update(condition.values)
+        return values
+
+    def _serialize_item(self, item):
+        return {name: self._serialize(value) for name, value in item.items()}
+
+    def _serialize(self, value):
+        value_type = type(value)
+        if value_type is str:
+            return {'S': value}
+        if value_type is int or value_type is Decimal:
+            return {'N': str(value)}
+        if value_type is dict:
+            return {'M': self._serialize_item(value)}
+        return self._serializer.serialize(value)
+
+    def _deserialize_item(self, item):
+        if item is None:
+            return None
+        return {
+            name: self._deserialize(value) for name, value in item.items()
+        }
+
+    def _deserialize(self, value):
+        if 'S' in value:
+            return value['S']
+        if 'N' in value:
+            return Decimal(value['N'])
+        if 'M' in value:
+            return self._deserialize_item(value['M'])
+        return self._deserializer.deserialize(value)
@@ -0,0 +1,474 @@
+"""A DynamoDB backend that speaks the DynamoDB JSON protocol itself.
+
+botocore runs every request through event hooks, parameter validation, a
+retry handler and a generic serializer before signing and sending it. For
+the handful of small requests a lock makes this costs far more CPU time than
+the lock itself. The client here sends the requests built by
+:class:`lynk.backends.dynamodb_client.DynamoDBClientBackend` straight to
+DynamoDB over a pool of keep-alive HTTP connections, signing them with a
+SigV4 signing key derived once a day.
+"""
+import os
+import json
+import time
+import hmac
+import socket
+import ssl
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+import boto3
+from botocore.exceptions import ClientError
+from lynk.backends.dynamodb_client import DynamoDBClientBackend
+from lynk.backends.dynamodb_client import DynamoDBClientVersionLeaseBridge
+from lynk.utils import TimeUtils
+
+
+class DynamoDBHTTPError(ClientError):
+    """Raised when DynamoDB returns an error.
+
+    Like the errors raised by botocore clients, ``response`` holds the error
+    ``Code`` and ``Message`` under ``Error`` along with any other fields of
+    the error, such as the ``Item`` of a failed conditional put or the
+    ``CancellationReasons`` of a cancelled transaction.
+    """
+
+
+class ConditionalCheckFailedException(DynamoDBHTTPError):
+    pass
+
+
+class ResourceNotFoundException(DynamoDBHTTPError):
+    pass
+
+
+class TransactionCanceledException(DynamoDBHTTPError):
+    pass
+
+
+class _Exceptions(object):
+    # Mirrors the exceptions attribute of botocore clients, which is how
+    # bridges and backends find the errors to catch.
+    ConditionalCheckFailedException = ConditionalCheckFailedException
+    ResourceNotFoundException = ResourceNotFoundException
+    TransactionCanceledException = TransactionCanceledException
+
+
+# Raised sending a request on a kept alive connection that the server has
+# since closed.
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+_MAX_LINE = 65536
+
+_ERRORS = {
+    'ConditionalCheckFailedException': ConditionalCheckFailedException,
+    'ResourceNotFoundException': ResourceNotFoundException,
+    'TransactionCanceledException': TransactionCanceledException,
+}
+
+
+class DynamoDBHTTPBackendBridgeFactory(object):
+    """Create backends sending requests with a :class:`DynamoDBHTTPClient`.
+
+    All the backends created share one client and its connection pool.
+
+    :type session: :class:`boto3.session.Session` or None
+    :param session: The session whose credentials and region are used. By
+        default a new session is created, which will use the standard boto3
+        AWS credential chain to find credentials.
+
+    :type endpoint_url: str or None
+    :param endpoint_url: The URL to send requests to. By default the
+        regional DynamoDB endpoint.
+
+    :type region_name: str or None
+    :param region_name: The region to sign requests for. By default the
+        session's region.
+
+    :type max_pool_connections: int or None
+    :param max_pool_connections: The most idle HTTP connections kept open.
+        Defaults to 10.
+
+    :type timeout: float
+    :param timeout: Seconds to wait to connect to the endpoint, and for each
+        read from it.
+    """
+    _DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+    def __init__(self, session=None, endpoint_url=None, region_name=None,
+                 max_pool_connections=None, timeout=10.0):
+        self._session = session
+        self._endpoint_url = endpoint_url
+        self._region_name = region_name
+        if max_pool_connections is None:
+            max_pool_connections = self._DEFAULT_MAX_POOL_CONNECTIONS
+        self._max_pool_connections = max_pool_connections
+        self._timeout = timeout
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def create(self, table_name):
+        """Create a bridge and backend bound to a DynamoDB table.
+
+        :type table_name: str
+        :param table_name: Name of the DynamoDB table.
+        """
+        client = self._get_shared_client()
+        bridge = DynamoDBClientVersionLeaseBridge(client)
+        backend = DynamoDBClientBackend(client, table_name)
+        return bridge, backend
+
+    def _get_shared_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self):
+        session = self._session
+        if session is None:
+            session = boto3.session.Session()
+        region_name = self._region_name or session.region_name
+        if region_name is None:
+            raise ValueError('A region_name is required to sign requests')
+        endpoint_url = self._endpoint_url
+        if endpoint_url is None:
+            endpoint_url = 'https://dynamodb.%s.amazonaws.com' % region_name
+        signer = SigV4Signer(session.get_credentials(), region_name)
+        pool = HTTPConnectionPool(
+            endpoint_url,
+            timeout=self._timeout,
+            max_idle_connections=self._max_pool_connections,
+        )
+        return DynamoDBHTTPClient(pool, signer)
+
+
+class SigV4Signer(object):
+    """Sign DynamoDB requests with AWS Signature Version 4.
+
+    The signing key only depends on the secret key, date, region and
+    service, so it is derived once a day, or when the credentials change,
+    and reused for every request in between.
+
+    :type credentials: :class:`botocore.credentials.Credentials`
+    :param credentials: The credentials to sign with. Refreshable
+        credentials are refreshed as usual.
+
+    :type region_name: str
+    :param region_name: The region requests are sent to.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: A set of utilities for interacting with time.
+    """
+    _SERVICE = 'dynamodb'
+    _ALGORITHM = 'AWS4-HMAC-SHA256'
+
+    def __init__(self, credentials, region_name, time_utils=None):
+        if credentials is None:
+            raise ValueError('No AWS credentials found to sign requests')
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._credentials = credentials
+        self._region_name = region_name
+        self._time_utils = time_utils
+        self._signing_key = (None, None, None)
+        self._timestamp = (None, None)
+
+    def sign(self, headers, body):
+        """Add the date and authorization headers to a request.
+
+        :type headers: dict
+        :param headers: The headers of a POST to ``/``. Every header in it is
+            signed, so it must hold the ``host`` and nothing that a proxy
+            could change.
+
+        :type body: bytes
+        :param body: The body of the request.
+        """
+        credentials = self._credentials.get_frozen_credentials()
+        amz_date, date = self._now()
+        headers['x-amz-date'] = amz_date
+        if credentials.token:
+            headers['x-amz-security-token'] = credentials.token
+        names = sorted(headers)
+        signed_headers = ';'.join(names)
+        canonical_request = '\n'.join([
+            'POST', '/', '',
+            ''.join('%s:%s\n' % (name, headers[name]) for name in names),
+            signed_headers,
+            hashlib.sha256(body).hexdigest(),
+        ])
+        scope = '%s/%s/%s/aws4_request' % (
+            date, self._region_name, self._SERVICE)
+        string_to_sign = '\n'.join([
+            self._ALGORITHM, amz_date, scope,
+            hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+        ])
+        signature = hmac.new(
+            self._key(credentials.secret_key, date),
+            string_to_sign.encode('utf-8'),
+            hashlib.sha256,
+        ).hexdigest()
+        headers['authorization'] = (
+            '%s Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+                self._ALGORITHM, credentials.access_key, scope,
+                signed_headers, signature)
+        )
+
+    def _now(self):
+        # Formatting the time is one of the costlier steps left, and it only
+        # changes once a second.
+        second = int(self._time_utils.time())
+        cached_second, formatted = self._timestamp
+        if cached_second != second:
+            amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(second))
+            formatted = (amz_date, amz_date[:8])
+            self._timestamp = (second, formatted)
+        return formatted
+
+    def _key(self, secret_key, date):
+        cached_secret, cached_date, key = self._signing_key
+        if cached_secret == secret_key and cached_date == date:
+            return key
+        key = ('AWS4' + secret_key).encode('utf-8')
+        for part in (date, self._region_name, self._SERVICE, 'aws4_request'):
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        self._signing_key = (secret_key, date, key)
+        return key
+
+
+class HTTPConnection(object):
+    """A keep-alive HTTP/1.1 connection that POSTs requests to ``/``.
+
+    Only what talking to DynamoDB needs is supported. Each request is sent
+    with a single write, and responses must have a ``Content-Length``.
+
+    :type hostname: str
+    :param hostname: The host to connect to.
+
+    :type port: int
+    :param port: The port to connect to.
+
+    :type timeout: float
+    :param timeout: Seconds to wait to connect, and for each read.
+
+    :type ssl_context: :class:`ssl.SSLContext` or None
+    :param ssl_context: If provided the connection uses TLS.
+    """
+    def __init__(self, hostname, port, timeout, ssl_context=None):
+        sock = socket.create_connection((hostname, port), timeout)
+        # Requests are sent in one write, so there is nothing to gain from
+        # Nagle's algorithm delaying them.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if ssl_context is not None:
+            sock = ssl_context.wrap_socket(sock, server_hostname=hostname)
+        self.pid = os.getpid()
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+
+    def post(self, head, body):
+        """Send a request and read the response.
+
+        :type head: bytes
+        :param head: The request line and headers, ending in a blank line.
+
+        :type body: bytes
+        :param body: The body of the request.
+
+        :rtype: tuple
+        :returns: The status code and body of the response, and whether the
+            connection can be used for another request.
+        """
+        self._sock.sendall(head + body)
+        status_line = self._reader.readline(_MAX_LINE)
+        if not status_line:
+            raise http.client.RemoteDisconnected(
+                'Remote end closed connection without response')
+        version, status = status_line.split(None, 2)[:2]
+        length = None
+        keep_alive = version == b'HTTP/1.1'
+        while True:
+            line = self._reader.readline(_MAX_LINE)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.partition(b':')
+            name = name.strip().lower()
+            if name == b'content-length':
+                length = int(value)
+            elif name == b'connection':
+                keep_alive = value.strip().lower() == b'keep-alive'
+        if length is None:
+            raise http.client.HTTPException(
+                'Response without a Content-Length')
+        data = self._reader.read(length)
+        if len(data) < length:
+            raise http.client.IncompleteRead(data, length - len(data))
+        return int(status), data, keep_alive
+
+    def close(self):
+        self._reader.close()
+        self._sock.close()
+
+
+class HTTPConnectionPool(object):
+    """Hand out keep-alive HTTP connections to one endpoint.
+
+    Idle connections are kept for reuse, most recently used first. A
+    process forked from the one that opened them starts a pool of its own,
+    since a socket must not be shared across a fork.
+
+    :type endpoint_url: str
+    :param endpoint_url: An ``http`` or ``https`` URL.
+
+    :type timeout: float
+    :param timeout: Seconds to wait to connect, and for each read.
+
+    :type max_idle_connections: int
+    :param max_idle_connections: The most connections kept open while not in
+        use.
+    """
+    def __init__(self, endpoint_url, timeout=10.0, max_idle_connections=10):
+        parts = urlsplit(endpoint_url)
+        if parts.scheme == 'https':
+            self._ssl_context = ssl.create_default_context()
+            default_port = 443
+        elif parts.scheme == 'http':
+            self._ssl_context = None
+            default_port = 80
+        else:
+            raise ValueError('Unsupported endpoint URL: %s' % endpoint_url)
+        self.host = parts.netloc
+        self._hostname = parts.hostname
+        self._port = parts.port or default_port
+        self._timeout = timeout
+        self._max_idle_connections = max_idle_connections
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def post(self, head, body):
+        """POST a request on a pooled connection.
+
+        A request on a reused connection that the server had already closed
+        is retried once on a new connection.
+
+        :rtype: tuple
+        :returns: The status code and body of the response.
+        """
+        connection, reused = self._checkout()
+        try:
+            try:
+                status, data, keep_alive = connection.post(head, body)
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                connection.close()
+                connection = self._connect()
+                status, data, keep_alive = connection.post(head, body)
+        except BaseException:
+            connection.close()
+            raise
+        if keep_alive:
+            self._checkin(connection)
+        else:
+            connection.close()
+        return status, data
+
+    def _checkout(self):
+        with self._lock:
+            self._forget_inherited()
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, connection):
+        with self._lock:
+            self._forget_inherited()
+            full = len(self._idle) >= self._max_idle_connections
+            if connection.pid == self._pid and not full:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def _forget_inherited(self):
+        # Must be called holding the lock.
+        pid = os.getpid()
+        if pid != self._pid:
+            self._idle = []
+            self._pid = pid
+
+    def _connect(self):
+        return HTTPConnection(
+            self._hostname, self._port, self._timeout, self._ssl_context)
+
+
+class DynamoDBHTTPClient(object):
+    """Send DynamoDB requests as signed JSON over HTTP.
+
+    Provides the subset of the botocore dynamodb client used by
+    :class:`lynk.backends.dynamodb_client.DynamoDBClientBackend`. Requests
+    are not validated and are sent once, errors are raised straight away
+    rather than retried. Parameters must already be in the DynamoDB wire
+    format and must not contain binary values.
+
+    :type pool: :class:`HTTPConnectionPool`
+    :param pool: The pool of connections to the endpoint.
+
+    :type signer: :class:`SigV4Signer`
+    :param signer: Signs each request.
+    """
+    exceptions = _Exceptions
+    _TARGET_PREFIX = 'DynamoDB_20120810.'
+    _CONTENT_TYPE = 'application/x-amz-json-1.0'
+
+    def __init__(self, pool, signer):
+        self._pool = pool
+        self._signer = signer
+
+    def put_item(self, **params):
+        return self._request('PutItem', params)
+
+    def update_item(self, **params):
+        return self._request('UpdateItem', params)
+
+    def delete_item(self, **params):
+        return self._request('DeleteItem', params)
+
+    def get_item(self, **params):
+        return self._request('GetItem', params)
+
+    def transact_write_items(self, **params):
+        return self._request('TransactWriteItems', params)
+
+    def _request(self, operation, params):
+        body = json.dumps(params, separators=(',', ':')).encode('utf-8')
+        headers = {
+            'host': self._pool.host,
+            'content-type': self._CONTENT_TYPE,
+            'x-amz-target': self._TARGET_PREFIX + operation,
+        }
+        self._signer.sign(headers, body)
+        head = 'POST / HTTP/1.1\r\n%scontent-length: %d\r\n\r\n' % (
+            ''.join('%s: %s\r\n' % header for header in headers.items()),
+            len(body),
+        )
+        status, data = self._pool.post(head.encode('utf-8'), body)
+        if status == 200:
+            return json.loads(data.decode('utf-8'))
+        raise self._error(operation, status, data)
+
+    def _error(self, operation, status, data):
+        try:
+            response = json.loads(data.decode('utf-8'))
+        except ValueError:
+            response = {}
+        code = response.pop('__type', str(status)).rsplit('#', 1)[-1]
+        message = response.pop('message', response.pop('Message', ''))
+        response['Error'] = {'Code': code, 'Message': message}
+        response['ResponseMetadata'] = {'HTTPStatusCode': status}
+        error_class = _ERRORS.get(code, DynamoDBHTTPError)
+        return error_class(response, operation)
@@ -0,0 +1,307 @@
+"""A backend that keeps locks in the memory of the current process."""
+import copy
+import threading
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.exceptions import TransactionConflictError
+
+
+class ConditionalCheckFailedError(Exception):
+    """Raised when the condition on a write to a MemoryBackend fails.
+
+    The item the condition was checked against, or None if there was no item,
+    is recorded in ``existing_item``.
+    """
+    def __init__(self, existing_item=None):
+        super(ConditionalCheckFailedError, self).__init__()
+        self.existing_item = existing_item
+
+
+class ResourceNotFoundError(Exception):
+    """Raised when a table does not exist."""
+
+
+class MemoryCondition(object):
+    """A condition on an item checked by a :class:`MemoryBackend`.
+
+    Conditions can be combined with ``|`` and ``&`` like the DynamoDB
+    condition objects they stand in for.
+
+    :type check: callable
+    :param check: Called with the current item, or None if there is none.
+        Returns True if the condition holds.
+    """
+    def __init__(self, check):
+        self._check = check
+
+    def __call__(self, item):
+        return self._check(item)
+
+    def __or__(self, other):
+        return MemoryCondition(lambda item: self(item) or other(item))
+
+    def __and__(self, other):
+        return MemoryCondition(lambda item: self(item) and other(item))
+
+
+def _attribute_equals(name, value):
+    return MemoryCondition(
+        lambda item: item is not None and item.get(name) == value)
+
+
+class MemoryBackendBridgeFactory(object):
+    """Create backends that keep locks in the memory of this process.
+
+    Locks are only shared between the sessions using the same factory, so
+    this is only useful when every contender for a lock lives in one
+    process. It is also a baseline that measures the cost of the lock
+    techniques without any network I/O.
+
+    :type lock_stripes: int
+    :param lock_stripes: Number of locks guarding the items of each table.
+        Operations on keys that hash to different stripes run in parallel.
+    """
+    _DEFAULT_LOCK_STRIPES = 64
+
+    def __init__(self, lock_stripes=None):
+        if lock_stripes is None:
+            lock_stripes = self._DEFAULT_LOCK_STRIPES
+        self._lock_stripes = lock_stripes
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+
+    def create(self, table_name):
+        """Create a bridge and backend bound to a table.
+
+        The table is created the first time it is asked for, and shared with
+        every later backend bound to the same name.
+
+        :type table_name: str
+        :param table_name: Name of the table.
+        """
+        with self._tables_lock:
+            table = self._tables.get(table_name)
+            if table is None:
+                table = MemoryTable(self._lock_stripes)
+                self._tables[table_name] = table
+        return MemoryVersionLeaseBridge(), MemoryBackend(table)
+
+
+class MemoryVersionLeaseBridge(object):
+    """Acts as a bridge between MemoryBackend and VersionLeaseTechinque.
+
+    Builds the same conditions as
+    :class:`lynk.backends.dynamodb.DynamoDBVersionLeaseBridge`, as
+    :class:`lynk.backends.memory.MemoryCondition` objects.
+    """
+    ConditionFailedError = ConditionalCheckFailedError
+    NoSuchLockError = ResourceNotFoundError
+
+    def lock_free(self):
+        """Build the condition that the lock is currently free."""
+        return MemoryCondition(lambda item: item is None)
+
+    def lock_expired(self, version_number):
+        """Build the condition that the lock has expired.
+
+        :type version_number: str
+        :param version_number: The version number the agent last saw.
+        """
+        return _attribute_equals('versionNumber', version_number)
+
+    def lock_free_or_expired(self, version_number):
+        """Build the condition that a lock is free or expired."""
+        return self.lock_free() | self.lock_expired(version_number)
+
+    def lease_elapsed(self, timestamp):
+        """Build the condition that a lock's lease ran out before a time.
+
+        Entries written without an expiresAt never match this condition.
+
+        :type timestamp: int
+        :param timestamp: Milliseconds since the epoch.
+        """
+        def check(item):
+            if item is None or 'expiresAt' not in item:
+                return False
+            return item['expiresAt'] < timestamp
+        return MemoryCondition(check)
+
+    def lock_free_or_lease_elapsed(self, timestamp):
+        """Build the condition that a lock is free or its lease ran out."""
+        return self.lock_free() | self.lease_elapsed(timestamp)
+
+    def we_own_lock(self, version_number):
+        """Build the condition that "we" own this lock.
+
+        :type version_number: str
+        :param version_number: The version number the agent last wrote.
+        """
+        return _attribute_equals('versionNumber', version_number)
+
+    def lock_unchanged(self, version_number):
+        """Build the condition that a lock entry has not been written since
+        it was read.
+
+        :type version_number: str
+        :param version_number: The version number of the entry when it was
+            read.
+        """
+        return _attribute_equals('versionNumber', version_number)
+
+
+class MemoryTable(object):
+    """The items of one in-memory table and the locks guarding them.
+
+    Each key is guarded by one of ``lock_stripes`` locks picked by its hash,
+    so operations on different keys rarely wait on each other.
+    """
+    def __init__(self, lock_stripes):
+        self.items = {}
+        self._stripes = [threading.Lock() for _ in range(lock_stripes)]
+
+    def stripe_for(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def stripes_for(self, keys):
+        # Always taking stripes in the same order means two transactions
+        # sharing stripes cannot deadlock.
+        indexes = sorted(set(
+            hash(key) % len(self._stripes) for key in keys))
+        return [self._stripes[i] for i in indexes]
+
+
+class MemoryBackend(BaseBackend):
+    """A thread safe backend storing items in a dictionary.
+
+    Items are keyed by their ``lockKey`` attribute. Conditions, the
+    behaviour of missing items and the existing item returned by a failed
+    put all match :class:`lynk.backends.dynamodb.DynamoDBBackend`, so
+    techniques behave the same way on either one.
+
+    :type table: :class:`lynk.backends.memory.MemoryTable`
+    :param table: The table to operate on.
+    """
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, table):
+        self._table = table
+
+    def put(self, item, condition=None):
+        """Put an item into the table.
+
+        If the condition fails the item it was checked against is attached
+        to the raised exception as ``existing_item``.
+        """
+        key = item['lockKey']
+        with self._table.stripe_for(key):
+            self._check(key, condition)
+            self._table.items[key] = copy.deepcopy(item)
+
+    def update(self, key, updates, condition=None):
+        """Update the attributes of an item, creating it if it is missing.
+
+        :type key: dict
+        :param key: The key of the item to update.
+
+        :type updates: dict
+        :param updates: A dictionary of attribute -> new_value updates.
+        """
+        lock_key = key['lockKey']
+        with self._table.stripe_for(lock_key):
+            self._check(lock_key, condition)
+            self._apply_update(lock_key, updates)
+
+    def delete(self, key, condition=None):
+        """Delete an item from the table, if it exists."""
+        lock_key = key['lockKey']
+        with self._table.stripe_for(lock_key):
+            self._check(lock_key, condition)
+            self._table.items.pop(lock_key, None)
+
+    def get(self, key, attributes, consistent=True):
+        """Get the attributes of an item.
+
+        Every read is consistent.
+
+        :rvalue: dict
+        :returns: A dictionary of attributeName -> attributeValue for each
+            attribute in the ``attributes`` list that the item has, or None
+            if there is no item.
+        """
+        lock_key = key['lockKey']
+        with self._table.stripe_for(lock_key):
+            item = self._table.items.get(lock_key)
+            if item is None:
+                return None
+            return {
+                attr: copy.deepcopy(item[attr])
+                for attr in attributes if attr in item
+            }
+
+    def transact_write(self, operations):
+        """Atomically apply write operations.
+
+        The stripes guarding every key involved are held while all the
+        conditions are checked and, if they hold, the operations applied.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any operation fails, recording the existing item
+            for each failed put.
+        """
+        keys = [self._operation_key(operation) for operation in operations]
+        stripes = self._table.stripes_for(keys)
+        for stripe in stripes:
+            stripe.acquire()
+        try:
+            self._check_transaction(operations, keys)
+            for key, operation in zip(keys, operations):
+                self._apply(key, operation)
+        finally:
+            for stripe in reversed(stripes):
+                stripe.release()
+
+    def _check_transaction(self, operations, keys):
+        failed_indexes = []
+        existing_items = {}
+        for i, (key, operation) in enumerate(zip(keys, operations)):
+            if not operation.condition:
+                continue
+            existing = self._table.items.get(key)
+            if operation.condition(existing):
+                continue
+            failed_indexes.append(i)
+            if isinstance(operation, Put):
+                existing_items[i] = copy.deepcopy(existing)
+        if failed_indexes:
+            raise TransactionConflictError(failed_indexes, existing_items)
+
+    def _operation_key(self, operation):
+        if isinstance(operation, Put):
+            return operation.item['lockKey']
+        return operation.key['lockKey']
+
+    def _apply(self, key, operation):
+        if isinstance(operation, Put):
+            self._table.items[key] = copy.deepcopy(operation.item)
+        elif isinstance(operation, Update):
+            self._apply_update(key, operation.updates)
+        else:
+            self._table.items.pop(key, None)
+
+    def _apply_update(self, key, updates):
+        item = self._table.items.get(key)
+        if item is None:
+            item = {'lockKey': key}
+            self._table.items[key] = item
+        item.update(copy.deepcopy(updates))
+
+    def _check(self, key, condition):
+        # Must be called holding the stripe guarding key.
+        if not condition:
+            return
+        existing = self._table.items.get(key)
+        if not condition(existing):
+            raise ConditionalCheckFailedError(copy.deepcopy(existing))
@@ -0,0 +1,200 @@
+"""Spread locks across several tables.
+
+Every table has its own provisioned throughput, so spreading locks across
+a set of tables, its shards, raises the rate of lock operations the set can
+sustain roughly in proportion to the number of tables, and an outage of one
+table only affects the locks stored in it.
+
+Each lock is stored in the table picked for its name by a consistent hash
+ring. Every table is placed on the ring at many points, its virtual nodes,
+so locks are spread evenly and adding a table to a set of ``n`` only moves
+about ``1 / (n + 1)`` of the locks. A lock that moves is not seen as held by
+the clients using the new set, so every client must switch to the new set at
+the same time, while no locks are held.
+"""
+import bisect
+import hashlib
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.dynamodb import DynamoDBBackendBridgeFactory
+
+
+def shard_table_names(table_name, shards):
+    """Name the tables of a set of shards.
+
+    This is how ``lynk create-table --shards`` names the tables it creates.
+
+    :type table_name: str
+    :param table_name: The name the set is known by.
+
+    :type shards: int
+    :param shards: The number of tables in the set.
+
+    :rtype: list
+    :returns: The names ``<table_name>-0`` to ``<table_name>-<shards - 1>``.
+    """
+    return ['%s-%d' % (table_name, i) for i in range(shards)]
+
+
+def _hash(value):
+    digest = hashlib.md5(value.encode('utf-8')).hexdigest()
+    return int(digest[:16], 16)
+
+
+class ConsistentHashRing(object):
+    """Map keys onto a set of nodes by consistent hashing.
+
+    :type nodes: list
+    :param nodes: The names of the nodes.
+
+    :type virtual_nodes: int
+    :param virtual_nodes: The number of points each node is placed at on the
+        ring. More points spread keys more evenly.
+    """
+    def __init__(self, nodes, virtual_nodes=100):
+        if not nodes:
+            raise ValueError('A hash ring needs at least one node.')
+        if len(set(nodes)) != len(nodes):
+            raise ValueError('The nodes of a hash ring must be unique.')
+        points = sorted(
+            (_hash('%s#%d' % (node, i)), node)
+            for node in nodes for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """Find the node a key belongs to.
+
+        :type key: str
+        :param key: The key to look up.
+        """
+        index = bisect.bisect(self._points, _hash(key))
+        return self._nodes[index % len(self._nodes)]
+
+
+class ShardedBackendBridgeFactory(object):
+    """Create backends that spread locks across several tables.
+
+    The backend of each table is created once, by another backend bridge
+    factory, so every table reuses the connections that factory shares.
+
+    :type table_names: list
+    :param table_names: The names of the tables to spread locks across.
+        :func:`shard_table_names` names the tables of a set created by
+        ``lynk create-table --shards``.
+
+    :type backend_bridge_factory: Anything with a create method or None.
+    :param backend_bridge_factory: Creates the bridge and backend of each
+        table. By default a
+        :class:`lynk.backends.dynamodb.DynamoDBBackendBridgeFactory`.
+
+    :type virtual_nodes: int
+    :param virtual_nodes: The number of points each table is placed at on
+        the hash ring.
+    """
+    def __init__(self, table_names, backend_bridge_factory=None,
+                 virtual_nodes=100):
+        if backend_bridge_factory is None:
+            backend_bridge_factory = DynamoDBBackendBridgeFactory()
+        self._table_names = list(table_names)
+        self._backend_bridge_factory = backend_bridge_factory
+        self._ring = ConsistentHashRing(self._table_names, virtual_nodes)
+
+    def create(self, table_name):
+        """Create a bridge and a backend that spreads locks across the tables.
+
+        :type table_name: str
+        :param table_name: Not used, since locks are stored in the tables the
+            factory was created with. Sessions pass the name they were
+            created with.
+        """
+        bridge = None
+        backends = {}
+        for name in self._table_names:
+            table_bridge, backends[name] = \
+                self._backend_bridge_factory.create(name)
+            if bridge is None:
+                bridge = table_bridge
+        return bridge, ShardedBackend(self._ring, backends)
+
+
+class ShardedBackend(BaseBackend):
+    """Route each operation to the backend of the table its lock belongs to.
+
+    A transaction spanning several tables is written in one request if the
+    backends can build each other's transaction items, as the DynamoDB
+    backends of tables sharing a client can. Otherwise only transactions
+    within one table are supported, and the backend does not claim to
+    support transactions, so groups of locks cannot be created on it.
+
+    :type ring: :class:`ConsistentHashRing`
+    :param ring: Maps the ``lockKey`` of an item to a table name.
+
+    :type backends: dict
+    :param backends: The backend of each table, by name.
+    """
+    def __init__(self, ring, backends):
+        self._ring = ring
+        self._backends = backends
+        self.MAX_TRANSACTION_ITEMS = min(
+            backend.MAX_TRANSACTION_ITEMS for backend in backends.values())
+        # Only claim transactions if any set of locks can be written in one,
+        # which needs more than one table to be written at once.
+        self.SUPPORTS_TRANSACTIONS = all(
+            backend.SUPPORTS_TRANSACTIONS for backend in backends.values())
+        if len(backends) > 1:
+            self.SUPPORTS_TRANSACTIONS = self.SUPPORTS_TRANSACTIONS and all(
+                hasattr(backend, 'transact_write_items')
+                for backend in backends.values())
+
+    def backend_for(self, lock_key):
+        """Find the backend of the table a lock is stored in.
+
+        :type lock_key: str
+        :param lock_key: The ``lockKey`` of the lock's item.
+        """
+        return self._backends[self._ring.node_for(lock_key)]
+
+    def put(self, item, condition=None):
+        return self.backend_for(item['lockKey']).put(
+            item, condition=condition)
+
+    def update(self, key, updates, condition=None):
+        return self.backend_for(key['lockKey']).update(
+            key, updates, condition=condition)
+
+    def delete(self, key, condition=None):
+        return self.backend_for(key['lockKey']).delete(
+            key, condition=condition)
+
+    def get(self, key, attributes, consistent=True):
+        return self.backend_for(key['lockKey']).get(
+            key, attributes, consistent=consistent)
+
+    def transact_write(self, operations):
+        """Atomically apply write operations across the tables.
+
+        :raises: ValueError if the operations span tables whose backends
+            cannot write to several tables in one transaction.
+        """
+        if not operations:
+            return
+        backends = [self._backend_for_operation(op) for op in operations]
+        first = backends[0]
+        if all(backend is first for backend in backends):
+            return first.transact_write(operations)
+        if not hasattr(first, 'transact_write_items'):
+            raise ValueError(
+                'The operations span several tables, and their backends '
+                'cannot write to more than one table in a transaction.')
+        first.transact_write_items([
+            backend.build_transact_item(operation)
+            for backend, operation in zip(backends, operations)
+        ])
+
+    def _backend_for_operation(self, operation):
+        if isinstance(operation, Put):
+            return self.backend_for(operation.item['lockKey'])
+        return self.backend_for(operation.key['lockKey'])
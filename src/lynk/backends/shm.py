@@ -0,0 +1,551 @@
+"""A backend that keeps locks in a memory mapped file shared by one host."""
+import os
+import json
+import mmap
+import time
+import zlib
+import errno
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.memory import ConditionalCheckFailedError
+from lynk.backends.memory import MemoryVersionLeaseBridge
+from lynk.exceptions import TransactionConflictError
+
+
+class TableFullError(Exception):
+    """Raised when there is no free slot left for a new lock."""
+
+
+class ItemTooLargeError(ValueError):
+    """Raised when an item is too big for a slot of the table.
+
+    Besides the fixed fields, a slot has ``slot_size - 338`` bytes for the
+    other attributes of an item as JSON. Shared mode locks and semaphore
+    shards keep every holder in the item, so this limits how many can hold
+    them at once.
+    """
+    def __init__(self, key, slot_size):
+        super(ItemTooLargeError, self).__init__(
+            "Item for %s does not fit in a slot of %s bytes." % (
+                key, slot_size))
+        self.key = key
+        self.slot_size = slot_size
+
+
+class SharedMemoryBackendBridgeFactory(object):
+    """Create backends that keep locks in memory shared by local processes.
+
+    Each table is a file of fixed size slots, memory mapped by every
+    process using it, so acquiring and releasing a lock involves no network
+    and no disk. It is placed in ``directory``, by default ``/dev/shm`` where
+    that exists. Only POSIX systems are supported.
+
+    :type directory: str
+    :param directory: The directory table files are created in.
+
+    :type slots: int
+    :param slots: The number of locks a table can hold at once.
+
+    :type slot_size: int
+    :param slot_size: The number of bytes each lock can take up. Shared mode
+        locks and semaphore shards keep every holder in their slot, at
+        roughly 55 bytes each, which limits how many can hold one at once:
+        10 with slots of 1024 bytes, 28 with the default 2048, 66 with 4096
+        and 140 with 8192. Acquiring one more raises
+        :class:`lynk.backends.shm.ItemTooLargeError`.
+
+    :type probe_limit: int
+    :param probe_limit: The number of slots searched for a lock name, from
+        the one its name hashes to. If they are all taken by other locks a
+        new lock cannot be stored, so this should be small relative to
+        ``slots``.
+
+    The sizes are only used when a table file is created. Processes opening
+    an existing table use the sizes it was created with.
+    """
+    _DEFAULT_DIRECTORY = '/dev/shm'
+
+    def __init__(self, directory=None, slots=4096, slot_size=2048,
+                 probe_limit=8):
+        if fcntl is None:
+            raise RuntimeError(
+                "The shared memory backend needs fcntl, which is only "
+                "available on POSIX systems.")
+        if directory is None:
+            directory = self._DEFAULT_DIRECTORY
+            if not os.path.isdir(directory):
+                directory = tempfile.gettempdir()
+        self._directory = directory
+        self._slots = slots
+        self._slot_size = slot_size
+        self._probe_limit = probe_limit
+
+    def create(self, table_name):
+        """Create a bridge and backend bound to a table.
+
+        The table file is created and sized the first time any process asks
+        for it, and mapped into this process once, however many factories
+        use it.
+
+        :type table_name: str
+        :param table_name: Name of the table.
+        """
+        path = os.path.join(
+            self._directory,
+            'lynk-%s.locks' % table_name.replace(os.sep, '_'),
+        )
+        table = open_table(
+            path, self._slots, self._slot_size, self._probe_limit)
+        return MemoryVersionLeaseBridge(), SharedMemoryBackend(table)
+
+
+# The table of each file opened by this process. Record locks belong to a
+# process, so its threads only exclude each other through the stripe locks
+# of one shared table, and closing any descriptor of a file would release every
+# record lock the process holds on it.
+_open_tables = {}
+_open_tables_lock = threading.Lock()
+
+
+def open_table(path, slots, slot_size, probe_limit):
+    """Open the table in a file, once per process.
+
+    Every call for the same file, by any path that resolves to it, returns
+    the same :class:`SharedMemoryTable`, with one set of stripe locks and
+    one file descriptor.
+
+    The sizes are only used if the file has not been created yet.
+    """
+    real_path = os.path.realpath(path)
+    with _open_tables_lock:
+        table = _open_tables.get(real_path)
+        if table is None:
+            table = SharedMemoryTable(
+                real_path, slots, slot_size, probe_limit)
+            _open_tables[real_path] = table
+        return table
+
+
+class SharedMemoryTable(object):
+    """An open addressed hash table of lock slots in a memory mapped file.
+
+    A lock name is hashed to a home slot, and stored in the first free slot
+    of the ``probe_limit`` slots starting there. Each slot holds::
+
+      state           1 byte, 1 if the slot is in use
+      lockKey         up to 128 bytes of UTF-8
+      versionNumber   up to 64 bytes of UTF-8
+      expiresAt       a flag and a signed 64 bit integer
+      hostIdentifier  up to 128 bytes of UTF-8
+      payload         the other attributes of the item as JSON
+
+    An operation on a name holds an ``fcntl`` lock on the byte range of its
+    probe window, so operations from different processes on names with
+    windows that do not overlap run in parallel. Record locks are held by a
+    process rather than a thread, so the threads of a process also take
+    turns through locks of their own, one for each stripe of
+    ``probe_limit`` slots. A window covers at most two stripes, so threads
+    working on names far enough apart run in parallel too. That only works
+    if the process opens a file once, so tables should be opened with
+    :func:`open_table`.
+
+    :type path: str
+    :param path: Path of the table file.
+    """
+    _MAGIC = b'LYNKSHM1'
+    _HEADER = struct.Struct('<8sIII')
+    _HEADER_SIZE = 64
+    _SLOT = struct.Struct('<BH128sH64sBqH128sH')
+    _USED = 1
+    # Seconds to wait before asking for a record lock again after the
+    # kernel reported a deadlock.
+    _DEADLOCK_RETRY_INTERVAL = 0.001
+
+    def __init__(self, path, slots, slot_size, probe_limit):
+        if slot_size <= self._SLOT.size:
+            raise ValueError(
+                "Slots must be bigger than %s bytes." % self._SLOT.size)
+        self._path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Whichever process gets here first sizes the file and writes the
+        # header, the rest use the sizes it chose.
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, self._HEADER_SIZE, 0)
+        try:
+            if os.fstat(self._fd).st_size < self._HEADER_SIZE:
+                self._create(slots, slot_size, min(probe_limit, slots))
+            else:
+                self._open()
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self._HEADER_SIZE, 0)
+        # The last window ends probe_limit - 1 slots past the final home.
+        last_slot = self._slots + self._probe_limit - 2
+        stripes = last_slot // self._probe_limit + 1
+        self._stripe_locks = [threading.Lock() for _ in range(stripes)]
+
+    def _create(self, slots, slot_size, probe_limit):
+        # The last probe window runs past the final home slot rather than
+        # wrapping around, so windows are always contiguous byte ranges.
+        size = self._HEADER_SIZE + (slots + probe_limit - 1) * slot_size
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._HEADER.pack_into(
+            self._map, 0, self._MAGIC, slots, slot_size, probe_limit)
+        self._slots = slots
+        self._slot_size = slot_size
+        self._probe_limit = probe_limit
+
+    def _open(self):
+        self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        magic, slots, slot_size, probe_limit = self._HEADER.unpack_from(
+            self._map, 0)
+        if magic != self._MAGIC:
+            raise ValueError("%s is not a lock table." % self._path)
+        self._slots = slots
+        self._slot_size = slot_size
+        self._probe_limit = probe_limit
+
+    def home(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self._slots
+
+    @contextmanager
+    def locked(self, keys):
+        """Hold the locks on the probe windows of some lock names."""
+        if len(keys) == 1:
+            home = self.home(keys[0])
+            windows = [(home, home + self._probe_limit)]
+        else:
+            windows = self._merged_windows(keys)
+        stripe_locks = [
+            self._stripe_locks[stripe] for stripe in self._stripes(windows)]
+        locked = []
+        for lock in stripe_locks:
+            lock.acquire()
+        try:
+            for start, end in windows:
+                byte_range = (
+                    self._offset(start), (end - start) * self._slot_size)
+                self._lock_range(*byte_range)
+                locked.append(byte_range)
+            yield
+        finally:
+            for start, length in reversed(locked):
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+            for lock in reversed(stripe_locks):
+                lock.release()
+
+    def _merged_windows(self, keys):
+        # Taking ranges in order of offset means two processes locking
+        # several windows cannot deadlock. Overlapping windows are merged,
+        # since unlocking one would unlock the part it shares with another.
+        homes = sorted(set(self.home(key) for key in keys))
+        merged = []
+        for home in homes:
+            end = home + self._probe_limit
+            if merged and home <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([home, end])
+        return merged
+
+    def _stripes(self, windows):
+        # The stripes covering the slots of some windows, in order, so that
+        # threads taking several cannot deadlock either.
+        stripes = set()
+        for start, end in windows:
+            stripes.update(range(
+                start // self._probe_limit,
+                (end - 1) // self._probe_limit + 1))
+        return sorted(stripes)
+
+    def _lock_range(self, start, length):
+        while True:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+                return
+            except OSError as e:
+                if e.errno != errno.EDEADLK:
+                    raise
+            # The kernel sees which process holds a record lock, not which
+            # thread. While another thread of this process holds a range the
+            # process we wait for is waiting on, that looks like a deadlock
+            # even though the other thread will let go.
+            time.sleep(self._DEADLOCK_RETRY_INTERVAL)
+
+    def _offset(self, slot):
+        return self._HEADER_SIZE + slot * self._slot_size
+
+    def find(self, key, taken=()):
+        """Find the slot holding a name, and the first free slot to put it.
+
+        Must be called holding the lock on the name's window.
+
+        :type taken: set
+        :param taken: Free slots that should not be returned, because they
+            are about to be written.
+
+        :rtype: tuple
+        :returns: The index of the slot holding the name, or None, and the
+            index of the first free slot in its window, or None.
+        """
+        encoded = key.encode('utf-8')
+        # A slot holds the name if it starts with the used state, the
+        # name's length and the name.
+        prefix = struct.pack('<BH', self._USED, len(encoded)) + encoded
+        home = self.home(key)
+        offset = self._offset(home)
+        free = None
+        for slot in range(home, home + self._probe_limit):
+            if self._map[offset:offset + len(prefix)] == prefix:
+                return slot, free
+            if (free is None and self._map[offset] != self._USED and
+                    slot not in taken):
+                free = slot
+            offset += self._slot_size
+        return None, free
+
+    def read(self, slot, full=True):
+        """Read the item in a slot.
+
+        :type full: bool
+        :param full: If ``False`` only the key, versionNumber and expiresAt
+            are read, which is all a condition needs.
+        """
+        fields = self._SLOT.unpack_from(self._map, self._offset(slot))
+        (_, key_length, key, version_length, version, has_expiry, expires_at,
+         host_length, host, payload_length) = fields
+        item = {'lockKey': key[:key_length].decode('utf-8')}
+        if version_length:
+            item['versionNumber'] = version[:version_length].decode('utf-8')
+        if has_expiry:
+            item['expiresAt'] = expires_at
+        if not full:
+            return item
+        if host_length:
+            item['hostIdentifier'] = host[:host_length].decode('utf-8')
+        if payload_length:
+            start = self._offset(slot) + self._SLOT.size
+            payload = self._map[start:start + payload_length]
+            item.update(json.loads(payload.decode('utf-8')))
+        return item
+
+    def write(self, slot, item):
+        """Write an item to a slot.
+
+        :raises: :class:`lynk.backends.shm.ItemTooLargeError` if the item
+            does not fit.
+        """
+        self.write_encoded(slot, self.encode(item))
+
+    def encode(self, item):
+        """Encode an item for :meth:`write_encoded`.
+
+        :raises: :class:`lynk.backends.shm.ItemTooLargeError` if the item
+            does not fit in a slot.
+        """
+        key = item['lockKey'].encode('utf-8')
+        version = item.get('versionNumber', '').encode('utf-8')
+        host = item.get('hostIdentifier', '').encode('utf-8')
+        expires_at = item.get('expiresAt')
+        rest = {
+            attr: value for attr, value in item.items()
+            if attr not in (
+                'lockKey', 'versionNumber', 'expiresAt', 'hostIdentifier')
+        }
+        payload = json.dumps(rest).encode('utf-8') if rest else b''
+        too_long = any([
+            len(key) > 128, len(version) > 64, len(host) > 128,
+            self._SLOT.size + len(payload) > self._slot_size,
+        ])
+        if too_long:
+            raise ItemTooLargeError(item['lockKey'], self._slot_size)
+        fields = (
+            self._USED, len(key), key, len(version), version,
+            expires_at is not None, int(expires_at or 0), len(host), host,
+            len(payload),
+        )
+        return fields, payload
+
+    def write_encoded(self, slot, encoded):
+        """Write an item returned by :meth:`encode` to a slot."""
+        fields, payload = encoded
+        offset = self._offset(slot)
+        self._SLOT.pack_into(self._map, offset, *fields)
+        start = offset + self._SLOT.size
+        self._map[start:start + len(payload)] = payload
+
+    def clear(self, slot):
+        self._map[self._offset(slot)] = 0
+
+
+class SharedMemoryBackend(BaseBackend):
+    """A backend storing items in a :class:`SharedMemoryTable`.
+
+    Conditions are the callables built by
+    :class:`lynk.backends.memory.MemoryVersionLeaseBridge`, and are checked
+    against the key, versionNumber and expiresAt of the existing slot.
+    Conditions, the behaviour of missing items and the existing item
+    returned by a failed put match the other backends.
+
+    :type table: :class:`lynk.backends.shm.SharedMemoryTable`
+    :param table: The table to operate on.
+    """
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, table):
+        self._table = table
+
+    def put(self, item, condition=None):
+        """Put an item into the table.
+
+        :raises: :class:`lynk.backends.shm.TableFullError` if the item is
+            new and there is no free slot for it, or
+            :class:`lynk.backends.shm.ItemTooLargeError` if it does not fit
+            in a slot.
+        """
+        key = item['lockKey']
+        with self._table.locked([key]):
+            self._put(key, item, condition)
+
+    def update(self, key, updates, condition=None):
+        """Update the attributes of an item, creating it if it is missing.
+
+        :raises: :class:`lynk.backends.shm.TableFullError` or
+            :class:`lynk.backends.shm.ItemTooLargeError`, as :meth:`put`
+            does.
+        """
+        lock_key = key['lockKey']
+        with self._table.locked([lock_key]):
+            self._update(lock_key, updates, condition)
+
+    def delete(self, key, condition=None):
+        """Delete an item from the table, if it exists."""
+        lock_key = key['lockKey']
+        with self._table.locked([lock_key]):
+            self._delete(lock_key, condition)
+
+    def get(self, key, attributes, consistent=True):
+        """Get the attributes of an item.
+
+        Every read is consistent.
+        """
+        lock_key = key['lockKey']
+        with self._table.locked([lock_key]):
+            slot, _ = self._table.find(lock_key)
+            if slot is None:
+                return None
+            item = self._table.read(slot)
+        return {attr: item[attr] for attr in attributes if attr in item}
+
+    def transact_write(self, operations):
+        """Atomically apply write operations.
+
+        The windows of every name involved are locked while all the
+        conditions are checked and, if they hold, the operations applied.
+        The slot and encoding of every write are worked out before any is
+        applied, so a full table or an item too large for its slot fails the
+        whole transaction rather than leaving part of it written.
+
+        :raises: :class:`lynk.backends.shm.TableFullError` or
+            :class:`lynk.backends.shm.ItemTooLargeError`, in which case none
+            of the operations were applied.
+        """
+        keys = [self._operation_key(operation) for operation in operations]
+        with self._table.locked(keys):
+            failed_indexes = []
+            existing_items = {}
+            slots = []
+            for i, (key, operation) in enumerate(zip(keys, operations)):
+                try:
+                    slots.append(self._check(key, operation.condition)[0])
+                except ConditionalCheckFailedError as e:
+                    failed_indexes.append(i)
+                    if isinstance(operation, Put):
+                        existing_items[i] = e.existing_item
+            if failed_indexes:
+                raise TransactionConflictError(failed_indexes, existing_items)
+            writes = self._plan(keys, operations, slots)
+            for slot, encoded in writes:
+                if encoded is None:
+                    self._table.clear(slot)
+                else:
+                    self._table.write_encoded(slot, encoded)
+
+    def _plan(self, keys, operations, slots):
+        # Free slots claimed by earlier new items of the transaction, since
+        # the windows of two names can overlap.
+        taken = set()
+        writes = []
+        for key, operation, slot in zip(keys, operations, slots):
+            if isinstance(operation, Put):
+                item = operation.item
+            elif isinstance(operation, Update):
+                if slot is None:
+                    item = {'lockKey': key}
+                else:
+                    item = self._table.read(slot)
+                item.update(operation.updates)
+            else:
+                if slot is not None:
+                    writes.append((slot, None))
+                continue
+            if slot is None:
+                _, slot = self._table.find(key, taken)
+                if slot is None:
+                    raise TableFullError()
+                taken.add(slot)
+            writes.append((slot, self._table.encode(item)))
+        return writes
+
+    def _operation_key(self, operation):
+        if isinstance(operation, Put):
+            return operation.item['lockKey']
+        return operation.key['lockKey']
+
+    def _put(self, key, item, condition):
+        slot, free = self._check(key, condition)
+        if slot is None:
+            slot = free
+        if slot is None:
+            raise TableFullError()
+        self._table.write(slot, item)
+
+    def _update(self, key, updates, condition):
+        slot, free = self._check(key, condition)
+        if slot is None:
+            item = {'lockKey': key}
+            slot = free
+        else:
+            item = self._table.read(slot)
+        if slot is None:
+            raise TableFullError()
+        item.update(updates)
+        self._table.write(slot, item)
+
+    def _delete(self, key, condition):
+        slot, _ = self._check(key, condition)
+        if slot is not None:
+            self._table.clear(slot)
+
+    def _check(self, key, condition):
+        # Must be called holding the lock on the key's window.
+        slot, free = self._table.find(key)
+        if condition:
+            existing = None
+            if slot is not None:
+                existing = self._table.read(slot, full=False)
+            if not condition(existing):
+                if slot is not None:
+                    existing = self._table.read(slot)
+                raise ConditionalCheckFailedError(existing)
+        return slot, free
@@ -0,0 +1,449 @@
+"""A backend that keeps locks in a SQLite database shared by one host."""
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.exceptions import TransactionConflictError
+
+
+class ConditionalCheckFailedError(Exception):
+    """Raised when the condition on a write to a SQLiteBackend fails.
+
+    The row the condition was checked against, or None if there was no row,
+    is recorded in ``existing_item``.
+    """
+    def __init__(self, existing_item=None):
+        super(ConditionalCheckFailedError, self).__init__()
+        self.existing_item = existing_item
+
+
+class SQLiteCondition(object):
+    """A condition on the row of a lock, as a SQL expression.
+
+    :type clause: str
+    :param clause: An expression over the ``versionNumber`` and
+        ``expiresAt`` columns of the existing row.
+
+    :type params: tuple
+    :param params: The values of the placeholders in ``clause``.
+
+    :type if_missing: bool
+    :param if_missing: Whether the condition holds when there is no row.
+    """
+    def __init__(self, clause, params=(), if_missing=False):
+        self.clause = clause
+        self.params = tuple(params)
+        self.if_missing = if_missing
+
+    def __or__(self, other):
+        return SQLiteCondition(
+            '(%s) OR (%s)' % (self.clause, other.clause),
+            self.params + other.params,
+            self.if_missing or other.if_missing,
+        )
+
+    def __and__(self, other):
+        return SQLiteCondition(
+            '(%s) AND (%s)' % (self.clause, other.clause),
+            self.params + other.params,
+            self.if_missing and other.if_missing,
+        )
+
+
+class SQLiteConnectionPool(object):
+    """Hand out connections to a SQLite database to the threads of a process.
+
+    Connections are opened in WAL mode, so readers never block the writer,
+    and with ``synchronous=NORMAL``, so commits do not wait for the disk.
+    Idle connections are kept for reuse. A process forked from the one that
+    opened them starts a pool of its own, since SQLite connections must not
+    be carried across a fork.
+
+    :type path: str
+    :param path: Path of the database file.
+
+    :type busy_timeout: float
+    :param busy_timeout: Seconds a write waits for another process's write
+        transaction to finish before failing.
+
+    :type max_idle_connections: int
+    :param max_idle_connections: The most connections kept open while not
+        in use.
+    """
+    def __init__(self, path, busy_timeout=5.0, max_idle_connections=8):
+        self._path = path
+        self._busy_timeout = busy_timeout
+        self._max_idle_connections = max_idle_connections
+        self._idle = []
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection in autocommit mode."""
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection inside a write transaction.
+
+        The transaction is committed if the block succeeds and rolled back
+        if it raises.
+        """
+        with self.connection() as connection:
+            # Taking the write lock up front means the transaction can never
+            # fail part way through because another process wrote first.
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+                connection.execute('COMMIT')
+            except BaseException:
+                # The connection goes back in the pool, so it must not be
+                # left inside a transaction.
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                raise
+
+    def _checkout(self):
+        with self._lock:
+            self._forget_inherited()
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, connection):
+        with self._lock:
+            self._forget_inherited()
+            full = len(self._idle) >= self._max_idle_connections
+            if connection.pid == self._pid and not full:
+                self._idle.append(connection)
+                return
+        if connection.pid == os.getpid():
+            connection.close()
+
+    def _forget_inherited(self):
+        # Must be called holding the lock.
+        pid = os.getpid()
+        if pid != self._pid:
+            self._idle = []
+            self._pid = pid
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self._path,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            factory=_Connection,
+        )
+        connection.pid = os.getpid()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+
+class _Connection(sqlite3.Connection):
+    # Records the process that opened it.
+    pid = None
+
+
+class SQLiteBackendBridgeFactory(object):
+    """Create backends that keep locks in a SQLite database file.
+
+    Every process on a host that opens the same file shares its locks. All
+    the backends created by one factory share a pool of connections.
+
+    :type path: str
+    :param path: Path of the database file. It is created if it does not
+        exist.
+
+    :type busy_timeout: float
+    :param busy_timeout: Seconds a write waits for another process's write
+        transaction to finish before failing.
+
+    :type max_idle_connections: int
+    :param max_idle_connections: The most connections to the database kept
+        open while not in use.
+    """
+    def __init__(self, path, busy_timeout=5.0, max_idle_connections=8):
+        self._pool = SQLiteConnectionPool(
+            path,
+            busy_timeout=busy_timeout,
+            max_idle_connections=max_idle_connections,
+        )
+
+    def create(self, table_name):
+        """Create a bridge and backend bound to a table.
+
+        The table is created in the database if it does not exist yet.
+
+        :type table_name: str
+        :param table_name: Name of the table.
+        """
+        backend = SQLiteBackend(self._pool, table_name)
+        backend.create_table()
+        return SQLiteVersionLeaseBridge(), backend
+
+
+class SQLiteVersionLeaseBridge(object):
+    """Acts as a bridge between SQLiteBackend and VersionLeaseTechinque.
+
+    Builds the same conditions as
+    :class:`lynk.backends.dynamodb.DynamoDBVersionLeaseBridge`, as
+    :class:`lynk.backends.sqlite.SQLiteCondition` expressions over the row
+    of a lock.
+    """
+    ConditionFailedError = ConditionalCheckFailedError
+
+    def lock_free(self):
+        """Build the condition that the lock is currently free."""
+        return SQLiteCondition('0', if_missing=True)
+
+    def lock_expired(self, version_number):
+        """Build the condition that the lock has expired.
+
+        :type version_number: str
+        :param version_number: The version number the agent last saw.
+        """
+        return SQLiteCondition('versionNumber = ?', (version_number,))
+
+    def lock_free_or_expired(self, version_number):
+        """Build the condition that a lock is free or expired."""
+        return self.lock_free() | self.lock_expired(version_number)
+
+    def lease_elapsed(self, timestamp):
+        """Build the condition that a lock's lease ran out before a time.
+
+        Entries written without an expiresAt never match this condition.
+
+        :type timestamp: int
+        :param timestamp: Milliseconds since the epoch.
+        """
+        return SQLiteCondition('expiresAt < ?', (timestamp,))
+
+    def lock_free_or_lease_elapsed(self, timestamp):
+        """Build the condition that a lock is free or its lease ran out."""
+        return self.lock_free() | self.lease_elapsed(timestamp)
+
+    def we_own_lock(self, version_number):
+        """Build the condition that "we" own this lock.
+
+        :type version_number: str
+        :param version_number: The version number the agent last wrote.
+        """
+        return SQLiteCondition('versionNumber = ?', (version_number,))
+
+    def lock_unchanged(self, version_number):
+        """Build the condition that a lock entry has not been written since
+        it was read.
+
+        :type version_number: str
+        :param version_number: The version number of the entry when it was
+            read.
+        """
+        return SQLiteCondition('versionNumber = ?', (version_number,))
+
+
+class SQLiteBackend(BaseBackend):
+    """Store lock items as rows of a SQLite table.
+
+    Each row holds the whole item as JSON, along with copies of its
+    ``versionNumber`` and ``expiresAt`` that conditions are checked against.
+    A conditional put on a lock that may be free is a single
+    ``INSERT ... ON CONFLICT DO UPDATE ... WHERE``, and any other conditional
+    write is an ``UPDATE ... WHERE`` on the lock's row. Every write is made
+    in its own transaction, apart from those passed to
+    :meth:`transact_write` together, which share one.
+
+    :type pool: :class:`lynk.backends.sqlite.SQLiteConnectionPool`
+    :param pool: Connections to the database.
+
+    :type table_name: str
+    :param table_name: Name of the table in the database.
+    """
+    _COLUMNS = ('versionNumber', 'expiresAt')
+
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, pool, table_name):
+        self._pool = pool
+        self._table = '"%s"' % table_name.replace('"', '""')
+
+    def create_table(self):
+        with self._pool.connection() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s ('
+                'lockKey TEXT PRIMARY KEY, '
+                'versionNumber TEXT, '
+                'expiresAt INTEGER, '
+                'item TEXT NOT NULL'
+                ') WITHOUT ROWID' % self._table
+            )
+
+    def put(self, item, condition=None):
+        """Put an item into the table.
+
+        If the condition fails the row it was checked against is attached to
+        the raised exception as ``existing_item``.
+        """
+        with self._pool.transaction() as connection:
+            self._put(connection, item, condition)
+
+    def update(self, key, updates, condition=None):
+        """Update the attributes of an item, creating it if it is missing.
+
+        :type key: dict
+        :param key: The key of the item to update.
+
+        :type updates: dict
+        :param updates: A dictionary of attribute -> new_value updates.
+        """
+        with self._pool.transaction() as connection:
+            self._update(connection, key['lockKey'], updates, condition)
+
+    def delete(self, key, condition=None):
+        """Delete an item from the table, if it exists."""
+        with self._pool.transaction() as connection:
+            self._delete(connection, key['lockKey'], condition)
+
+    def get(self, key, attributes, consistent=True):
+        """Get the attributes of an item.
+
+        Every read is consistent.
+
+        :rvalue: dict
+        :returns: A dictionary of attributeName -> attributeValue for each
+            attribute in the ``attributes`` list that the item has, or None
+            if there is no item.
+        """
+        with self._pool.connection() as connection:
+            item = self._read(connection, key['lockKey'])
+        if item is None:
+            return None
+        return {attr: item[attr] for attr in attributes if attr in item}
+
+    def transact_write(self, operations):
+        """Atomically apply write operations in a single transaction.
+
+        :raises: :class:`lynk.exceptions.TransactionConflictError` if the
+            condition of any operation fails, recording the existing item
+            for each failed put. None of the operations are applied.
+        """
+        with self._pool.transaction() as connection:
+            failed_indexes = []
+            existing_items = {}
+            for i, operation in enumerate(operations):
+                try:
+                    self._apply(connection, operation)
+                except ConditionalCheckFailedError as e:
+                    failed_indexes.append(i)
+                    if isinstance(operation, Put):
+                        existing_items[i] = e.existing_item
+            if failed_indexes:
+                # Rolls back the operations that were applied.
+                raise TransactionConflictError(failed_indexes, existing_items)
+
+    def _apply(self, connection, operation):
+        if isinstance(operation, Put):
+            self._put(connection, operation.item, operation.condition)
+        elif isinstance(operation, Update):
+            self._update(
+                connection, operation.key['lockKey'], operation.updates,
+                operation.condition,
+            )
+        else:
+            self._delete(
+                connection, operation.key['lockKey'], operation.condition)
+
+    def _put(self, connection, item, condition):
+        key = item['lockKey']
+        values = (
+            key, item.get('versionNumber'), item.get('expiresAt'),
+            json.dumps(item),
+        )
+        if condition is None or condition.if_missing:
+            sql = (
+                'INSERT INTO %s (lockKey, versionNumber, expiresAt, item) '
+                'VALUES (?, ?, ?, ?) ON CONFLICT (lockKey) DO UPDATE SET '
+                'versionNumber = excluded.versionNumber, '
+                'expiresAt = excluded.expiresAt, item = excluded.item'
+                % self._table
+            )
+            params = values
+        else:
+            sql = (
+                'UPDATE %s SET versionNumber = ?, expiresAt = ?, item = ? '
+                'WHERE lockKey = ?' % self._table
+            )
+            params = values[1:] + values[:1]
+        self._execute_conditional(connection, key, sql, params, condition)
+
+    def _update(self, connection, key, updates, condition):
+        assignments = []
+        params = []
+        for column in self._COLUMNS:
+            if column in updates:
+                assignments.append('%s = ?' % column)
+                params.append(updates[column])
+        paths = []
+        for attr, value in updates.items():
+            paths.append('?, json(?)')
+            params.extend(['$."%s"' % attr, json.dumps(value)])
+        assignments.append('item = json_set(item, %s)' % ', '.join(paths))
+        if condition is None or condition.if_missing:
+            item = dict(updates, lockKey=key)
+            sql = (
+                'INSERT INTO %s (lockKey, versionNumber, expiresAt, item) '
+                'VALUES (?, ?, ?, ?) ON CONFLICT (lockKey) DO UPDATE SET %s'
+                % (self._table, ', '.join(assignments))
+            )
+            params = [
+                key, item.get('versionNumber'), item.get('expiresAt'),
+                json.dumps(item),
+            ] + params
+        else:
+            sql = 'UPDATE %s SET %s WHERE lockKey = ?' % (
+                self._table, ', '.join(assignments))
+            params.append(key)
+        self._execute_conditional(
+            connection, key, sql, tuple(params), condition)
+
+    def _delete(self, connection, key, condition):
+        sql = 'DELETE FROM %s WHERE lockKey = ?' % self._table
+        self._execute_conditional(connection, key, sql, (key,), condition)
+
+    def _execute_conditional(self, connection, key, sql, params, condition):
+        # Both the upsert and plain statements end in a WHERE clause that
+        # the condition can be added to. If nothing changed either there was
+        # a row the condition rejected, or there was no row to change.
+        if condition is not None:
+            sql += ' %s (%s)' % (
+                'AND' if sql.startswith(('UPDATE', 'DELETE')) else 'WHERE',
+                condition.clause,
+            )
+            params += condition.params
+        cursor = connection.execute(sql, params)
+        if condition is None or cursor.rowcount > 0:
+            return
+        existing = self._read(connection, key)
+        if existing is None and condition.if_missing:
+            return
+        raise ConditionalCheckFailedError(existing)
+
+    def _read(self, connection, key):
+        row = connection.execute(
+            'SELECT item FROM %s WHERE lockKey = ?' % self._table,
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
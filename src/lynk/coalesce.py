@@ -0,0 +1,261 @@
+"""Coordinate threads of one process that are waiting for the same lock."""
+import threading
+from collections import deque
+
+from lynk.utils import TimeUtils
+
+
+class Waiter(object):
+    """A place in a :class:`lynk.coalesce.LocalWaitQueue`.
+
+    :ivar state: None while the waiter is queued. ``REPRESENTATIVE`` once it
+        should acquire the lock from the backend itself, or ``HANDED_OFF``
+        once the lock has been handed to it by a local holder.
+    :ivar version_number: The versionNumber the lock was handed off with.
+    :ivar written_at: When the hand-off was written, in seconds since the
+        epoch, if the holder recorded it.
+    """
+    REPRESENTATIVE = 'representative'
+    HANDED_OFF = 'handed_off'
+
+    def __init__(self, name, lease_duration):
+        self.name = name
+        self.lease_duration = lease_duration
+        self.state = None
+        self.version_number = None
+        self.written_at = None
+        # Set while a holder is handing the lock to this waiter, it cannot
+        # leave the queue until the outcome is known.
+        self.claimed = False
+        self._event = threading.Event()
+
+    def _set_state(self, state, version_number=None, written_at=None):
+        self.state = state
+        self.version_number = version_number
+        self.written_at = written_at
+        self._event.set()
+
+
+class _Entry(object):
+    __slots__ = ('holder', 'representative', 'waiters')
+
+    def __init__(self):
+        self.holder = None
+        self.representative = None
+        self.waiters = deque()
+
+
+class LocalWaitQueue(object):
+    """Queue the threads of a process waiting for each lock name.
+
+    Without a queue every thread that wants a lock runs its own acquire loop
+    against the backend, competing with the other threads of the process as
+    well as with other hosts. With one, only a single representative thread
+    per lock name talks to the backend, the rest wait in line locally. When
+    a thread that got the lock through the queue releases it, the lock is
+    handed straight to the next thread in line by rotating its versionNumber,
+    instead of being deleted and raced for.
+
+    If a queued thread waits a full lease of the current holder without being
+    handed the lock, and nobody is acting as the representative, it becomes
+    the representative. This bounds how long a holder that never releases
+    can keep the other threads of the process from going to the backend.
+    """
+    # How often a wait that can be cancelled checks for cancellation.
+    _CANCEL_CHECK_INTERVAL = 0.1
+
+    def __init__(self, time_utils=None):
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def join(self, name, lease_duration):
+        """Get in line for a lock.
+
+        :type name: str
+        :param name: Logical name of the lock.
+
+        :type lease_duration: int
+        :param lease_duration: The lease the lock will be held for.
+
+        :rtype: :class:`lynk.coalesce.Waiter`
+        :returns: The caller's place in line. If nobody in this process holds
+            or is acquiring the lock it is already the representative.
+        """
+        waiter = Waiter(name, lease_duration)
+        with self._lock:
+            entry = self._entries.setdefault(name, _Entry())
+            if entry.holder is None and entry.representative is None:
+                entry.representative = waiter
+                waiter._set_state(Waiter.REPRESENTATIVE)
+            else:
+                entry.waiters.append(waiter)
+        return waiter
+
+    def try_join(self, name, lease_duration):
+        """Become the representative for a lock, if nobody else is.
+
+        :returns: A :class:`lynk.coalesce.Waiter` that is the representative,
+            or None if another thread of this process holds or is acquiring
+            the lock.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                if entry.holder is not None:
+                    return None
+                if entry.representative is not None:
+                    return None
+        return self.join(name, lease_duration)
+
+    def wait(self, waiter, timeout, cancel_event=None):
+        """Wait until the waiter is handed the lock or made representative.
+
+        :type waiter: :class:`lynk.coalesce.Waiter`
+        :param waiter: The waiter to wait for.
+
+        :type timeout: float
+        :param timeout: Maximum number of seconds to wait.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: Stops the wait early when set.
+
+        :returns: The waiter's new state, or None if the timeout expired or
+            the wait was cancelled. In that case the waiter has left the
+            queue.
+        """
+        now = self._time_utils.time()
+        end_time = now + timeout
+        patience_start = now
+        while not waiter._event.is_set():
+            now = self._time_utils.time()
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            if now >= end_time or cancelled:
+                if self.leave(waiter):
+                    return None
+                # The lock is being handed to us right now, so the result
+                # is only moments away.
+                waiter._event.wait()
+                break
+            patience_end = patience_start + self._patience(waiter)
+            if now >= patience_end:
+                self._promote_if_unrepresented(waiter)
+                patience_start = now
+                continue
+            interval = min(end_time, patience_end) - now
+            if cancel_event is not None:
+                interval = min(interval, self._CANCEL_CHECK_INTERVAL)
+            waiter._event.wait(interval)
+        return waiter.state
+
+    def acquired(self, waiter):
+        """Record that a representative acquired the lock from the backend."""
+        with self._lock:
+            entry = self._entries[waiter.name]
+            if entry.representative is waiter:
+                entry.representative = None
+            entry.holder = waiter
+
+    def leave(self, waiter):
+        """Remove a waiter that is giving up on the lock.
+
+        :rtype: bool
+        :returns: False if the waiter could not leave because the lock is
+            being, or has already been, handed to it.
+        """
+        with self._lock:
+            if waiter.claimed or waiter.state == Waiter.HANDED_OFF:
+                return False
+            entry = self._entries.get(waiter.name)
+            if entry is None:
+                return True
+            if entry.representative is waiter:
+                entry.representative = None
+                self._promote_next(entry)
+            elif waiter in entry.waiters:
+                entry.waiters.remove(waiter)
+            self._discard_if_unused(waiter.name, entry)
+            return True
+
+    def claim_next(self, holder):
+        """Pick the waiter a releasing holder should hand the lock to.
+
+        :type holder: :class:`lynk.coalesce.Waiter`
+        :param holder: The waiter that acquired the lock being released.
+
+        :returns: The next :class:`lynk.coalesce.Waiter` in line, which must
+            then be passed to either ``handed_off`` or ``hand_off_failed``.
+            None if there is nobody waiting, in which case the lock should be
+            released to the backend.
+        """
+        with self._lock:
+            entry = self._entries.get(holder.name)
+            if entry is None or entry.holder is not holder:
+                return None
+            if entry.waiters:
+                waiter = entry.waiters.popleft()
+                waiter.claimed = True
+                return waiter
+            entry.holder = None
+            self._discard_if_unused(holder.name, entry)
+            return None
+
+    def handed_off(self, holder, waiter, version_number, written_at=None):
+        """Record that the lock now belongs to a claimed waiter.
+
+        :type written_at: float
+        :param written_at: When the hand-off was written, in seconds since
+            the epoch, so the waiter can measure the age of its lease.
+        """
+        with self._lock:
+            entry = self._entries[holder.name]
+            entry.holder = waiter
+            waiter.claimed = False
+            waiter._set_state(
+                Waiter.HANDED_OFF, version_number, written_at)
+
+    def hand_off_failed(self, holder, waiter):
+        """Put a claimed waiter back after the lock could not be handed off.
+
+        The holder no longer owns the lock, so the waiter becomes the
+        representative if there is none.
+        """
+        with self._lock:
+            entry = self._entries[holder.name]
+            if entry.holder is holder:
+                entry.holder = None
+            waiter.claimed = False
+            entry.waiters.appendleft(waiter)
+            if entry.holder is None and entry.representative is None:
+                self._promote_next(entry)
+
+    def _patience(self, waiter):
+        with self._lock:
+            entry = self._entries.get(waiter.name)
+            if entry is None or entry.holder is None:
+                return waiter.lease_duration
+            return entry.holder.lease_duration
+
+    def _promote_if_unrepresented(self, waiter):
+        with self._lock:
+            entry = self._entries[waiter.name]
+            if waiter.state is not None or waiter.claimed or \
+                    entry.representative is not None:
+                return
+            entry.waiters.remove(waiter)
+            entry.representative = waiter
+            waiter._set_state(Waiter.REPRESENTATIVE)
+
+    def _promote_next(self, entry):
+        if not entry.waiters:
+            return
+        waiter = entry.waiters.popleft()
+        entry.representative = waiter
+        waiter._set_state(Waiter.REPRESENTATIVE)
+
+    def _discard_if_unused(self, name, entry):
+        if entry.holder is None and entry.representative is None and \
+                not entry.waiters:
+            del self._entries[name]
@@ -2,15 +2,22 @@ class LockNotGrantedError(Exception):
     """Thrown when a lock is not granted due to a timeout"""
 
 
+class LockAcquireCancelledError(LockNotGrantedError):
+    """Thrown when a lock is not granted because the acquire was cancelled."""
+
+
 class LockAlreadyInUseError(Exception):
     """Thrown when a lock cannot be acquired because another client owns it.
 
     It will be populated with the existing lock's record_version_number and
     lease_duration which allows us to try and take the lock after that timeout.
+    If the existing lock recorded when its lease expires, in milliseconds since
+    the epoch, that is populated as expires_at.
     """
-    def __init__(self, lease_duration, version_number):
+    def __init__(self, lease_duration, version_number, expires_at=None):
         self.lease_duration = lease_duration
         self.version_number = version_number
+        self.expires_at = expires_at
 
 
 class LockLostError(Exception):
@@ -30,3 +37,27 @@ class CannotDeserializeError(Exception):
     """Raised when something cannot be deserialized."""
     def __init__(self, reason):
         self.message = reason
+
+
+class TransactionConflictError(Exception):
+    """Raised when a transactional write fails because of its conditions.
+
+    None of the operations in the transaction were applied. The indexes of the
+    operations whose conditions failed are recorded in ``failed_indexes``, the
+    rest could be retried without them. Backends that can return the items
+    that failed :class:`lynk.backends.base.Put` conditions record them in
+    ``existing_items``, keyed by the index of the operation.
+    """
+    def __init__(self, failed_indexes, existing_items=None):
+        self.failed_indexes = failed_indexes
+        if existing_items is None:
+            existing_items = {}
+        self.existing_items = existing_items
+
+
+class RequestThrottledError(Exception):
+    """Raised when a backend request could not be sent before its timeout.
+
+    The session's rate limiter did not let the request through in time,
+    because the backend has been throttling requests.
+    """
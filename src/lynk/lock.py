@@ -2,6 +2,9 @@ import json
 
 from contextlib import contextmanager
 
+from lynk.throttle import urgent
+from lynk.exceptions import NoSuchLockError
+
 
 class Lock(object):
     """A class that provides an interface with which to use a lock.
@@ -13,19 +16,28 @@ class Lock(object):
     """
     _REFRESH_PERIOD_RATIO = 3.0 / 4.0
 
-    def __init__(self, name, technique, refresher_factory=None):
+    def __init__(self, name, technique, refresher_factory=None, holds=None):
         """Initialize a new Lock.
 
         :type locker: :class:`lynk.lock.Locker`
         :param locker: The provided Locker is responsible for running the
             actual locking algorithms for creation releasing and stealing.
+
+        :type holds: :class:`lynk.reentrant.LocalHolds`
+        :param holds: If provided the lock is reentrant. A thread that
+            already holds the lock name, through this or any other lock
+            sharing ``holds``, can acquire it again without a backend request,
+            and the name is only released in the backend by the release
+            matching its outermost acquire.
         """
         self._name = name
         self._technique = technique
         self._refresher_factory = refresher_factory
         self._refresher = None
+        self._holds = holds
 
-    def acquire(self, lease_duration=20, max_wait_seconds=300):
+    def acquire(self, lease_duration=20, max_wait_seconds=300, deadline=None,
+                cancel_event=None):
         """Try to aquire this lock.
 
         This call will block until the lock has been confirmed as owned by us
@@ -42,22 +54,79 @@ class Lock(object):
         :param max_wait_seconds: Number of seconds to wait to aquire the lock
             before giving up and raising a
             :class:`lynk.exceptions.LockNotGrantedError`.
+
+        :type deadline: float
+        :param deadline: A time, by the clock of this lock's technique, to
+            give up at. If both this and ``max_wait_seconds`` are given,
+            whichever comes first is used.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: Setting this event from another thread
+            interrupts the wait, and a
+            :class:`lynk.exceptions.LockAcquireCancelledError` is raised.
         """
+        if self._holds is not None and self._holds.enter(self._name):
+            return
         self._technique.acquire(
             self._name,
             lease_duration,
             max_wait_seconds=max_wait_seconds,
+            cancel_event=cancel_event,
+            deadline=deadline,
         )
-        self._start_refresher(lease_duration)
+        self._acquired(lease_duration)
+
+    def try_acquire(self, lease_duration=20):
+        """Make a single attempt to acquire this lock without waiting.
+
+        :type lease_duration: int
+        :param lease_duration: The number of seconds to hold the lock for
+            initially.
+
+        :rtype: bool
+        :returns: True if the lock was acquired, False if it is in use.
+        """
+        if self._holds is not None and self._holds.enter(self._name):
+            return True
+        if not self._technique.try_acquire(self._name, lease_duration):
+            return False
+        self._acquired(lease_duration)
+        return True
 
     def release(self):
-        """Release this lock."""
-        self._stop_refresher()
-        self._technique.release(self._name)
+        """Release this lock.
+
+        A reentrant lock is only released in the backend once every acquire
+        made by the current thread has been matched by a release.
+        """
+        if self._holds is None:
+            self._release()
+            return
+        holder = self._holds.exit(self._name)
+        if holder is not None:
+            holder._release()
 
     def refresh(self):
         """Refresh this lock."""
-        self._technique.refresh(self._name)
+        holder = self._holder()
+        with urgent():
+            holder._technique.refresh(self._name)
+
+    @property
+    def supports_batch_refresh(self):
+        """Whether this lock can be refreshed in a batch with others."""
+        return self._technique.SUPPORTS_TRANSACTIONS
+
+    def prepare_refresh(self):
+        """Prepare a refresh of this lock to be sent later in a batch.
+
+        Only supported if :attr:`supports_batch_refresh` is true.
+
+        :rtype: :class:`lynk.techniques.PendingRefresh`
+        """
+        holder = self._holder()
+        with urgent():
+            return holder._technique.prepare_refresh(self._name)
 
     def __call__(self, lease_duration=20, timeout_seconds=300):
         return self._context_manager(lease_duration, timeout_seconds)
@@ -73,8 +142,29 @@ class Lock(object):
         finally:
             self.release()
 
+    def _acquired(self, lease_duration):
+        self._start_refresher(lease_duration)
+        if self._holds is not None:
+            self._holds.claim(self._name, self)
+
+    def _release(self):
+        self._stop_refresher()
+        with urgent():
+            self._technique.release(self._name)
+
+    def _holder(self):
+        # A nested reentrant acquire can be made through a different lock
+        # object than the one holding the name in the backend. Only the
+        # owner holding the name, or that lock object, may use it.
+        if self._holds is None:
+            return self
+        holder = self._holds.holder(self._name, self)
+        if holder is None:
+            raise NoSuchLockError()
+        return holder
+
     def _start_refresher(self, lease_duration):
-        if not self._refresher_factory:
+        if self._refresher_factory is None:
             return
         self._refresher = self._refresher_factory.create_lock_refresher(
             self,
@@ -107,3 +197,106 @@ class Lock(object):
             'technique': self._technique.serialize(),
         }
         return json.dumps(properties)
+
+
+class LockGroup(object):
+    """A set of locks that are acquired, refreshed and released together.
+
+    Acquiring the group takes every one of its locks in a single atomic
+    backend request, or none of them. This object should not be initialized
+    directly, but created from a :class:`lynk.session.Session`.
+    """
+    _REFRESH_PERIOD_RATIO = Lock._REFRESH_PERIOD_RATIO
+    # The group is refreshed by a transaction of its own, rather than being
+    # batched with other locks.
+    supports_batch_refresh = False
+
+    def __init__(self, names, technique, refresher_factory=None):
+        if not technique.SUPPORTS_TRANSACTIONS:
+            raise ValueError(
+                "Locks of %s cannot be acquired together in a group." % (
+                    type(technique).__name__))
+        self._names = sorted(set(names))
+        self._technique = technique
+        self._refresher_factory = refresher_factory
+        self._refresher = None
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    def acquire(self, lease_duration=20, max_wait_seconds=300, deadline=None,
+                cancel_event=None):
+        """Try to acquire every lock in this group.
+
+        This call will block until all of the locks have been acquired
+        together, or the timeout has been reached, in which case a
+        :class:`lynk.exceptions.LockNotGrantedError` is raised and none of
+        them are held.
+
+        :type lease_duration: int
+        :param lease_duration: The number of seconds to hold the locks for
+            initially.
+
+        :type max_wait_seconds: float
+        :param max_wait_seconds: Number of seconds to wait to acquire the
+            locks before giving up.
+
+        :type deadline: float
+        :param deadline: A time, by the clock of this group's technique, to
+            give up at. If both this and ``max_wait_seconds`` are given,
+            whichever comes first is used.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: Setting this event from another thread
+            interrupts the wait, and a
+            :class:`lynk.exceptions.LockAcquireCancelledError` is raised.
+        """
+        self._technique.acquire_many(
+            self._names,
+            lease_duration,
+            max_wait_seconds=max_wait_seconds,
+            cancel_event=cancel_event,
+            deadline=deadline,
+        )
+        self._start_refresher(lease_duration)
+
+    def release(self):
+        """Release every lock in this group."""
+        self._stop_refresher()
+        with urgent():
+            self._technique.release_many(self._names)
+
+    def refresh(self):
+        """Refresh every lock in this group."""
+        with urgent():
+            self._technique.refresh_many(self._names)
+
+    def __call__(self, lease_duration=20, timeout_seconds=300):
+        return self._context_manager(lease_duration, timeout_seconds)
+
+    @contextmanager
+    def _context_manager(self, lease_duration, max_wait_seconds):
+        self.acquire(
+            lease_duration=lease_duration,
+            max_wait_seconds=max_wait_seconds,
+        )
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _start_refresher(self, lease_duration):
+        if self._refresher_factory is None:
+            return
+        self._refresher = self._refresher_factory.create_lock_refresher(
+            self,
+            lease_duration * self._REFRESH_PERIOD_RATIO,
+        )
+        self._refresher.start()
+
+    def _stop_refresher(self):
+        if not self._refresher:
+            return
+        self._refresher.stop()
+        self._refresher = None
@@ -0,0 +1,352 @@
+"""Measure where the time spent on locks goes.
+
+A :class:`lynk.session.Session` given a ``metrics`` hook reports to it:
+
+* The latency of every backend request, and which of them failed their
+  condition, through an :class:`InstrumentedBackend` wrapped around the
+  session's backend.
+* The time each acquire took, how many attempts it made and how long it
+  slept between them.
+* How old each lock's lease was when it was refreshed, against its lease
+  duration, and every lock found to be lost.
+
+:class:`HistogramMetrics` keeps all of these in histograms that can be
+exported as a dict. Without a hook a session does none of this work.
+"""
+import weakref
+import threading
+
+from lynk.backends.base import BaseBackend
+from lynk.exceptions import TransactionConflictError
+from lynk.utils import TimeUtils
+
+
+class MetricsHook(object):
+    """Receives measurements of locks. Every method does nothing by default.
+    """
+    def on_backend_call(self, operation, seconds):
+        """Called after every backend request, whether or not it succeeded.
+
+        :type operation: str
+        :param operation: One of ``put``, ``update``, ``delete``, ``get`` and
+            ``transact_write``.
+
+        :type seconds: float
+        :param seconds: How long the request took.
+        """
+
+    def on_condition_failed(self, operation):
+        """Called when the condition of a backend request fails.
+
+        :type operation: str
+        :param operation: The kind of request.
+        """
+
+    def on_acquire(self, name, attempts, seconds, slept):
+        """Called when a lock has been acquired.
+
+        :type name: str
+        :param name: Logical name of the lock.
+
+        :type attempts: int
+        :param attempts: The number of times the lock was tried.
+
+        :type seconds: float
+        :param seconds: How long the acquire took in total.
+
+        :type slept: float
+        :param slept: How much of that was spent waiting between attempts.
+        """
+
+    def on_refresh(self, name, age, lease_duration):
+        """Called when a lock has been refreshed.
+
+        :type name: str
+        :param name: Logical name of the lock.
+
+        :type age: float
+        :param age: Seconds since the lock was last written. A lock whose age
+            reaches its lease duration can be taken by someone else.
+
+        :type lease_duration: float
+        :param lease_duration: The lock's lease duration in seconds.
+        """
+
+    def on_lock_lost(self, name):
+        """Called when a lock turns out to have been taken by someone else.
+
+        :type name: str
+        :param name: Logical name of the lock.
+        """
+
+
+class _ThreadSentinel(object):
+    # Kept in a thread's locals, so it is collected when the thread exits.
+    pass
+
+
+def _fold(counts_ref, shard):
+    counts = counts_ref()
+    if counts is not None:
+        counts._fold(shard)
+
+
+class _PerThreadCounts(object):
+    # Each thread counts into a list of its own, so recording never takes a
+    # lock or loses an update. Reads add up every thread's list. When a
+    # thread exits its list is added to a shared total and dropped, so
+    # short lived threads do not leave lists behind.
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+        self._total = [0] * size
+        self._shards_lock = threading.Lock()
+
+    def _counts(self):
+        counts = getattr(self._local, 'counts', None)
+        if counts is None:
+            counts = [0] * self._size
+            sentinel = _ThreadSentinel()
+            with self._shards_lock:
+                self._shards.append(counts)
+            weakref.finalize(sentinel, _fold, weakref.ref(self), counts)
+            self._local.sentinel = sentinel
+            self._local.counts = counts
+        return counts
+
+    def _fold(self, shard):
+        with self._shards_lock:
+            for i, count in enumerate(shard):
+                self._total[i] += count
+            # Other threads' lists may hold equal counts, so the list is
+            # found by identity rather than with remove().
+            self._shards = [s for s in self._shards if s is not shard]
+
+    def _merged(self):
+        # The total and the lists are copied together, so a list being
+        # folded in meanwhile is counted exactly once.
+        with self._shards_lock:
+            merged = list(self._total)
+            shards = list(self._shards)
+        for shard in shards:
+            for i, count in enumerate(list(shard)):
+                merged[i] += count
+        return merged
+
+
+class Counter(_PerThreadCounts):
+    """A count that any number of threads can add to without locking."""
+    def __init__(self):
+        super(Counter, self).__init__(1)
+
+    def increment(self, amount=1):
+        self._counts()[0] += amount
+
+    @property
+    def value(self):
+        return self._merged()[0]
+
+
+class Histogram(_PerThreadCounts):
+    """A distribution of values that threads can record without locking.
+
+    Values are scaled to integers and counted in log-linear buckets, like an
+    HDR histogram. Integers below 128 each have a bucket of their own, and
+    every larger power of two range is split into 64 buckets, so a value is
+    reported to within about 1.6% of what was recorded. Scaled values of 2
+    to the power 41 or more are counted as the largest value there is a
+    bucket for.
+
+    :type scale: float
+    :param scale: Values are multiplied by this before being counted, so
+        with the default of a million, values in seconds are counted in
+        microseconds.
+    """
+    _SUB_BUCKET_BITS = 6
+    _MAX_SHIFT = 34
+    _BUCKETS = (_MAX_SHIFT + 2) << _SUB_BUCKET_BITS
+    _PERCENTILES = (
+        ('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+    def __init__(self, scale=1e6):
+        # The last two slots hold the number and sum of the values.
+        super(Histogram, self).__init__(self._BUCKETS + 2)
+        self._scale = scale
+
+    def record(self, value):
+        scaled = max(int(value * self._scale), 0)
+        counts = self._counts()
+        counts[self._index(scaled)] += 1
+        counts[-2] += 1
+        counts[-1] += scaled
+
+    def _index(self, value):
+        shift = max(value.bit_length() - self._SUB_BUCKET_BITS - 1, 0)
+        if shift > self._MAX_SHIFT:
+            return self._BUCKETS - 1
+        return (shift << self._SUB_BUCKET_BITS) + (value >> shift)
+
+    def _value_at(self, index):
+        # The middle of the range of values counted in a bucket.
+        shift = max((index >> self._SUB_BUCKET_BITS) - 1, 0)
+        lowest = (index - (shift << self._SUB_BUCKET_BITS)) << shift
+        return lowest + ((1 << shift) - 1) / 2.0
+
+    def snapshot(self):
+        """Summarize the values recorded so far.
+
+        :rtype: dict
+        :returns: The ``count`` of values, and their ``mean``, ``min``,
+            ``max``, and ``p50``, ``p90``, ``p99`` and ``p999`` percentiles,
+            all in the unit the values were recorded in. Only the count is
+            included if there are no values.
+        """
+        counts = self._merged()
+        total = counts[-2]
+        if not total:
+            return {'count': 0}
+        buckets = counts[:-2]
+        filled = [i for i, count in enumerate(buckets) if count]
+        snapshot = {
+            'count': total,
+            'mean': counts[-1] / float(total) / self._scale,
+            'min': self._value_at(filled[0]) / self._scale,
+            'max': self._value_at(filled[-1]) / self._scale,
+        }
+        seen = 0
+        percentiles = list(self._PERCENTILES)
+        for i in filled:
+            seen += buckets[i]
+            while percentiles and seen >= percentiles[0][1] * total:
+                name, _ = percentiles.pop(0)
+                snapshot[name] = self._value_at(i) / self._scale
+        return snapshot
+
+
+class HistogramMetrics(MetricsHook):
+    """Keep every measurement in histograms and counters.
+
+    Recording a measurement costs a few list updates, and never waits for
+    another thread. :meth:`snapshot` exports them all as a dict.
+    """
+    OPERATIONS = ('put', 'update', 'delete', 'get', 'transact_write')
+
+    def __init__(self):
+        self._latencies = dict(
+            (operation, Histogram()) for operation in self.OPERATIONS)
+        self._condition_failures = dict(
+            (operation, Counter()) for operation in self.OPERATIONS)
+        self._acquire_seconds = Histogram()
+        self._acquire_attempts = Histogram(scale=1)
+        self._acquire_slept = Histogram()
+        self._refresh_age = Histogram()
+        # Recorded in ten thousandths to keep four decimal places.
+        self._refresh_lease_used = Histogram(scale=1e4)
+        self._locks_lost = Counter()
+
+    def on_backend_call(self, operation, seconds):
+        self._latencies[operation].record(seconds)
+
+    def on_condition_failed(self, operation):
+        self._condition_failures[operation].increment()
+
+    def on_acquire(self, name, attempts, seconds, slept):
+        self._acquire_attempts.record(attempts)
+        self._acquire_seconds.record(seconds)
+        self._acquire_slept.record(slept)
+
+    def on_refresh(self, name, age, lease_duration):
+        self._refresh_age.record(age)
+        if lease_duration:
+            self._refresh_lease_used.record(age / float(lease_duration))
+
+    def on_lock_lost(self, name):
+        self._locks_lost.increment()
+
+    def snapshot(self):
+        """Export every measurement.
+
+        :rtype: dict
+        :returns: A dictionary of measurement name to either a count, or a
+            histogram summary as returned by :meth:`Histogram.snapshot`.
+            Times are in seconds, and ``refresh.lease_used`` is the fraction
+            of its lease a lock had used up when it was refreshed.
+        """
+        snapshot = {
+            'acquire.seconds': self._acquire_seconds.snapshot(),
+            'acquire.attempts': self._acquire_attempts.snapshot(),
+            'acquire.slept_seconds': self._acquire_slept.snapshot(),
+            'refresh.age_seconds': self._refresh_age.snapshot(),
+            'refresh.lease_used': self._refresh_lease_used.snapshot(),
+            'locks_lost': self._locks_lost.value,
+        }
+        for operation in self.OPERATIONS:
+            snapshot['backend.%s.seconds' % operation] = \
+                self._latencies[operation].snapshot()
+            snapshot['backend.%s.condition_failures' % operation] = \
+                self._condition_failures[operation].value
+        return snapshot
+
+
+class InstrumentedBackend(BaseBackend):
+    """Report the latency and failed conditions of another backend's calls.
+
+    :type backend: :class:`lynk.backends.base.BaseBackend`
+    :param backend: The backend requests are passed on to.
+
+    :type metrics: :class:`MetricsHook`
+    :param metrics: Receives the measurements.
+
+    :type condition_failed_error: Exception class
+    :param condition_failed_error: The error the backend raises when the
+        condition of a request fails, the bridge's ``ConditionFailedError``.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: A set of utilities for interacting with time.
+    """
+    def __init__(self, backend, metrics, condition_failed_error,
+                 time_utils=None):
+        self._backend = backend
+        self._metrics = metrics
+        self._condition_failed_errors = (
+            condition_failed_error, TransactionConflictError)
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        self.MAX_TRANSACTION_ITEMS = getattr(
+            backend, 'MAX_TRANSACTION_ITEMS',
+            BaseBackend.MAX_TRANSACTION_ITEMS)
+        self.SUPPORTS_TRANSACTIONS = getattr(
+            backend, 'SUPPORTS_TRANSACTIONS', False)
+
+    def put(self, item, condition=None):
+        return self._call(
+            'put', self._backend.put, item, condition=condition)
+
+    def update(self, key, updates, condition=None):
+        return self._call(
+            'update', self._backend.update, key, updates, condition=condition)
+
+    def delete(self, key, condition=None):
+        return self._call(
+            'delete', self._backend.delete, key, condition=condition)
+
+    def get(self, key, attributes, consistent=True):
+        return self._call(
+            'get', self._backend.get, key, attributes, consistent=consistent)
+
+    def transact_write(self, operations):
+        return self._call(
+            'transact_write', self._backend.transact_write, operations)
+
+    def _call(self, operation, fn, *args, **kwargs):
+        start = self._time_utils.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except self._condition_failed_errors:
+            self._metrics.on_condition_failed(operation)
+            raise
+        finally:
+            self._metrics.on_backend_call(
+                operation, self._time_utils.perf_counter() - start)
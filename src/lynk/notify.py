@@ -0,0 +1,254 @@
+"""Channels used to tell waiting agents that a lock has been released."""
+import uuid
+import socket
+import struct
+import logging
+import threading
+
+
+LOG = logging.getLogger(__name__)
+
+
+class BaseNotifier(object):
+    """Delivers release notifications to agents waiting for a lock.
+
+    Notifications are only a hint used to wake waiters up early. They may be
+    lost or delivered more than once, waiters still fall back to polling the
+    backend.
+    """
+    def subscribe(self, name):
+        """Start listening for releases of a lock.
+
+        :type name: str
+        :param name: Logical name of the lock.
+
+        :rtype: :class:`lynk.notify.Subscription`
+        :returns: A subscription that must be closed once the caller is no
+            longer waiting.
+        """
+        raise NotImplementedError('subscribe')
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError('unsubscribe')
+
+    def publish(self, name, wake_all=None):
+        """Notify every subscriber that a lock has been released.
+
+        :type name: str
+        :param name: Logical name of the lock that was released.
+
+        :type wake_all: bool
+        :param wake_all: If ``True`` every subscriber is woken, for a release
+            that more than one waiter can make use of. By default the
+            notifier decides.
+        """
+        raise NotImplementedError('publish')
+
+    def close(self):
+        pass
+
+
+class Subscription(object):
+    """Interest in the release of a single lock."""
+    def __init__(self, notifier, name):
+        self.name = name
+        self._notifier = notifier
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def is_notified(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Block until the lock is released or the timeout expires.
+
+        :type timeout: float
+        :param timeout: Maximum number of seconds to wait.
+
+        :rtype: bool
+        :returns: True if a release was published while waiting, or since
+            the last call to wait.
+        """
+        notified = self._event.wait(timeout)
+        self._event.clear()
+        return notified
+
+    def close(self):
+        self._notifier.unsubscribe(self)
+
+
+class LocalNotifier(BaseNotifier):
+    """Deliver notifications to subscribers in the same process.
+
+    This is enough to wake up threads waiting on a lock that another thread
+    of the same process released, as long as they share the notifier.
+
+    Only one thread can take a released lock, and every other thread that
+    tries costs a failed conditional write. So by default each notification
+    wakes only the longest waiting subscriber that has not already been
+    woken. When that thread releases the lock in turn it wakes the next one.
+
+    :type wake_all: bool
+    :param wake_all: If ``True`` every subscriber is woken by each
+        notification instead. A release that several waiters can use, such
+        as that of a lock held exclusively while others wait to share it, is
+        published to every subscriber regardless.
+    """
+    def __init__(self, wake_all=False):
+        self._wake_all = wake_all
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, name):
+        subscription = Subscription(self, name)
+        with self._lock:
+            self._subscriptions.setdefault(name, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.name)
+            if not subscriptions or subscription not in subscriptions:
+                return
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.name]
+
+    def publish(self, name, wake_all=None):
+        if wake_all is None:
+            wake_all = self._wake_all
+        with self._lock:
+            subscriptions = self._subscriptions.get(name, ())
+            if wake_all:
+                for subscription in subscriptions:
+                    subscription.notify()
+                return
+            for subscription in subscriptions:
+                if not subscription.is_notified():
+                    subscription.notify()
+                    return
+
+
+class UDPNotifier(LocalNotifier):
+    """Share notifications with other processes over UDP.
+
+    Every release published locally is also sent as a datagram to each peer,
+    and datagrams received from peers are fanned out to local subscribers. If
+    the listening address is a multicast group the notifier joins it, and by
+    default publishes to that same group so every member receives it.
+
+    Datagrams are sent without any acknowledgement, which is fine since a
+    lost notification only means a waiter falls back to polling. Each one
+    carries an id of the notifier that sent it, so a notifier ignores its
+    own datagrams when multicast loops them back to it. Loopback itself
+    stays on, so other processes on the same host still receive them.
+
+    :type address: tuple
+    :param address: A ``(host, port)`` pair to listen on. A port of 0 picks
+        any free port, the one chosen is available as ``address`` once the
+        notifier has been created.
+
+    :type peers: list
+    :param peers: ``(host, port)`` pairs to send notifications to.
+
+    :type ttl: int
+    :param ttl: Number of network hops multicast notifications can travel.
+
+    :type wake_all: bool
+    :param wake_all: Whether a notification wakes every local subscriber, or
+        only the longest waiting one.
+    """
+    # Lock names longer than this are not sent to peers.
+    _MAX_MESSAGE_SIZE = 8192
+    # How often the receiving thread checks whether it has been closed.
+    _RECEIVE_TIMEOUT = 0.5
+    # Follows the id of the sender of a notification that should wake every
+    # subscriber. Ids are hex, so it cannot be mistaken for part of one.
+    _WAKE_ALL_MARKER = b'*'
+
+    def __init__(self, address=('127.0.0.1', 0), peers=None, ttl=1,
+                 wake_all=False):
+        super(UDPNotifier, self).__init__(wake_all)
+        host, port = address
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self._is_multicast(host):
+            self._socket.bind(('', port))
+            membership = struct.pack(
+                '4s4s', socket.inet_aton(host), socket.inet_aton('0.0.0.0'))
+            self._socket.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self._socket.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            if peers is None:
+                peers = [(host, self._socket.getsockname()[1])]
+        else:
+            self._socket.bind((host, port))
+        self._socket.settimeout(self._RECEIVE_TIMEOUT)
+        self._peers = list(peers or [])
+        self._sender_id = uuid.uuid4().hex.encode('ascii')
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._receive, name='lynk-udp-notifier')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def address(self):
+        return self._socket.getsockname()
+
+    def publish(self, name, wake_all=None):
+        super(UDPNotifier, self).publish(name, wake_all)
+        sender_id = self._sender_id
+        if wake_all:
+            sender_id += self._WAKE_ALL_MARKER
+        message = sender_id + b' ' + name.encode('utf-8')
+        if len(message) > self._MAX_MESSAGE_SIZE:
+            return
+        for peer in self._peers:
+            try:
+                self._socket.sendto(message, peer)
+            except (socket.error, OSError):
+                LOG.debug('Failed to notify %s of release', peer,
+                          exc_info=True)
+
+    def close(self):
+        self._closed = True
+        self._thread.join()
+        self._socket.close()
+
+    def _receive(self):
+        while not self._closed:
+            try:
+                message, _ = self._socket.recvfrom(self._MAX_MESSAGE_SIZE)
+            except socket.timeout:
+                continue
+            except (socket.error, OSError):
+                if self._closed:
+                    return
+                LOG.debug('Failed to receive notification', exc_info=True)
+                continue
+            sender_id, _, name = message.partition(b' ')
+            wake_all = None
+            if sender_id.endswith(self._WAKE_ALL_MARKER):
+                sender_id = sender_id[:-len(self._WAKE_ALL_MARKER)]
+                wake_all = True
+            if sender_id == self._sender_id:
+                # Our own datagram looped back to us, the local subscribers
+                # have already been notified.
+                continue
+            try:
+                name = name.decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+            # Only deliver locally, re-sending it would loop forever.
+            LocalNotifier.publish(self, name, wake_all)
+
+    def _is_multicast(self, host):
+        try:
+            first_octet = bytearray(socket.inet_aton(host))[0]
+        except (socket.error, OSError, ValueError):
+            return False
+        return 224 <= first_octet <= 239
@@ -0,0 +1,107 @@
+"""Track which thread or task of a process holds each reentrant lock."""
+import threading
+
+from lynk.exceptions import NoSuchLockError
+
+
+class _Hold(object):
+    __slots__ = ('lock', 'count')
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.count = 1
+
+
+class LocalHolds(object):
+    """Count how many times the holder of each lock name has acquired it.
+
+    Reentrant locks created by one session share a ``LocalHolds``. The first
+    acquire of a name by a thread goes to the backend as usual and is
+    recorded here, along with the lock object that made it. Further acquires
+    of that name by the same thread, through any reentrant lock object, are
+    only counted, and only the release matching the outermost acquire is sent
+    to the backend, by the lock object that made it.
+
+    :type get_owner: callable
+    :param get_owner: Returns the current owner. By default the current
+        thread, the asyncio locks pass one returning the current task.
+    """
+    def __init__(self, get_owner=None):
+        if get_owner is None:
+            get_owner = threading.current_thread
+        self._get_owner = get_owner
+        # Shared locks let several owners hold a name at once, so holds are
+        # kept by name and then by owner. Looking up a name never has to go
+        # through the holds of other names.
+        self._holds = {}
+        self._lock = threading.Lock()
+
+    def enter(self, name):
+        """Count a nested acquire of a name.
+
+        :rtype: bool
+        :returns: True if the current owner already holds the name, in which
+            case the acquire has been counted and needs no backend request.
+        """
+        owner = self._get_owner()
+        with self._lock:
+            hold = self._holds.get(name, {}).get(owner)
+            if hold is None:
+                return False
+            hold.count += 1
+            return True
+
+    def claim(self, name, lock):
+        """Record that the current owner has acquired a name from the backend.
+
+        :type lock: :class:`lynk.lock.Lock`
+        :param lock: The lock object holding the name in the backend.
+        """
+        owner = self._get_owner()
+        with self._lock:
+            self._holds.setdefault(name, {})[owner] = _Hold(lock)
+
+    def exit(self, name):
+        """Count a release of a name by the current owner.
+
+        :rtype: :class:`lynk.lock.Lock` or None
+        :returns: The lock object holding the name in the backend if this was
+            the outermost release and it should now be released there,
+            otherwise None.
+        """
+        owner = self._get_owner()
+        with self._lock:
+            owners = self._holds.get(name, {})
+            hold = owners.get(owner)
+            if hold is None:
+                raise NoSuchLockError()
+            hold.count -= 1
+            if hold.count:
+                return None
+            del owners[owner]
+            if not owners:
+                del self._holds[name]
+            return hold.lock
+
+    def holder(self, name, lock=None):
+        """Find the lock object holding a name in the backend.
+
+        :type lock: :class:`lynk.lock.Lock`
+        :param lock: The lock object asking. The lock object holding a name
+            gets it back from any owner, so that its refresher can run in a
+            thread or task of its own.
+
+        :rtype: :class:`lynk.lock.Lock` or None
+        :returns: The lock object holding the name, or None unless the name
+            is held by the current owner or through ``lock``.
+        """
+        owner = self._get_owner()
+        with self._lock:
+            owners = self._holds.get(name, {})
+            hold = owners.get(owner)
+            if hold is not None:
+                return hold.lock
+            for hold in owners.values():
+                if hold.lock is lock:
+                    return lock
+            return None
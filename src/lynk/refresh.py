@@ -1,5 +1,25 @@
+import heapq
+import queue
+import logging
+import itertools
 from threading import Thread
+from threading import current_thread
 from threading import Event
+from threading import Condition
+from collections import OrderedDict
+
+from lynk.utils import TimeUtils
+from lynk.backends.base import BaseBackend
+from lynk.exceptions import LockLostError
+from lynk.exceptions import NoSuchLockError
+from lynk.exceptions import TransactionConflictError
+from lynk.throttle import urgent
+
+
+LOG = logging.getLogger(__name__)
+# Refresh errors after which the lock is no longer held. Any other error
+# may be transient, so the refresh is tried again.
+_NOT_HELD_ERRORS = (LockLostError, NoSuchLockError)
 
 
 class LockRefresher(Thread):
@@ -26,3 +46,473 @@ class LockRefresher(Thread):
 class LockRefresherFactory(object):
     def create_lock_refresher(self, lock, refresh_period_seconds):
         return LockRefresher(lock.refresh, refresh_period_seconds)
+
+
+class ScheduledLockRefresher(object):
+    """A handle to a lock refresh that is run by a LockRefreshScheduler.
+
+    It has the same ``start`` and ``stop`` interface as
+    :class:`lynk.refresh.LockRefresher` so a Lock can use either one, but it
+    does not own a thread. Starting it registers it with the scheduler, and
+    stopping it marks it as cancelled so the scheduler drops it.
+    """
+    __slots__ = ('_scheduler', 'lock', 'refresh_period_seconds',
+                 'deadline', 'scheduled', 'cancelled')
+
+    def __init__(self, scheduler, lock, refresh_period_seconds):
+        self._scheduler = scheduler
+        self.lock = lock
+        self.refresh_period_seconds = refresh_period_seconds
+        self.deadline = None
+        self.scheduled = False
+        self.cancelled = False
+
+    def start(self):
+        self._scheduler.register(self)
+
+    def stop(self):
+        self._scheduler.unregister(self)
+
+
+class LockRefreshScheduler(object):
+    """Refresh any number of locks from a few background threads.
+
+    Rather than running a thread per lock, every lock refresh is kept in a
+    heap ordered by the time it is next due. One thread sleeps until the
+    earliest deadline and hands every refresh that has come due to a small
+    pool of workers, which put them back in the heap with their next
+    deadline once they are done. A slow refresh only holds up its own
+    worker, and workers are only started while there are more refreshes in
+    flight than workers to run them. Registering a refresh is a heap
+    push, O(log n). Unregistering marks the entry as cancelled in O(1), and
+    cancelled entries are discarded when they reach the top of the heap, or
+    all at once if they ever make up more than half of it.
+
+    Refreshes that come due within ``batch_window`` seconds of each other
+    are run together, and if a ``batch_refresher`` is provided it is given
+    all of them at once so they can be sent to the backend in batches.
+
+    A lock stops being refreshed once it turns out to be lost. A refresh
+    that fails for any other reason, such as throttling, is tried again
+    after a tenth of the lock's refresh period, which leaves room for more
+    attempts before its lease runs out.
+
+    An instance can be used anywhere a
+    :class:`lynk.refresh.LockRefresherFactory` is expected. A
+    :class:`lynk.session.Session` creates one and shares it between all of
+    its locks.
+    """
+    _RETRY_PERIOD_RATIO = 0.1
+
+    def __init__(self, time_utils=None, batch_refresher=None,
+                 batch_window=0, max_workers=4):
+        """Initialize a LockRefreshScheduler.
+
+        :type time_utils: :class:`lynk.utils.TimeUtils`
+        :param time_utils: A set of utilities for interacting with time.
+
+        :type batch_refresher: :class:`lynk.refresh.BatchLockRefresher`
+        :param batch_refresher: Used to refresh locks that come due together.
+            If None each lock is refreshed on its own.
+
+        :type batch_window: float
+        :param batch_window: Number of seconds early a refresh can be run so
+            that it can be batched with one that is due now. Should be small
+            relative to the refresh period of the locks.
+
+        :type max_workers: int
+        :param max_workers: The most refreshes, or batches of refreshes, run
+            at the same time.
+        """
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        self._batch_refresher = batch_refresher
+        self._batch_window = batch_window
+        self._heap = []
+        self._cancelled_count = 0
+        self._counter = itertools.count()
+        self._condition = Condition()
+        self._thread = None
+        self._stopped = False
+        self._max_workers = max_workers
+        self._workers = []
+        self._tasks = queue.Queue()
+        # Refreshes handed to the workers that have not finished yet.
+        self._in_flight = 0
+
+    def create_lock_refresher(self, lock, refresh_period_seconds):
+        return ScheduledLockRefresher(self, lock, refresh_period_seconds)
+
+    def register(self, refresher):
+        """Start periodically calling a refresher's refresh function.
+
+        :type refresher: :class:`lynk.refresh.ScheduledLockRefresher`
+        :param refresher: The refresher to schedule. Its first refresh will be
+            due one refresh period from now.
+
+        :raises: RuntimeError if the scheduler has been stopped, since the
+            refresher would never be called.
+        """
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError('scheduler stopped')
+            if refresher.scheduled and refresher.cancelled:
+                self._cancelled_count -= 1
+            refresher.cancelled = False
+            if refresher.scheduled:
+                return
+            self._push(refresher, self._time_utils.time())
+            self._ensure_thread_started()
+            if self._heap[0][2] is refresher:
+                self._condition.notify()
+
+    def unregister(self, refresher):
+        """Stop refreshing a refresher.
+
+        :type refresher: :class:`lynk.refresh.ScheduledLockRefresher`
+        :param refresher: The refresher to stop calling.
+        """
+        with self._condition:
+            if refresher.cancelled:
+                return
+            refresher.cancelled = True
+            if not refresher.scheduled:
+                # Either it was never started, or it is being refreshed right
+                # now, in which case it will not be put back in the heap.
+                return
+            self._cancelled_count += 1
+            if self._cancelled_count > len(self._heap) // 2:
+                self._compact()
+
+    def stop(self):
+        """Stop the scheduler thread and its workers.
+
+        Pending refreshes are not run, and the scheduler cannot be restarted.
+        Refreshes already handed to the workers are finished first, and this
+        waits for every thread to exit, unless it is called from one of them.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is None:
+            return
+        current = current_thread()
+        if self._thread is not current:
+            # Only the scheduler thread starts workers, so once it has exited
+            # the list of them is complete.
+            self._thread.join()
+        for worker in self._workers:
+            if worker is not current:
+                worker.join()
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap) - self._cancelled_count
+
+    def _push(self, refresher, now, delay=None):
+        if delay is None:
+            delay = refresher.refresh_period_seconds
+        refresher.deadline = now + delay
+        refresher.scheduled = True
+        heapq.heappush(
+            self._heap,
+            (refresher.deadline, next(self._counter), refresher),
+        )
+
+    def _compact(self):
+        for entry in self._heap:
+            if entry[2].cancelled:
+                entry[2].scheduled = False
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled_count = 0
+
+    def _ensure_thread_started(self):
+        if self._thread is not None:
+            return
+        self._thread = Thread(target=self._run, name='lynk-lock-refresher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            due = self._wait_for_due_refreshers()
+            if due is None:
+                for _ in self._workers:
+                    self._tasks.put(None)
+                return
+            if self._batch_refresher is not None and len(due) > 1:
+                self._submit(self._refresh_batch, due)
+                continue
+            for refresher in due:
+                self._submit(self._refresh, refresher)
+
+    def _submit(self, fn, arg):
+        # Only called by the scheduler thread, which is the only one to
+        # start workers.
+        with self._condition:
+            self._in_flight += 1
+            start_worker = self._in_flight > len(self._workers) and \
+                len(self._workers) < self._max_workers
+        if start_worker:
+            worker = Thread(
+                target=self._work,
+                name='lynk-lock-refresher-%s' % len(self._workers))
+            worker.daemon = True
+            self._workers.append(worker)
+            worker.start()
+        self._tasks.put((fn, arg))
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            fn, arg = task
+            try:
+                fn(arg)
+            except Exception:
+                LOG.exception('Failed to refresh locks.')
+            finally:
+                with self._condition:
+                    self._in_flight -= 1
+
+    def _wait_for_due_refreshers(self):
+        with self._condition:
+            while not self._stopped:
+                self._discard_cancelled_head()
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                now = self._time_utils.time()
+                timeout = self._heap[0][0] - now
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+                return self._pop_due(now + self._batch_window)
+            return None
+
+    def _discard_cancelled_head(self):
+        while self._heap and self._heap[0][2].cancelled:
+            _, _, refresher = heapq.heappop(self._heap)
+            refresher.scheduled = False
+            self._cancelled_count -= 1
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, refresher = heapq.heappop(self._heap)
+            refresher.scheduled = False
+            if refresher.cancelled:
+                self._cancelled_count -= 1
+                continue
+            due.append(refresher)
+        return due
+
+    def _refresh(self, refresher):
+        try:
+            refresher.lock.refresh()
+        except Exception as e:
+            self._refresh_failed(refresher, e)
+            return
+        self._reschedule(refresher)
+
+    def _refresh_batch(self, refreshers):
+        failures = self._batch_refresher.refresh(
+            [refresher.lock for refresher in refreshers])
+        for refresher in refreshers:
+            error = failures.get(refresher.lock)
+            if error is not None:
+                self._refresh_failed(refresher, error)
+                continue
+            self._reschedule(refresher)
+
+    def _refresh_failed(self, refresher, error):
+        if should_retry_refresh(error):
+            self._reschedule(
+                refresher,
+                refresher.refresh_period_seconds * self._RETRY_PERIOD_RATIO)
+
+    def _reschedule(self, refresher, delay=None):
+        with self._condition:
+            if refresher.cancelled or refresher.scheduled:
+                return
+            self._push(refresher, self._time_utils.time(), delay)
+            # Workers reschedule while the scheduler thread may be waiting
+            # for a later deadline, or for any refresh at all.
+            if self._heap[0][2] is refresher:
+                self._condition.notify()
+
+
+def should_retry_refresh(error):
+    """Log a failed refresh and tell whether to try it again.
+
+    Used by :class:`LockRefreshScheduler` and
+    :class:`lynk.aio.refresh.AsyncLockRefreshScheduler`.
+
+    :type error: Exception
+    :param error: The error the refresh failed with.
+
+    :rtype: bool
+    :returns: False if the lock is no longer held, True if the error may be
+        transient.
+    """
+    exc_info = (type(error), error, error.__traceback__)
+    if isinstance(error, _NOT_HELD_ERRORS):
+        LOG.error('Lost lock, no longer refreshing it.', exc_info=exc_info)
+        return False
+    LOG.warning('Failed to refresh lock, trying again soon.',
+                exc_info=exc_info)
+    return True
+
+
+def group_by_backend(prepared):
+    """Group prepared refreshes into transactions.
+
+    Used by :class:`BatchLockRefresher` and
+    :class:`lynk.aio.refresh.AsyncBatchLockRefresher`.
+
+    :type prepared: list
+    :param prepared: Pairs of a lock and its
+        :class:`lynk.techniques.PendingRefresh`.
+
+    :rtype: list
+    :returns: A list of groups, one for each backend in order of first
+        appearance. Each group is a list of the backend's chunks of at most
+        ``MAX_TRANSACTION_ITEMS`` pairs. A backend that does not support
+        transactions has chunks of one pair. A chunk of one pair is not
+        worth a transaction, and its refresh should be sent on its own.
+    """
+    groups = OrderedDict()
+    for lock, pending in prepared:
+        groups.setdefault(id(pending.backend), []).append((lock, pending))
+    chunked = []
+    for group in groups.values():
+        backend = group[0][1].backend
+        size = 1
+        if getattr(backend, 'SUPPORTS_TRANSACTIONS', False):
+            size = getattr(backend, 'MAX_TRANSACTION_ITEMS',
+                           BaseBackend.MAX_TRANSACTION_ITEMS)
+        chunked.append(
+            [group[i:i + size] for i in range(0, len(group), size)])
+    return chunked
+
+
+def drop_conflicts(chunk, error, failures):
+    """Record the locks whose refresh conditions failed in a transaction.
+
+    Nothing in the transaction was applied. The locks whose conditions
+    failed are lost, the rest can be tried again.
+
+    :type chunk: list
+    :param chunk: The pairs of a lock and its pending refresh that were
+        sent in the transaction.
+
+    :type error: :class:`lynk.exceptions.TransactionConflictError`
+    :param error: The error the transaction failed with.
+
+    :type failures: dict
+    :param failures: Each lost lock is added to this, mapped to a
+        :class:`lynk.exceptions.LockLostError`.
+
+    :rtype: list
+    :returns: The pairs of the chunk that can be tried again.
+    """
+    failed = set(error.failed_indexes)
+    for i in failed:
+        chunk[i][1].lost()
+        failures[chunk[i][0]] = LockLostError()
+    return [entry for i, entry in enumerate(chunk) if i not in failed]
+
+
+class BatchLockRefresher(object):
+    """Refresh many locks using as few backend requests as possible.
+
+    The locks are grouped by the backend they are stored in, and each group
+    is refreshed with transactional writes of up to the backend's
+    ``MAX_TRANSACTION_ITEMS`` operations. Each refresh keeps its own
+    ownership condition. When some of those conditions fail, only the
+    corresponding locks are reported as lost, and the transaction is retried
+    without them. When a transaction fails for any other reason, such as
+    throttling, its locks are refreshed one at a time, so each gets an error
+    of its own.
+
+    Locks that do not support being refreshed in a batch, see
+    :attr:`lynk.lock.Lock.supports_batch_refresh`, and locks whose backend
+    does not support transactions are refreshed one at a time instead.
+    """
+    def refresh(self, locks):
+        """Refresh a list of locks.
+
+        :type locks: list
+        :param locks: The :class:`lynk.lock.Lock` objects to refresh.
+
+        :rtype: dict
+        :returns: A dictionary mapping each lock that could not be refreshed
+            to the exception explaining why. Locks that were lost map to a
+            :class:`lynk.exceptions.LockLostError`.
+        """
+        # Refreshes go ahead of other requests through a session's rate
+        # limiter.
+        with urgent():
+            return self._refresh(locks)
+
+    def _refresh(self, locks):
+        failures = {}
+        prepared = []
+        for lock in locks:
+            if not getattr(lock, 'supports_batch_refresh', False):
+                self._refresh_one(lock, failures)
+                continue
+            try:
+                prepared.append((lock, lock.prepare_refresh()))
+            except Exception as e:
+                failures[lock] = e
+        for chunks in group_by_backend(prepared):
+            for chunk in chunks:
+                if len(chunk) == 1:
+                    lock, pending = chunk[0]
+                    self._send_one(lock, pending, failures)
+                else:
+                    self._refresh_chunk(chunk, failures)
+        return failures
+
+    def _refresh_one(self, lock, failures):
+        try:
+            lock.refresh()
+        except Exception as e:
+            failures[lock] = e
+
+    def _send_one(self, lock, pending, failures):
+        # The refresh has already been prepared, so it is sent as it is
+        # rather than through lock.refresh, which would prepare another.
+        key, updates, condition = pending.operation
+        try:
+            pending.backend.update(key, updates=updates, condition=condition)
+        except pending.condition_failed_error:
+            pending.lost()
+            failures[lock] = LockLostError()
+        except Exception as e:
+            failures[lock] = e
+        else:
+            pending.succeeded()
+
+    def _refresh_chunk(self, chunk, failures):
+        backend = chunk[0][1].backend
+        while chunk:
+            try:
+                backend.transact_write(
+                    [pending.operation for _, pending in chunk])
+            except TransactionConflictError as e:
+                chunk = drop_conflicts(chunk, e, failures)
+                continue
+            except Exception:
+                LOG.debug('Failed to refresh locks in a transaction, '
+                          'refreshing them one at a time.', exc_info=True)
+                for lock, pending in chunk:
+                    self._send_one(lock, pending, failures)
+                return
+            for _, pending in chunk:
+                pending.succeeded()
+            return
@@ -0,0 +1,529 @@
+"""A counting semaphore whose permits are spread over several lock entries."""
+import math
+import uuid
+import random
+import socket
+import threading
+from contextlib import contextmanager
+
+from lynk.utils import TimeUtils
+from lynk.wait import AcquireTimer
+from lynk.wait import LeaseWaitStrategy
+from lynk.wait import limit_to_deadline
+from lynk.exceptions import LockAcquireCancelledError
+from lynk.exceptions import LockLostError
+from lynk.exceptions import NoSuchLockError
+from lynk.throttle import urgent
+from lynk.ttl import DELETE_AFTER_ATTRIBUTE
+from lynk.ttl import delete_after
+from lynk.techniques import compare_and_swap
+
+
+class ShardedSemaphoreTechnique(object):
+    """Grant up to a fixed number of permits for a name at any one time.
+
+    A single entry holding every permit would make its key a hot spot, and
+    every acquire and release would contend for it. Instead the permits are
+    divided between ``shards`` entries, stored under the keys ``name#0`` to
+    ``name#<shards - 1>``, and each acquire tries a random shard that has
+    room. Each shard entry records the permits it has granted, along with
+    the time each one's lease runs out::
+
+      name:           string
+      versionNumber:  string
+      holders:        map of permit id to expiresAt
+      capacity:       int
+      hostIdentifier: string
+      leaseDuration:  int
+      writeTime:      int
+      expiresAt:      int
+
+    Shards are changed by compare and swap on their versionNumber, like
+    :class:`lynk.techniques.SharedExclusiveTechnique`. The technique keeps
+    the last state it saw of each shard and writes against it directly, so
+    when that state is current an acquire, refresh or release costs one
+    conditional write and no reads. When it is stale the write fails, and
+    the backend returns the current state to try again with.
+
+    Permits are leases, like the locks of
+    :class:`lynk.techniques.VersionLeaseTechinque`. A holder refreshes its
+    permit before its lease runs out, and permits whose lease ran out, with
+    the ``max_clock_skew`` margin added, are dropped by the next change to
+    their shard. When every shard is full the acquire waits until the
+    earliest lease in them runs out, as decided by the wait strategy, or
+    until a release is published to the notifier. Without a notifier it
+    gives up straight away if that wait would run past its deadline, like a
+    lock does. With one it waits for a release until the deadline.
+
+    With ``poll_with_reads`` the shards a waiter last saw full are read
+    again with eventually consistent reads, a stale one only costs a failed
+    write or a later attempt. With a ``metrics`` hook every acquire, refresh
+    and lost permit is reported under the name of the semaphore.
+
+    Every agent using a semaphore must agree on its number of permits and
+    shards. A technique can be shared by any number of threads. They take
+    turns writing to each shard, so the writes of one process never race
+    each other and only fail when another process changed the shard. That
+    is why it has no use for a local wait queue.
+    """
+    _DEFAULT_MAX_CLOCK_SKEW = 1.0
+    # Shards hold this many permits each unless told otherwise.
+    _DEFAULT_PERMITS_PER_SHARD = 20
+    _ATTRIBUTES = ['versionNumber', 'holders']
+
+    def __init__(self, name, permits, backend_bridge, backend, shards=None,
+                 host_identifier=None, time_utils=None, max_clock_skew=None,
+                 wait_strategy=None, notifier=None, poll_with_reads=False,
+                 metrics=None):
+        """Initialize a ShardedSemaphoreTechnique.
+
+        :type name: str
+        :param name: Logical name of the semaphore.
+
+        :type permits: int
+        :param permits: The number of permits that can be held at once.
+
+        :type shards: int
+        :param shards: The number of entries to spread the permits across. By
+            default one for every 20 permits.
+
+        The rest of the arguments are the same as those of
+        :class:`lynk.techniques.VersionLeaseTechinque`.
+        """
+        if permits < 1:
+            raise ValueError("A semaphore needs at least one permit.")
+        if shards is None:
+            shards = int(math.ceil(
+                float(permits) / self._DEFAULT_PERMITS_PER_SHARD))
+        if not 1 <= shards <= permits:
+            raise ValueError(
+                "A semaphore with %s permits needs between 1 and %s shards, "
+                "got %s." % (permits, permits, shards))
+        self._name = name
+        self._capacities = [
+            permits // shards + (1 if i < permits % shards else 0)
+            for i in range(shards)
+        ]
+        self._backend_bridge = backend_bridge
+        self._backend = backend
+        if host_identifier is None:
+            host_identifier = socket.gethostname()
+        self._host_identifier = host_identifier
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        if max_clock_skew is None:
+            max_clock_skew = self._DEFAULT_MAX_CLOCK_SKEW
+        self._max_clock_skew = max_clock_skew
+        if wait_strategy is None:
+            wait_strategy = LeaseWaitStrategy()
+        self._wait_strategy = wait_strategy
+        self._notifier = notifier
+        self._poll_with_reads = poll_with_reads
+        self._metrics = metrics
+        self._random = random.Random()
+        # The last state seen of each shard, None if it was missing. Threads
+        # only ever get and set single keys of this and _permits, which are
+        # atomic, so neither needs a lock of its own.
+        self._shards = {}
+        # The shard and lease of every permit held through this technique.
+        self._permits = {}
+        # When each permit was last written, only kept to measure refreshes.
+        self._written_at = {}
+        self._shard_locks = [threading.Lock() for _ in range(shards)]
+
+    @property
+    def permits(self):
+        return sum(self._capacities)
+
+    @property
+    def shards(self):
+        return len(self._capacities)
+
+    def acquire(self, lease_duration, max_wait_seconds, cancel_event=None,
+                deadline=None):
+        """Acquire a permit.
+
+        :type lease_duration: int
+        :param lease_duration: Number of seconds to hold the permit for.
+
+        :type max_wait_seconds: int
+        :param max_wait_seconds: Maximum number of seconds to wait till
+            giving up on acquiring a permit.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: If set while waiting, the wait is interrupted
+            and a :class:`lynk.exceptions.LockAcquireCancelledError` is
+            raised.
+
+        :type deadline: float
+        :param deadline: A time, by this technique's clock, to give up at.
+            If both this and ``max_wait_seconds`` are given, whichever comes
+            first is used.
+
+        :rtype: str
+        :returns: The id of the acquired permit.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise LockAcquireCancelledError()
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        subscription = None
+        if self._notifier is not None:
+            subscription = self._notifier.subscribe(self._name)
+        # Permits are usually released well before their lease runs out, so
+        # while a release can wake us it is worth waiting for until the
+        # deadline.
+        timer = AcquireTimer(
+            self._time_utils, self._wait_strategy, max_wait_seconds,
+            start_time, can_be_woken=subscription is not None)
+        consistent = True
+        try:
+            while True:
+                permit = self._try_acquire(lease_duration, consistent)
+                if permit is not None:
+                    break
+                now = self._time_utils.time()
+                sleep_time = timer.next_sleep(now, self._remaining_lease(now))
+                timer.wait(sleep_time, subscription, cancel_event)
+                consistent = not self._poll_with_reads
+        finally:
+            if subscription is not None:
+                subscription.close()
+        self._acquired(timer.attempts + 1, started, timer.slept)
+        return permit
+
+    def try_acquire(self, lease_duration):
+        """Try each shard that may have room for a permit, without waiting.
+
+        :rtype: str
+        :returns: The id of the acquired permit, or None if every shard is
+            full.
+        """
+        started = self._time_utils.perf_counter()
+        permit = self._try_acquire(lease_duration)
+        if permit is not None:
+            self._acquired(1, started, 0)
+        return permit
+
+    def _try_acquire(self, lease_duration, consistent=True):
+        permit = str(uuid.uuid4())
+        # Permits may have been released since the shards were last seen, so
+        # full ones are checked again before giving up. Each call keeps its
+        # own set of the shards it has not seen yet.
+        stale = set(range(self.shards))
+        while True:
+            now = self._time_utils.time()
+            candidates = [
+                shard for shard in range(self.shards)
+                if self._may_have_room(shard, now, stale)
+            ]
+            if not candidates:
+                return None
+            shard = self._random.choice(candidates)
+            with self._shard_locks[shard]:
+                if self._try_shard(
+                        shard, permit, lease_duration, stale, consistent):
+                    return permit
+
+    def _try_shard(self, shard, permit, lease_duration, stale, consistent):
+        # Must be called holding the shard's lock. Another thread may have
+        # changed the shard since it was picked, so it is checked again.
+        now = self._time_utils.time()
+        item = self._shards.get(shard)
+        holders = self._active_holders(item, now)
+        if len(holders) >= self._capacities[shard]:
+            if shard in stale:
+                # Find out whether it still is full.
+                self._read(shard, consistent)
+                stale.discard(shard)
+            return False
+        holders[permit] = self._to_millis(now + lease_duration)
+        if not self._swap(shard, item, holders):
+            # The swap failed against the shard's current state.
+            stale.discard(shard)
+            return False
+        self._permits[permit] = (shard, lease_duration)
+        if self._metrics is not None:
+            self._written_at[permit] = now
+        return True
+
+    def release(self, permit):
+        """Release a permit.
+
+        :type permit: str
+        :param permit: The id of the permit to release.
+        """
+        self._change_permit(permit, None)
+        del self._permits[permit]
+        self._written_at.pop(permit, None)
+        if self._notifier is not None:
+            self._notifier.publish(self._name)
+
+    def refresh(self, permit):
+        """Refresh a permit.
+
+        :type permit: str
+        :param permit: The id of the permit to refresh.
+        """
+        lease_duration = self._get_permit(permit)[1]
+        write_time = self._change_permit(permit, lease_duration)
+        if self._metrics is not None:
+            written_at = self._written_at.get(permit)
+            self._written_at[permit] = write_time
+            if written_at is not None:
+                self._metrics.on_refresh(
+                    self._name, write_time - written_at, lease_duration)
+
+    def _change_permit(self, permit, lease_duration):
+        # Pushes the permit's lease forward, or removes it if lease_duration
+        # is None. Returns when the change was made.
+        shard = self._get_permit(permit)[0]
+        with self._shard_locks[shard]:
+            return self._change_permit_in_shard(
+                shard, permit, lease_duration)
+
+    def _change_permit_in_shard(self, shard, permit, lease_duration):
+        while True:
+            item = self._shards.get(shard)
+            if item is None or permit not in item.get('holders', {}):
+                # Our view of the shard may be out of date.
+                item = self._read(shard)
+            if item is None or permit not in item.get('holders', {}):
+                self._permits.pop(permit, None)
+                self._written_at.pop(permit, None)
+                if self._metrics is not None:
+                    self._metrics.on_lock_lost(self._name)
+                raise LockLostError()
+            now = self._time_utils.time()
+            holders = self._active_holders(item, now)
+            holders.pop(permit, None)
+            if lease_duration is not None:
+                holders[permit] = self._to_millis(now + lease_duration)
+            if self._swap(shard, item, holders):
+                return now
+
+    def _acquired(self, attempts, started, slept):
+        if self._metrics is not None:
+            self._metrics.on_acquire(
+                self._name, attempts,
+                self._time_utils.perf_counter() - started, slept)
+
+    def _get_permit(self, permit):
+        if permit not in self._permits:
+            raise NoSuchLockError()
+        return self._permits[permit]
+
+    def _may_have_room(self, shard, now, stale):
+        if shard in stale:
+            return True
+        holders = self._active_holders(self._shards.get(shard), now)
+        return len(holders) < self._capacities[shard]
+
+    def _remaining_lease(self, now):
+        # Until the first lease that is holding a permit runs out.
+        expiries = [
+            expires_at
+            for shard in range(self.shards)
+            for expires_at in self._active_holders(
+                self._shards.get(shard), now).values()
+        ]
+        if not expiries:
+            return 0
+        return max(
+            float(min(expiries)) / 1000.0 - now + self._max_clock_skew, 0)
+
+    def _active_holders(self, item, now):
+        if not item:
+            return {}
+        cutoff = self._to_millis(now - self._max_clock_skew)
+        return {
+            permit: int(expires_at)
+            for permit, expires_at in item.get('holders', {}).items()
+            if int(expires_at) > cutoff
+        }
+
+    def _swap(self, shard, item, holders):
+        # Replace the state of the shard we last saw with one holding these
+        # permits. Our view of the shard is updated whether or not that
+        # worked.
+        swapped, current = compare_and_swap(
+            self._backend, self._backend_bridge,
+            {'lockKey': self._shard_key(shard)}, item,
+            self._entry(shard, holders), self._ATTRIBUTES)
+        self._remember(shard, current)
+        return swapped
+
+    def _remember(self, shard, item):
+        self._shards[shard] = item
+
+    def _read(self, shard, consistent=True):
+        item = self._backend.get(
+            {'lockKey': self._shard_key(shard)},
+            attributes=self._ATTRIBUTES,
+            consistent=consistent,
+        )
+        self._remember(shard, item)
+        return item
+
+    def _entry(self, shard, holders):
+        now = self._time_utils.time()
+        write_time = self._to_millis(now)
+        expires_at = max(list(holders.values()) + [write_time])
+        return {
+            'lockKey': self._shard_key(shard),
+            'versionNumber': str(uuid.uuid4()),
+            'holders': holders,
+            'capacity': self._capacities[shard],
+            'hostIdentifier': self._host_identifier,
+            'leaseDuration': int(
+                math.ceil((expires_at - write_time) / 1000.0)),
+            'writeTime': write_time,
+            'expiresAt': expires_at,
+            DELETE_AFTER_ATTRIBUTE: delete_after(expires_at),
+        }
+
+    def _shard_key(self, shard):
+        return '%s#%s' % (self._name, shard)
+
+    def _to_millis(self, timestamp):
+        return int(timestamp * 1000)
+
+
+class Permit(object):
+    """A permit held on a :class:`lynk.semaphore.Semaphore`.
+
+    It can be used as a context manager that releases the permit on exit.
+    """
+    _REFRESH_PERIOD_RATIO = 3.0 / 4.0
+    # A refresh is a compare and swap on the permit's shard, which cannot be
+    # batched with other refreshes.
+    supports_batch_refresh = False
+
+    def __init__(self, permit_id, technique, lease_duration,
+                 refresher_factory=None):
+        self.permit_id = permit_id
+        self._technique = technique
+        self._refresher = None
+        if refresher_factory is not None:
+            self._refresher = refresher_factory.create_lock_refresher(
+                self,
+                lease_duration * self._REFRESH_PERIOD_RATIO,
+            )
+            self._refresher.start()
+
+    def release(self):
+        """Release this permit."""
+        if self._refresher:
+            self._refresher.stop()
+            self._refresher = None
+        with urgent():
+            self._technique.release(self.permit_id)
+
+    def refresh(self):
+        """Refresh this permit."""
+        with urgent():
+            self._technique.refresh(self.permit_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class Semaphore(object):
+    """A semaphore that caps how many agents can hold a permit at once.
+
+    This object should not be initialized directly, but created from a
+    :class:`lynk.session.Session`. Unlike a :class:`lynk.lock.Lock` it can be
+    shared between threads, each acquire returns its own
+    :class:`lynk.semaphore.Permit`::
+
+        semaphore = session.create_semaphore('partner api', permits=200)
+        with semaphore():
+            call_partner_api()
+    """
+    def __init__(self, name, technique, refresher_factory=None):
+        self._name = name
+        self._technique = technique
+        self._refresher_factory = refresher_factory
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def permits(self):
+        return self._technique.permits
+
+    def acquire(self, lease_duration=20, max_wait_seconds=300, deadline=None,
+                cancel_event=None):
+        """Acquire a permit.
+
+        This call will block until a permit has been acquired, or the
+        timeout has been reached, in which case a
+        :class:`lynk.exceptions.LockNotGrantedError` is raised.
+
+        :type lease_duration: int
+        :param lease_duration: The number of seconds to hold the permit for
+            initially.
+
+        :type max_wait_seconds: float
+        :param max_wait_seconds: Number of seconds to wait for a permit before
+            giving up.
+
+        :type deadline: float
+        :param deadline: A time, by the clock of this semaphore's technique,
+            to give up at. If both this and ``max_wait_seconds`` are given,
+            whichever comes first is used.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: Setting this event from another thread
+            interrupts the wait, and a
+            :class:`lynk.exceptions.LockAcquireCancelledError` is raised.
+
+        :rtype: :class:`lynk.semaphore.Permit`
+        """
+        permit_id = self._technique.acquire(
+            lease_duration,
+            max_wait_seconds=max_wait_seconds,
+            cancel_event=cancel_event,
+            deadline=deadline,
+        )
+        return self._permit(permit_id, lease_duration)
+
+    def try_acquire(self, lease_duration=20):
+        """Acquire a permit if one is available, without waiting.
+
+        :rtype: :class:`lynk.semaphore.Permit`
+        :returns: The acquired permit, or None if none were available.
+        """
+        permit_id = self._technique.try_acquire(lease_duration)
+        if permit_id is None:
+            return None
+        return self._permit(permit_id, lease_duration)
+
+    def __call__(self, lease_duration=20, timeout_seconds=300):
+        return self._context_manager(lease_duration, timeout_seconds)
+
+    @contextmanager
+    def _context_manager(self, lease_duration, max_wait_seconds):
+        permit = self.acquire(
+            lease_duration=lease_duration,
+            max_wait_seconds=max_wait_seconds,
+        )
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def _permit(self, permit_id, lease_duration):
+        return Permit(
+            permit_id,
+            self._technique,
+            lease_duration,
+            refresher_factory=self._refresher_factory,
+        )
@@ -1,10 +1,21 @@
 import json
 import socket
+import threading
 
 from lynk.techniques import VersionLeaseTechinque
-from lynk.refresh import LockRefresherFactory
+from lynk.techniques import SharedExclusiveTechnique
+from lynk.refresh import LockRefreshScheduler
+from lynk.refresh import BatchLockRefresher
 from lynk.backends.dynamodb import DynamoDBBackendBridgeFactory
 from lynk.lock import Lock
+from lynk.lock import LockGroup
+from lynk.semaphore import Semaphore
+from lynk.semaphore import ShardedSemaphoreTechnique
+from lynk.notify import LocalNotifier
+from lynk.coalesce import LocalWaitQueue
+from lynk.reentrant import LocalHolds
+from lynk.throttle import RateLimitedBackend
+from lynk.metrics import InstrumentedBackend
 from lynk.exceptions import CannotDeserializeError
 
 
@@ -31,19 +42,127 @@ class Session(object):
         these need to be created by a shared factory class because they
         have shared dependencies. If None is provided the default is a
         :class:`lynk.backends.dynamodb.DynamoDBBackendBridgeFactory` which
-        will create locks bound to a DynamoDB Table.
+        will create locks bound to a DynamoDB Table. The factory is only
+        asked to create a bridge and backend once, they are then shared by
+        every lock this session creates.
+
+    :type max_clock_skew: float
+    :param max_clock_skew: The maximum number of seconds the clocks of any
+        two hosts sharing locks are expected to differ by. Lease expiry times
+        written by other hosts are only trusted with this margin added. By
+        default 1 second.
+
+    :type wait_strategy: :class:`lynk.wait.BaseWaitStrategy`
+    :param wait_strategy: Decides how long locks created by this session wait
+        between attempts to acquire a lock that is in use. By default they
+        wait for the current owner's lease to run out.
+
+    :type poll_with_reads: bool
+    :param poll_with_reads: If ``True`` locks created by this session wait
+        for a lock that is in use by polling it with eventually consistent
+        reads, and only write to it once it looks free. This trades a
+        conditional write per attempt for a cheaper read. By default
+        ``False``.
+
+    :type notifier: :class:`lynk.notify.BaseNotifier`
+    :param notifier: The channel releases are published on, so that waiting
+        locks wake up straight away instead of finishing their wait. By
+        default a :class:`lynk.notify.LocalNotifier` that only reaches locks
+        created by this session. Pass the same notifier to several sessions
+        to share it, or a :class:`lynk.notify.UDPNotifier` to reach other
+        processes.
+
+    :type coalesce_waiters: bool
+    :param coalesce_waiters: If ``True`` threads waiting for the same lock
+        through this session get in line locally, and only one of them at a
+        time waits on the backend. A thread releasing a lock it got this way
+        hands it straight to the next thread in line. Only exclusive locks
+        of a reader-writer pair get in line, and semaphores need no line
+        since their threads already take turns writing. By default
+        ``False``.
+
+    :type reentrant_locks: bool
+    :param reentrant_locks: If ``True`` locks created by this session are
+        reentrant by default. A thread holding a lock name can acquire it
+        again, through the same or another reentrant lock object, without a
+        backend request, and the name is only released in the backend when
+        the outermost acquire is released. By default ``False``.
+
+    :type rate_limiter: :class:`lynk.throttle.AdaptiveRateLimiter`
+    :param rate_limiter: Limits the rate of backend requests made by this
+        session, adapting to throttling by the backend. Releases and
+        refreshes are let through ahead of acquires. Share one limiter
+        between sessions to limit them together. By default requests are not
+        limited. The default backend is then built without botocore's own
+        retries, and a ``backend_bridge_factory`` given should be too, for
+        example with ``max_attempts=1``, or throttling is hidden from the
+        limiter.
+
+    :type retry_policy: :class:`lynk.throttle.RetryPolicy`
+    :param retry_policy: Decides which failed backend requests are retried,
+        how long to wait between attempts and how long a request may take in
+        total. If a ``rate_limiter`` is given this defaults to a
+        :class:`lynk.throttle.RetryPolicy` with its default settings,
+        otherwise failed requests are only retried by the backend itself.
+
+    :type metrics: :class:`lynk.metrics.MetricsHook`
+    :param metrics: Told the latency of every backend request, every failed
+        condition, the attempts and time spent sleeping of every acquire,
+        how much of its lease each lock had used when refreshed, and every
+        lost lock. :class:`lynk.metrics.HistogramMetrics` keeps them in
+        histograms. By default nothing is measured, at no cost.
     """
+    # Refreshes due within this many seconds of each other are sent to the
+    # backend together.
+    _REFRESH_BATCH_WINDOW = 0.5
+
     def __init__(self, table_name, host_identifier=None,
-                 backend_bridge_factory=None):
+                 backend_bridge_factory=None, max_clock_skew=None,
+                 wait_strategy=None, poll_with_reads=False, notifier=None,
+                 coalesce_waiters=False, reentrant_locks=False,
+                 rate_limiter=None, retry_policy=None, metrics=None):
         self._table_name = table_name
         if host_identifier is None:
             host_identifier = socket.gethostname()
         self._host_identifier = host_identifier
         if backend_bridge_factory is None:
-            backend_bridge_factory = DynamoDBBackendBridgeFactory()
+            max_attempts = None
+            if rate_limiter is not None or retry_policy is not None:
+                # Requests are retried by a RateLimitedBackend, which has to
+                # see every throttled request to slow down.
+                max_attempts = 1
+            backend_bridge_factory = DynamoDBBackendBridgeFactory(
+                max_attempts=max_attempts)
         self._backend_bridge_factory = backend_bridge_factory
+        self._max_clock_skew = max_clock_skew
+        self._wait_strategy = wait_strategy
+        self._poll_with_reads = poll_with_reads
+        if notifier is None:
+            notifier = LocalNotifier()
+        self._notifier = notifier
+        self._wait_queue = None
+        if coalesce_waiters:
+            self._wait_queue = LocalWaitQueue()
+        self._reentrant_locks = reentrant_locks
+        # Holds are kept apart per mode, so holding a name in one mode is
+        # never mistaken for holding it in another.
+        self._holds = dict(
+            (mode, LocalHolds())
+            for mode in (None,) + SharedExclusiveTechnique.MODES
+        )
+        self._rate_limiter = rate_limiter
+        self._retry_policy = retry_policy
+        self._metrics = metrics
+        self._bridge_and_backend = None
+        self._bridge_and_backend_lock = threading.Lock()
+        self._refresh_scheduler = LockRefreshScheduler(
+            batch_refresher=BatchLockRefresher(),
+            batch_window=self._REFRESH_BATCH_WINDOW,
+        )
+        self._closed = False
 
-    def create_lock(self, lock_name, auto_refresh=True):
+    def create_lock(self, lock_name, auto_refresh=True, mode=None,
+                    reentrant=None):
         """Create a new lock object.
 
         :type lock_name: str
@@ -52,29 +171,146 @@ class Session(object):
         :type auto_refresh: bool
         :param auto_refresh: If ``True`` the created lock will automatically
             refresh itself. If ``False`` it will not. The default value is
-            ``True``.
+            ``True``. All the auto refreshing locks of a session are refreshed
+            by a single shared background thread, which batches refreshes
+            that come due together into as few backend requests as possible.
+
+        :type mode: str
+        :param mode: ``'shared'`` or ``'exclusive'`` to create a reader-writer
+            lock with :class:`lynk.techniques.SharedExclusiveTechnique`. Any
+            number of shared locks on a name can be held at once, while an
+            exclusive one excludes every other lock on that name. Every lock
+            on a name must be created with a mode, or every one without. By
+            default a plain exclusive lock is created.
+
+        :type reentrant: bool
+        :param reentrant: If ``True`` the lock is reentrant, so a thread
+            that already holds its name through a reentrant lock of this
+            session with the same ``mode`` can acquire it again without a
+            backend request. By default the session's ``reentrant_locks``
+            setting is used.
+
+        :raises: RuntimeError if the session has been closed.
+        """
+        self._check_open()
+        refresher_factory = None
+        if auto_refresh:
+            refresher_factory = self._refresh_scheduler
+        if reentrant is None:
+            reentrant = self._reentrant_locks
+        technique = self._create_technique(mode)
+        holds = None
+        if reentrant:
+            holds = self._holds[mode]
+        lock = Lock(
+            lock_name,
+            technique,
+            refresher_factory=refresher_factory,
+            holds=holds,
+        )
+        return lock
+
+    def create_lock_group(self, lock_names, auto_refresh=True):
+        """Create an object to acquire several locks atomically.
+
+        :type lock_names: list
+        :param lock_names: Logical names of the locks in the backend.
+
+        :type auto_refresh: bool
+        :param auto_refresh: If ``True`` the group's locks are refreshed
+            together in the background while it is held.
+
+        :rtype: :class:`lynk.lock.LockGroup`
+
+        :raises: RuntimeError if the session has been closed.
         """
-        bridge, backend = self._backend_bridge_factory.create(
-            self._table_name,
+        self._check_open()
+        refresher_factory = None
+        if auto_refresh:
+            refresher_factory = self._refresh_scheduler
+        return LockGroup(
+            lock_names,
+            self._create_technique(),
+            refresher_factory=refresher_factory,
+        )
+
+    def acquire_many(self, lock_names, lease_duration=20,
+                     max_wait_seconds=300, deadline=None, cancel_event=None,
+                     auto_refresh=True):
+        """Atomically acquire several locks.
+
+        All of the locks are written in one transaction, so this costs a
+        single round trip when they are free, and either every lock is
+        acquired or none are. The arguments are the same as those of
+        :meth:`lynk.lock.LockGroup.acquire`.
+
+        :rtype: :class:`lynk.lock.LockGroup`
+        :returns: The acquired locks, which must be released with the
+            group's ``release`` method.
+
+        :raises: RuntimeError if the session has been closed.
+        """
+        group = self.create_lock_group(lock_names, auto_refresh=auto_refresh)
+        group.acquire(
+            lease_duration=lease_duration,
+            max_wait_seconds=max_wait_seconds,
+            deadline=deadline,
+            cancel_event=cancel_event,
         )
-        technique = VersionLeaseTechinque(
+        return group
+
+    def create_semaphore(self, name, permits, shards=None, auto_refresh=True):
+        """Create a semaphore that caps how many permits can be held at once.
+
+        :type name: str
+        :param name: Logical name of the semaphore in the backend.
+
+        :type permits: int
+        :param permits: The number of permits that can be held at once.
+
+        :type shards: int
+        :param shards: The number of backend entries to spread the permits
+            across, see :class:`lynk.semaphore.ShardedSemaphoreTechnique`.
+            Every agent using the semaphore must use the same number of
+            permits and shards.
+
+        :type auto_refresh: bool
+        :param auto_refresh: If ``True`` permits are refreshed in the
+            background while they are held.
+
+        :rtype: :class:`lynk.semaphore.Semaphore`
+
+        :raises: RuntimeError if the session has been closed.
+        """
+        self._check_open()
+        bridge, backend = self._get_bridge_and_backend()
+        technique = ShardedSemaphoreTechnique(
+            name,
+            permits,
             bridge,
             backend,
+            shards=shards,
             host_identifier=self._host_identifier,
+            max_clock_skew=self._max_clock_skew,
+            wait_strategy=self._wait_strategy,
+            notifier=self._notifier,
+            poll_with_reads=self._poll_with_reads,
+            metrics=self._metrics,
         )
         refresher_factory = None
         if auto_refresh:
-            refresher_factory = LockRefresherFactory()
-        lock = Lock(
-            lock_name,
+            refresher_factory = self._refresh_scheduler
+        return Semaphore(
+            name,
             technique,
             refresher_factory=refresher_factory,
         )
-        return lock
 
     def deserialize_lock(self, serialized_lock, auto_refresh=True):
         """Create a lock object from a serialized lock.
 
+        Deserialized locks are never reentrant.
+
         :type serialized_lock: str
         :param serialized_lock: The serialized lock.
 
@@ -84,10 +320,10 @@ class Session(object):
             ``True``.
 
         :returns: The deserialized Lock object.
+
+        :raises: RuntimeError if the session has been closed.
         """
-        bridge, backend = self._backend_bridge_factory.create(
-            self._table_name,
-        )
+        self._check_open()
         data = json.loads(serialized_lock)
         version = data.get('__version')
         if not version:
@@ -106,16 +342,10 @@ class Session(object):
                 "properties."
             )
 
-        technique = VersionLeaseTechinque.from_serialized_technique(
-            serialized_technique,
-            bridge,
-            backend,
-            host_identifier=self._host_identifier,
-
-        )
+        technique = self._deserialize_technique(serialized_technique)
         refresher_factory = None
         if auto_refresh:
-            refresher_factory = LockRefresherFactory()
+            refresher_factory = self._refresh_scheduler
         lock = Lock(
             lock_name,
             technique,
@@ -123,3 +353,107 @@ class Session(object):
         )
         lock.refresh()
         return lock
+
+    def close(self):
+        """Stop refreshing locks and shut down the session's threads.
+
+        Locks created by this session are no longer refreshed in the
+        background, so any that are still held should be released first. A
+        closed session refuses to create locks and semaphores, and locks it
+        created before being closed raise a RuntimeError when an acquire
+        tries to start refreshing them.
+        """
+        self._closed = True
+        self._refresh_scheduler.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check_open(self):
+        # Locks of a closed session would silently lose their leases, since
+        # nothing is left to refresh them.
+        if self._closed:
+            raise RuntimeError('Session is closed.')
+
+    def _deserialize_technique(self, serialized_technique):
+        bridge, backend = self._get_bridge_and_backend()
+        version = json.loads(serialized_technique).get('__version')
+        if version == SharedExclusiveTechnique._SERIALIZED_VERSION:
+            return SharedExclusiveTechnique.from_serialized_technique(
+                serialized_technique,
+                bridge,
+                backend,
+                host_identifier=self._host_identifier,
+                max_clock_skew=self._max_clock_skew,
+                wait_strategy=self._wait_strategy,
+                notifier=self._notifier,
+                poll_with_reads=self._poll_with_reads,
+                wait_queue=self._wait_queue,
+                metrics=self._metrics,
+            )
+        return VersionLeaseTechinque.from_serialized_technique(
+            serialized_technique,
+            bridge,
+            backend,
+            host_identifier=self._host_identifier,
+            max_clock_skew=self._max_clock_skew,
+            wait_strategy=self._wait_strategy,
+            poll_with_reads=self._poll_with_reads,
+            notifier=self._notifier,
+            wait_queue=self._wait_queue,
+            metrics=self._metrics,
+        )
+
+    def _create_technique(self, mode=None):
+        bridge, backend = self._get_bridge_and_backend()
+        if mode is not None:
+            return SharedExclusiveTechnique(
+                bridge,
+                backend,
+                host_identifier=self._host_identifier,
+                max_clock_skew=self._max_clock_skew,
+                wait_strategy=self._wait_strategy,
+                notifier=self._notifier,
+                mode=mode,
+                poll_with_reads=self._poll_with_reads,
+                wait_queue=self._wait_queue,
+                metrics=self._metrics,
+            )
+        return VersionLeaseTechinque(
+            bridge,
+            backend,
+            host_identifier=self._host_identifier,
+            max_clock_skew=self._max_clock_skew,
+            wait_strategy=self._wait_strategy,
+            poll_with_reads=self._poll_with_reads,
+            notifier=self._notifier,
+            wait_queue=self._wait_queue,
+            metrics=self._metrics,
+        )
+
+    def _get_bridge_and_backend(self):
+        # Creating a backend can be expensive (for DynamoDB it loads service
+        # models and opens connections), so it is done once the first time a
+        # lock needs it and then shared across every lock in this session.
+        if self._bridge_and_backend is None:
+            with self._bridge_and_backend_lock:
+                if self._bridge_and_backend is None:
+                    self._bridge_and_backend = \
+                        self._create_bridge_and_backend()
+        return self._bridge_and_backend
+
+    def _create_bridge_and_backend(self):
+        bridge, backend = self._backend_bridge_factory.create(self._table_name)
+        if self._metrics is not None:
+            backend = InstrumentedBackend(
+                backend, self._metrics, bridge.ConditionFailedError)
+        if self._rate_limiter is not None or self._retry_policy is not None:
+            backend = RateLimitedBackend(
+                backend,
+                rate_limiter=self._rate_limiter,
+                retry_policy=self._retry_policy,
+            )
+        return bridge, backend
@@ -2,20 +2,80 @@
 import uuid
 import json
 import copy
+import math
 import socket
 
 from lynk.utils import TimeUtils
+from lynk.ttl import DELETE_AFTER_ATTRIBUTE
+from lynk.ttl import delete_after
+from lynk.wait import AcquireTimer
+from lynk.wait import LeaseWaitStrategy
+from lynk.wait import limit_to_deadline
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
 from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import LockAcquireCancelledError
 from lynk.exceptions import LockAlreadyInUseError
 from lynk.exceptions import LockLostError
 from lynk.exceptions import NoSuchLockError
 from lynk.exceptions import CannotDeserializeError
+from lynk.exceptions import TransactionConflictError
+
+
+def compare_and_swap(backend, backend_bridge, key, item, new_item,
+                     attributes):
+    """Replace an entry, as long as it has not changed since it was read.
+
+    The write is conditional on the versionNumber of the entry that was
+    read, or on there being no entry if none was.
+
+    :type key: dict
+    :param key: The key of the entry.
+
+    :type item: dict
+    :param item: The entry as it was read, None if there was none.
+
+    :type new_item: dict
+    :param new_item: The entry to replace it with, or None to delete it.
+
+    :type attributes: list
+    :param attributes: The attributes to read the current entry with, if the
+        backend does not return it when the condition fails.
+
+    :rtype: tuple
+    :returns: Whether the entry was replaced, along with the new entry, or
+        the current one if another agent changed it first.
+    """
+    condition = backend_bridge.lock_free()
+    if item:
+        condition = backend_bridge.lock_unchanged(item['versionNumber'])
+    try:
+        if new_item is not None:
+            backend.put(new_item, condition=condition)
+        elif item:
+            backend.delete(key, condition=condition)
+    except backend_bridge.ConditionFailedError as e:
+        current = getattr(e, 'existing_item', None)
+        if current is None:
+            current = backend.get(key, attributes=attributes)
+        return False, current
+    return True, new_item
 
 
 class BaseTechnique(object):
-    def acquire(self, name, lease_duration, max_wait_seconds):
+    # Whether acquire_many, release_many, refresh_many and prepare_refresh
+    # are implemented. They send several locks' writes in one transaction,
+    # which not every technique can express.
+    SUPPORTS_TRANSACTIONS = False
+
+    def acquire(self, name, lease_duration, max_wait_seconds,
+                cancel_event=None, deadline=None):
         raise NotImplementedError('acquire')
 
+    def try_acquire(self, name, lease_duration):
+        raise NotImplementedError('try_acquire')
+
     def release(self, name):
         raise NotImplementedError('release')
 
@@ -26,7 +86,202 @@ class BaseTechnique(object):
         raise NotImplementedError('serialize')
 
 
-class VersionLeaseTechinque(BaseTechnique):
+class PendingRefresh(object):
+    """A lock refresh that has been prepared but not sent to a backend yet.
+
+    Preparing a refresh separately from sending it allows many refreshes that
+    share a backend to be sent together in one transaction.
+
+    :ivar backend: The backend the operation needs to be sent to.
+    :ivar operation: The :class:`lynk.backends.base.Update` to send.
+    :ivar condition_failed_error: The error the backend raises if the
+        operation is sent on its own and its condition fails.
+    """
+    def __init__(self, backend, operation, on_success, on_lost=None,
+                 condition_failed_error=None):
+        self.backend = backend
+        self.operation = operation
+        self._on_success = on_success
+        self._on_lost = on_lost
+        if condition_failed_error is None:
+            # An empty tuple of errors catches nothing.
+            condition_failed_error = ()
+        self.condition_failed_error = condition_failed_error
+
+    def succeeded(self):
+        """Record that the operation was applied by the backend."""
+        self._on_success()
+
+    def lost(self):
+        """Record that the operation's condition failed, losing the lock."""
+        if self._on_lost is not None:
+            self._on_lost()
+
+
+class _ContendedLock(object):
+    # What is known about a lock that was in use during acquire_many.
+    __slots__ = ('prior_lock', 'waited', 'attempts')
+
+    def __init__(self, prior_lock):
+        self.prior_lock = prior_lock
+        self.waited = 0
+        self.attempts = 0
+
+
+class BaseLeaseTechnique(BaseTechnique):
+    """The parts shared by techniques that hold locks as leases.
+
+    Every lock held through the technique is recorded by name, along with
+    its lease duration and the id the technique holds it by, which is what
+    is serialized. The arguments are the same as those of
+    :class:`lynk.techniques.VersionLeaseTechinque`.
+    """
+    _DEFAULT_MAX_CLOCK_SKEW = 1.0
+    _SERIALIZED_VERSION = None
+
+    def __init__(self, backend_bridge, backend, host_identifier=None,
+                 time_utils=None, max_clock_skew=None, wait_strategy=None,
+                 poll_with_reads=False, notifier=None, wait_queue=None,
+                 metrics=None):
+        self._backend_bridge = backend_bridge
+        self._backend = backend
+        if host_identifier is None:
+            host_identifier = socket.gethostname()
+        self._host_identifier = host_identifier
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        if max_clock_skew is None:
+            max_clock_skew = self._DEFAULT_MAX_CLOCK_SKEW
+        self._max_clock_skew = max_clock_skew
+        if wait_strategy is None:
+            wait_strategy = LeaseWaitStrategy()
+        self._wait_strategy = wait_strategy
+        self._poll_with_reads = poll_with_reads
+        self._notifier = notifier
+        self._wait_queue = wait_queue
+        self._metrics = metrics
+        self._versions = {}
+        self._leases = {}
+        # When each lock was last written, only kept to measure refreshes.
+        self._written_at = {}
+        # The place in the wait queue each lock was acquired through.
+        self._waiters = {}
+
+    @classmethod
+    def _load_serialized(cls, serialized_technique):
+        data = json.loads(serialized_technique)
+        version = data.get('__version')
+        if not version:
+            raise CannotDeserializeError(
+                "Serialized data does not contain Technique.")
+        if version != cls._SERIALIZED_VERSION:
+            raise CannotDeserializeError(
+                "Unsupported serialized data version. Found %s, expected "
+                "%s" % (version, cls._SERIALIZED_VERSION))
+        return data
+
+    def _restore(self, data):
+        self._versions = copy.copy(data['versions'])
+        self._leases = copy.copy(data.get('leases', {}))
+
+    def serialize(self):
+        return json.dumps(self._serialized_properties())
+
+    def _serialized_properties(self):
+        return {
+            '__version': self._SERIALIZED_VERSION,
+            'versions': self._versions,
+            'leases': self._leases,
+        }
+
+    def _acquired(self, name, attempts, started, slept):
+        # Durations are measured on a monotonic clock, started with
+        # perf_counter, so a wall clock step cannot skew them.
+        if self._metrics is not None:
+            self._metrics.on_acquire(
+                name, attempts, self._time_utils.perf_counter() - started,
+                slept)
+
+    def _acquire_through_queue(self, name, lease_duration, max_wait_seconds,
+                               cancel_event):
+        # Wait in line behind the other threads of this process that want
+        # the lock. Only the representative goes to the backend, through
+        # _acquire_from_backend, the rest are handed the lock locally.
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        waiter = self._wait_queue.join(name, lease_duration)
+        state = self._wait_queue.wait(waiter, max_wait_seconds, cancel_event)
+        if state is None:
+            if cancel_event is not None and cancel_event.is_set():
+                raise LockAcquireCancelledError()
+            raise LockNotGrantedError()
+        if state == waiter.HANDED_OFF:
+            self._versions[name] = waiter.version_number
+            self._leases[name] = lease_duration
+            self._waiters[name] = waiter
+            if self._metrics is not None:
+                self._written_at[name] = waiter.written_at
+                # The whole time was spent waiting for the local holder.
+                waited = self._time_utils.perf_counter() - started
+                self._metrics.on_acquire(name, 1, waited, waited)
+            return
+        time_waited = self._time_utils.time() - start_time
+        try:
+            self._acquire_from_backend(
+                name, lease_duration, max_wait_seconds - time_waited,
+                cancel_event)
+        except Exception:
+            self._wait_queue.leave(waiter)
+            raise
+        self._wait_queue.acquired(waiter)
+        self._waiters[name] = waiter
+
+    def _forget(self, name):
+        # Drop everything kept about a lock we no longer hold.
+        del self._versions[name]
+        self._leases.pop(name, None)
+        self._written_at.pop(name, None)
+
+    def _refreshed(self, name, write_time):
+        written_at = self._written_at.get(name)
+        self._written_at[name] = write_time
+        if written_at is not None:
+            self._metrics.on_refresh(
+                name, write_time - written_at, self._leases[name])
+
+    def _lock_lost(self, name):
+        self._written_at.pop(name, None)
+        if self._metrics is not None:
+            self._metrics.on_lock_lost(name)
+
+    def _get_version_for_name(self, name):
+        if name not in self._versions:
+            raise NoSuchLockError()
+        return self._versions[name]
+
+    def _get_lease_for_name(self, name):
+        if name not in self._leases:
+            # Locks serialized before lease durations were recorded need to
+            # look theirs up once so the expiry can be pushed forward.
+            lock_info = self._backend.get(
+                {'lockKey': name},
+                attributes=['leaseDuration'],
+            )
+            if not lock_info:
+                raise LockLostError()
+            self._leases[name] = lock_info['leaseDuration']
+        return self._leases[name]
+
+    def _to_millis(self, timestamp):
+        return int(timestamp * 1000)
+
+    def _create_version_number(self):
+        identifier = str(uuid.uuid4())
+        return identifier
+
+
+class VersionLeaseTechinque(BaseLeaseTechnique):
     """A class to implement the version lease technique.
 
     The version lease technique uses a uuid4 as a fencing token, and a timing
@@ -38,6 +293,9 @@ class VersionLeaseTechinque(BaseTechnique):
       versionNumber:  string
       leaseDuration:  int
       hostIdentifier: string
+      writeTime:      int
+      expiresAt:      int
+      deleteAfter:    int
 
     * Name - In a distributed system multiple hosts/entities sometimes need to
       operate on the same resource. To do so they acquire a lock on the
@@ -53,6 +311,12 @@ class VersionLeaseTechinque(BaseTechnique):
       If it does not do that the lock can be stolen by another client.
     * hostIdentifier - This is a convenience for debugging. This simply gives a
       way for a debugging programmer to see which host currently owns a lock.
+    * writeTime - Milliseconds since the epoch, according to the writer's
+      clock, when the entry was last written or refreshed.
+    * expiresAt - Milliseconds since the epoch, according to the writer's
+      clock, when the lease runs out if it is not refreshed.
+    * deleteAfter - Seconds since the epoch after which an abandoned entry
+      can be deleted, see :func:`lynk.ttl.delete_after`.
 
 
     The three elemental operations that make up the algorithm are acquire,
@@ -92,12 +356,57 @@ class VersionLeaseTechinque(BaseTechnique):
       failing to acquire in the first place. The leaseDuration and
       versionNumber are recorded and used to retry again.
 
+    By default every attempt after the first is a conditional write, which
+    consumes write capacity even when it is bound to fail. If
+    ``poll_with_reads`` is set, the waiter instead reads the entry with an
+    eventually consistent read after each wait, and only attempts the write
+    when the entry is gone, its versionNumber has not changed over a full
+    leaseDuration, or its expiresAt has passed. A stale read can only cause
+    a write that fails, or one that is delayed until the next poll, since the
+    write itself is still conditional.
+
+    If a notifier is provided, releasing a lock publishes a notification to
+    it, and a waiter subscribed to that lock wakes up and retries right away
+    instead of finishing its wait. Notifications can be lost, so the waits
+    described here still bound how long it takes to notice a release. A
+    subscribed waiter whose wait would run past its deadline waits until the
+    deadline instead of giving up, since a release may still wake it.
+
+    If a :class:`lynk.coalesce.LocalWaitQueue` is provided, threads of this
+    process waiting for the same lock get in line locally, and only one of
+    them at a time runs the acquire loop above. A release by a thread that
+    got the lock through the queue hands it to the next thread in line with
+    a single conditional update that rotates the versionNumber, rather than
+    deleting the entry.
+
+    When the entry also has an expiresAt timestamp the waiter does not need
+    to sleep for the full leaseDuration. It sleeps until the lease expires
+    plus a margin for clock skew between hosts, and then tries to take the
+    lock on the condition that the entry is gone or its expiresAt is at least
+    that margin in the past. If that fails because the owner's clock is
+    further off than expected, the waiter keeps going until it has waited out
+    the full leaseDuration, after which the versionNumber check above applies.
+
+    Several locks can be acquired at once with ``acquire_many``, which writes
+    all of their entries in a single transaction, so either every lock is
+    taken or none are. The locks are always written in the same sorted
+    order, and a caller never holds some of them while waiting for the rest,
+    so two callers wanting overlapping sets cannot deadlock. If any of them
+    is in use the whole set is retried once the longest wait needed by the
+    locks in use has passed, each of them with the same steal conditions as
+    above. Waiting for several locks always uses conditional writes, and is
+    not woken by notifications or coordinated through a wait queue.
+
     This basic locking scheme has no concept of priority or a sepmaphore. A
     lock acquisition can easily time out by happenstance if a lock gets unlucky
     it can still get starved and timeout.
     """
+    _SERIALIZED_VERSION = 'VersionLeaseTechinque.1'
+
     def __init__(self, backend_bridge, backend, host_identifier=None,
-                 time_utils=None):
+                 time_utils=None, max_clock_skew=None, wait_strategy=None,
+                 poll_with_reads=False, notifier=None, wait_queue=None,
+                 metrics=None):
         """Initialize a VersionLeaseTechinque.
 
         :type backend_bridge: Bridge class to bridge the interface betwen
@@ -119,38 +428,76 @@ class VersionLeaseTechinque(BaseTechnique):
             By default hostname is used.
 
         :type time_utils: :class:`lynk.utils.TimeUtils`
-        :param time_utils: A set of utilities for interacting with time.
+        :param time_utils: A set of utilities for interacting with time. Its
+            ``time`` method is the clock used for lease timestamps.
+
+        :type max_clock_skew: float
+        :param max_clock_skew: The maximum number of seconds the clocks of
+            any two agents sharing a lock are expected to differ by. A lease
+            is only considered expired by its timestamp once it is this much
+            in the past. Defaults to 1 second.
+
+        :type wait_strategy: :class:`lynk.wait.BaseWaitStrategy`
+        :param wait_strategy: Decides how long to wait between attempts to
+            acquire a lock that is in use. By default
+            :class:`lynk.wait.LeaseWaitStrategy` which waits until the current
+            owner's lease runs out.
+
+        :type poll_with_reads: bool
+        :param poll_with_reads: If ``True`` a waiter polls the lock with
+            eventually consistent reads, and only tries to write it once it
+            looks free. Otherwise every attempt is a conditional write.
 
+        :type notifier: :class:`lynk.notify.BaseNotifier`
+        :param notifier: Used to publish releases, and to wake up early while
+            waiting for a lock that is in use. If None waiters only find out
+            about releases when they next try to take the lock.
+
+        :type wait_queue: :class:`lynk.coalesce.LocalWaitQueue`
+        :param wait_queue: Shared by every technique of this process that
+            should coordinate waiting for locks locally. If None each acquire
+            goes to the backend on its own.
+
+        :type metrics: :class:`lynk.metrics.MetricsHook`
+        :param metrics: Told about every acquire and refresh, and every lock
+            found to be lost. If None nothing is measured.
         """
-        self._backend_bridge = backend_bridge
-        self._backend = backend
-        if host_identifier is None:
-            host_identifier = socket.gethostname()
-        self._host_identifier = host_identifier
-        if time_utils is None:
-            time_utils = TimeUtils()
-        self._time_utils = time_utils
-        self._versions = {}
+        super(VersionLeaseTechinque, self).__init__(
+            backend_bridge,
+            backend,
+            host_identifier=host_identifier,
+            time_utils=time_utils,
+            max_clock_skew=max_clock_skew,
+            wait_strategy=wait_strategy,
+            poll_with_reads=poll_with_reads,
+            notifier=notifier,
+            wait_queue=wait_queue,
+            metrics=metrics,
+        )
+
+    @property
+    def SUPPORTS_TRANSACTIONS(self):
+        # Locks can only be acquired together if the backend can write them
+        # in one transaction, which a backend spreading them across tables
+        # may not be able to do.
+        return getattr(self._backend, 'SUPPORTS_TRANSACTIONS', False)
 
     @classmethod
     def from_serialized_technique(cls, serialized_technique, backend_bridge,
                                   backend, host_identifier=None,
-                                  time_utils=None):
-        data = json.loads(serialized_technique)
-        version = data.get('__version')
-        if not version:
-            raise CannotDeserializeError(
-                "Serialized data does not contain Technique.")
-        if version != 'VersionLeaseTechinque.1':
-            raise CannotDeserializeError(
-                "Unsupported serialized data version. Found %s, expected "
-                "VersionLeaseTechinque.1" % version)
-
-        tech = cls(backend_bridge, backend, host_identifier, time_utils)
-        tech._versions = copy.copy(data['versions'])
+                                  time_utils=None, max_clock_skew=None,
+                                  wait_strategy=None, poll_with_reads=False,
+                                  notifier=None, wait_queue=None,
+                                  metrics=None):
+        data = cls._load_serialized(serialized_technique)
+        tech = cls(backend_bridge, backend, host_identifier, time_utils,
+                   max_clock_skew, wait_strategy, poll_with_reads, notifier,
+                   wait_queue, metrics)
+        tech._restore(data)
         return tech
 
-    def acquire(self, name, lease_duration, max_wait_seconds):
+    def acquire(self, name, lease_duration, max_wait_seconds,
+                cancel_event=None, deadline=None):
         """Acquire a lock.
 
         Tries to acquire a lock using the strategy outlined above.
@@ -164,120 +511,390 @@ class VersionLeaseTechinque(BaseTechnique):
         :type max_wait_seconds: int
         :param max_wait_seconds: Maximum number of seconds to wait till
             giving up on acquiring the lock.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: If set while waiting, the wait is interrupted
+            and a :class:`lynk.exceptions.LockAcquireCancelledError` is
+            raised.
+
+        :type deadline: float
+        :param deadline: A time, by this technique's clock, to give up at.
+            If both this and ``max_wait_seconds`` are given, whichever comes
+            first is used.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise LockAcquireCancelledError()
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        if self._wait_queue is None:
+            self._acquire_from_backend(
+                name, lease_duration, max_wait_seconds, cancel_event)
+            return
+        self._acquire_through_queue(
+            name, lease_duration, max_wait_seconds, cancel_event)
+
+    def try_acquire(self, name, lease_duration):
+        """Make a single attempt to acquire a lock without waiting.
+
+        The lock is taken if it is free, or if its lease has expired by its
+        expiresAt timestamp.
+
+        :type name: str
+        :param name: Logical name of the lock being aquired.
+
+        :type lease_duration: int
+        :param lease_duration: Number of seconds to acquire the lock.
+
+        :rtype: bool
+        :returns: True if the lock was acquired.
+        """
+        waiter = None
+        if self._wait_queue is not None:
+            # If another thread of this process holds or is acquiring the
+            # lock there is no point asking the backend.
+            waiter = self._wait_queue.try_join(name, lease_duration)
+            if waiter is None:
+                return False
+        started = self._time_utils.perf_counter()
+        cutoff = self._to_millis(
+            self._time_utils.time() - self._max_clock_skew)
+        try:
+            self._write_lock(
+                name,
+                lease_duration,
+                self._create_version_number(),
+                self._backend_bridge.lock_free_or_lease_elapsed(cutoff),
+            )
+        except Exception as e:
+            if waiter is not None:
+                self._wait_queue.leave(waiter)
+            if isinstance(e, self._backend_bridge.ConditionFailedError):
+                return False
+            raise
+        if waiter is not None:
+            self._wait_queue.acquired(waiter)
+            self._waiters[name] = waiter
+        self._acquired(name, 1, started, 0)
+        return True
+
+    def acquire_many(self, names, lease_duration, max_wait_seconds,
+                     cancel_event=None, deadline=None):
+        """Atomically acquire several locks.
+
+        :type names: list
+        :param names: Logical names of the locks to acquire. At most the
+            backend's ``MAX_TRANSACTION_ITEMS`` locks can be acquired at once.
+
+        :type lease_duration: int
+        :param lease_duration: Number of seconds to acquire the locks for.
+
+        :type max_wait_seconds: int
+        :param max_wait_seconds: Maximum number of seconds to wait till
+            giving up on acquiring the locks.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: If set while waiting, the wait is interrupted
+            and a :class:`lynk.exceptions.LockAcquireCancelledError` is
+            raised.
+
+        :type deadline: float
+        :param deadline: A time, by this technique's clock, to give up at.
+            If both this and ``max_wait_seconds`` are given, whichever comes
+            first is used.
         """
+        names = self._names_to_acquire(names)
+        if cancel_event is not None and cancel_event.is_set():
+            raise LockAcquireCancelledError()
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        timer = AcquireTimer(
+            self._time_utils, self._wait_strategy, max_wait_seconds,
+            start_time)
+        versions = {name: self._create_version_number() for name in names}
+        contended = {}
+        while True:
+            in_use = self._try_write_locks(
+                names, lease_duration, versions, contended)
+            if not in_use:
+                for name in names:
+                    self._acquired(
+                        name, timer.attempts + 1, started, timer.slept)
+                return
+            now = self._time_utils.time()
+            sleep_time = timer.next_sleep(
+                now, self._contended_lease(contended, in_use, now))
+            _, sleep_time = timer.wait(sleep_time, cancel_event=cancel_event)
+            self._waited_on_contended(contended, sleep_time)
+
+    def _names_to_acquire(self, names):
+        names = sorted(set(names))
+        max_items = self._backend.MAX_TRANSACTION_ITEMS
+        if len(names) > max_items:
+            raise ValueError(
+                "Cannot acquire more than %s locks at once, got %s." % (
+                    max_items, len(names)))
+        return names
+
+    def _try_write_locks(self, names, lease_duration, versions, contended):
+        # Returns a LockAlreadyInUseError for each lock that was in use, or
+        # an empty dictionary if every lock was written.
+        try:
+            self._backend.transact_write(self._lock_operations(
+                names, lease_duration, versions, contended))
+        except TransactionConflictError as e:
+            in_use = {}
+            for i in e.failed_indexes:
+                lock_info = e.existing_items.get(i)
+                if lock_info is None:
+                    lock_info = self._backend.get(
+                        {'lockKey': names[i]},
+                        attributes=[
+                            'leaseDuration', 'versionNumber', 'expiresAt'],
+                    )
+                in_use[names[i]] = self._lock_in_use_error(lock_info)
+            return in_use
+        self._locks_written(names, lease_duration, versions)
+        return {}
+
+    def _lock_operations(self, names, lease_duration, versions, contended):
+        operations = []
+        for name in names:
+            condition = self._backend_bridge.lock_free()
+            if name in contended:
+                condition = self._steal_condition(
+                    contended[name].prior_lock, contended[name].waited)
+            operations.append(Put(
+                self._lock_item(name, lease_duration, versions[name]),
+                condition,
+            ))
+        return operations
+
+    def _locks_written(self, names, lease_duration, versions):
+        for name in names:
+            self._versions[name] = versions[name]
+            self._leases[name] = lease_duration
+
+    def _contended_lease(self, contended, in_use, now):
+        # Records the owners of the locks that were in use, and returns the
+        # time until the lease that runs out last is over.
+        for name, prior_lock in in_use.items():
+            known = contended.get(name)
+            if known is None or \
+                    known.prior_lock.version_number != \
+                    prior_lock.version_number:
+                contended[name] = _ContendedLock(prior_lock)
+            else:
+                known.prior_lock = prior_lock
+        return max(
+            self._remaining_lease(
+                contended[name].prior_lock, now,
+                contended[name].waited, contended[name].attempts)
+            for name in in_use
+        )
+
+    def _waited_on_contended(self, contended, sleep_time):
+        for lock in contended.values():
+            lock.waited += sleep_time
+            lock.attempts += 1
+
+    def _acquire_from_backend(self, name, lease_duration, max_wait_seconds,
+                              cancel_event=None):
         start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
         version = self._create_version_number()
+        # Subscribe before the first attempt so a release that happens right
+        # after it fails is not missed.
+        subscription = None
+        if self._notifier is not None:
+            subscription = self._notifier.subscribe(name)
+        attempts, slept = 1, 0
         try:
-            self._try_write_new_lock(
+            self._try_write_lock(
                 name,
                 lease_duration,
                 version,
+                self._backend_bridge.lock_free(),
             )
-            self._versions[name] = version
         except LockAlreadyInUseError as prior_lock:
+            # Locks are often released well before their lease runs out, so
+            # while a release can wake us it is worth waiting for until the
+            # deadline.
+            timer = AcquireTimer(
+                self._time_utils, self._wait_strategy, max_wait_seconds,
+                start_time, can_be_woken=subscription is not None)
             self._try_steal_lock(
                 name,
                 lease_duration,
-                max_wait_seconds,
-                prior_lock.lease_duration,
-                prior_lock.version_number,
-                start_time,
-            )
-
-    def _try_write_new_lock(self, name, lease_duration, version):
-        item = {
-            'lockKey': name,
-            'leaseDuration': lease_duration,
-            'hostIdentifier': self._host_identifier,
-            'versionNumber': version,
-        }
-        try:
-            self._backend.put(
-                item,
-                condition=self._backend_bridge.lock_free(),
+                prior_lock,
+                timer,
+                subscription,
+                cancel_event,
             )
-            self._versions[name] = version
-        except self._backend_bridge.ConditionFailedError:
-            self._raise_lock_in_use(name)
+            # Counting the attempt that failed before waiting started.
+            attempts, slept = timer.attempts + 1, timer.slept
+        finally:
+            if subscription is not None:
+                subscription.close()
+        self._acquired(name, attempts, started, slept)
 
-    def _try_steal_lock(self, name, lease_duration, max_wait_seconds,
-                        existing_lease, existing_version_number, start_time):
+    def _try_steal_lock(self, name, lease_duration, prior_lock, timer,
+                        subscription=None, cancel_event=None):
         version = self._create_version_number()
+        # Total time slept since the current owner's version was first
+        # observed. Once it exceeds their lease the version itself proves the
+        # lock was abandoned, independent of anyone's clock.
+        waited_on_prior = 0
+        attempts_on_prior = 0
         while True:
-            time_waited = self._time_utils.time() - start_time
-            sleep_time = self._calculate_sleep_time(
-                time_waited,
-                max_wait_seconds,
-                existing_lease,
-            )
-            self._time_utils.sleep(sleep_time)
-            lock_method_args = [
-                name,
-                lease_duration,
-                version,
-            ]
-            lock_method = self._try_write_new_lock
-            if existing_version_number:
-                lock_method_args.append(existing_version_number)
-                lock_method = self._try_write_lock
+            now = self._time_utils.time()
+            sleep_time = timer.next_sleep(now, self._remaining_lease(
+                prior_lock, now, waited_on_prior, attempts_on_prior))
+            notified, sleep_time = timer.wait(
+                sleep_time, subscription, cancel_event)
+            waited_on_prior += sleep_time
+            attempts_on_prior += 1
             try:
-                lock_method(*lock_method_args)
-                self._versions[name] = version
-                break
-            except LockAlreadyInUseError as prior_lock:
-                existing_lease = prior_lock.lease_duration
-                existing_version_number = prior_lock.version_number
+                # A notification is a stronger signal than a possibly stale
+                # read, so the lock is written straight away after one.
+                if self._poll_with_reads and not notified:
+                    prior_lock = self._poll_lock(
+                        name, prior_lock, waited_on_prior)
+                self._try_write_lock(
+                    name,
+                    lease_duration,
+                    version,
+                    self._steal_condition(prior_lock, waited_on_prior),
+                )
+                return
+            except LockAlreadyInUseError as next_prior_lock:
+                if next_prior_lock.version_number != prior_lock.version_number:
+                    waited_on_prior = 0
+                    attempts_on_prior = 0
+                prior_lock = next_prior_lock
+
+    def _poll_lock(self, name, prior_lock, waited_on_prior):
+        # Returns the lock state to base the steal condition on if a write is
+        # worth attempting, or raises LockAlreadyInUseError if it is not.
+        lock_info = self._backend.get(
+            {'lockKey': name},
+            attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            consistent=False,
+        )
+        return self._check_polled_lock(lock_info, prior_lock, waited_on_prior)
+
+    def _check_polled_lock(self, lock_info, prior_lock, waited_on_prior):
+        current_lock = self._lock_in_use_error(lock_info)
+        if current_lock.version_number is None:
+            return current_lock
+        if current_lock.version_number != prior_lock.version_number:
+            raise current_lock
+        if waited_on_prior >= float(prior_lock.lease_duration):
+            return current_lock
+        if self._lease_elapsed(current_lock):
+            return current_lock
+        raise current_lock
+
+    def _lease_elapsed(self, prior_lock):
+        if prior_lock.expires_at is None:
+            return False
+        cutoff = self._to_millis(
+            self._time_utils.time() - self._max_clock_skew)
+        return prior_lock.expires_at < cutoff
 
-    def _try_write_lock(self, name, lease_duration, version,
-                        existing_version_number):
+    def _remaining_lease(self, prior_lock, now, waited_on_prior,
+                         attempts_on_prior):
+        lease_left = max(
+            float(prior_lock.lease_duration) - waited_on_prior, 0)
+        if prior_lock.expires_at is None or attempts_on_prior > 0:
+            # Either there is no expiry to go by, or we already tried to take
+            # the lock once it expired and failed. Wait out the rest of the
+            # lease so the version can be used instead.
+            return lease_left
+        # Wake up once the owner's lease has expired, plus a margin for the
+        # difference between their clock and ours. There is never a reason to
+        # wait longer than the full lease though, after that we can take the
+        # lock based on its version alone.
+        remaining = (
+            float(prior_lock.expires_at) / 1000.0 - now + self._max_clock_skew
+        )
+        return min(max(remaining, 0), lease_left)
+
+    def _steal_condition(self, prior_lock, waited_on_prior):
+        if prior_lock.version_number is None:
+            return self._backend_bridge.lock_free()
+        if waited_on_prior >= float(prior_lock.lease_duration):
+            return self._backend_bridge.lock_free_or_expired(
+                prior_lock.version_number,
+            )
+        if prior_lock.expires_at is not None:
+            cutoff = self._to_millis(
+                self._time_utils.time() - self._max_clock_skew)
+            return self._backend_bridge.lock_free_or_lease_elapsed(cutoff)
+        return self._backend_bridge.lock_free()
+
+    def _try_write_lock(self, name, lease_duration, version, condition):
+        try:
+            self._write_lock(name, lease_duration, version, condition)
+        except self._backend_bridge.ConditionFailedError as e:
+            self._raise_lock_in_use(name, e)
+
+    def _write_lock(self, name, lease_duration, version, condition):
+        item = self._lock_item(name, lease_duration, version)
+        self._backend.put(item, condition=condition)
+        self._lock_written(name, lease_duration, version, item)
+
+    def _lock_written(self, name, lease_duration, version, item):
+        self._versions[name] = version
+        self._leases[name] = lease_duration
+        if self._metrics is not None:
+            self._written_at[name] = item['writeTime'] / 1000.0
+
+    def _lock_item(self, name, lease_duration, version):
         item = {
             'lockKey': name,
             'leaseDuration': lease_duration,
             'hostIdentifier': self._host_identifier,
             'versionNumber': version,
         }
-        try:
-            self._backend.put(
-                item,
-                condition=self._backend_bridge.lock_free_or_expired(
-                    existing_version_number,
-                ),
-            )
-            self._versions[name] = version
-        except self._backend_bridge.ConditionFailedError:
-            self._raise_lock_in_use(name)
-
-    def _create_version_number(self):
-        identifier = str(uuid.uuid4())
-        return identifier
+        item.update(self._lease_timestamps(lease_duration))
+        return item
 
-    def _calculate_sleep_time(self, time_waited, max_wait, existing_lease):
-        if time_waited >= max_wait:
-            raise LockNotGrantedError()
-        remaining_wait_time = max_wait - time_waited
-        next_wait = existing_lease
-        if next_wait > remaining_wait_time:
-            raise LockNotGrantedError()
-        return next_wait
+    def _lease_timestamps(self, lease_duration):
+        now = self._time_utils.time()
+        expires_at = self._to_millis(now + lease_duration)
+        return {
+            'writeTime': self._to_millis(now),
+            'expiresAt': expires_at,
+            DELETE_AFTER_ATTRIBUTE: delete_after(expires_at),
+        }
 
-    def _raise_lock_in_use(self, name):
-        lock_info = self._backend.get(
-            {'lockKey': name},
-            attributes=['leaseDuration', 'versionNumber'],
-        )
+    def _raise_lock_in_use(self, name, error):
+        # Backends that can, attach the item that caused the condition to
+        # fail to the error. Otherwise it needs to be read separately.
+        lock_info = getattr(error, 'existing_item', None)
+        if lock_info is None:
+            lock_info = self._backend.get(
+                {'lockKey': name},
+                attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            )
         # If we could not find any lock info that means between our call to
         # write the lock which failed, and our call to get the lock info, the
         # agent that owned the lock releaesd it. Since there is no longer a
         # lock we don't need to wait, and we don't have a prior versionNumber
         # to look for. So the leaseDuration can be set to 0 since we can retry
         # right away. And the versionNumber can be set to None so that the
-        # correct _try_write_new_lock method is called instead of
-        # _try_write_lock.
+        # lock_free condition is used on the next attempt.
+        raise self._lock_in_use_error(lock_info)
+
+    def _lock_in_use_error(self, lock_info):
         if not lock_info:
             lock_info = {'leaseDuration': 0, 'versionNumber': None}
-        raise LockAlreadyInUseError(
+        return LockAlreadyInUseError(
             lock_info['leaseDuration'],
             lock_info['versionNumber'],
+            lock_info.get('expiresAt'),
         )
 
     def release(self, name):
@@ -286,46 +903,612 @@ class VersionLeaseTechinque(BaseTechnique):
         :type name: str
         :param name: Logical name of the lock to release.
         """
+        holder = self._waiters.pop(name, None)
+        if holder is not None:
+            waiter = self._wait_queue.claim_next(holder)
+            if waiter is not None:
+                self._hand_off(name, holder, waiter)
+                return
         try:
             version_number = self._get_version_for_name(name)
             self._backend.delete(
                 {'lockKey': name},
                 condition=self._backend_bridge.we_own_lock(version_number),
             )
-            del self._versions[name]
+            self._forget(name)
         except self._backend_bridge.ConditionFailedError:
+            self._lock_lost(name)
             raise LockLostError()
+        if self._notifier is not None:
+            self._notifier.publish(name)
 
-    def refresh(self, name):
-        """Refresh a lock.
+    def release_many(self, names):
+        """Release several locks with a single transaction.
 
-        :type name: str
-        :param name: Logical name of the lock to refresh.
+        :type names: list
+        :param names: Logical names of the locks to release.
+
+        :raises: :class:`lynk.exceptions.LockLostError` if any of the locks
+            had been lost. The others are still released.
         """
-        old_version = self._get_version_for_name(name)
+        names = sorted(set(names))
+        lost = self._transact_write_applicable(
+            self._release_operations(names))
+        self._released_many(names, lost)
+
+    def _release_operations(self, names):
+        return [
+            Delete(
+                {'lockKey': name},
+                self._backend_bridge.we_own_lock(
+                    self._get_version_for_name(name)),
+            )
+            for name in names
+        ]
+
+    def _released_many(self, names, lost):
+        for name in names:
+            self._forget(name)
+        if self._notifier is not None:
+            for i, name in enumerate(names):
+                if i not in lost:
+                    self._notifier.publish(name)
+        if lost:
+            for i in lost:
+                self._lock_lost(names[i])
+            raise LockLostError()
+
+    def refresh_many(self, names):
+        """Refresh several locks with a single transaction.
+
+        :type names: list
+        :param names: Logical names of the locks to refresh.
+
+        :raises: :class:`lynk.exceptions.LockLostError` if any of the locks
+            had been lost. The others are still refreshed.
+        """
+        pending = [self.prepare_refresh(name) for name in sorted(set(names))]
+        lost = self._transact_write_applicable(
+            [refresh.operation for refresh in pending])
+        self._refreshed_many(pending, lost)
+
+    def _refreshed_many(self, pending, lost):
+        for i, refresh in enumerate(pending):
+            if i in lost:
+                refresh.lost()
+            else:
+                refresh.succeeded()
+        if lost:
+            raise LockLostError()
+
+    def _transact_write_applicable(self, operations):
+        # Apply every operation whose condition holds, and return the indexes
+        # of the ones whose condition failed.
+        remaining = list(range(len(operations)))
+        failed = set()
+        while remaining:
+            try:
+                self._backend.transact_write(
+                    [operations[i] for i in remaining])
+                break
+            except TransactionConflictError as e:
+                conflicts = set(remaining[i] for i in e.failed_indexes)
+                failed.update(conflicts)
+                remaining = [i for i in remaining if i not in conflicts]
+        return failed
+
+    def _hand_off(self, name, holder, waiter):
+        version_number = self._get_version_for_name(name)
         new_version = self._create_version_number()
+        updates = {
+            'hostIdentifier': self._host_identifier,
+            'versionNumber': new_version,
+            'leaseDuration': waiter.lease_duration,
+        }
+        updates.update(self._lease_timestamps(waiter.lease_duration))
         try:
             self._backend.update(
                 {'lockKey': name},
-                updates={
-                    'hostIdentifier': self._host_identifier,
-                    'versionNumber': new_version,
-                },
-                condition=self._backend_bridge.we_own_lock(old_version),
+                updates=updates,
+                condition=self._backend_bridge.we_own_lock(version_number),
             )
-            self._versions[name] = new_version
         except self._backend_bridge.ConditionFailedError:
+            self._wait_queue.hand_off_failed(holder, waiter)
+            self._lock_lost(name)
             raise LockLostError()
+        except Exception:
+            self._wait_queue.hand_off_failed(holder, waiter)
+            raise
+        self._forget(name)
+        self._wait_queue.handed_off(
+            holder, waiter, new_version, updates['writeTime'] / 1000.0)
 
-    def _get_version_for_name(self, name):
-        if name not in self._versions:
-            raise NoSuchLockError()
-        return self._versions[name]
+    def refresh(self, name):
+        """Refresh a lock.
 
-    def serialize(self):
-        properties = {
-            '__version': '%s.1' % self.__class__.__name__,
-            'versions': self._versions,
+        :type name: str
+        :param name: Logical name of the lock to refresh.
+        """
+        pending = self.prepare_refresh(name)
+        key, updates, condition = pending.operation
+        try:
+            self._backend.update(key, updates=updates, condition=condition)
+            pending.succeeded()
+        except self._backend_bridge.ConditionFailedError:
+            pending.lost()
+            raise LockLostError()
+
+    def prepare_refresh(self, name):
+        """Prepare a refresh of a lock without sending it to the backend.
+
+        :type name: str
+        :param name: Logical name of the lock to refresh.
+
+        :rtype: :class:`lynk.techniques.PendingRefresh`
+        :returns: The refresh to send. Once it has been applied by the backend
+            its ``succeeded`` method must be called so the technique learns
+            the lock's new versionNumber.
+        """
+        old_version = self._get_version_for_name(name)
+        new_version = self._create_version_number()
+        updates = {
+            'hostIdentifier': self._host_identifier,
+            'versionNumber': new_version,
+        }
+        updates.update(self._lease_timestamps(self._get_lease_for_name(name)))
+        operation = Update(
+            {'lockKey': name},
+            updates,
+            self._backend_bridge.we_own_lock(old_version),
+        )
+
+        def on_success():
+            self._versions[name] = new_version
+            if self._metrics is not None:
+                self._refreshed(name, updates['writeTime'] / 1000.0)
+
+        return PendingRefresh(
+            self._backend, operation, on_success,
+            lambda: self._lock_lost(name),
+            self._backend_bridge.ConditionFailedError)
+
+
+class SharedExclusiveTechnique(BaseLeaseTechnique):
+    """A reader-writer lock built on compare and swap of a single entry.
+
+    Any number of agents can hold the lock in shared mode at once, while an
+    agent holding it in exclusive mode excludes everyone else. The entry of
+    a lock records every current holder, along with the time each one's
+    lease runs out::
+
+      name:           string
+      versionNumber:  string
+      mode:           string
+      holders:        map of holder id to expiresAt
+      intent:         map of holder id to expiresAt
+      hostIdentifier: string
+      leaseDuration:  int
+      writeTime:      int
+      expiresAt:      int
+
+    * versionNumber - A new uuid4 is written on every change to the entry.
+      Each change reads the entry, works out its new content and writes it on
+      the condition that the versionNumber is still the one read, so
+      concurrent changes never overwrite each other. When that condition
+      fails the entry is read again and the change retried.
+    * mode - Whether the current holders share the lock or hold it
+      exclusively.
+    * holders - The holders, each identified by a uuid4 created when it
+      acquired the lock. A holder pushes its expiresAt forward when it
+      refreshes, and removes itself when it releases. Entries whose lease ran
+      out, with the ``max_clock_skew`` margin added, are dropped by the next
+      change to the entry.
+    * intent - An agent waiting to acquire the lock exclusively records its
+      intent here. While another agent's intent has not expired no new shared
+      holders are admitted, so a steady stream of readers cannot starve a
+      writer. Existing shared holders can still refresh and release.
+    * leaseDuration and expiresAt - The seconds until, and the time at which,
+      the last lease or intent in the entry runs out. The rest of the
+      attributes are the same as those of
+      :class:`lynk.techniques.VersionLeaseTechinque`.
+
+    Waiting, notifications, cancellation and ``poll_with_reads`` behave as
+    described for the version lease technique, polling reads the whole entry
+    rather than writing to it. A local wait queue only lines up waiters for
+    exclusive locks, since shared ones do not keep each other out. Releasing
+    an exclusive lock hands it to the next local waiter by swapping it into
+    the holders, unless another agent has recorded its intent. Unlike that
+    technique, expiry here is always
+    judged by timestamps, so the clocks of the agents sharing a lock must
+    agree to within ``max_clock_skew``. Locks of this technique and of the
+    version lease technique must not be used on the same name. They cannot
+    be acquired together in a :class:`lynk.lock.LockGroup`, nor refreshed
+    in a batch.
+
+    :type mode: str
+    :param mode: Either ``'shared'`` or ``'exclusive'``.
+    """
+    SHARED = 'shared'
+    EXCLUSIVE = 'exclusive'
+    MODES = (SHARED, EXCLUSIVE)
+    # Every change reads the entry before writing it, so changes to several
+    # locks cannot be sent together in one transaction, and acquire_many,
+    # release_many, refresh_many and prepare_refresh are not provided.
+    SUPPORTS_TRANSACTIONS = False
+    _SERIALIZED_VERSION = 'SharedExclusiveTechnique.1'
+    _ATTRIBUTES = ['versionNumber', 'mode', 'holders', 'intent']
+
+    def __init__(self, backend_bridge, backend, host_identifier=None,
+                 time_utils=None, max_clock_skew=None, wait_strategy=None,
+                 notifier=None, mode=EXCLUSIVE, poll_with_reads=False,
+                 wait_queue=None, metrics=None):
+        if mode not in self.MODES:
+            raise ValueError(
+                "Unknown lock mode %s, expected one of %s." % (
+                    mode, ', '.join(self.MODES)))
+        super(SharedExclusiveTechnique, self).__init__(
+            backend_bridge,
+            backend,
+            host_identifier=host_identifier,
+            time_utils=time_utils,
+            max_clock_skew=max_clock_skew,
+            wait_strategy=wait_strategy,
+            poll_with_reads=poll_with_reads,
+            notifier=notifier,
+            wait_queue=wait_queue,
+            metrics=metrics,
+        )
+        self._mode = mode
+
+    @classmethod
+    def from_serialized_technique(cls, serialized_technique, backend_bridge,
+                                  backend, host_identifier=None,
+                                  time_utils=None, max_clock_skew=None,
+                                  wait_strategy=None, notifier=None,
+                                  poll_with_reads=False, wait_queue=None,
+                                  metrics=None):
+        data = cls._load_serialized(serialized_technique)
+        tech = cls(backend_bridge, backend, host_identifier, time_utils,
+                   max_clock_skew, wait_strategy, notifier, data['mode'],
+                   poll_with_reads, wait_queue, metrics)
+        tech._restore(data)
+        return tech
+
+    def acquire(self, name, lease_duration, max_wait_seconds,
+                cancel_event=None, deadline=None):
+        """Acquire a lock in this technique's mode.
+
+        :type name: str
+        :param name: Logical name of the lock being aquired.
+
+        :type lease_duration: int
+        :param lease_duration: Number of seconds to acquire the lock.
+
+        :type max_wait_seconds: int
+        :param max_wait_seconds: Maximum number of seconds to wait till
+            giving up on acquiring the lock.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: If set while waiting, the wait is interrupted
+            and a :class:`lynk.exceptions.LockAcquireCancelledError` is
+            raised.
+
+        :type deadline: float
+        :param deadline: A time, by this technique's clock, to give up at.
+            If both this and ``max_wait_seconds`` are given, whichever comes
+            first is used.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise LockAcquireCancelledError()
+        max_wait_seconds = limit_to_deadline(
+            self._time_utils, max_wait_seconds, deadline)
+        if self._wait_queue is None or self._mode != self.EXCLUSIVE:
+            self._acquire_from_backend(
+                name, lease_duration, max_wait_seconds, cancel_event)
+            return
+        self._acquire_through_queue(
+            name, lease_duration, max_wait_seconds, cancel_event)
+
+    def _acquire_from_backend(self, name, lease_duration, max_wait_seconds,
+                              cancel_event):
+        start_time = self._time_utils.time()
+        started = self._time_utils.perf_counter()
+        holder = self._create_version_number()
+        subscription = None
+        if self._notifier is not None:
+            subscription = self._notifier.subscribe(name)
+        timer = AcquireTimer(
+            self._time_utils, self._wait_strategy, max_wait_seconds,
+            start_time, can_be_woken=subscription is not None)
+        try:
+            self._acquire_as(
+                name, holder, lease_duration, timer, subscription,
+                cancel_event)
+        except LockNotGrantedError:
+            self._withdraw_intent(name, holder)
+            raise
+        finally:
+            if subscription is not None:
+                subscription.close()
+        self._acquired(name, timer.attempts + 1, started, timer.slept)
+
+    def _acquire_as(self, name, holder, lease_duration, timer, subscription,
+                    cancel_event):
+        item = self._read(name)
+        while True:
+            now = self._time_utils.time()
+            holders, intent = self._active_entries(item, now)
+            if self._can_acquire(item, holders, intent, holder):
+                swapped, item = self._take(
+                    name, item, holder, lease_duration, now)
+                if swapped:
+                    return
+                # Another agent changed the entry first. Contention alone
+                # must not keep us going past the deadline.
+                timer.check_deadline(now)
+                continue
+            sleep_time = timer.next_sleep(
+                now, self._remaining_wait(item, holders, intent, holder, now))
+            if self._needs_intent(intent, holder, now + sleep_time):
+                intent = {
+                    holder: self._to_millis(now + sleep_time + lease_duration)
+                }
+                swapped, item = self._swap(
+                    name, item, item['mode'], holders, intent)
+                if not swapped:
+                    timer.check_deadline(now)
+                    continue
+            timer.wait(sleep_time, subscription, cancel_event)
+            # A stale read only costs a failed swap, or a later attempt.
+            item = self._read(name, consistent=not self._poll_with_reads)
+
+    def try_acquire(self, name, lease_duration):
+        """Make a single attempt to acquire a lock without waiting.
+
+        :rtype: bool
+        :returns: True if the lock was acquired, False if it is held in a
+            conflicting mode.
+        """
+        waiter = None
+        if self._wait_queue is not None and self._mode == self.EXCLUSIVE:
+            # If another thread of this process holds or is acquiring the
+            # lock there is no point asking the backend.
+            waiter = self._wait_queue.try_join(name, lease_duration)
+            if waiter is None:
+                return False
+        try:
+            acquired = self._try_take(name, lease_duration)
+        except Exception:
+            if waiter is not None:
+                self._wait_queue.leave(waiter)
+            raise
+        if waiter is not None:
+            if not acquired:
+                self._wait_queue.leave(waiter)
+                return False
+            self._wait_queue.acquired(waiter)
+            self._waiters[name] = waiter
+        return acquired
+
+    def _try_take(self, name, lease_duration):
+        started = self._time_utils.perf_counter()
+        holder = self._create_version_number()
+        item = self._read(name)
+        while True:
+            now = self._time_utils.time()
+            holders, intent = self._active_entries(item, now)
+            if not self._can_acquire(item, holders, intent, holder):
+                return False
+            swapped, item = self._take(
+                name, item, holder, lease_duration, now)
+            if swapped:
+                self._acquired(name, 1, started, 0)
+                return True
+
+    def release(self, name):
+        """Release a lock.
+
+        :type name: str
+        :param name: Logical name of the lock to release.
+        """
+        holder_waiter = self._waiters.pop(name, None)
+        if holder_waiter is not None:
+            waiter = self._wait_queue.claim_next(holder_waiter)
+            if waiter is not None and \
+                    self._hand_off(name, holder_waiter, waiter):
+                return
+        holder = self._get_version_for_name(name)
+        self._change_own_entry(name, holder, None)
+        self._forget(name)
+        if self._notifier is None:
+            return
+        if self._mode == self.EXCLUSIVE:
+            # Every shared waiter can take the lock once an exclusive holder
+            # is gone, so they are all woken rather than one per release.
+            self._notifier.publish(name, wake_all=True)
+        else:
+            self._notifier.publish(name)
+
+    def refresh(self, name):
+        """Refresh a lock.
+
+        :type name: str
+        :param name: Logical name of the lock to refresh.
+        """
+        holder = self._get_version_for_name(name)
+        write_time = self._change_own_entry(
+            name, holder, self._get_lease_for_name(name))
+        if self._metrics is not None:
+            self._refreshed(name, write_time)
+
+    def _serialized_properties(self):
+        properties = super(
+            SharedExclusiveTechnique, self)._serialized_properties()
+        properties['mode'] = self._mode
+        return properties
+
+    def _change_own_entry(self, name, holder, lease_duration):
+        # Pushes our lease forward, or removes it if lease_duration is None.
+        # Returns when the change was made.
+        item = self._read(name)
+        while True:
+            if not item or holder not in item.get('holders', {}):
+                self._lock_lost(name)
+                raise LockLostError()
+            now = self._time_utils.time()
+            holders, intent = self._active_entries(item, now)
+            holders.pop(holder, None)
+            if lease_duration is not None:
+                holders[holder] = self._to_millis(now + lease_duration)
+            swapped, item = self._swap(
+                name, item, item['mode'], holders, intent)
+            if swapped:
+                return now
+
+    def _hand_off(self, name, holder_waiter, waiter):
+        # Swaps the next local waiter into the holders in our place. Returns
+        # False, with the waiter put back in line, if the lock should be
+        # released to the backend instead.
+        try:
+            handed_off = self._hand_off_entry(
+                name, self._get_version_for_name(name),
+                waiter.lease_duration)
+        except Exception:
+            self._wait_queue.hand_off_failed(holder_waiter, waiter)
+            raise
+        if handed_off is None:
+            self._wait_queue.hand_off_failed(holder_waiter, waiter)
+            return False
+        new_holder, written_at = handed_off
+        self._forget(name)
+        self._wait_queue.handed_off(
+            holder_waiter, waiter, new_holder, written_at)
+        return True
+
+    def _hand_off_entry(self, name, holder, lease_duration):
+        # Returns the new holder and when it was written, or None if another
+        # agent that recorded its intent has been waiting for the lock, and
+        # must not be starved by the threads of this process.
+        item = self._read(name)
+        while True:
+            if not item or holder not in item.get('holders', {}):
+                self._lock_lost(name)
+                raise LockLostError()
+            now = self._time_utils.time()
+            holders, intent = self._active_entries(item, now)
+            if intent:
+                return None
+            new_holder = self._create_version_number()
+            holders.pop(holder, None)
+            holders[new_holder] = self._to_millis(now + lease_duration)
+            swapped, item = self._swap(
+                name, item, self.EXCLUSIVE, holders, intent)
+            if swapped:
+                return new_holder, now
+
+    def _take(self, name, item, holder, lease_duration, now):
+        holders, intent = self._active_entries(item, now)
+        # Taking the lock fulfils our own intent.
+        intent.pop(holder, None)
+        holders[holder] = self._to_millis(now + lease_duration)
+        swapped, item = self._swap(name, item, self._mode, holders, intent)
+        if swapped:
+            self._versions[name] = holder
+            self._leases[name] = lease_duration
+            if self._metrics is not None:
+                self._written_at[name] = now
+        return swapped, item
+
+    def _withdraw_intent(self, name, holder):
+        # An intent left behind expires on its own, but until then it keeps
+        # new shared holders out. A failed swap only means the entry changed,
+        # so it is retried against the current one. Any other error is
+        # raised, the caller is giving up anyway.
+        item = self._read(name)
+        while item and holder in item.get('intent', {}):
+            holders, intent = self._active_entries(
+                item, self._time_utils.time())
+            intent.pop(holder, None)
+            swapped, item = self._swap(
+                name, item, item['mode'], holders, intent)
+            if swapped:
+                return
+
+    def _read(self, name, consistent=True):
+        return self._backend.get(
+            {'lockKey': name},
+            attributes=self._ATTRIBUTES,
+            consistent=consistent,
+        )
+
+    def _active_entries(self, item, now):
+        # The holders and intent of the entry whose leases have not run out.
+        if not item:
+            return {}, {}
+        cutoff = self._to_millis(now - self._max_clock_skew)
+        return tuple(
+            {
+                holder: int(expires_at)
+                for holder, expires_at in item.get(attribute, {}).items()
+                if int(expires_at) > cutoff
+            }
+            for attribute in ('holders', 'intent')
+        )
+
+    def _can_acquire(self, item, holders, intent, holder):
+        others_intent = [other for other in intent if other != holder]
+        if self._mode == self.EXCLUSIVE:
+            return not holders and not others_intent
+        if holders and item['mode'] != self.SHARED:
+            return False
+        return not others_intent
+
+    def _needs_intent(self, intent, holder, wake_time):
+        if self._mode != self.EXCLUSIVE:
+            return False
+        if not intent:
+            return True
+        # Keep our intent alive until after we next wake up.
+        cutoff = self._to_millis(wake_time + self._max_clock_skew)
+        return holder in intent and intent[holder] < cutoff
+
+    def _remaining_wait(self, item, holders, intent, holder, now):
+        # Until every lease that stops us taking the lock has run out.
+        blocking = list(holders.values())
+        blocking.extend(
+            expires_at for other, expires_at in intent.items()
+            if other != holder
+        )
+        if not blocking:
+            return 0
+        return max(
+            float(max(blocking)) / 1000.0 - now + self._max_clock_skew, 0)
+
+    def _swap(self, name, item, mode, holders, intent):
+        # Replace the entry we read with one built from mode, holders and
+        # intent, or delete it if both are empty.
+        new_item = None
+        if holders or intent:
+            new_item = self._entry(name, mode, holders, intent)
+        return compare_and_swap(
+            self._backend, self._backend_bridge, {'lockKey': name}, item,
+            new_item, self._ATTRIBUTES)
+
+    def _entry(self, name, mode, holders, intent):
+        now = self._time_utils.time()
+        expires_at = max(
+            list(holders.values()) + list(intent.values()))
+        write_time = self._to_millis(now)
+        return {
+            'lockKey': name,
+            'versionNumber': self._create_version_number(),
+            'mode': mode,
+            'holders': holders,
+            'intent': intent,
+            'hostIdentifier': self._host_identifier,
+            'leaseDuration': max(
+                int(math.ceil((expires_at - write_time) / 1000.0)), 0),
+            'writeTime': write_time,
+            'expiresAt': expires_at,
+            DELETE_AFTER_ATTRIBUTE: delete_after(expires_at),
         }
-        serialized = json.dumps(properties)
-        return serialized
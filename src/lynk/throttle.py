@@ -0,0 +1,401 @@
+"""Rate limit and retry the backend requests of a session.
+
+When many clients contend for locks at once, for example retrying acquires
+during an incident, their requests can exceed a table's provisioned
+throughput. DynamoDB then throttles them, and locks that are already held
+can be lost if their refreshes are throttled for longer than a lease. A
+:class:`RateLimitedBackend` sends each request through an
+:class:`AdaptiveRateLimiter` that backs off when it sees throttling, and
+retries throttled and transient failures according to a
+:class:`RetryPolicy`.
+
+Requests made inside :func:`urgent`, which is how locks release and
+refresh, are let through ahead of any other waiting requests and can use a
+share of the limiter's capacity that acquires cannot.
+"""
+import threading
+from contextlib import contextmanager
+
+from lynk.backends.base import BaseBackend
+from lynk.exceptions import RequestThrottledError
+from lynk.utils import TimeUtils
+from lynk.wait import ExponentialBackoffWaitStrategy
+
+
+# Error codes meaning that a request was rejected because too many requests
+# are being made.
+THROTTLING_ERROR_CODES = frozenset([
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'LimitExceededException',
+])
+
+# Error codes of failures that are likely to succeed if tried again.
+TRANSIENT_ERROR_CODES = frozenset([
+    'InternalServerError',
+    'ServiceUnavailable',
+])
+
+# Reasons a transaction can be cancelled for that are not the fault of the
+# request. ``None`` is the reason given for the items that did nothing wrong.
+_RETRYABLE_CANCELLATION_REASONS = frozenset([
+    'None', 'ThrottlingError', 'ProvisionedThroughputExceeded',
+    'TransactionConflict',
+])
+_THROTTLING_CANCELLATION_REASONS = frozenset([
+    'ThrottlingError', 'ProvisionedThroughputExceeded',
+])
+
+_local = threading.local()
+
+
+@contextmanager
+def urgent():
+    """Mark the backend requests made by this thread in the block as urgent.
+
+    Releases and refreshes are urgent, since delaying them keeps locks from
+    other clients or risks losing a held lock.
+    """
+    previous = is_urgent()
+    _local.urgent = True
+    try:
+        yield
+    finally:
+        _local.urgent = previous
+
+
+def is_urgent():
+    """Check whether this thread's backend requests are currently urgent."""
+    return getattr(_local, 'urgent', False)
+
+
+def _error_code(error):
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return None
+    return response.get('Error', {}).get('Code')
+
+
+def _cancellation_reasons(error):
+    return set(
+        str(reason.get('Code'))
+        for reason in error.response.get('CancellationReasons', [])
+    )
+
+
+def is_throttling_error(error):
+    """Check whether an exception raised by a backend is a throttling error.
+
+    A transaction cancelled because some of its items were throttled counts
+    as throttled.
+    """
+    code = _error_code(error)
+    if code == 'TransactionCanceledException':
+        return bool(
+            _cancellation_reasons(error) & _THROTTLING_CANCELLATION_REASONS)
+    return code in THROTTLING_ERROR_CODES
+
+
+class AdaptiveRateLimiter(object):
+    """A token bucket whose rate adapts to throttling.
+
+    Each request takes a token from a bucket that refills at ``rate`` tokens
+    a second and holds at most a second's worth of them. The rate follows
+    additive increase, multiplicative decrease: every successful request
+    raises it a little, so it grows by about ``increase`` requests a second
+    every second, and throttling cuts it by the ``decrease`` factor, at most
+    once a second so that a burst of throttled requests only counts once.
+
+    Urgent requests take tokens before any other request waiting for one,
+    and ``urgent_reserve`` of the bucket can only be used by them, so
+    releases and refreshes still get through while acquires are starved.
+
+    :type rate: float
+    :param rate: Requests a second allowed at first.
+
+    :type min_rate: float
+    :param min_rate: The lowest the rate is cut to.
+
+    :type max_rate: float or None
+    :param max_rate: The highest the rate grows to. By default it is not
+        bounded.
+
+    :type increase: float
+    :param increase: Requests a second the rate grows by each second.
+
+    :type decrease: float
+    :param decrease: Factor the rate is multiplied by when throttled.
+
+    :type urgent_reserve: float
+    :param urgent_reserve: Fraction of the bucket kept for urgent requests.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: A set of utilities for interacting with time.
+    """
+    # Seconds after cutting the rate during which more throttling is taken
+    # to be caused by requests sent before the cut.
+    _DECREASE_COOLDOWN = 1.0
+
+    def __init__(self, rate=50.0, min_rate=1.0, max_rate=None, increase=1.0,
+                 decrease=0.5, urgent_reserve=0.25, time_utils=None):
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._urgent_reserve = urgent_reserve
+        self._rate = float(rate)
+        self._tokens = self._capacity()
+        self._updated_at = time_utils.time()
+        self._last_decrease = None
+        self._urgent_waiters = 0
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self):
+        """Requests a second currently allowed."""
+        return self._rate
+
+    def acquire(self, urgent=False, deadline=None):
+        """Wait for a token.
+
+        :type urgent: bool
+        :param urgent: Whether the request is urgent.
+
+        :type deadline: float or None
+        :param deadline: A time, in seconds since the epoch, to give up at.
+
+        :raises: :class:`lynk.exceptions.RequestThrottledError` if no token
+            is available before the deadline.
+        """
+        with self._condition:
+            if urgent:
+                self._urgent_waiters += 1
+            try:
+                self._wait_for_token(urgent, deadline)
+            finally:
+                if urgent:
+                    self._urgent_waiters -= 1
+
+    def _wait_for_token(self, urgent, deadline):
+        # Must be called holding the condition.
+        while True:
+            now = self._time_utils.time()
+            wait = self._take(urgent, now)
+            if wait == 0:
+                return
+            if deadline is not None:
+                if now >= deadline:
+                    raise RequestThrottledError()
+                wait = min(wait, deadline - now)
+            self._condition.wait(wait)
+
+    def _take(self, urgent, now):
+        # Takes a token and returns 0, or returns the seconds to wait before
+        # there could be one.
+        self._refill(now)
+        needed = 1.0
+        if not urgent:
+            if self._urgent_waiters:
+                # Leave the tokens to the urgent requests, and check back
+                # once one of them could have taken one.
+                return 1.0 / self._rate
+            needed += self._urgent_reserve * self._capacity()
+        if self._tokens >= needed:
+            self._tokens -= 1
+            return 0
+        return (needed - self._tokens) / self._rate
+
+    def on_success(self):
+        """Record that a request succeeded, growing the rate."""
+        with self._condition:
+            self._refill(self._time_utils.time())
+            rate = self._rate + self._increase / self._rate
+            if self._max_rate is not None:
+                rate = min(rate, self._max_rate)
+            self._rate = rate
+
+    def on_throttle(self):
+        """Record that a request was throttled, cutting the rate."""
+        with self._condition:
+            now = self._time_utils.time()
+            if self._last_decrease is not None and \
+                    now - self._last_decrease < self._DECREASE_COOLDOWN:
+                return
+            self._refill(now)
+            self._last_decrease = now
+            self._rate = max(self._min_rate, self._rate * self._decrease)
+            self._tokens = min(self._tokens, self._capacity())
+
+    def _capacity(self):
+        return max(1.0, self._rate)
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._updated_at)
+        self._updated_at = now
+        self._tokens = min(
+            self._capacity(), self._tokens + elapsed * self._rate)
+
+
+class RetryPolicy(object):
+    """Decide which failed backend requests are retried, and when.
+
+    Throttled requests, transient server errors and transactions cancelled
+    by throttling or by conflicting with another transaction are retried.
+    Anything else, such as a failed condition, is raised straight away.
+
+    A transient server error does not tell whether the request was applied,
+    so conditional writes are not retried after one. Retrying them could
+    fail the condition on the write the first attempt already made, and
+    report a lock the caller now holds as taken.
+
+    :type max_attempts: int
+    :param max_attempts: The most times a request is sent, including the
+        first.
+
+    :type timeout: float or None
+    :param timeout: Seconds a request may take in total, including waiting
+        for the rate limiter and between retries. By default there is no
+        limit beyond ``max_attempts``.
+
+    :type backoff: :class:`lynk.wait.BaseWaitStrategy`
+    :param backoff: Decides how long to wait before each retry. By default
+        an :class:`lynk.wait.ExponentialBackoffWaitStrategy` with full jitter
+        starting from 25 milliseconds and capped at a second.
+    """
+    def __init__(self, max_attempts=5, timeout=None, backoff=None):
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        if backoff is None:
+            backoff = ExponentialBackoffWaitStrategy(base=0.025, cap=1.0)
+        self._backoff = backoff
+
+    def is_retryable(self, error, idempotent=True):
+        """Check whether a request that raised an exception can be retried.
+
+        :type error: Exception
+        :param error: The exception the request raised.
+
+        :type idempotent: bool
+        :param idempotent: Whether sending the request twice has the same
+            effect as sending it once. If not, it is only retried after
+            errors that show it was rejected without being applied.
+        """
+        code = _error_code(error)
+        if code == 'TransactionCanceledException':
+            # A cancelled transaction has applied none of its operations.
+            return _cancellation_reasons(error) <= \
+                _RETRYABLE_CANCELLATION_REASONS
+        if code in THROTTLING_ERROR_CODES:
+            return True
+        return idempotent and code in TRANSIENT_ERROR_CODES
+
+    def next_wait(self, attempt, previous_wait):
+        """Calculate the seconds to wait before a retry.
+
+        :type attempt: int
+        :param attempt: The number of attempts that have failed so far.
+
+        :type previous_wait: float
+        :param previous_wait: Seconds waited before the last attempt.
+        """
+        return self._backoff.next_wait(attempt, previous_wait, 0)
+
+
+class RateLimitedBackend(BaseBackend):
+    """Send the requests of another backend through a rate limiter.
+
+    Failed requests are retried according to a retry policy, and throttling
+    errors cut the limiter's rate.
+
+    :type backend: :class:`lynk.backends.base.BaseBackend`
+    :param backend: The backend requests are passed on to.
+
+    :type rate_limiter: :class:`AdaptiveRateLimiter` or None
+    :param rate_limiter: Limits the rate of requests. If None requests are
+        only retried.
+
+    :type retry_policy: :class:`RetryPolicy` or None
+    :param retry_policy: Decides which failures are retried. By default a
+        :class:`RetryPolicy` with its default settings.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: A set of utilities for interacting with time.
+    """
+    def __init__(self, backend, rate_limiter=None, retry_policy=None,
+                 time_utils=None):
+        self._backend = backend
+        self._rate_limiter = rate_limiter
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self._retry_policy = retry_policy
+        if time_utils is None:
+            time_utils = TimeUtils()
+        self._time_utils = time_utils
+        self.MAX_TRANSACTION_ITEMS = getattr(
+            backend, 'MAX_TRANSACTION_ITEMS',
+            BaseBackend.MAX_TRANSACTION_ITEMS)
+        self.SUPPORTS_TRANSACTIONS = getattr(
+            backend, 'SUPPORTS_TRANSACTIONS', False)
+
+    def put(self, item, condition=None):
+        return self._call(
+            condition is None, self._backend.put, item, condition=condition)
+
+    def update(self, key, updates, condition=None):
+        return self._call(
+            condition is None, self._backend.update, key, updates,
+            condition=condition)
+
+    def delete(self, key, condition=None):
+        return self._call(
+            condition is None, self._backend.delete, key,
+            condition=condition)
+
+    def get(self, key, attributes, consistent=True):
+        return self._call(
+            True, self._backend.get, key, attributes, consistent=consistent)
+
+    def transact_write(self, operations):
+        return self._call(False, self._backend.transact_write, operations)
+
+    def _call(self, idempotent, fn, *args, **kwargs):
+        deadline = None
+        if self._retry_policy.timeout is not None:
+            deadline = self._time_utils.time() + self._retry_policy.timeout
+        request_is_urgent = is_urgent()
+        attempt = 0
+        previous_wait = 0
+        while True:
+            if self._rate_limiter is not None:
+                self._rate_limiter.acquire(request_is_urgent, deadline)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                previous_wait = self._before_retry(
+                    e, idempotent, attempt, previous_wait, deadline)
+                continue
+            if self._rate_limiter is not None:
+                self._rate_limiter.on_success()
+            return result
+
+    def _before_retry(self, error, idempotent, attempt, previous_wait,
+                      deadline):
+        # Waits before retrying a failed request, or re-raises its error if
+        # it should not be retried. Returns the seconds waited.
+        if self._rate_limiter is not None and is_throttling_error(error):
+            self._rate_limiter.on_throttle()
+        policy = self._retry_policy
+        if attempt >= policy.max_attempts or \
+                not policy.is_retryable(error, idempotent):
+            raise error
+        wait = policy.next_wait(attempt, previous_wait)
+        if deadline is not None and \
+                self._time_utils.time() + wait >= deadline:
+            raise error
+        self._time_utils.sleep(wait)
+        return wait
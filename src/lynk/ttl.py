@@ -0,0 +1,24 @@
+"""When abandoned lock entries may be deleted."""
+
+
+# Every entry records, in its deleteAfter attribute, a time in seconds since
+# the epoch after which it can be deleted unless it is written again. It is
+# EXPIRED_ENTRY_RETENTION seconds past the entry's expiresAt, far more than
+# the clock skew locks tolerate, so an entry is only ever deleted once nobody
+# can still hold it. DynamoDB's time to live and ``lynk gc`` delete abandoned
+# entries by it.
+DELETE_AFTER_ATTRIBUTE = 'deleteAfter'
+EXPIRED_ENTRY_RETENTION = 3600
+
+
+def delete_after(expires_at):
+    """Calculate when an entry can be deleted.
+
+    :type expires_at: int
+    :param expires_at: The expiresAt of the entry, in milliseconds since the
+        epoch.
+
+    :rtype: int
+    :returns: Seconds since the epoch.
+    """
+    return expires_at // 1000 + EXPIRED_ENTRY_RETENTION
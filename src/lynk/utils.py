@@ -5,5 +5,31 @@ class TimeUtils(object):
     def time(self):
         return time.time()
 
+    def perf_counter(self):
+        """Read a monotonic clock, for measuring how long something took.
+
+        Unlike :meth:`time` it is unaffected by changes to the system clock,
+        but its value is only meaningful relative to another reading.
+        """
+        return time.perf_counter()
+
     def sleep(self, amt):
         time.sleep(amt)
+
+    def wait(self, amt, event=None):
+        """Sleep for a number of seconds, or until an event is set.
+
+        :type amt: float
+        :param amt: Maximum number of seconds to wait.
+
+        :type event: :class:`threading.Event`
+        :param event: An event that interrupts the wait when set. If None
+            this is the same as calling ``sleep``.
+
+        :rtype: bool
+        :returns: True if the wait was interrupted by the event.
+        """
+        if event is None:
+            time.sleep(amt)
+            return False
+        return event.wait(amt)
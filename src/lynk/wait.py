@@ -0,0 +1,266 @@
+"""Strategies deciding how long to wait between attempts to take a lock."""
+import random
+
+from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import LockAcquireCancelledError
+
+
+class BaseWaitStrategy(object):
+    # If True a wait that would run past the caller's deadline is cut short
+    # so that one last attempt can be made right at the deadline. If False
+    # the caller gives up as soon as the next wait would run past it.
+    truncate_at_deadline = False
+
+    def next_wait(self, attempt, previous_wait, remaining_lease):
+        """Calculate the number of seconds to wait before the next attempt.
+
+        :type attempt: int
+        :param attempt: The number of attempts that have failed so far while
+            acquiring this lock, starting from 1.
+
+        :type previous_wait: float
+        :param previous_wait: Seconds waited before the last attempt, 0 if
+            there was no wait before it.
+
+        :type remaining_lease: float
+        :param remaining_lease: Seconds until the current owner's lease is
+            known to have run out, and it can be taken regardless of whether
+            the owner releases it.
+        """
+        raise NotImplementedError('next_wait')
+
+
+class LeaseWaitStrategy(BaseWaitStrategy):
+    """Wait until the current owner's lease runs out.
+
+    This makes the fewest possible attempts, but an early release is not
+    noticed until the lease would have expired, and every waiter that saw the
+    same owner wakes up at the same time.
+    """
+    def next_wait(self, attempt, previous_wait, remaining_lease):
+        return remaining_lease
+
+
+class ExponentialBackoffWaitStrategy(BaseWaitStrategy):
+    """Wait an exponentially growing, randomized amount of time.
+
+    Randomizing the waits spreads out waiters that observed the same owner,
+    so they do not all retry at the same instant and all but one fail. Two
+    kinds of jitter are supported:
+
+    * ``full`` - Wait a random time between 0 and
+      ``min(cap, base * 2 ** attempt)``.
+    * ``decorrelated`` - Wait a random time between ``base`` and three times
+      the previous wait, never more than ``cap``.
+
+    A wait is never shorter than ``min_interval`` to bound the rate of
+    attempts. The time left on the current owner's lease is deliberately
+    ignored, since every waiter that saw the same owner would otherwise wake
+    up together when it runs out. Waits that would run past the acquire's
+    ``max_wait_seconds`` are cut short so a final attempt is made right at the
+    deadline.
+    """
+    truncate_at_deadline = True
+    JITTER_TYPES = ('full', 'decorrelated')
+
+    def __init__(self, base=0.05, cap=5.0, min_interval=0.01, jitter='full',
+                 rand=None):
+        """Initialize an ExponentialBackoffWaitStrategy.
+
+        :type base: float
+        :param base: Seconds that the backoff starts from.
+
+        :type cap: float
+        :param cap: Maximum number of seconds to wait between attempts.
+
+        :type min_interval: float
+        :param min_interval: Minimum number of seconds to wait between
+            attempts.
+
+        :type jitter: str
+        :param jitter: Either ``full`` or ``decorrelated``.
+
+        :type rand: :class:`random.Random`
+        :param rand: Source of randomness.
+        """
+        if jitter not in self.JITTER_TYPES:
+            raise ValueError(
+                "Unknown jitter type %s, expected one of %s" % (
+                    jitter, ', '.join(self.JITTER_TYPES)))
+        self._base = base
+        self._cap = cap
+        self._min_interval = min_interval
+        self._jitter = jitter
+        if rand is None:
+            rand = random.Random()
+        self._rand = rand
+
+    def next_wait(self, attempt, previous_wait, remaining_lease):
+        if self._jitter == 'full':
+            # Cap the exponent to avoid overflowing on very long waits.
+            ceiling = min(self._cap, self._base * 2 ** min(attempt, 32))
+            wait = self._rand.uniform(0, ceiling)
+        else:
+            upper = max(self._base, previous_wait * 3)
+            wait = min(self._cap, self._rand.uniform(self._base, upper))
+        return max(wait, self._min_interval)
+
+
+def limit_to_deadline(time_utils, max_wait_seconds, deadline):
+    """Shorten the time an acquire may wait so it ends by a deadline.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: The clock the deadline is measured on.
+
+    :type max_wait_seconds: float
+    :param max_wait_seconds: Number of seconds the acquire may wait.
+
+    :type deadline: float
+    :param deadline: A time to give up at, or None.
+
+    :rtype: float
+    :returns: Whichever of ``max_wait_seconds`` and the seconds left until
+        ``deadline`` is smaller.
+    """
+    if deadline is None:
+        return max_wait_seconds
+    return min(max_wait_seconds, deadline - time_utils.time())
+
+
+class AcquireTimer(object):
+    """Time the waits between the attempts of a single acquire.
+
+    Every technique waits this way, so they all give up at the same
+    deadline, wake up on the same notifications and notice cancellation
+    within the same interval.
+
+    :type time_utils: :class:`lynk.utils.TimeUtils`
+    :param time_utils: The clock the deadline is measured on.
+
+    :type wait_strategy: :class:`BaseWaitStrategy`
+    :param wait_strategy: Decides how long each wait is.
+
+    :type max_wait_seconds: float
+    :param max_wait_seconds: Number of seconds after ``start_time`` to give
+        up at.
+
+    :type start_time: float
+    :param start_time: When the acquire started. Defaults to now.
+
+    :type can_be_woken: bool
+    :param can_be_woken: If ``True`` a wait that would run past the deadline
+        is cut short there, even if the wait strategy would rather give up,
+        since a notification may still end it early.
+    """
+    # There is no way to block on a notification and a cancel event at once,
+    # so waits that need both check the cancel event this often.
+    _CANCEL_CHECK_INTERVAL = 0.1
+
+    def __init__(self, time_utils, wait_strategy, max_wait_seconds,
+                 start_time=None, can_be_woken=False):
+        self._time_utils = time_utils
+        self._wait_strategy = wait_strategy
+        self._max_wait_seconds = max_wait_seconds
+        if start_time is None:
+            start_time = time_utils.time()
+        self._start_time = start_time
+        self._can_be_woken = can_be_woken
+        self._previous_wait = 0
+        # The number of attempts that failed, and the seconds spent waiting.
+        self.attempts = 0
+        self.slept = 0
+
+    def next_sleep(self, now, remaining_lease):
+        """Count a failed attempt, and decide how long to wait after it.
+
+        :type now: float
+        :param now: The current time.
+
+        :type remaining_lease: float
+        :param remaining_lease: Seconds until the lease keeping us from the
+            lock is known to have run out.
+
+        :rtype: float
+        :returns: The number of seconds to wait before the next attempt.
+
+        :raises: :class:`lynk.exceptions.LockNotGrantedError` if the deadline
+            has passed, or the wait would run past it.
+        """
+        self.attempts += 1
+        wait = self._wait_strategy.next_wait(
+            self.attempts, self._previous_wait, remaining_lease)
+        time_waited = now - self._start_time
+        if time_waited >= self._max_wait_seconds:
+            raise LockNotGrantedError()
+        remaining_wait_time = self._max_wait_seconds - time_waited
+        if wait > remaining_wait_time:
+            truncate = self._wait_strategy.truncate_at_deadline
+            if not truncate and not self._can_be_woken:
+                raise LockNotGrantedError()
+            wait = remaining_wait_time
+        self._previous_wait = wait
+        return wait
+
+    def check_deadline(self, now):
+        """Give up if the deadline has passed, without counting an attempt.
+
+        For attempts that are retried straight away rather than after a
+        wait, such as a compare and swap that lost a race.
+
+        :raises: :class:`lynk.exceptions.LockNotGrantedError` if the deadline
+            has passed.
+        """
+        if now - self._start_time >= self._max_wait_seconds:
+            raise LockNotGrantedError()
+
+    def wait(self, sleep_time, subscription=None, cancel_event=None):
+        """Wait before the next attempt.
+
+        :type sleep_time: float
+        :param sleep_time: The number of seconds to wait for.
+
+        :type subscription: :class:`lynk.notify.Subscription`
+        :param subscription: If given, a published release ends the wait
+            early.
+
+        :type cancel_event: :class:`threading.Event`
+        :param cancel_event: Setting this interrupts the wait, and a
+            :class:`lynk.exceptions.LockAcquireCancelledError` is raised.
+
+        :rtype: tuple
+        :returns: Whether a release was published, and how many seconds
+            were actually spent waiting.
+        """
+        if subscription is None:
+            if self._time_utils.wait(sleep_time, cancel_event):
+                raise LockAcquireCancelledError()
+            notified, slept = False, sleep_time
+        else:
+            start = self._time_utils.perf_counter()
+            notified = self._wait_for_notification(
+                subscription, sleep_time, cancel_event)
+            slept = self._time_utils.perf_counter() - start
+        self.waited(slept)
+        return notified, slept
+
+    def waited(self, slept):
+        """Record a wait made without :meth:`wait`, such as an awaited sleep.
+
+        :type slept: float
+        :param slept: The number of seconds spent waiting.
+        """
+        self._previous_wait = slept
+        self.slept += slept
+
+    def _wait_for_notification(self, subscription, timeout, cancel_event):
+        if cancel_event is None:
+            return subscription.wait(timeout)
+        remaining = timeout
+        while remaining > 0:
+            interval = min(remaining, self._CANCEL_CHECK_INTERVAL)
+            if subscription.wait(interval):
+                return True
+            if cancel_event.is_set():
+                raise LockAcquireCancelledError()
+            remaining -= interval
+        return False
@@ -0,0 +1,190 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import boto3
+import pytest
+
+from lynk.session import Session
+from lynk.backends.dynamodb_http import DynamoDBHTTPBackendBridgeFactory
+
+
+def _check(expression, item, values):
+    # Evaluates the condition expressions a DynamoDBClientVersionLeaseBridge
+    # builds.
+    if ' OR ' in expression:
+        return any(_check(part, item, values)
+                   for part in expression.split(' OR '))
+    if expression == 'attribute_not_exists(#lockKey)':
+        return item is None
+    if item is None:
+        return False
+    if expression == '#versionNumber = :versionNumber':
+        return item.get('versionNumber') == values[':versionNumber']
+    if expression == '#expiresAt < :expiresAt':
+        return 'expiresAt' in item and \
+            int(item['expiresAt']['N']) < int(values[':expiresAt']['N'])
+    raise AssertionError('Unexpected condition %s' % expression)
+
+
+class StubDynamoDB(object):
+    """Enough of DynamoDB, on the wire, for a lock to work against."""
+    def __init__(self):
+        self.items = {}
+        self.connections = set()
+        self.close_next_connection = False
+        self._lock = threading.Lock()
+
+    def handle(self, target, request):
+        operation = target.split('.')[-1]
+        with self._lock:
+            return getattr(self, operation)(request)
+
+    def PutItem(self, request):
+        key = request['Item']['lockKey']['S']
+        failed = self._failed(key, request)
+        if failed:
+            return failed
+        self.items[key] = request['Item']
+        return 200, {}
+
+    def UpdateItem(self, request):
+        key = request['Key']['lockKey']['S']
+        failed = self._failed(key, request)
+        if failed:
+            return failed
+        item = self.items.setdefault(key, dict(request['Key']))
+        names = request['ExpressionAttributeNames']
+        values = request['ExpressionAttributeValues']
+        for assignment in request['UpdateExpression'][4:].split(', '):
+            name, value = assignment.split(' = ')
+            item[names[name]] = values[value]
+        return 200, {}
+
+    def DeleteItem(self, request):
+        key = request['Key']['lockKey']['S']
+        failed = self._failed(key, request)
+        if failed:
+            return failed
+        self.items.pop(key, None)
+        return 200, {}
+
+    def GetItem(self, request):
+        item = self.items.get(request['Key']['lockKey']['S'])
+        if item is None:
+            return 200, {}
+        names = request['ExpressionAttributeNames'].values()
+        return 200, {
+            'Item': {name: item[name] for name in names if name in item}}
+
+    def _failed(self, key, request):
+        expression = request.get('ConditionExpression')
+        item = self.items.get(key)
+        if expression is None or _check(
+                expression, item, request.get('ExpressionAttributeValues')):
+            return None
+        error = {
+            '__type': 'com.amazonaws.dynamodb.v20120810#'
+                      'ConditionalCheckFailedException',
+            'message': 'The conditional request failed',
+        }
+        if item is not None and 'ReturnValuesOnConditionCheckFailure' in \
+                request:
+            error['Item'] = item
+        return 400, error
+
+
+@pytest.fixture
+def stub_server():
+    stub = StubDynamoDB()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            assert self.headers['Authorization'].startswith(
+                'AWS4-HMAC-SHA256 Credential=akid/')
+            stub.connections.add(self.client_address)
+            length = int(self.headers['Content-Length'])
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            status, response = stub.handle(
+                self.headers['X-Amz-Target'], request)
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/x-amz-json-1.0')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            if stub.close_next_connection:
+                # Close without telling the client, like a server timing
+                # out an idle connection.
+                stub.close_next_connection = False
+                self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={'poll_interval': 0.01})
+    thread.daemon = True
+    thread.start()
+    stub.endpoint_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    yield stub
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def create_session(stub_server):
+    def wrapped(**kwargs):
+        boto_session = boto3.session.Session(
+            aws_access_key_id='akid',
+            aws_secret_access_key='secret',
+            region_name='us-west-2',
+        )
+        factory = DynamoDBHTTPBackendBridgeFactory(
+            session=boto_session, endpoint_url=stub_server.endpoint_url)
+        return Session('locks', backend_bridge_factory=factory,
+                       max_clock_skew=0, **kwargs)
+    return wrapped
+
+
+class TestDynamoDBHTTPBackend(object):
+    def test_can_acquire_and_release_lock(self, create_session,
+                                          stub_server):
+        session = create_session()
+        lock = session.create_lock('foo', auto_refresh=False)
+        lock.acquire(lease_duration=20)
+        assert stub_server.items['foo']['leaseDuration'] == {'N': '20'}
+        lock.refresh()
+        lock.release()
+        assert stub_server.items == {}
+
+    def test_held_lock_does_exclude_others(self, create_session):
+        session = create_session()
+        lock = session.create_lock('foo', auto_refresh=False)
+        other = session.create_lock('foo', auto_refresh=False)
+        lock.acquire(lease_duration=20)
+        assert other.try_acquire() is False
+        lock.release()
+        assert other.try_acquire() is True
+        other.release()
+
+    def test_does_reuse_connections(self, create_session, stub_server):
+        lock = create_session().create_lock('foo', auto_refresh=False)
+        for _ in range(10):
+            lock.acquire(lease_duration=20)
+            lock.release()
+        assert len(stub_server.connections) == 1
+
+    def test_does_retry_on_connection_closed_by_server(
+            self, create_session, stub_server):
+        lock = create_session().create_lock('foo', auto_refresh=False)
+        stub_server.close_next_connection = True
+        lock.acquire(lease_duration=20)
+        lock.release()
+        assert stub_server.items == {}
+        assert len(stub_server.connections) == 2
@@ -0,0 +1,176 @@
+import threading
+import time
+
+import mock
+import pytest
+
+from lynk.session import Session
+from lynk.metrics import MetricsHook
+from lynk.backends.memory import MemoryBackendBridgeFactory
+
+
+class TestMemoryBackend(object):
+    def test_lock_does_exclude_threads(self):
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+            max_clock_skew=0,
+        )
+        state = {'held': 0, 'max_held': 0, 'acquires': 0}
+        state_lock = threading.Lock()
+
+        def contend():
+            lock = session.create_lock('shared', auto_refresh=False)
+            for _ in range(20):
+                with lock(lease_duration=10, timeout_seconds=10):
+                    with state_lock:
+                        state['held'] += 1
+                        state['acquires'] += 1
+                        state['max_held'] = max(
+                            state['max_held'], state['held'])
+                    with state_lock:
+                        state['held'] -= 1
+
+        threads = [threading.Thread(target=contend) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert state['acquires'] == 160
+        assert state['max_held'] == 1
+
+    def test_sessions_sharing_factory_share_locks(self):
+        factory = MemoryBackendBridgeFactory()
+        first = Session('table name', backend_bridge_factory=factory)
+        second = Session('table name', backend_bridge_factory=factory)
+        lock = first.create_lock('foo', auto_refresh=False)
+        other = second.create_lock('foo', auto_refresh=False)
+        assert lock.try_acquire()
+        assert not other.try_acquire()
+        lock.release()
+        assert other.try_acquire()
+        other.release()
+
+    def test_reentrant_shared_lock_is_not_exclusive(self):
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+            reentrant_locks=True,
+        )
+        reader = session.create_lock('x', auto_refresh=False, mode='shared')
+        reader.acquire(lease_duration=10)
+        other_reader = []
+
+        def read():
+            lock = session.create_lock('x', auto_refresh=False, mode='shared')
+            other_reader.append(lock.try_acquire(lease_duration=10))
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+        assert other_reader == [True]
+        # Holding the name shared does not make this an exclusive re-entry.
+        writer = session.create_lock(
+            'x', auto_refresh=False, mode='exclusive')
+        assert writer.try_acquire(lease_duration=10) is False
+        reader.release()
+
+    def test_does_wake_waiter_when_long_lease_is_released_early(self):
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+        )
+        lock = session.create_lock('foo', auto_refresh=False)
+        waiter = session.create_lock('foo', auto_refresh=False)
+        lock.acquire(lease_duration=20)
+        timer = threading.Timer(0.2, lock.release)
+        timer.start()
+        start = time.time()
+        waiter.acquire(lease_duration=20, max_wait_seconds=5)
+        assert 0.1 < time.time() - start < 5
+        waiter.release()
+
+    def test_does_wake_every_reader_when_writer_releases(self):
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+        )
+        writer = session.create_lock(
+            'x', auto_refresh=False, mode='exclusive')
+        writer.acquire(lease_duration=20)
+        acquired = []
+
+        def read():
+            reader = session.create_lock(
+                'x', auto_refresh=False, mode='shared')
+            reader.acquire(lease_duration=20, max_wait_seconds=5)
+            acquired.append(time.time())
+
+        readers = [threading.Thread(target=read) for _ in range(3)]
+        for reader in readers:
+            reader.start()
+        time.sleep(0.2)
+        released = time.time()
+        writer.release()
+        for reader in readers:
+            reader.join()
+        assert len(acquired) == 3
+        # Every reader was let in by the single release.
+        assert all(t - released < 1 for t in acquired)
+
+    def test_closing_session_stops_refresher_threads(self):
+        threads_before = set(threading.enumerate())
+        with Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+        ) as session:
+            locks = [session.create_lock('lock %s' % i) for i in range(3)]
+            for lock in locks:
+                lock.acquire(lease_duration=0.1)
+            # Give the refreshes time to come due and start workers.
+            time.sleep(0.25)
+            for lock in locks:
+                lock.release()
+            scheduler = session._refresh_scheduler
+            assert scheduler._workers
+        threads = [scheduler._thread] + scheduler._workers
+        assert not any(thread.is_alive() for thread in threads)
+        assert set(threading.enumerate()) - threads_before == set()
+
+    def test_closed_session_does_refuse_new_locks(self):
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+            max_clock_skew=0,
+        )
+        lock = session.create_lock('early')
+        session.close()
+        with pytest.raises(RuntimeError):
+            session.create_lock('b')
+        with pytest.raises(RuntimeError):
+            session.create_semaphore('semaphore', 2)
+        with pytest.raises(RuntimeError):
+            session.acquire_many(['a', 'b'])
+        # A lock created before closing cannot be left without refreshes.
+        with pytest.raises(RuntimeError):
+            lock.acquire(lease_duration=1)
+
+    def test_does_measure_shared_locks_and_semaphores(self):
+        metrics = mock.Mock(spec=MetricsHook)
+        session = Session(
+            'table name',
+            backend_bridge_factory=MemoryBackendBridgeFactory(),
+            metrics=metrics,
+        )
+        shared = session.create_lock(
+            'shared', mode='shared', auto_refresh=False)
+        shared.acquire(lease_duration=10)
+        shared.refresh()
+        shared.release()
+        semaphore = session.create_semaphore('semaphore', 2)
+        with semaphore(lease_duration=10):
+            pass
+        acquired = [c[0][0] for c in metrics.on_acquire.call_args_list]
+        assert acquired == ['shared', 'semaphore']
+        metrics.on_refresh.assert_called_once_with('shared', mock.ANY, 10)
+        assert metrics.on_backend_call.called
@@ -0,0 +1,64 @@
+import pytest
+
+from lynk.notify import UDPNotifier
+
+
+@pytest.fixture
+def notifiers():
+    created = []
+
+    def wrapped(peers=None):
+        notifier = UDPNotifier(('127.0.0.1', 0), peers=peers)
+        created.append(notifier)
+        return notifier
+    yield wrapped
+    for notifier in created:
+        notifier.close()
+
+
+class TestUDPNotifier(object):
+    def test_does_notify_peer(self, notifiers):
+        receiver = notifiers()
+        sender = notifiers(peers=[receiver.address])
+        subscription = receiver.subscribe('lock')
+        sender.publish('lock')
+        assert subscription.wait(5) is True
+
+    def test_does_notify_local_subscribers(self, notifiers):
+        notifier = notifiers()
+        subscription = notifier.subscribe('lock')
+        notifier.publish('lock')
+        assert subscription.wait(0) is True
+
+    def test_does_notify_every_peer_subscriber(self, notifiers):
+        receiver = notifiers()
+        sender = notifiers(peers=[receiver.address])
+        first = receiver.subscribe('lock')
+        second = receiver.subscribe('lock')
+        sender.publish('lock', wake_all=True)
+        assert first.wait(5) is True
+        assert second.wait(5) is True
+
+    def test_does_not_notify_other_locks(self, notifiers):
+        receiver = notifiers()
+        sender = notifiers(peers=[receiver.address])
+        subscription = receiver.subscribe('lock')
+        other = receiver.subscribe('other lock')
+        sender.publish('other lock')
+        assert other.wait(5) is True
+        assert subscription.wait(0) is False
+
+    def test_does_ignore_own_notifications(self, notifiers):
+        notifier = notifiers()
+        # Sending to itself is what multicast loopback does.
+        notifier._peers.append(notifier.address)
+        first = notifier.subscribe('lock')
+        second = notifier.subscribe('lock')
+        synced = notifier.subscribe('sync')
+        notifier.publish('lock')
+        # Datagrams are received in order, so once this one arrives any
+        # echo of the first would have been delivered too.
+        notifiers(peers=[notifier.address]).publish('sync')
+        assert synced.wait(5) is True
+        assert first.wait(0) is True
+        assert second.wait(0) is False
@@ -1,6 +1,11 @@
 import time
+import threading
+
+import mock
+import pytest
 
 from lynk.refresh import LockRefresher
+from lynk.refresh import LockRefreshScheduler
 
 
 class TestLockRefresher(object):
@@ -37,3 +42,99 @@ class TestLockRefresher(object):
         # no fewer than 2 times and no more than 4 times.
         assert refresh_count < 4
         assert refresh_count > 2
+
+
+class TestLockRefreshScheduler(object):
+    def test_does_call_refresh_fn_periodically(self):
+        mock_lock = mock.Mock()
+        scheduler = LockRefreshScheduler()
+        refresher = scheduler.create_lock_refresher(mock_lock, 0.1)
+        refresher.start()
+        time.sleep(0.35)
+        refresher.stop()
+        scheduler.stop()
+        assert 2 < mock_lock.refresh.call_count < 4
+
+    def test_does_refresh_many_locks_from_few_threads(self):
+        threads_before = set(threading.enumerate())
+        scheduler = LockRefreshScheduler()
+        locks = [mock.Mock() for _ in range(500)]
+        refreshers = [
+            scheduler.create_lock_refresher(lock, 0.1) for lock in locks
+        ]
+        for refresher in refreshers:
+            refresher.start()
+        # Compare the threads themselves rather than a count, since threads
+        # left over from other tests may exit in the meantime.
+        new_threads = set(threading.enumerate()) - threads_before
+        assert new_threads == {scheduler._thread}
+        time.sleep(0.25)
+        new_threads = set(threading.enumerate()) - threads_before
+        assert new_threads <= {scheduler._thread} | set(scheduler._workers)
+        assert len(scheduler._workers) <= 4
+        for refresher in refreshers:
+            refresher.stop()
+        scheduler.stop()
+        assert all(lock.refresh.called for lock in locks)
+
+    def test_does_wake_for_earlier_deadline(self):
+        slow_lock = mock.Mock()
+        fast_lock = mock.Mock()
+        scheduler = LockRefreshScheduler()
+        scheduler.create_lock_refresher(slow_lock, 1000).start()
+        fast = scheduler.create_lock_refresher(fast_lock, 0.05)
+        fast.start()
+        time.sleep(0.2)
+        fast.stop()
+        scheduler.stop()
+        assert fast_lock.refresh.called
+        assert not slow_lock.refresh.called
+
+    def test_slow_refresh_does_not_delay_others(self):
+        slow_lock = mock.Mock()
+        release_slow = threading.Event()
+        slow_lock.refresh.side_effect = lambda: release_slow.wait(5)
+        fast_lock = mock.Mock()
+        scheduler = LockRefreshScheduler()
+        slow = scheduler.create_lock_refresher(slow_lock, 0.05)
+        fast = scheduler.create_lock_refresher(fast_lock, 0.05)
+        slow.start()
+        fast.start()
+        time.sleep(0.35)
+        # The slow refresh is still running, while the other lock kept
+        # being refreshed on time.
+        assert slow_lock.refresh.call_count == 1
+        assert fast_lock.refresh.call_count > 2
+        release_slow.set()
+        slow.stop()
+        fast.stop()
+        scheduler.stop()
+
+    def test_does_not_start_more_than_max_workers(self):
+        release = threading.Event()
+        locks = [mock.Mock() for _ in range(5)]
+        for lock in locks:
+            lock.refresh.side_effect = lambda: release.wait(5)
+        scheduler = LockRefreshScheduler(max_workers=2)
+        refreshers = [
+            scheduler.create_lock_refresher(lock, 0.05) for lock in locks]
+        for refresher in refreshers:
+            refresher.start()
+        time.sleep(0.2)
+        assert len(scheduler._workers) == 2
+        assert sum(lock.refresh.call_count for lock in locks) == 2
+        release.set()
+        time.sleep(0.1)
+        for refresher in refreshers:
+            refresher.stop()
+        scheduler.stop()
+        assert all(lock.refresh.called for lock in locks)
+
+    def test_stopped_scheduler_does_refuse_refreshers(self):
+        scheduler = LockRefreshScheduler()
+        scheduler.create_lock_refresher(mock.Mock(), 1000).start()
+        scheduler.stop()
+        refresher = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        with pytest.raises(RuntimeError):
+            refresher.start()
+        assert len(scheduler) == 1
@@ -0,0 +1,55 @@
+import time
+import threading
+
+import mock
+
+from lynk.session import Session
+from lynk.backends.memory import MemoryBackendBridgeFactory
+
+
+class TestSemaphore(object):
+    def test_threads_sharing_semaphore_do_not_conflict(self):
+        bridge, backend = MemoryBackendBridgeFactory().create('table name')
+        failed_puts = []
+        put = backend.put
+
+        def counting_put(item, condition=None):
+            # A round trip long enough for writes to overlap.
+            time.sleep(0.001)
+            try:
+                put(item, condition=condition)
+            except bridge.ConditionFailedError:
+                failed_puts.append(item)
+                raise
+        backend.put = counting_put
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (bridge, backend)
+        session = Session(
+            'table name',
+            backend_bridge_factory=bridge_factory,
+            max_clock_skew=0,
+        )
+        semaphore = session.create_semaphore(
+            'api', 3, shards=1, auto_refresh=False)
+        state = {'held': 0, 'max_held': 0, 'grants': 0}
+        state_lock = threading.Lock()
+
+        def contend():
+            for _ in range(20):
+                with semaphore(lease_duration=10, timeout_seconds=10):
+                    with state_lock:
+                        state['held'] += 1
+                        state['grants'] += 1
+                        state['max_held'] = max(
+                            state['max_held'], state['held'])
+                    with state_lock:
+                        state['held'] -= 1
+
+        threads = [threading.Thread(target=contend) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert state['grants'] == 160
+        assert state['max_held'] <= 3
+        assert failed_puts == []
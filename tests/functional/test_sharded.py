@@ -0,0 +1,46 @@
+import pytest
+
+from lynk.session import Session
+from lynk.backends.memory import MemoryBackendBridgeFactory
+from lynk.backends.sharded import ShardedBackendBridgeFactory
+from lynk.backends.sharded import shard_table_names
+
+
+class TestShardedBackend(object):
+    def test_does_spread_locks_across_tables(self):
+        memory = MemoryBackendBridgeFactory()
+        table_names = shard_table_names('locks', 4)
+        factory = ShardedBackendBridgeFactory(
+            table_names, backend_bridge_factory=memory)
+        session = Session(
+            'locks', backend_bridge_factory=factory, max_clock_skew=0)
+        other = Session(
+            'locks', backend_bridge_factory=factory, max_clock_skew=0)
+        locks = [session.create_lock('lock %d' % i, auto_refresh=False)
+                 for i in range(40)]
+        for lock in locks:
+            lock.acquire(lease_duration=20)
+        for i in range(40):
+            contender = other.create_lock('lock %d' % i, auto_refresh=False)
+            assert contender.try_acquire() is False
+        for name in table_names:
+            assert memory._tables[name].items
+        for lock in locks:
+            lock.release()
+        assert not any(memory._tables[name].items for name in table_names)
+
+    def test_does_reject_group_across_memory_tables_up_front(self):
+        memory = MemoryBackendBridgeFactory()
+        table_names = shard_table_names('locks', 2)
+        factory = ShardedBackendBridgeFactory(
+            table_names, backend_bridge_factory=memory)
+        session = Session('locks', backend_bridge_factory=factory)
+        ring = factory._ring
+        names = ['lock %d' % i for i in range(100)]
+        first = next(name for name in names
+                     if ring.node_for(name) == table_names[0])
+        second = next(name for name in names
+                      if ring.node_for(name) == table_names[1])
+        with pytest.raises(ValueError):
+            session.create_lock_group([first, second], auto_refresh=False)
+        assert not any(memory._tables[name].items for name in table_names)
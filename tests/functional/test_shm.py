@@ -0,0 +1,61 @@
+import multiprocessing
+
+import pytest
+
+from lynk.session import Session
+from lynk.backends.shm import SharedMemoryBackendBridgeFactory
+from lynk.backends.shm import ItemTooLargeError
+from lynk.wait import ExponentialBackoffWaitStrategy
+
+
+def _increment(directory, counter_path, times):
+    session = Session(
+        'locks',
+        backend_bridge_factory=SharedMemoryBackendBridgeFactory(directory),
+        max_clock_skew=0,
+        # Releases are not published to other processes, so poll quickly
+        # rather than waiting out the holder's lease.
+        wait_strategy=ExponentialBackoffWaitStrategy(base=0.001, cap=0.01),
+    )
+    lock = session.create_lock('counter', auto_refresh=False)
+    for _ in range(times):
+        with lock(lease_duration=10, timeout_seconds=30):
+            with open(counter_path) as f:
+                count = int(f.read())
+            with open(counter_path, 'w') as f:
+                f.write(str(count + 1))
+
+
+class TestSharedMemoryBackend(object):
+    def test_lock_does_exclude_processes(self, tmpdir):
+        counter_path = str(tmpdir.join('counter'))
+        with open(counter_path, 'w') as f:
+            f.write('0')
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(
+                target=_increment, args=(str(tmpdir), counter_path, 25))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            assert process.exitcode == 0
+        with open(counter_path) as f:
+            assert int(f.read()) == 100
+
+    def test_shared_lock_does_hold_documented_number_of_holders(self, tmpdir):
+        session = Session(
+            'locks',
+            backend_bridge_factory=SharedMemoryBackendBridgeFactory(
+                str(tmpdir)),
+        )
+        for _ in range(28):
+            lock = session.create_lock(
+                'cfg', auto_refresh=False, mode='shared')
+            lock.acquire(lease_duration=60)
+        lock = session.create_lock('cfg', auto_refresh=False, mode='shared')
+        with pytest.raises(ItemTooLargeError):
+            lock.acquire(lease_duration=60)
+
@@ -0,0 +1,45 @@
+import multiprocessing
+
+from lynk.session import Session
+from lynk.backends.sqlite import SQLiteBackendBridgeFactory
+from lynk.wait import ExponentialBackoffWaitStrategy
+
+
+def _increment(path, counter_path, times):
+    session = Session(
+        'locks',
+        backend_bridge_factory=SQLiteBackendBridgeFactory(path),
+        max_clock_skew=0,
+        # Releases are not published to other processes, so poll quickly
+        # rather than waiting out the holder's lease.
+        wait_strategy=ExponentialBackoffWaitStrategy(base=0.001, cap=0.01),
+    )
+    lock = session.create_lock('counter', auto_refresh=False)
+    for _ in range(times):
+        with lock(lease_duration=10, timeout_seconds=30):
+            # Nothing else should read or write the counter until this
+            # process has written it back.
+            with open(counter_path) as f:
+                count = int(f.read())
+            with open(counter_path, 'w') as f:
+                f.write(str(count + 1))
+
+
+class TestSQLiteBackend(object):
+    def test_lock_does_exclude_processes(self, tmpdir):
+        path = str(tmpdir.join('locks.db'))
+        counter_path = str(tmpdir.join('counter'))
+        with open(counter_path, 'w') as f:
+            f.write('0')
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=_increment, args=(path, counter_path, 25))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            assert process.exitcode == 0
+        with open(counter_path) as f:
+            assert int(f.read()) == 100
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from lynk.session import Session
+from lynk.backends.base import BaseBackend
+from lynk.backends.memory import MemoryBackendBridgeFactory
+from lynk.throttle import AdaptiveRateLimiter
+from lynk.throttle import RetryPolicy
+
+
+class ProvisionedThroughputExceededException(Exception):
+    def __init__(self):
+        self.response = {
+            'Error': {'Code': 'ProvisionedThroughputExceededException'}}
+
+
+class ProvisionedBackend(BaseBackend):
+    """A backend that throttles requests beyond a fixed rate."""
+    def __init__(self, backend, rate):
+        self._backend = backend
+        self._rate = rate
+        self._window = None
+        self._used = 0
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _consume(self):
+        with self._lock:
+            window = int(time.time() * 10)
+            if window != self._window:
+                self._window = window
+                self._used = 0
+            self._used += 1
+            if self._used > self._rate / 10.0:
+                self.throttled += 1
+                raise ProvisionedThroughputExceededException()
+
+    def put(self, item, condition=None):
+        self._consume()
+        return self._backend.put(item, condition=condition)
+
+    def update(self, key, updates, condition=None):
+        self._consume()
+        return self._backend.update(key, updates, condition=condition)
+
+    def delete(self, key, condition=None):
+        self._consume()
+        return self._backend.delete(key, condition=condition)
+
+    def get(self, key, attributes, consistent=True):
+        self._consume()
+        return self._backend.get(key, attributes, consistent=consistent)
+
+    def transact_write(self, operations):
+        self._consume()
+        return self._backend.transact_write(operations)
+
+
+class ProvisionedBackendBridgeFactory(object):
+    def __init__(self, rate):
+        self._factory = MemoryBackendBridgeFactory()
+        self._rate = rate
+        self.backend = None
+
+    def create(self, table_name):
+        bridge, backend = self._factory.create(table_name)
+        self.backend = ProvisionedBackend(backend, self._rate)
+        return bridge, self.backend
+
+
+class TestRateLimitedSession(object):
+    def test_held_lock_does_survive_contention(self):
+        factory = ProvisionedBackendBridgeFactory(rate=100)
+        session = Session(
+            'table name',
+            backend_bridge_factory=factory,
+            max_clock_skew=0,
+            rate_limiter=AdaptiveRateLimiter(rate=100, min_rate=5),
+            retry_policy=RetryPolicy(max_attempts=10),
+        )
+        holder = session.create_lock('foo', auto_refresh=False)
+        holder.acquire(lease_duration=3)
+        stop = threading.Event()
+        stolen = []
+
+        def contend():
+            lock = session.create_lock('foo', auto_refresh=False)
+            while not stop.is_set():
+                try:
+                    if lock.try_acquire(lease_duration=3):
+                        stolen.append(lock)
+                except ProvisionedThroughputExceededException:
+                    pass
+
+        threads = [threading.Thread(target=contend) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(8):
+                time.sleep(0.25)
+                holder.refresh()
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        holder.release()
+        assert stolen == []
+        assert factory.backend.throttled > 0
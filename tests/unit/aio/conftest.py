@@ -0,0 +1,7 @@
+import sys
+
+
+# lynk.aio uses async/await syntax, which older interpreters cannot parse.
+collect_ignore_glob = []
+if sys.version_info < (3, 5):
+    collect_ignore_glob.append('test_*.py')
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+import mock
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Put
+from lynk.aio.backends import AsyncBaseBackend
+from lynk.aio.backends import ExecutorBackend
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestExecutorBackend(object):
+    def test_is_async_backend(self):
+        backend = ExecutorBackend(mock.Mock(spec=BaseBackend))
+        assert isinstance(backend, AsyncBaseBackend)
+
+    def test_can_put(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        backend = ExecutorBackend(sync_backend)
+        run(backend.put({'key': 'value'}, condition='condition'))
+        sync_backend.put.assert_called_once_with(
+            {'key': 'value'}, condition='condition')
+
+    def test_can_update(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        backend = ExecutorBackend(sync_backend)
+        run(backend.update({'key': 'value'}, {'foo': 'bar'}, 'condition'))
+        sync_backend.update.assert_called_once_with(
+            {'key': 'value'}, updates={'foo': 'bar'}, condition='condition')
+
+    def test_can_delete(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        backend = ExecutorBackend(sync_backend)
+        run(backend.delete({'key': 'value'}, condition='condition'))
+        sync_backend.delete.assert_called_once_with(
+            {'key': 'value'}, condition='condition')
+
+    def test_can_get(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        sync_backend.get.return_value = {'foo': 'bar'}
+        backend = ExecutorBackend(sync_backend)
+        result = run(backend.get({'key': 'value'}, ['foo'], consistent=False))
+        assert result == {'foo': 'bar'}
+        sync_backend.get.assert_called_once_with(
+            {'key': 'value'}, attributes=['foo'], consistent=False)
+
+    def test_can_transact_write(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        backend = ExecutorBackend(sync_backend)
+        operations = [Put({'key': 'value'}, None)]
+        run(backend.transact_write(operations))
+        sync_backend.transact_write.assert_called_once_with(operations)
+
+    def test_does_propagate_errors(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        sync_backend.put.side_effect = ValueError()
+        backend = ExecutorBackend(sync_backend)
+        with pytest.raises(ValueError):
+            run(backend.put({'key': 'value'}))
+
+    def test_does_use_wrapped_transaction_size(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        sync_backend.MAX_TRANSACTION_ITEMS = 25
+        backend = ExecutorBackend(sync_backend)
+        assert backend.MAX_TRANSACTION_ITEMS == 25
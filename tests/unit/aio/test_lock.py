@@ -0,0 +1,190 @@
+import json
+import asyncio
+
+import pytest
+import mock
+
+from lynk.aio.lock import AsyncLock
+from lynk.aio.refresh import AsyncLockRefreshScheduler
+from lynk.aio.refresh import AsyncScheduledLockRefresher
+from lynk.aio.utils import current_task
+from lynk.reentrant import LocalHolds
+from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import NoSuchLockError
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class MockAsyncTechnique(object):
+    """Records calls to the coroutines of an async technique."""
+    def __init__(self):
+        self.mock = mock.Mock()
+
+    async def acquire(self, *args, **kwargs):
+        return self.mock.acquire(*args, **kwargs)
+
+    async def try_acquire(self, *args, **kwargs):
+        return self.mock.try_acquire(*args, **kwargs)
+
+    async def release(self, *args, **kwargs):
+        return self.mock.release(*args, **kwargs)
+
+    async def refresh(self, *args, **kwargs):
+        return self.mock.refresh(*args, **kwargs)
+
+    async def prepare_refresh(self, *args, **kwargs):
+        return self.mock.prepare_refresh(*args, **kwargs)
+
+    def serialize(self):
+        return self.mock.serialize()
+
+
+@pytest.fixture
+def create_lock():
+    def wrapped(refresher=False, holds=None):
+        technique = MockAsyncTechnique()
+        refresher_factory = None
+        if refresher:
+            refresher_factory = mock.Mock(spec=AsyncLockRefreshScheduler)
+            refresher_factory.create_lock_refresher.return_value = \
+                mock.Mock(spec=AsyncScheduledLockRefresher)
+        lock = AsyncLock('lock name', technique, refresher_factory,
+                         holds=holds)
+        return lock, technique.mock, refresher_factory
+    return wrapped
+
+
+class TestAsyncLock(object):
+    def test_can_acquire_lock(self, create_lock):
+        lock, technique, _ = create_lock()
+        run(lock.acquire(10, max_wait_seconds=30))
+        technique.acquire.assert_called_once_with(
+            'lock name', 10, max_wait_seconds=30, deadline=None)
+
+    def test_can_acquire_lock_with_deadline(self, create_lock):
+        lock, technique, _ = create_lock()
+        run(lock.acquire(10, deadline=1010.0))
+        # The technique measures the deadline on its own clock.
+        technique.acquire.assert_called_once_with(
+            'lock name', 10, max_wait_seconds=300, deadline=1010.0)
+
+    def test_acquire_does_start_refresher(self, create_lock):
+        lock, technique, refresher_factory = create_lock(refresher=True)
+        run(lock.acquire(20))
+        refresher_factory.create_lock_refresher.assert_called_once_with(
+            lock, 15)
+        refresher = refresher_factory.create_lock_refresher.return_value
+        refresher.start.assert_called_once_with()
+
+    def test_release_does_stop_refresher(self, create_lock):
+        lock, technique, refresher_factory = create_lock(refresher=True)
+        run(lock.acquire(20))
+        run(lock.release())
+        refresher = refresher_factory.create_lock_refresher.return_value
+        refresher.stop.assert_called_once_with()
+        technique.release.assert_called_once_with('lock name')
+
+    def test_can_try_acquire(self, create_lock):
+        lock, technique, refresher_factory = create_lock(refresher=True)
+        technique.try_acquire.return_value = False
+        assert run(lock.try_acquire()) is False
+        refresher_factory.create_lock_refresher.assert_not_called()
+        technique.try_acquire.return_value = True
+        assert run(lock.try_acquire()) is True
+        refresher_factory.create_lock_refresher.assert_called_once_with(
+            lock, 15)
+
+    def test_can_use_as_context_manager(self, create_lock):
+        lock, technique, _ = create_lock()
+
+        async def use_lock():
+            async with lock(lease_duration=10, timeout_seconds=5):
+                technique.release.assert_not_called()
+
+        run(use_lock())
+        technique.acquire.assert_called_once_with(
+            'lock name', 10, max_wait_seconds=5, deadline=None)
+        technique.release.assert_called_once_with('lock name')
+
+    def test_can_use_directly_as_context_manager(self, create_lock):
+        lock, technique, _ = create_lock()
+
+        async def use_lock():
+            async with lock:
+                pass
+
+        run(use_lock())
+        technique.acquire.assert_called_once_with(
+            'lock name', 20, max_wait_seconds=300, deadline=None)
+        technique.release.assert_called_once_with('lock name')
+
+    def test_context_manager_does_not_release_unacquired_lock(
+            self, create_lock):
+        lock, technique, _ = create_lock()
+        technique.acquire.side_effect = LockNotGrantedError()
+
+        async def use_lock():
+            async with lock():
+                pass
+
+        with pytest.raises(LockNotGrantedError):
+            run(use_lock())
+        technique.release.assert_not_called()
+
+    def test_can_serialize_lock(self, create_lock):
+        lock, technique, _ = create_lock()
+        technique.serialize.return_value = 'SERIALIZED_TECHNIQUE'
+        serialized = json.loads(run(lock.serialize()))
+        technique.refresh.assert_called_once_with('lock name')
+        assert serialized == {
+            '__version': 'Lock.1',
+            'name': 'lock name',
+            'technique': 'SERIALIZED_TECHNIQUE',
+        }
+
+    def test_reentrant_lock_is_reentrant_per_task(self, create_lock):
+        lock, technique, _ = create_lock(
+            holds=LocalHolds(get_owner=current_task))
+
+        async def nested():
+            async with lock:
+                async with lock:
+                    pass
+                assert not technique.release.called
+
+        run(nested())
+        technique.acquire.assert_called_once_with(
+            'lock name', 20, max_wait_seconds=300, deadline=None)
+        technique.release.assert_called_once_with('lock name')
+
+    def test_reentrant_lock_is_not_shared_between_tasks(self, create_lock):
+        lock, technique, _ = create_lock(
+            holds=LocalHolds(get_owner=current_task))
+
+        async def acquire_from_other_task():
+            await lock.acquire()
+            await asyncio.ensure_future(lock.acquire())
+
+        run(acquire_from_other_task())
+        assert technique.acquire.call_count == 2
+
+    def test_reentrant_lock_cannot_refresh_from_other_task(self, create_lock):
+        holds = LocalHolds(get_owner=current_task)
+        lock, technique, _ = create_lock(holds=holds)
+        other, other_technique, _ = create_lock(holds=holds)
+
+        async def refresh_from_other_task():
+            await lock.acquire()
+            with pytest.raises(NoSuchLockError):
+                await asyncio.ensure_future(other.refresh())
+            await asyncio.ensure_future(lock.refresh())
+
+        run(refresh_from_other_task())
+        other_technique.refresh.assert_not_called()
+        technique.refresh.assert_called_once_with('lock name')
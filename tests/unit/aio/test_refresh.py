@@ -0,0 +1,226 @@
+import asyncio
+
+import mock
+
+from lynk.backends.base import Update
+from lynk.exceptions import LockLostError
+from lynk.exceptions import RequestThrottledError
+from lynk.exceptions import TransactionConflictError
+from lynk.techniques import PendingRefresh
+from lynk.aio.backends import AsyncBaseBackend
+from lynk.aio.refresh import AsyncLockRefreshScheduler
+from lynk.aio.refresh import AsyncBatchLockRefresher
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class ConditionFailedError(Exception):
+    pass
+
+
+class FakeAsyncLock(object):
+    def __init__(self, backend=None, refresh_error=None):
+        self.backend = backend
+        self.refresh_error = refresh_error
+        self.refreshes = 0
+        self.batched_refreshes = 0
+        self.losses = 0
+
+    @property
+    def supports_batch_refresh(self):
+        return self.backend is not None
+
+    async def refresh(self):
+        if self.refresh_error is not None:
+            raise self.refresh_error
+        self.refreshes += 1
+
+    async def prepare_refresh(self):
+        def on_success():
+            self.batched_refreshes += 1
+
+        def on_lost():
+            self.losses += 1
+
+        return PendingRefresh(
+            self.backend, Update({'lockKey': id(self)}, {}, None), on_success,
+            on_lost, ConditionFailedError)
+
+
+class FakeBatchBackend(AsyncBaseBackend):
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, conflicts=None, error=None, lost=None):
+        self.transactions = []
+        self.updates = []
+        self._conflicts = conflicts or []
+        self._error = error
+        self._lost = lost or []
+
+    async def update(self, key, updates, condition=None):
+        self.updates.append(key['lockKey'])
+        if key['lockKey'] in self._lost:
+            raise ConditionFailedError()
+
+    async def transact_write(self, operations):
+        self.transactions.append(operations)
+        if self._error is not None:
+            raise self._error
+        if self._conflicts:
+            raise TransactionConflictError(self._conflicts.pop(0))
+
+
+class RecordingBatchRefresher(object):
+    def __init__(self):
+        self.batches = []
+
+    async def refresh(self, locks):
+        self.batches.append(locks)
+        return {}
+
+
+class TestAsyncLockRefreshScheduler(object):
+    def test_does_refresh_periodically(self):
+        batch_refresher = RecordingBatchRefresher()
+        scheduler = AsyncLockRefreshScheduler(
+            batch_refresher=batch_refresher)
+        lock = mock.sentinel.lock
+
+        async def hold():
+            refresher = scheduler.create_lock_refresher(lock, 0.01)
+            refresher.start()
+            await asyncio.sleep(0.055)
+            refresher.stop()
+
+        run(hold())
+        assert 3 <= len(batch_refresher.batches) <= 5
+        assert all(batch == [lock] for batch in batch_refresher.batches)
+
+    def test_does_batch_refreshes_due_together(self):
+        batch_refresher = RecordingBatchRefresher()
+        scheduler = AsyncLockRefreshScheduler(
+            batch_window=0.01, batch_refresher=batch_refresher)
+        locks = [mock.Mock() for _ in range(100)]
+
+        async def hold():
+            refreshers = [
+                scheduler.create_lock_refresher(lock, 0.01) for lock in locks
+            ]
+            for refresher in refreshers:
+                refresher.start()
+            await asyncio.sleep(0.025)
+            for refresher in refreshers:
+                refresher.stop()
+
+        run(hold())
+        assert len(batch_refresher.batches[0]) == 100
+
+    def test_stop_does_cancel_refresh(self):
+        batch_refresher = RecordingBatchRefresher()
+        scheduler = AsyncLockRefreshScheduler(
+            batch_refresher=batch_refresher)
+
+        async def hold():
+            refresher = scheduler.create_lock_refresher(mock.Mock(), 0.01)
+            refresher.start()
+            refresher.stop()
+            await asyncio.sleep(0.03)
+
+        run(hold())
+        assert batch_refresher.batches == []
+
+    def test_does_stop_refreshing_failed_lock(self):
+        scheduler = AsyncLockRefreshScheduler()
+        lock = FakeAsyncLock(refresh_error=LockLostError())
+
+        async def hold():
+            refresher = scheduler.create_lock_refresher(lock, 0.01)
+            refresher.start()
+            await asyncio.sleep(0.03)
+            return refresher
+
+        refresher = run(hold())
+        assert refresher.handle is None
+
+    def test_does_retry_refresh_that_fails_transiently(self):
+        scheduler = AsyncLockRefreshScheduler()
+        lock = FakeAsyncLock(refresh_error=RequestThrottledError())
+
+        async def hold():
+            refresher = scheduler.create_lock_refresher(lock, 0.02)
+            refresher.start()
+            await asyncio.sleep(0.021)
+            lock.refresh_error = None
+            await asyncio.sleep(0.01)
+            refresher.stop()
+
+        run(hold())
+        # Retried after a tenth of the period rather than a whole one.
+        assert lock.refreshes >= 1
+
+
+class TestAsyncBatchLockRefresher(object):
+    def test_does_refresh_single_lock_directly(self):
+        backend = FakeBatchBackend()
+        lock = FakeAsyncLock(backend)
+        failures = run(AsyncBatchLockRefresher().refresh([lock]))
+        assert failures == {}
+        # The prepared refresh is sent, rather than preparing another.
+        assert lock.refreshes == 0
+        assert lock.batched_refreshes == 1
+        assert backend.updates == [id(lock)]
+        assert backend.transactions == []
+
+    def test_does_batch_locks_sharing_backend(self):
+        backend = FakeBatchBackend()
+        locks = [FakeAsyncLock(backend) for _ in range(150)]
+        failures = run(AsyncBatchLockRefresher().refresh(locks))
+        assert failures == {}
+        assert [len(t) for t in backend.transactions] == [100, 50]
+        assert all(lock.batched_refreshes == 1 for lock in locks)
+
+    def test_does_retry_without_conflicting_locks(self):
+        backend = FakeBatchBackend(conflicts=[[1]])
+        locks = [FakeAsyncLock(backend) for _ in range(3)]
+        failures = run(AsyncBatchLockRefresher().refresh(locks))
+        assert list(failures) == [locks[1]]
+        assert isinstance(failures[locks[1]], LockLostError)
+        assert [len(t) for t in backend.transactions] == [3, 2]
+        assert locks[1].batched_refreshes == 0
+        assert locks[0].batched_refreshes == 1
+        assert [lock.losses for lock in locks] == [0, 1, 0]
+
+    def test_does_refresh_one_at_a_time_after_other_errors(self):
+        backend = FakeBatchBackend(error=RequestThrottledError())
+        locks = [FakeAsyncLock(backend) for _ in range(3)]
+        backend._lost = [id(locks[1])]
+        failures = run(AsyncBatchLockRefresher().refresh(locks))
+        assert list(failures) == [locks[1]]
+        assert isinstance(failures[locks[1]], LockLostError)
+        assert backend.updates == [id(lock) for lock in locks]
+        assert [lock.batched_refreshes for lock in locks] == [1, 0, 1]
+        assert [lock.losses for lock in locks] == [0, 1, 0]
+        assert [lock.refreshes for lock in locks] == [0, 0, 0]
+
+    def test_does_report_prepare_errors(self):
+        lock = FakeAsyncLock(FakeBatchBackend())
+        error = LockLostError()
+        lock.prepare_refresh = mock.Mock(side_effect=error)
+        failures = run(AsyncBatchLockRefresher().refresh([lock]))
+        assert failures == {lock: error}
+
+    def test_does_fall_back_without_transactions(self):
+        backend = FakeBatchBackend()
+        backend.SUPPORTS_TRANSACTIONS = False
+        locks = [FakeAsyncLock(backend) for _ in range(2)]
+        failures = run(AsyncBatchLockRefresher().refresh(locks))
+        assert failures == {}
+        assert backend.transactions == []
+        assert backend.updates == [id(lock) for lock in locks]
+        assert all(lock.batched_refreshes == 1 for lock in locks)
@@ -0,0 +1,90 @@
+import json
+import asyncio
+
+import mock
+
+from lynk.backends.base import BaseBackend
+from lynk.aio import AsyncSession
+from lynk.aio.lock import AsyncLock
+from lynk.aio.backends import AsyncBaseBackend
+from lynk.aio.backends import ExecutorBackend
+from lynk.aio.refresh import AsyncLockRefreshScheduler
+from lynk.metrics import InstrumentedBackend
+from lynk.metrics import MetricsHook
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class TestAsyncSession(object):
+    def test_can_create_lock(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (
+            mock.Mock(), mock.Mock(spec=BaseBackend))
+        session = AsyncSession('table', backend_bridge_factory=bridge_factory)
+        lock = session.create_lock('foo')
+        assert isinstance(lock, AsyncLock)
+        assert isinstance(lock._refresher_factory, AsyncLockRefreshScheduler)
+        bridge_factory.create.assert_called_once_with('table')
+
+    def test_does_wrap_sync_backend(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (
+            mock.Mock(), mock.Mock(spec=BaseBackend))
+        session = AsyncSession('table', backend_bridge_factory=bridge_factory)
+        first = session.create_lock('foo')
+        second = session.create_lock('bar')
+        assert isinstance(first._technique._backend, ExecutorBackend)
+        assert first._technique._backend is second._technique._backend
+        bridge_factory.create.assert_called_once_with('table')
+
+    def test_can_measure_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (
+            mock.Mock(), mock.Mock(spec=BaseBackend))
+        metrics = mock.Mock(spec=MetricsHook)
+        session = AsyncSession(
+            'table', backend_bridge_factory=bridge_factory, metrics=metrics)
+        lock = session.create_lock('foo')
+        assert lock._technique._core._metrics is metrics
+        backend = lock._technique._backend
+        assert isinstance(backend._backend, InstrumentedBackend)
+
+    def test_does_not_wrap_async_backend(self):
+        backend = AsyncBaseBackend()
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), backend)
+        session = AsyncSession('table', backend_bridge_factory=bridge_factory)
+        lock = session.create_lock('foo')
+        assert lock._technique._backend is backend
+
+    def test_can_create_lock_without_refresher(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = AsyncSession('table', backend_bridge_factory=bridge_factory)
+        lock = session.create_lock('foo', auto_refresh=False)
+        assert lock._refresher_factory is None
+
+    def test_can_deserialize_lock(self):
+        sync_backend = mock.Mock(spec=BaseBackend)
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), sync_backend)
+        session = AsyncSession('table', backend_bridge_factory=bridge_factory)
+        serialized = json.dumps({
+            '__version': 'Lock.1',
+            'name': 'foo',
+            'technique': json.dumps({
+                '__version': 'VersionLeaseTechinque.1',
+                'versions': {'foo': 'version'},
+                'leases': {'foo': 20},
+            }),
+        })
+        lock = run(session.deserialize_lock(serialized, auto_refresh=False))
+        assert isinstance(lock, AsyncLock)
+        # Deserializing refreshes the lock.
+        sync_backend.update.assert_called_once()
@@ -0,0 +1,341 @@
+import json
+import asyncio
+
+import pytest
+import mock
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.dynamodb import DynamoDBVersionLeaseBridge
+from lynk.techniques import VersionLeaseTechinque
+from lynk.metrics import MetricsHook
+from lynk.exceptions import NoSuchLockError
+from lynk.exceptions import LockLostError
+from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import TransactionConflictError
+from lynk.aio.backends import AsyncBaseBackend
+from lynk.aio.techniques import AsyncVersionLeaseTechnique
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class ConditionFailedError(Exception):
+    pass
+
+
+class MockAsyncBackend(AsyncBaseBackend):
+    """Forwards every call to a synchronous mock so it can be asserted on."""
+    def __init__(self):
+        self.mock = mock.Mock(spec=BaseBackend)
+
+    async def put(self, item, condition=None):
+        return self.mock.put(item, condition=condition)
+
+    async def update(self, key, updates, condition=None):
+        return self.mock.update(key, updates=updates, condition=condition)
+
+    async def delete(self, key, condition=None):
+        return self.mock.delete(key, condition=condition)
+
+    async def get(self, key, attributes, consistent=True):
+        return self.mock.get(key, attributes=attributes,
+                             consistent=consistent)
+
+    async def transact_write(self, operations):
+        return self.mock.transact_write(operations)
+
+
+class FakeAsyncTime(object):
+    def __init__(self, times=None, perf_counters=None):
+        if times is None:
+            times = []
+        if perf_counters is None:
+            perf_counters = []
+        self._times = times
+        self._perf_counters = perf_counters
+        self.sleeps = []
+
+    def time(self):
+        if self._times:
+            return self._times.pop(0)
+        return 1
+
+    def perf_counter(self):
+        if self._perf_counters:
+            return self._perf_counters.pop(0)
+        return 0
+
+    async def sleep(self, amt):
+        self.sleeps.append(amt)
+
+
+@pytest.fixture
+def async_technique_factory():
+    def wrapped(times=None, poll_with_reads=False, metrics=None,
+                perf_counters=None):
+        bridge = mock.Mock(spec=DynamoDBVersionLeaseBridge)
+        bridge.ConditionFailedError = ConditionFailedError
+        backend = MockAsyncBackend()
+        fake_time = FakeAsyncTime(times, perf_counters)
+        technique = AsyncVersionLeaseTechnique(
+            bridge, backend, host_identifier='host', time_utils=fake_time,
+            poll_with_reads=poll_with_reads, metrics=metrics)
+        return technique, bridge, backend.mock, fake_time
+    return wrapped
+
+
+class TestAsyncVersionLeaseTechnique(object):
+    def test_does_support_transactions_if_backend_does(
+            self, async_technique_factory):
+        technique, _, _, _ = async_technique_factory()
+        assert technique.SUPPORTS_TRANSACTIONS is False
+        technique._backend.SUPPORTS_TRANSACTIONS = True
+        assert technique.SUPPORTS_TRANSACTIONS is True
+
+    def test_can_acquire_lock(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        bridge.lock_free.return_value = 'lock free'
+        run(technique.acquire('lock name', 20, 10))
+        backend.put.assert_called_once_with(
+            {
+                'lockKey': 'lock name',
+                'leaseDuration': 20,
+                'hostIdentifier': 'host',
+                'versionNumber': mock.ANY,
+                'writeTime': mock.ANY,
+                'expiresAt': mock.ANY,
+                'deleteAfter': mock.ANY,
+            },
+            condition='lock free',
+        )
+        assert 'lock name' in technique._core._versions
+
+    def test_does_wait_and_steal_lock(self, async_technique_factory):
+        technique, bridge, backend, time = async_technique_factory()
+        bridge.lock_free_or_expired.return_value = 'lock free or expired'
+        error = ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, {}]
+        run(technique.acquire('lock name', 20, 10))
+        assert time.sleeps == [5]
+        assert backend.put.call_args[1]['condition'] == 'lock free or expired'
+        bridge.lock_free_or_expired.assert_called_once_with(
+            'existing_version')
+
+    def test_does_look_up_lock_info(self, async_technique_factory):
+        technique, bridge, backend, time = async_technique_factory()
+        backend.put.side_effect = [ConditionFailedError(), {}]
+        backend.get.return_value = {
+            'leaseDuration': 3,
+            'versionNumber': 'existing_version',
+        }
+        run(technique.acquire('lock name', 20, 10))
+        assert time.sleeps == [3]
+        backend.get.assert_called_once_with(
+            {'lockKey': 'lock name'},
+            attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            consistent=True,
+        )
+
+    def test_can_poll_with_reads(self, async_technique_factory):
+        technique, bridge, backend, time = async_technique_factory(
+            poll_with_reads=True)
+        bridge.lock_free.return_value = 'lock free'
+        error = ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, {}]
+        backend.get.return_value = None
+        run(technique.acquire('lock name', 20, 10))
+        assert backend.get.call_args[1]['consistent'] is False
+        assert backend.put.call_args[1]['condition'] == 'lock free'
+
+    def test_timeout_does_raise(self, async_technique_factory):
+        technique, bridge, backend, time = async_technique_factory()
+        error = ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = error
+        with pytest.raises(LockNotGrantedError):
+            run(technique.acquire('lock name', 20, 10))
+
+    def test_does_give_up_at_deadline(self, async_technique_factory):
+        technique, bridge, backend, fake_time = async_technique_factory()
+        error = ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = error
+        # The technique's clock reads 1, leaving 10 seconds to wait.
+        with pytest.raises(LockNotGrantedError):
+            run(technique.acquire('lock name', 20, 300, deadline=11))
+        assert fake_time.sleeps == []
+
+    def test_can_try_acquire(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        assert run(technique.try_acquire('lock name', 20)) is True
+        backend.put.side_effect = ConditionFailedError()
+        assert run(technique.try_acquire('other lock', 20)) is False
+        assert list(technique._core._versions) == ['lock name']
+
+    def test_can_release_lock(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        bridge.we_own_lock.return_value = 'we own lock'
+        run(technique.acquire('lock name', 20, 10))
+        run(technique.release('lock name'))
+        backend.delete.assert_called_once_with(
+            {'lockKey': 'lock name'}, condition='we own lock')
+        assert technique._core._versions == {}
+
+    def test_release_lost_lock_does_raise(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        run(technique.acquire('lock name', 20, 10))
+        backend.delete.side_effect = ConditionFailedError()
+        with pytest.raises(LockLostError):
+            run(technique.release('lock name'))
+
+    def test_lost_lock_release_is_measured(self, async_technique_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, bridge, backend, _ = async_technique_factory(
+            metrics=metrics)
+        run(technique.acquire('lock name', 20, 10))
+        backend.delete.side_effect = ConditionFailedError()
+        with pytest.raises(LockLostError):
+            run(technique.release('lock name'))
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+
+    def test_release_unacquired_lock_does_raise(
+            self, async_technique_factory):
+        technique, _, _, _ = async_technique_factory()
+        with pytest.raises(NoSuchLockError):
+            run(technique.release('lock name'))
+
+    def test_can_refresh_lock(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        run(technique.acquire('lock name', 20, 10))
+        version = technique._core._versions['lock name']
+        run(technique.refresh('lock name'))
+        bridge.we_own_lock.assert_called_with(version)
+        new_version = backend.update.call_args[1]['updates']['versionNumber']
+        assert technique._core._versions['lock name'] == new_version
+
+    def test_refresh_lost_lock_does_raise(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        run(technique.acquire('lock name', 20, 10))
+        backend.update.side_effect = ConditionFailedError()
+        with pytest.raises(LockLostError):
+            run(technique.refresh('lock name'))
+
+    def test_lost_lock_refresh_is_measured(self, async_technique_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, bridge, backend, _ = async_technique_factory(
+            metrics=metrics)
+        run(technique.acquire('lock name', 20, 10))
+        backend.update.side_effect = ConditionFailedError()
+        with pytest.raises(LockLostError):
+            run(technique.refresh('lock name'))
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+
+    def test_acquire_is_measured(self, async_technique_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, _, _, _ = async_technique_factory(
+            perf_counters=[0, 2], metrics=metrics)
+        run(technique.acquire('lock name', 20, 10))
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 2, 0)
+
+    def test_does_not_inherit_blocking_methods(
+            self, async_technique_factory):
+        technique, _, _, _ = async_technique_factory()
+        assert not isinstance(technique, VersionLeaseTechinque)
+        assert asyncio.iscoroutinefunction(technique.acquire)
+        assert asyncio.iscoroutinefunction(technique.refresh)
+
+    def test_can_acquire_and_release_many(self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        run(technique.acquire_many(['b', 'a'], 20, 10))
+        puts = backend.transact_write.call_args[0][0]
+        assert [put.item['lockKey'] for put in puts] == ['a', 'b']
+        assert technique._core._versions == {
+            put.item['lockKey']: put.item['versionNumber'] for put in puts
+        }
+        run(technique.release_many(['a', 'b']))
+        deletes = backend.transact_write.call_args[0][0]
+        assert [delete.key for delete in deletes] == [
+            {'lockKey': 'a'}, {'lockKey': 'b'}]
+        assert technique._core._versions == {}
+
+    def test_acquire_many_does_wait_for_locks_in_use(
+            self, async_technique_factory):
+        technique, bridge, backend, fake_time = async_technique_factory()
+        backend.transact_write.side_effect = [
+            TransactionConflictError([1], {
+                1: {'leaseDuration': 5, 'versionNumber': 'prior'},
+            }),
+            None,
+        ]
+        run(technique.acquire_many(['a', 'b'], 20, 10))
+        assert fake_time.sleeps == [5]
+        assert backend.transact_write.call_count == 2
+        # Having waited out its lease, the prior version can be replaced.
+        bridge.lock_free_or_expired.assert_called_once_with('prior')
+        assert sorted(technique._core._versions) == ['a', 'b']
+
+    def test_acquire_many_does_time_out(self, async_technique_factory):
+        technique, _, backend, _ = async_technique_factory()
+        backend.transact_write.side_effect = TransactionConflictError([0], {
+            0: {'leaseDuration': 20, 'versionNumber': 'prior'},
+        })
+        with pytest.raises(LockNotGrantedError):
+            run(technique.acquire_many(['a', 'b'], 20, 10))
+        assert technique._core._versions == {}
+
+    def test_refresh_many_does_refresh_the_rest_of_lost_locks(
+            self, async_technique_factory):
+        technique, _, backend, _ = async_technique_factory()
+        run(technique.acquire_many(['a', 'b'], 20, 10))
+        backend.transact_write.side_effect = [
+            TransactionConflictError([0]), None]
+        with pytest.raises(LockLostError):
+            run(technique.refresh_many(['a', 'b']))
+        updates = backend.transact_write.call_args[0][0]
+        assert [update.key for update in updates] == [{'lockKey': 'b'}]
+
+    def test_can_deserialize_sync_technique(self, async_technique_factory):
+        _, bridge, _, _ = async_technique_factory()
+        sync_technique = VersionLeaseTechinque(
+            bridge, mock.Mock(spec=BaseBackend))
+        sync_technique._versions = {'lock name': 'version'}
+        backend = MockAsyncBackend()
+        backend.mock.get.return_value = {'leaseDuration': 20}
+        technique = AsyncVersionLeaseTechnique.from_serialized_technique(
+            sync_technique.serialize(), bridge, backend)
+        run(technique.refresh('lock name'))
+        bridge.we_own_lock.assert_called_with('version')
+        # The lease duration was not serialized, so it is looked up once.
+        backend.mock.get.assert_called_once_with(
+            {'lockKey': 'lock name'}, attributes=['leaseDuration'],
+            consistent=True)
+        assert json.loads(technique.serialize())['leases'] == {
+            'lock name': 20,
+        }
+
+    def test_prepare_refresh_of_missing_lock_does_raise(
+            self, async_technique_factory):
+        technique, bridge, backend, _ = async_technique_factory()
+        technique._core._versions = {'lock name': 'version'}
+        backend.get.return_value = None
+        with pytest.raises(LockLostError):
+            run(technique.prepare_refresh('lock name'))
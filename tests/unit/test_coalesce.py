@@ -0,0 +1,128 @@
+import threading
+
+from lynk.coalesce import LocalWaitQueue
+from lynk.coalesce import Waiter
+
+
+class TestLocalWaitQueue(object):
+    def test_first_waiter_is_representative(self):
+        queue = LocalWaitQueue()
+        waiter = queue.join('lock', 10)
+        assert waiter.state == Waiter.REPRESENTATIVE
+        assert queue.wait(waiter, 0) == Waiter.REPRESENTATIVE
+
+    def test_second_waiter_does_wait(self):
+        queue = LocalWaitQueue()
+        queue.join('lock', 10)
+        waiter = queue.join('lock', 10)
+        assert waiter.state is None
+
+    def test_waiters_of_other_locks_are_representatives(self):
+        queue = LocalWaitQueue()
+        queue.join('lock', 10)
+        waiter = queue.join('other lock', 10)
+        assert waiter.state == Waiter.REPRESENTATIVE
+
+    def test_can_hand_off_to_next_waiter(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        first = queue.join('lock', 10)
+        second = queue.join('lock', 10)
+
+        claimed = queue.claim_next(holder)
+        assert claimed is first
+        queue.handed_off(holder, first, 'new version')
+
+        assert first.state == Waiter.HANDED_OFF
+        assert first.version_number == 'new version'
+        assert second.state is None
+        assert queue.claim_next(first) is second
+
+    def test_does_not_claim_without_waiters(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        assert queue.claim_next(holder) is None
+        assert queue.join('lock', 10).state == Waiter.REPRESENTATIVE
+
+    def test_does_not_claim_for_old_holder(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        queue.handed_off(holder, queue.claim_next(holder), 'version')
+        queue.join('lock', 10)
+        assert queue.claim_next(holder) is None
+        assert waiter.state == Waiter.HANDED_OFF
+
+    def test_failed_hand_off_does_promote_waiter(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        queue.hand_off_failed(holder, queue.claim_next(holder))
+        assert waiter.state == Waiter.REPRESENTATIVE
+
+    def test_representative_leaving_does_promote_next(self):
+        queue = LocalWaitQueue()
+        representative = queue.join('lock', 10)
+        waiter = queue.join('lock', 10)
+        assert queue.leave(representative) is True
+        assert waiter.state == Waiter.REPRESENTATIVE
+
+    def test_claimed_waiter_cannot_leave(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        queue.claim_next(holder)
+        assert queue.leave(waiter) is False
+
+    def test_wait_does_time_out(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        assert queue.wait(waiter, 0.01) is None
+        assert queue.claim_next(holder) is None
+
+    def test_does_promote_waiter_after_holders_lease(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 0.01)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        assert queue.wait(waiter, 5) == Waiter.REPRESENTATIVE
+
+    def test_does_wake_waiter_on_hand_off(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(queue.wait(waiter, 10)))
+        thread.start()
+        queue.handed_off(holder, queue.claim_next(holder), 'version')
+        thread.join(5)
+        assert results == [Waiter.HANDED_OFF]
+
+    def test_can_cancel_wait(self):
+        queue = LocalWaitQueue()
+        holder = queue.join('lock', 10)
+        queue.acquired(holder)
+        waiter = queue.join('lock', 10)
+        event = threading.Event()
+        event.set()
+        assert queue.wait(waiter, 10, event) is None
+        assert queue.claim_next(holder) is None
+
+    def test_can_try_join(self):
+        queue = LocalWaitQueue()
+        representative = queue.try_join('lock', 10)
+        assert representative.state == Waiter.REPRESENTATIVE
+        assert queue.try_join('lock', 10) is None
+        queue.acquired(representative)
+        assert queue.try_join('lock', 10) is None
+        assert queue.claim_next(representative) is None
+        assert queue.try_join('lock', 10) is not None
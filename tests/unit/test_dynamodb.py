@@ -7,6 +7,11 @@ from lynk.backends.dynamodb import DynamoDBBackend
 from lynk.backends.dynamodb import DynamoDBControl
 from lynk.backends.dynamodb import DynamoDBVersionLeaseBridge
 from lynk.backends.dynamodb import DynamoDBBackendBridgeFactory
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
+from lynk.exceptions import TransactionConflictError
+from lynk.utils import TimeUtils
 
 
 class ResourceNotFoundException(Exception):
@@ -17,10 +22,24 @@ class ConditionalCheckFailedException(Exception):
     pass
 
 
+class TransactionCanceledException(Exception):
+    def __init__(self, reasons):
+        self.response = {'CancellationReasons': reasons}
+
+
 class Exceptions(object):
     def __init__(self):
         self.ResourceNotFoundException = ResourceNotFoundException
         self.ConditionalCheckFailedException = ConditionalCheckFailedException
+        self.TransactionCanceledException = TransactionCanceledException
+
+
+def _expired(name, version):
+    return {
+        'lockKey': {'S': name},
+        'versionNumber': {'S': version},
+        'expiresAt': {'N': '1000'},
+    }
 
 
 @pytest.fixture
@@ -39,6 +58,8 @@ def ddb_control_factory():
 def backend_factory():
     def wrapped():
         mock_table = mock.Mock()
+        mock_table.name = 'table_name'
+        mock_table.meta.client.exceptions = Exceptions()
         backend = DynamoDBBackend(mock_table)
         return mock_table, backend
     return wrapped
@@ -102,6 +123,58 @@ class TestControlPlane(object):
         )
         mock_client.get_waiter.assert_called_with('table_exists')
         mock_waiter.wait.assert_called_with(TableName='table_name')
+        mock_client.update_time_to_live.assert_called_with(
+            TableName='table_name',
+            TimeToLiveSpecification={
+                'Enabled': True,
+                'AttributeName': 'deleteAfter',
+            },
+        )
+
+    def test_can_collect_garbage(self, ddb_control_factory):
+        session = mock.Mock(spec=Session)
+        mock_client = mock.Mock()
+        mock_client.exceptions = Exceptions()
+        session.client.return_value = mock_client
+        time_utils = mock.Mock(spec=TimeUtils)
+        time_utils.time.return_value = 10000
+        control = DynamoDBControl('table_name', session, time_utils)
+
+        def scan(**kwargs):
+            if kwargs['Segment'] == 1:
+                return {'Items': []}
+            if 'ExclusiveStartKey' not in kwargs:
+                return {
+                    'Items': [_expired('foo', 'a')],
+                    'LastEvaluatedKey': {'lockKey': {'S': 'foo'}},
+                }
+            return {'Items': [_expired('bar', 'b'), _expired('baz', 'c')]}
+
+        mock_client.scan.side_effect = scan
+        mock_client.delete_item.side_effect = [
+            None, ConditionalCheckFailedException(), None]
+        assert control.collect_garbage(older_than=600, segments=2) == 2
+
+        scans = [c[1] for c in mock_client.scan.call_args_list]
+        assert sorted((c['Segment'], c['TotalSegments']) for c in scans) == [
+            (0, 2), (0, 2), (1, 2)]
+        assert scans[0]['FilterExpression'] == '#expiresAt < :cutoff'
+        assert scans[0]['ExpressionAttributeValues'] == {
+            ':cutoff': {'N': '9400000'}}
+        mock_client.delete_item.assert_any_call(
+            TableName='table_name',
+            Key={'lockKey': {'S': 'foo'}},
+            ConditionExpression=(
+                '#versionNumber = :versionNumber AND #expiresAt < :cutoff'),
+            ExpressionAttributeNames={
+                '#versionNumber': 'versionNumber',
+                '#expiresAt': 'expiresAt',
+            },
+            ExpressionAttributeValues={
+                ':versionNumber': {'S': 'a'},
+                ':cutoff': {'N': '9400000'},
+            },
+        )
 
     def test_can_destroy_table(self, ddb_control_factory):
         session = mock.Mock(spec=Session)
@@ -154,6 +227,36 @@ class TestDynamoDBBackendBridgeFactory(object):
         assert isinstance(bridge, DynamoDBVersionLeaseBridge)
         assert isinstance(backend, DynamoDBBackend)
 
+    def test_does_share_resource_between_creates(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBBackendBridgeFactory(session=mock_session)
+        factory.create('table_name')
+        factory.create('other_table_name')
+        mock_session.resource.assert_called_once_with(
+            'dynamodb', config=mock.ANY)
+
+    def test_can_configure_max_pool_connections(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBBackendBridgeFactory(
+            session=mock_session,
+            max_pool_connections=50,
+        )
+        factory.create('table_name')
+        config = mock_session.resource.call_args[1]['config']
+        assert config.max_pool_connections == 50
+        assert config.retries is None
+
+    def test_can_limit_botocore_attempts(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBBackendBridgeFactory(
+            session=mock_session,
+            max_attempts=1,
+        )
+        factory.create('table_name')
+        config = mock_session.resource.call_args[1]['config']
+        assert config.retries == {'total_max_attempts': 1}
+        assert config.max_pool_connections == 10
+
 
 class TestDyanmoDBBackend(object):
     def test_can_put(self, backend_factory):
@@ -171,8 +274,35 @@ class TestDyanmoDBBackend(object):
         table.put_item.assert_called_with(
             Item={'key': 'value'},
             ConditionExpression='foo',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD',
         )
 
+    def test_failed_put_does_attach_existing_item(self, backend_factory):
+        table, backend = backend_factory()
+        error = ConditionalCheckFailedException()
+        error.response = {
+            'Item': {
+                'versionNumber': {'S': 'version'},
+                'leaseDuration': {'N': '20'},
+            },
+        }
+        table.put_item.side_effect = error
+        with pytest.raises(ConditionalCheckFailedException) as e:
+            backend.put({'key': 'value'}, condition='foo')
+        assert e.value.existing_item == {
+            'versionNumber': 'version',
+            'leaseDuration': 20,
+        }
+
+    def test_failed_put_without_item_does_attach_none(self, backend_factory):
+        table, backend = backend_factory()
+        error = ConditionalCheckFailedException()
+        error.response = {}
+        table.put_item.side_effect = error
+        with pytest.raises(ConditionalCheckFailedException) as e:
+            backend.put({'key': 'value'}, condition='foo')
+        assert e.value.existing_item is None
+
     def test_can_update(self, backend_factory):
         table, backend = backend_factory()
         backend.update({'key': 'value'}, updates={'attribute': 'new value'})
@@ -251,6 +381,27 @@ class TestDyanmoDBBackend(object):
         )
         assert result == {'foo': 'bar'}
 
+    def test_can_get_eventually_consistent(self, backend_factory):
+        table, backend = backend_factory()
+        table.get_item.return_value = {}
+        backend.get({'key': 'value'}, attributes=['foo'], consistent=False)
+
+        table.get_item.assert_called_with(
+            Key={'key': 'value'},
+            AttributesToGet=['foo'],
+            ConsistentRead=False,
+        )
+
+    def test_can_get_missing_attributes(self, backend_factory):
+        table, backend = backend_factory()
+        table.get_item.return_value = {
+            'Item': {
+                'foo': 'bar',
+            }
+        }
+        result = backend.get({'key': 'value'}, attributes=['foo', 'baz'])
+        assert result == {'foo': 'bar'}
+
     def test_can_get_no_result(self, backend_factory):
         table, backend = backend_factory()
         table.get_item.return_value = {}
@@ -263,6 +414,103 @@ class TestDyanmoDBBackend(object):
         )
         assert result is None
 
+    def test_can_transact_write(self, backend_factory):
+        table, backend = backend_factory()
+        backend.transact_write([
+            Put({'key': 'value'}, None),
+            Update({'key': 'value'}, {'attribute': 'new value'},
+                   Attr('attribute').eq('old value')),
+            Delete({'key': 'value'}, Attr('key').not_exists()),
+        ])
+
+        table.meta.client.transact_write_items.assert_called_with(
+            TransactItems=[
+                {
+                    'Put': {
+                        'TableName': 'table_name',
+                        'Item': {'key': 'value'},
+                    },
+                },
+                {
+                    'Update': {
+                        'TableName': 'table_name',
+                        'Key': {'key': 'value'},
+                        'UpdateExpression': 'set attribute = :a',
+                        'ConditionExpression': '#n0 = :v0',
+                        'ExpressionAttributeNames': {'#n0': 'attribute'},
+                        'ExpressionAttributeValues': {
+                            ':a': 'new value',
+                            ':v0': 'old value',
+                        },
+                    },
+                },
+                {
+                    'Delete': {
+                        'TableName': 'table_name',
+                        'Key': {'key': 'value'},
+                        'ConditionExpression': 'attribute_not_exists(#n0)',
+                        'ExpressionAttributeNames': {'#n0': 'key'},
+                    },
+                },
+            ],
+        )
+
+    def test_transact_write_does_raise_conflict(self, backend_factory):
+        table, backend = backend_factory()
+        table.meta.client.transact_write_items.side_effect = \
+            TransactionCanceledException([
+                {'Code': 'None'},
+                {'Code': 'ConditionalCheckFailed'},
+            ])
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Delete({'key': 'a'}, None),
+                Delete({'key': 'b'}, None),
+            ])
+        assert e.value.failed_indexes == [1]
+
+    def test_transact_write_does_return_existing_items(
+            self, backend_factory):
+        table, backend = backend_factory()
+        table.meta.client.transact_write_items.side_effect = \
+            TransactionCanceledException([
+                {'Code': 'None'},
+                {
+                    'Code': 'ConditionalCheckFailed',
+                    'Item': {
+                        'lockKey': {'S': 'b'},
+                        'leaseDuration': {'N': '20'},
+                    },
+                },
+            ])
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Put({'lockKey': 'a'}, Attr('lockKey').not_exists()),
+                Put({'lockKey': 'b'}, Attr('lockKey').not_exists()),
+            ])
+        assert e.value.failed_indexes == [1]
+        assert e.value.existing_items == {
+            1: {'lockKey': 'b', 'leaseDuration': 20},
+        }
+        items = table.meta.client.transact_write_items.call_args[1][
+            'TransactItems']
+        assert items[0]['Put']['ReturnValuesOnConditionCheckFailure'] == \
+            'ALL_OLD'
+
+    def test_transact_write_does_reraise_other_cancellations(
+            self, backend_factory):
+        table, backend = backend_factory()
+        table.meta.client.transact_write_items.side_effect = \
+            TransactionCanceledException([
+                {'Code': 'None'},
+                {'Code': 'TransactionConflict'},
+            ])
+        with pytest.raises(TransactionCanceledException):
+            backend.transact_write([
+                Delete({'key': 'a'}, None),
+                Delete({'key': 'b'}, None),
+            ])
+
 
 class TestDynamoDBVersionLeaseBridge(object):
     def test_lock_free(self):
@@ -277,6 +525,12 @@ class TestDynamoDBVersionLeaseBridge(object):
         expr = bridge.lock_expired('version')
         assert expr == Attr('versionNumber').eq('version')
 
+    def test_lock_unchanged(self):
+        mock_resource = mock.Mock()
+        bridge = DynamoDBVersionLeaseBridge(mock_resource)
+        expr = bridge.lock_unchanged('version')
+        assert expr == Attr('versionNumber').eq('version')
+
     def test_lock_free_or_expired(self):
         mock_resource = mock.Mock()
         bridge = DynamoDBVersionLeaseBridge(mock_resource)
@@ -285,6 +539,20 @@ class TestDynamoDBVersionLeaseBridge(object):
             Attr('lockKey').not_exists() | Attr('versionNumber').eq('version')
         )
 
+    def test_lease_elapsed(self):
+        mock_resource = mock.Mock()
+        bridge = DynamoDBVersionLeaseBridge(mock_resource)
+        expr = bridge.lease_elapsed(1000)
+        assert expr == Attr('expiresAt').lt(1000)
+
+    def test_lock_free_or_lease_elapsed(self):
+        mock_resource = mock.Mock()
+        bridge = DynamoDBVersionLeaseBridge(mock_resource)
+        expr = bridge.lock_free_or_lease_elapsed(1000)
+        assert expr == (
+            Attr('lockKey').not_exists() | Attr('expiresAt').lt(1000)
+        )
+
     def test_we_own_lock(self):
         mock_resource = mock.Mock()
         bridge = DynamoDBVersionLeaseBridge(mock_resource)
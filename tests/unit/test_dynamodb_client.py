@@ -0,0 +1,291 @@
+from decimal import Decimal
+
+import pytest
+import mock
+from boto3.session import Session
+
+from lynk.backends.dynamodb_client import ClientCondition
+from lynk.backends.dynamodb_client import DynamoDBClientBackend
+from lynk.backends.dynamodb_client import DynamoDBClientVersionLeaseBridge
+from lynk.backends.dynamodb_client import DynamoDBClientBackendBridgeFactory
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
+from lynk.exceptions import TransactionConflictError
+
+
+class ResourceNotFoundException(Exception):
+    pass
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class TransactionCanceledException(Exception):
+    def __init__(self, reasons):
+        self.response = {'CancellationReasons': reasons}
+
+
+class Exceptions(object):
+    def __init__(self):
+        self.ResourceNotFoundException = ResourceNotFoundException
+        self.ConditionalCheckFailedException = ConditionalCheckFailedException
+        self.TransactionCanceledException = TransactionCanceledException
+
+
+@pytest.fixture
+def backend_factory():
+    def wrapped():
+        mock_client = mock.Mock()
+        mock_client.exceptions = Exceptions()
+        bridge = DynamoDBClientVersionLeaseBridge(mock_client)
+        backend = DynamoDBClientBackend(mock_client, 'table_name')
+        return mock_client, bridge, backend
+    return wrapped
+
+
+class TestDynamoDBClientBackendBridgeFactory(object):
+    def test_can_create(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBClientBackendBridgeFactory()
+        bridge, backend = factory.create('table_name', session=mock_session)
+        assert isinstance(bridge, DynamoDBClientVersionLeaseBridge)
+        assert isinstance(backend, DynamoDBClientBackend)
+
+    def test_does_share_client_between_creates(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBClientBackendBridgeFactory(session=mock_session)
+        factory.create('table_name')
+        factory.create('other_table_name')
+        mock_session.client.assert_called_once_with(
+            'dynamodb', config=mock.ANY)
+
+    def test_does_disable_parameter_validation(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBClientBackendBridgeFactory(
+            session=mock_session,
+            max_pool_connections=50,
+        )
+        factory.create('table_name')
+        config = mock_session.client.call_args[1]['config']
+        assert config.max_pool_connections == 50
+        assert config.parameter_validation is False
+        assert config.retries is None
+
+    def test_can_limit_botocore_attempts(self):
+        mock_session = mock.Mock(spec=Session)
+        factory = DynamoDBClientBackendBridgeFactory(
+            session=mock_session,
+            max_attempts=1,
+        )
+        factory.create('table_name')
+        config = mock_session.client.call_args[1]['config']
+        assert config.retries == {'total_max_attempts': 1}
+        assert config.parameter_validation is False
+
+
+class TestDynamoDBClientBackend(object):
+    def test_can_put(self, backend_factory):
+        client, _, backend = backend_factory()
+        backend.put({'lockKey': 'foo', 'leaseDuration': 20,
+                     'holders': {'a': 1000}})
+
+        client.put_item.assert_called_with(
+            TableName='table_name',
+            Item={
+                'lockKey': {'S': 'foo'},
+                'leaseDuration': {'N': '20'},
+                'holders': {'M': {'a': {'N': '1000'}}},
+            },
+        )
+
+    def test_can_put_with_condition(self, backend_factory):
+        client, bridge, backend = backend_factory()
+        backend.put({'lockKey': 'foo'},
+                    condition=bridge.lock_free_or_lease_elapsed(1000))
+
+        client.put_item.assert_called_with(
+            TableName='table_name',
+            Item={'lockKey': {'S': 'foo'}},
+            ConditionExpression=(
+                'attribute_not_exists(#lockKey) OR #expiresAt < :expiresAt'),
+            ExpressionAttributeNames={
+                '#lockKey': 'lockKey', '#expiresAt': 'expiresAt'},
+            ExpressionAttributeValues={':expiresAt': {'N': '1000'}},
+            ReturnValuesOnConditionCheckFailure='ALL_OLD',
+        )
+
+    def test_failed_put_does_attach_existing_item(self, backend_factory):
+        client, bridge, backend = backend_factory()
+        error = ConditionalCheckFailedException()
+        error.response = {
+            'Item': {
+                'versionNumber': {'S': 'version'},
+                'leaseDuration': {'N': '20'},
+            },
+        }
+        client.put_item.side_effect = error
+        with pytest.raises(ConditionalCheckFailedException) as e:
+            backend.put({'lockKey': 'foo'}, condition=bridge.lock_free())
+        assert e.value.existing_item == {
+            'versionNumber': 'version',
+            'leaseDuration': 20,
+        }
+
+    def test_can_update_with_condition(self, backend_factory):
+        client, bridge, backend = backend_factory()
+        backend.update(
+            {'lockKey': 'foo'},
+            updates={'versionNumber': 'b', 'expiresAt': 2000},
+            condition=bridge.we_own_lock('a'),
+        )
+
+        client.update_item.assert_called_with(
+            TableName='table_name',
+            Key={'lockKey': {'S': 'foo'}},
+            UpdateExpression='SET #u0 = :u0, #u1 = :u1',
+            ConditionExpression='#versionNumber = :versionNumber',
+            ExpressionAttributeNames={
+                '#versionNumber': 'versionNumber',
+                '#u0': 'versionNumber',
+                '#u1': 'expiresAt',
+            },
+            ExpressionAttributeValues={
+                ':u0': {'S': 'b'},
+                ':u1': {'N': '2000'},
+                ':versionNumber': {'S': 'a'},
+            },
+        )
+
+    def test_does_reuse_compiled_templates(self, backend_factory):
+        client, bridge, backend = backend_factory()
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'},
+                       condition=bridge.we_own_lock('a'))
+        backend.update({'lockKey': 'bar'}, {'versionNumber': 'c'},
+                       condition=bridge.we_own_lock('b'))
+        first, second = client.update_item.call_args_list
+        assert first[1]['UpdateExpression'] is \
+            second[1]['UpdateExpression']
+        assert second[1]['ExpressionAttributeValues'] == {
+            ':u0': {'S': 'c'}, ':versionNumber': {'S': 'b'}}
+
+    def test_can_delete(self, backend_factory):
+        client, _, backend = backend_factory()
+        backend.delete({'lockKey': 'foo'})
+
+        client.delete_item.assert_called_with(
+            TableName='table_name',
+            Key={'lockKey': {'S': 'foo'}},
+        )
+
+    def test_can_get(self, backend_factory):
+        client, _, backend = backend_factory()
+        client.get_item.return_value = {
+            'Item': {
+                'versionNumber': {'S': 'a'},
+                'expiresAt': {'N': '1000'},
+            },
+        }
+        result = backend.get({'lockKey': 'foo'},
+                             ['versionNumber', 'expiresAt'],
+                             consistent=False)
+
+        client.get_item.assert_called_with(
+            TableName='table_name',
+            Key={'lockKey': {'S': 'foo'}},
+            ProjectionExpression='#p0, #p1',
+            ExpressionAttributeNames={
+                '#p0': 'versionNumber', '#p1': 'expiresAt'},
+            ConsistentRead=False,
+        )
+        assert result == {'versionNumber': 'a', 'expiresAt': 1000}
+        assert isinstance(result['expiresAt'], Decimal)
+
+    def test_can_get_no_result(self, backend_factory):
+        client, _, backend = backend_factory()
+        client.get_item.return_value = {}
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) is None
+
+    def test_can_transact_write(self, backend_factory):
+        client, bridge, backend = backend_factory()
+        backend.transact_write([
+            Put({'lockKey': 'a'}, bridge.lock_free()),
+            Update({'lockKey': 'b'}, {'expiresAt': 10},
+                   bridge.we_own_lock('v')),
+            Delete({'lockKey': 'c'}, None),
+        ])
+
+        client.transact_write_items.assert_called_with(TransactItems=[
+            {'Put': {
+                'TableName': 'table_name',
+                'Item': {'lockKey': {'S': 'a'}},
+                'ConditionExpression': 'attribute_not_exists(#lockKey)',
+                'ExpressionAttributeNames': {'#lockKey': 'lockKey'},
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+            }},
+            {'Update': {
+                'TableName': 'table_name',
+                'Key': {'lockKey': {'S': 'b'}},
+                'UpdateExpression': 'SET #u0 = :u0',
+                'ConditionExpression': '#versionNumber = :versionNumber',
+                'ExpressionAttributeNames': {
+                    '#versionNumber': 'versionNumber', '#u0': 'expiresAt'},
+                'ExpressionAttributeValues': {
+                    ':u0': {'N': '10'}, ':versionNumber': {'S': 'v'}},
+            }},
+            {'Delete': {
+                'TableName': 'table_name',
+                'Key': {'lockKey': {'S': 'c'}},
+            }},
+        ])
+
+    def test_transact_write_does_return_existing_items(
+            self, backend_factory):
+        client, bridge, backend = backend_factory()
+        client.transact_write_items.side_effect = \
+            TransactionCanceledException([
+                {'Code': 'None'},
+                {
+                    'Code': 'ConditionalCheckFailed',
+                    'Item': {'lockKey': {'S': 'b'}},
+                },
+            ])
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Put({'lockKey': 'a'}, bridge.lock_free()),
+                Put({'lockKey': 'b'}, bridge.lock_free()),
+            ])
+        assert e.value.failed_indexes == [1]
+        assert e.value.existing_items == {1: {'lockKey': 'b'}}
+
+    def test_transact_write_does_reraise_other_cancellations(
+            self, backend_factory):
+        client, _, backend = backend_factory()
+        client.transact_write_items.side_effect = \
+            TransactionCanceledException([{'Code': 'TransactionConflict'}])
+        with pytest.raises(TransactionCanceledException):
+            backend.transact_write([Delete({'lockKey': 'a'}, None)])
+
+
+class TestClientCondition(object):
+    def test_can_combine_conditions(self):
+        bridge = DynamoDBClientVersionLeaseBridge(mock.Mock())
+        condition = bridge.lock_expired('a') | bridge.lease_elapsed(10)
+        assert condition.expression == (
+            '(#versionNumber = :versionNumber) OR (#expiresAt < :expiresAt)')
+        assert condition.names == {
+            '#versionNumber': 'versionNumber', '#expiresAt': 'expiresAt'}
+        assert condition.values == {
+            ':versionNumber': {'S': 'a'}, ':expiresAt': {'N': '10'}}
+
+    def test_does_reject_conflicting_values(self):
+        bridge = DynamoDBClientVersionLeaseBridge(mock.Mock())
+        with pytest.raises(ValueError):
+            bridge.we_own_lock('a') & bridge.we_own_lock('b')
+
+    def test_lock_free_has_no_values(self):
+        bridge = DynamoDBClientVersionLeaseBridge(mock.Mock())
+        condition = bridge.lock_free()
+        assert isinstance(condition, ClientCondition)
+        assert condition.values == {}
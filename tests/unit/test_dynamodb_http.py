@@ -0,0 +1,177 @@
+import json
+
+import pytest
+import mock
+from boto3.session import Session
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from lynk.backends.dynamodb_http import ConditionalCheckFailedException
+from lynk.backends.dynamodb_http import DynamoDBHTTPBackendBridgeFactory
+from lynk.backends.dynamodb_http import DynamoDBHTTPClient
+from lynk.backends.dynamodb_http import DynamoDBHTTPError
+from lynk.backends.dynamodb_http import HTTPConnectionPool
+from lynk.backends.dynamodb_http import SigV4Signer
+from lynk.backends.dynamodb_client import DynamoDBClientBackend
+from lynk.utils import TimeUtils
+
+
+# 2023-11-14T22:13:20Z
+NOW = 1700000000
+
+
+@pytest.fixture
+def create_signer():
+    def wrapped(token=None, now=NOW):
+        time_utils = mock.Mock(spec=TimeUtils)
+        time_utils.time.return_value = now
+        credentials = Credentials('akid', 'secret', token)
+        signer = SigV4Signer(credentials, 'us-west-2', time_utils)
+        return signer, time_utils
+    return wrapped
+
+
+@pytest.fixture
+def create_client():
+    def wrapped(status=200, data=b'{}'):
+        pool = mock.Mock(spec=HTTPConnectionPool)
+        pool.host = 'localhost:8000'
+        pool.post.return_value = (status, data)
+        signer = mock.Mock(spec=SigV4Signer)
+        return pool, DynamoDBHTTPClient(pool, signer)
+    return wrapped
+
+
+def _botocore_signature(headers, body, token=None):
+    request = AWSRequest(
+        method='POST', url='http://%s/' % headers['host'], data=body,
+        headers={
+            name: value for name, value in headers.items()
+            if name not in ('authorization', 'x-amz-date',
+                            'x-amz-security-token')
+        },
+    )
+    request.context['timestamp'] = headers['x-amz-date']
+    auth = SigV4Auth(
+        Credentials('akid', 'secret', token), 'dynamodb', 'us-west-2')
+    auth._modify_request_before_signing(request)
+    canonical_request = auth.canonical_request(request)
+    return auth.signature(
+        auth.string_to_sign(request, canonical_request), request)
+
+
+class TestSigV4Signer(object):
+    def _headers(self):
+        return {
+            'host': 'localhost:8000',
+            'content-type': 'application/x-amz-json-1.0',
+            'x-amz-target': 'DynamoDB_20120810.PutItem',
+        }
+
+    def test_does_match_botocore_signature(self, create_signer):
+        signer, _ = create_signer()
+        headers = self._headers()
+        signer.sign(headers, b'{"TableName":"locks"}')
+        assert headers['x-amz-date'] == '20231114T221320Z'
+        assert headers['authorization'] == (
+            'AWS4-HMAC-SHA256 '
+            'Credential=akid/20231114/us-west-2/dynamodb/aws4_request, '
+            'SignedHeaders=content-type;host;x-amz-date;x-amz-target, '
+            'Signature=%s' % _botocore_signature(
+                headers, b'{"TableName":"locks"}')
+        )
+
+    def test_does_sign_session_token(self, create_signer):
+        signer, _ = create_signer(token='token')
+        headers = self._headers()
+        signer.sign(headers, b'{}')
+        assert headers['x-amz-security-token'] == 'token'
+        assert headers['authorization'].endswith(
+            _botocore_signature(headers, b'{}', token='token'))
+
+    def test_does_reuse_signing_key_within_a_day(self, create_signer):
+        signer, time_utils = create_signer()
+        signer.sign(self._headers(), b'{}')
+        key = signer._signing_key
+        time_utils.time.return_value = NOW + 3600
+        signer.sign(self._headers(), b'{}')
+        assert signer._signing_key is key
+
+    def test_does_derive_new_signing_key_each_day(self, create_signer):
+        signer, time_utils = create_signer()
+        signer.sign(self._headers(), b'{}')
+        key = signer._signing_key
+        time_utils.time.return_value = NOW + 86400
+        headers = self._headers()
+        signer.sign(headers, b'{}')
+        assert signer._signing_key != key
+        assert headers['authorization'].endswith(
+            _botocore_signature(headers, b'{}'))
+
+    def test_does_require_credentials(self):
+        with pytest.raises(ValueError):
+            SigV4Signer(None, 'us-west-2')
+
+
+class TestDynamoDBHTTPClient(object):
+    def test_can_send_request(self, create_client):
+        pool, client = create_client(data=b'{"Item": {"a": {"S": "b"}}}')
+        response = client.get_item(TableName='locks')
+        assert response == {'Item': {'a': {'S': 'b'}}}
+        head, body = pool.post.call_args[0]
+        assert head.startswith(b'POST / HTTP/1.1\r\n')
+        assert b'x-amz-target: DynamoDB_20120810.GetItem\r\n' in head
+        assert head.endswith(b'content-length: %d\r\n\r\n' % len(body))
+        assert json.loads(body.decode('utf-8')) == {'TableName': 'locks'}
+
+    def test_does_raise_modeled_error(self, create_client):
+        _, client = create_client(status=400, data=json.dumps({
+            '__type': 'com.amazonaws.dynamodb.v20120810#'
+                      'ConditionalCheckFailedException',
+            'message': 'The conditional request failed',
+            'Item': {'lockKey': {'S': 'foo'}},
+        }).encode('utf-8'))
+        with pytest.raises(client.exceptions.ConditionalCheckFailedException) \
+                as e:
+            client.put_item(TableName='locks')
+        assert e.value.response['Error'] == {
+            'Code': 'ConditionalCheckFailedException',
+            'Message': 'The conditional request failed',
+        }
+        assert e.value.response['Item'] == {'lockKey': {'S': 'foo'}}
+
+    def test_does_raise_other_errors(self, create_client):
+        _, client = create_client(status=500, data=b'<html></html>')
+        with pytest.raises(DynamoDBHTTPError) as e:
+            client.delete_item(TableName='locks')
+        assert e.value.response['Error']['Code'] == '500'
+        assert not isinstance(e.value, ConditionalCheckFailedException)
+
+
+class TestHTTPConnectionPool(object):
+    def test_does_reject_unsupported_scheme(self):
+        with pytest.raises(ValueError):
+            HTTPConnectionPool('ftp://localhost')
+
+    def test_does_use_endpoint_host(self):
+        pool = HTTPConnectionPool('http://localhost:8000')
+        assert pool.host == 'localhost:8000'
+
+
+class TestDynamoDBHTTPBackendBridgeFactory(object):
+    def test_can_create(self):
+        session = mock.Mock(spec=Session)
+        session.region_name = 'us-west-2'
+        factory = DynamoDBHTTPBackendBridgeFactory(session=session)
+        bridge, backend = factory.create('locks')
+        assert isinstance(backend, DynamoDBClientBackend)
+        assert bridge.ConditionFailedError is \
+            ConditionalCheckFailedException
+
+    def test_does_require_region(self):
+        session = mock.Mock(spec=Session)
+        session.region_name = None
+        factory = DynamoDBHTTPBackendBridgeFactory(session=session)
+        with pytest.raises(ValueError):
+            factory.create('locks')
@@ -1,18 +1,24 @@
 import json
+import threading
 
 import pytest
 import mock
 
 from lynk.lock import Lock
+from lynk.lock import LockGroup
 from lynk.techniques import BaseTechnique
+from lynk.techniques import VersionLeaseTechinque
 from lynk.refresh import LockRefresherFactory
 from lynk.refresh import LockRefresher
+from lynk.reentrant import LocalHolds
 from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import NoSuchLockError
+from lynk.throttle import is_urgent
 
 
 @pytest.fixture
 def create_lock():
-    def wrapped(name=None, technique=None, refresher=False):
+    def wrapped(name=None, technique=None, refresher=False, holds=None):
         if name is None:
             name = 'lock name'
         if technique is None:
@@ -22,7 +28,7 @@ def create_lock():
         else:
             refresh_factory = None
 
-        lock = Lock(name, technique, refresh_factory)
+        lock = Lock(name, technique, refresh_factory, holds=holds)
         return lock, technique, refresh_factory
     return wrapped
 
@@ -42,12 +48,45 @@ class TestLock(object):
     def test_can_acquire_lock(self, create_lock):
         lock, tech, _ = create_lock()
         lock.acquire()
-        tech.acquire.assert_called_with('lock name', 20, max_wait_seconds=300)
+        tech.acquire.assert_called_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=None,
+            deadline=None)
 
     def test_can_acquire_lock_with_custom_params(self, create_lock):
         lock, tech, _ = create_lock()
         lock.acquire(100, max_wait_seconds=10)
-        tech.acquire.assert_called_with('lock name', 100, max_wait_seconds=10)
+        tech.acquire.assert_called_with(
+            'lock name', 100, max_wait_seconds=10, cancel_event=None,
+            deadline=None)
+
+    def test_can_acquire_lock_with_deadline(self, create_lock):
+        lock, tech, _ = create_lock()
+        lock.acquire(deadline=1010.0)
+        # The technique measures the deadline on its own clock.
+        tech.acquire.assert_called_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=None,
+            deadline=1010.0)
+
+    def test_can_acquire_lock_with_cancel_event(self, create_lock):
+        lock, tech, _ = create_lock()
+        event = threading.Event()
+        lock.acquire(cancel_event=event)
+        tech.acquire.assert_called_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=event,
+            deadline=None)
+
+    def test_can_try_acquire_lock(self, create_lock):
+        lock, tech, refresher_factory = create_lock(refresher=True)
+        tech.try_acquire.return_value = True
+        assert lock.try_acquire(10) is True
+        tech.try_acquire.assert_called_with('lock name', 10)
+        refresher_factory.create_lock_refresher.assert_called_with(lock, 7.5)
+
+    def test_failed_try_acquire_does_not_start_refresher(self, create_lock):
+        lock, tech, refresher_factory = create_lock(refresher=True)
+        tech.try_acquire.return_value = False
+        assert lock.try_acquire() is False
+        refresher_factory.create_lock_refresher.assert_not_called()
 
     def test_can_release_lock(self, create_lock):
         lock, tech, _ = create_lock()
@@ -59,11 +98,42 @@ class TestLock(object):
         lock.refresh()
         tech.refresh.assert_called_with('lock name')
 
+    def test_does_release_and_refresh_urgently(self, create_lock):
+        lock, tech, _ = create_lock()
+        urgency = []
+
+        def record(*args, **kwargs):
+            urgency.append(is_urgent())
+
+        tech.acquire.side_effect = record
+        tech.refresh.side_effect = record
+        tech.release.side_effect = record
+        lock.acquire()
+        lock.refresh()
+        lock.release()
+        assert urgency == [False, True, True]
+
+    def test_can_prepare_refresh(self, create_lock):
+        lock, tech, _ = create_lock(
+            technique=mock.Mock(spec=VersionLeaseTechinque))
+        pending = lock.prepare_refresh()
+        tech.prepare_refresh.assert_called_with('lock name')
+        assert pending == tech.prepare_refresh.return_value
+
+    def test_can_be_refreshed_in_batch_if_technique_can(self, create_lock):
+        lock, tech, _ = create_lock()
+        tech.SUPPORTS_TRANSACTIONS = True
+        assert lock.supports_batch_refresh
+        tech.SUPPORTS_TRANSACTIONS = False
+        assert not lock.supports_batch_refresh
+
     def test_context_manager_does_acquire_and_release(self, create_lock):
         lock, tech, _ = create_lock()
         with lock():
             pass
-        tech.acquire.assert_called_with('lock name', 20, max_wait_seconds=300)
+        tech.acquire.assert_called_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=None,
+            deadline=None)
         tech.release.assert_called_with('lock name')
 
     def test_lock_not_granted_does_escape_context_manager(self, create_lock):
@@ -77,7 +147,9 @@ class TestLock(object):
         with pytest.raises(LockNotGrantedError):
             with lock():
                 pass
-        tech.acquire.assert_called_with('lock name', 20, max_wait_seconds=300)
+        tech.acquire.assert_called_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=None,
+            deadline=None)
         tech.release.assert_not_called()
 
     def test_acquire_does_create_and_start_refresher(self, create_lock):
@@ -100,3 +172,149 @@ class TestLock(object):
         lock.release()
 
         mock_refresher.stop.assert_called_once()
+
+    def test_nested_reentrant_acquire_does_not_use_backend(self, create_lock):
+        lock, tech, _ = create_lock(holds=LocalHolds())
+        lock.acquire()
+        lock.acquire()
+        assert lock.try_acquire() is True
+        tech.acquire.assert_called_once_with(
+            'lock name', 20, max_wait_seconds=300, cancel_event=None,
+            deadline=None)
+        tech.try_acquire.assert_not_called()
+
+    def test_reentrant_lock_released_by_outermost_release(self, create_lock):
+        lock, tech, _ = create_lock(holds=LocalHolds())
+        with lock():
+            with lock():
+                pass
+            tech.release.assert_not_called()
+        tech.release.assert_called_once_with('lock name')
+
+    def test_reentrant_locks_share_holds_by_name(self, create_lock):
+        holds = LocalHolds()
+        outer, outer_tech, _ = create_lock(holds=holds)
+        inner, inner_tech, _ = create_lock(holds=holds)
+        outer.acquire()
+        inner.acquire()
+        inner.refresh()
+        outer.release()
+        inner.release()
+        inner_tech.acquire.assert_not_called()
+        inner_tech.refresh.assert_not_called()
+        inner_tech.release.assert_not_called()
+        outer_tech.refresh.assert_called_once_with('lock name')
+        outer_tech.release.assert_called_once_with('lock name')
+
+    def test_reentrant_lock_cannot_refresh_from_other_thread(
+            self, create_lock):
+        holds = LocalHolds()
+        outer, outer_tech, _ = create_lock(holds=holds)
+        inner, inner_tech, _ = create_lock(holds=holds)
+        outer.acquire()
+        errors = []
+
+        def refresh():
+            try:
+                inner.refresh()
+            except NoSuchLockError as e:
+                errors.append(e)
+            # The holding lock's refresher runs on a thread of its own.
+            outer.refresh()
+
+        thread = threading.Thread(target=refresh)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        inner_tech.refresh.assert_not_called()
+        outer_tech.refresh.assert_called_once_with('lock name')
+
+    def test_reentrant_lock_does_not_start_nested_refresher(
+            self, create_lock):
+        lock, tech, refresher_factory = create_lock(
+            refresher=True, holds=LocalHolds())
+        lock.acquire()
+        lock.acquire()
+        lock.release()
+        refresher = refresher_factory.create_lock_refresher.return_value
+        refresher_factory.create_lock_refresher.assert_called_once_with(
+            lock, 15)
+        refresher.stop.assert_not_called()
+        lock.release()
+        refresher.stop.assert_called_once_with()
+
+    def test_failed_reentrant_acquire_is_not_held(self, create_lock):
+        lock, tech, _ = create_lock(holds=LocalHolds())
+        tech.acquire.side_effect = [LockNotGrantedError(), None]
+        with pytest.raises(LockNotGrantedError):
+            lock.acquire()
+        lock.acquire()
+        assert tech.acquire.call_count == 2
+
+
+@pytest.fixture
+def create_lock_group():
+    def wrapped(names=None, refresher=False):
+        if names is None:
+            names = ['b', 'a']
+        technique = mock.Mock(spec=VersionLeaseTechinque)
+        refresh_factory = None
+        if refresher:
+            refresh_factory = mock.Mock(spec=LockRefresherFactory)
+        group = LockGroup(names, technique, refresh_factory)
+        return group, technique, refresh_factory
+    return wrapped
+
+
+class TestLockGroup(object):
+    def test_does_refuse_technique_without_transactions(self):
+        technique = mock.Mock(spec=BaseTechnique)
+        technique.SUPPORTS_TRANSACTIONS = False
+        with pytest.raises(ValueError):
+            LockGroup(['a', 'b'], technique)
+
+    def test_can_acquire_group(self, create_lock_group):
+        group, tech, _ = create_lock_group()
+        group.acquire(10, max_wait_seconds=30)
+        tech.acquire_many.assert_called_with(
+            ['a', 'b'], 10, max_wait_seconds=30, cancel_event=None,
+            deadline=None)
+
+    def test_can_acquire_group_with_deadline(self, create_lock_group):
+        group, tech, _ = create_lock_group()
+        group.acquire(deadline=1010.0)
+        tech.acquire_many.assert_called_with(
+            ['a', 'b'], 20, max_wait_seconds=300, cancel_event=None,
+            deadline=1010.0)
+
+    def test_can_release_group(self, create_lock_group):
+        group, tech, _ = create_lock_group()
+        group.acquire()
+        group.release()
+        tech.release_many.assert_called_with(['a', 'b'])
+
+    def test_can_refresh_group(self, create_lock_group):
+        group, tech, _ = create_lock_group()
+        group.refresh()
+        tech.refresh_many.assert_called_with(['a', 'b'])
+
+    def test_group_is_refreshed_as_one(self, create_lock_group):
+        group, tech, refresher_factory = create_lock_group(refresher=True)
+        mock_refresher = mock.Mock(spec=LockRefresher)
+        refresher_factory.create_lock_refresher.return_value = mock_refresher
+        group.acquire()
+        refresher_factory.create_lock_refresher.assert_called_once_with(
+            group, 15)
+        mock_refresher.start.assert_called_once()
+        assert not group.supports_batch_refresh
+        group.release()
+        mock_refresher.stop.assert_called_once()
+
+    def test_can_use_group_as_context_manager(self, create_lock_group):
+        group, tech, _ = create_lock_group()
+        with group(lease_duration=5, timeout_seconds=10):
+            tech.release_many.assert_not_called()
+        tech.acquire_many.assert_called_with(
+            ['a', 'b'], 5, max_wait_seconds=10, cancel_event=None,
+            deadline=None)
+        tech.release_many.assert_called_with(['a', 'b'])
@@ -0,0 +1,193 @@
+import pytest
+
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
+from lynk.backends.memory import MemoryBackendBridgeFactory
+from lynk.backends.memory import MemoryVersionLeaseBridge
+from lynk.backends.memory import ConditionalCheckFailedError
+from lynk.exceptions import TransactionConflictError
+
+
+@pytest.fixture
+def create_backend():
+    def wrapped(lock_stripes=None):
+        factory = MemoryBackendBridgeFactory(lock_stripes=lock_stripes)
+        return factory.create('table name')
+    return wrapped
+
+
+class TestMemoryBackendBridgeFactory(object):
+    def test_does_share_tables_by_name(self):
+        factory = MemoryBackendBridgeFactory()
+        _, first = factory.create('foo')
+        _, second = factory.create('foo')
+        _, other = factory.create('bar')
+        first.put({'lockKey': 'lock', 'versionNumber': 'a'})
+        assert second.get({'lockKey': 'lock'}, ['versionNumber']) == {
+            'versionNumber': 'a'}
+        assert other.get({'lockKey': 'lock'}, ['versionNumber']) is None
+
+    def test_does_not_share_tables_between_factories(self):
+        _, first = MemoryBackendBridgeFactory().create('foo')
+        _, second = MemoryBackendBridgeFactory().create('foo')
+        first.put({'lockKey': 'lock'})
+        assert second.get({'lockKey': 'lock'}, ['lockKey']) is None
+
+
+class TestMemoryBackend(object):
+    def test_can_put_and_get(self, create_backend):
+        _, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'host': 'h'})
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber', 'gone']) == {
+            'versionNumber': 'a'}
+
+    def test_can_get_no_result(self, create_backend):
+        _, backend = create_backend()
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) is None
+
+    def test_stored_items_are_copies(self, create_backend):
+        _, backend = create_backend()
+        item = {'lockKey': 'foo', 'holders': {'a': 1}}
+        backend.put(item)
+        item['holders']['b'] = 2
+        read = backend.get({'lockKey': 'foo'}, ['holders'])
+        read['holders']['c'] = 3
+        assert backend.get({'lockKey': 'foo'}, ['holders']) == {
+            'holders': {'a': 1}}
+
+    def test_failed_put_does_attach_existing_item(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        with pytest.raises(bridge.ConditionFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_free())
+        assert e.value.existing_item == {
+            'lockKey': 'foo', 'versionNumber': 'a'}
+
+    def test_failed_put_without_item_does_attach_none(self, create_backend):
+        bridge, backend = create_backend()
+        with pytest.raises(ConditionalCheckFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_expired('a'))
+        assert e.value.existing_item is None
+
+    def test_can_update(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'lease': 1})
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'},
+                       condition=bridge.we_own_lock('a'))
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber', 'lease']) \
+            == {'versionNumber': 'b', 'lease': 1}
+
+    def test_update_does_create_missing_item(self, create_backend):
+        _, backend = create_backend()
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'})
+        assert backend.get({'lockKey': 'foo'}, ['lockKey', 'versionNumber']) \
+            == {'lockKey': 'foo', 'versionNumber': 'b'}
+
+    def test_failed_update_does_not_change_item(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.update({'lockKey': 'foo'}, {'versionNumber': 'c'},
+                           condition=bridge.we_own_lock('b'))
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) == {
+            'versionNumber': 'a'}
+
+    def test_can_delete_with_condition(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.delete({'lockKey': 'foo'},
+                           condition=bridge.we_own_lock('b'))
+        backend.delete({'lockKey': 'foo'}, condition=bridge.we_own_lock('a'))
+        assert backend.get({'lockKey': 'foo'}, ['lockKey']) is None
+
+    def test_can_delete_missing_item(self, create_backend):
+        _, backend = create_backend()
+        backend.delete({'lockKey': 'foo'})
+
+    def test_can_transact_write(self, create_backend):
+        bridge, backend = create_backend(lock_stripes=2)
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        backend.put({'lockKey': 'c', 'versionNumber': '1'})
+        backend.transact_write([
+            Put({'lockKey': 'a', 'versionNumber': '2'}, bridge.lock_free()),
+            Update({'lockKey': 'b'}, {'versionNumber': '2'},
+                   bridge.we_own_lock('1')),
+            Delete({'lockKey': 'c'}, bridge.we_own_lock('1')),
+        ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'b'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'c'}, ['versionNumber']) is None
+
+    def test_transact_write_does_raise_conflict(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        backend.put({'lockKey': 'c', 'versionNumber': '1'})
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Put({'lockKey': 'a', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Put({'lockKey': 'b', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Update({'lockKey': 'c'}, {'versionNumber': '2'},
+                       bridge.we_own_lock('0')),
+            ])
+        assert e.value.failed_indexes == [1, 2]
+        assert e.value.existing_items == {
+            1: {'lockKey': 'b', 'versionNumber': '1'}}
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) is None
+        assert backend.get({'lockKey': 'c'}, ['versionNumber']) == {
+            'versionNumber': '1'}
+
+
+class TestMemoryVersionLeaseBridge(object):
+    def test_lock_free(self):
+        condition = MemoryVersionLeaseBridge().lock_free()
+        assert condition(None)
+        assert not condition({'lockKey': 'foo'})
+
+    def test_lock_expired(self):
+        condition = MemoryVersionLeaseBridge().lock_expired('a')
+        assert condition({'versionNumber': 'a'})
+        assert not condition({'versionNumber': 'b'})
+        assert not condition(None)
+
+    def test_lock_free_or_expired(self):
+        condition = MemoryVersionLeaseBridge().lock_free_or_expired('a')
+        assert condition(None)
+        assert condition({'versionNumber': 'a'})
+        assert not condition({'versionNumber': 'b'})
+
+    def test_lease_elapsed(self):
+        condition = MemoryVersionLeaseBridge().lease_elapsed(100)
+        assert condition({'expiresAt': 99})
+        assert not condition({'expiresAt': 100})
+        assert not condition({'versionNumber': 'a'})
+        assert not condition(None)
+
+    def test_lock_free_or_lease_elapsed(self):
+        condition = MemoryVersionLeaseBridge().lock_free_or_lease_elapsed(100)
+        assert condition(None)
+        assert condition({'expiresAt': 99})
+        assert not condition({'expiresAt': 101})
+
+    def test_we_own_lock(self):
+        condition = MemoryVersionLeaseBridge().we_own_lock('a')
+        assert condition({'versionNumber': 'a'})
+        assert not condition({'versionNumber': 'b'})
+
+    def test_lock_unchanged(self):
+        condition = MemoryVersionLeaseBridge().lock_unchanged('a')
+        assert condition({'versionNumber': 'a'})
+        assert not condition(None)
+
+    def test_can_combine_conditions(self):
+        bridge = MemoryVersionLeaseBridge()
+        condition = bridge.lock_expired('a') & bridge.lease_elapsed(100)
+        assert condition({'versionNumber': 'a', 'expiresAt': 1})
+        assert not condition({'versionNumber': 'a', 'expiresAt': 200})
@@ -0,0 +1,166 @@
+import threading
+
+import pytest
+import mock
+
+from lynk.backends.base import BaseBackend
+from lynk.exceptions import TransactionConflictError
+from lynk.metrics import Counter
+from lynk.metrics import Histogram
+from lynk.metrics import HistogramMetrics
+from lynk.metrics import InstrumentedBackend
+from lynk.metrics import MetricsHook
+from lynk.utils import TimeUtils
+
+
+class ConditionFailedError(Exception):
+    pass
+
+
+@pytest.fixture
+def create_backend():
+    def wrapped():
+        backend = mock.Mock(spec=BaseBackend)
+        metrics = mock.Mock(spec=MetricsHook)
+        time_utils = mock.Mock(spec=TimeUtils)
+        # Latency is measured on the monotonic clock alone.
+        time_utils.time.side_effect = AssertionError('wall clock read')
+        time_utils.perf_counter.side_effect = [10.0, 10.25]
+        instrumented = InstrumentedBackend(
+            backend, metrics, ConditionFailedError, time_utils)
+        return backend, instrumented, metrics
+    return wrapped
+
+
+class TestHistogram(object):
+    def test_does_summarize_empty_histogram(self):
+        assert Histogram().snapshot() == {'count': 0}
+
+    def test_does_count_small_values_exactly(self):
+        histogram = Histogram(scale=1)
+        for value in range(1, 101):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        assert snapshot['count'] == 100
+        assert snapshot['mean'] == 50.5
+        assert snapshot['min'] == 1
+        assert snapshot['max'] == 100
+        assert snapshot['p50'] == 50
+        assert snapshot['p90'] == 90
+        assert snapshot['p99'] == 99
+        assert snapshot['p999'] == 100
+
+    def test_does_keep_large_values_within_precision(self):
+        histogram = Histogram()
+        for value in (0.001, 0.02, 0.3, 4.0, 50.0, 600.0):
+            histogram.record(value)
+        snapshot = histogram.snapshot()
+        assert snapshot['min'] == pytest.approx(0.001, rel=0.016)
+        assert snapshot['p50'] == pytest.approx(0.3, rel=0.016)
+        assert snapshot['max'] == pytest.approx(600.0, rel=0.016)
+
+    def test_does_clamp_huge_values(self):
+        histogram = Histogram(scale=1)
+        histogram.record(2 ** 50)
+        assert histogram.snapshot()['max'] < 2 ** 41
+
+    def test_does_not_lose_values_recorded_by_threads(self):
+        histogram = Histogram(scale=1)
+
+        def record():
+            for _ in range(10000):
+                histogram.record(5)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = histogram.snapshot()
+        assert snapshot['count'] == 80000
+        assert snapshot['mean'] == 5
+
+
+class TestCounter(object):
+    def test_does_add_up_threads(self):
+        counter = Counter()
+        counter.increment()
+
+        def increment():
+            for _ in range(1000):
+                counter.increment()
+
+        thread = threading.Thread(target=increment)
+        thread.start()
+        thread.join()
+        assert counter.value == 1001
+
+    def test_does_keep_counts_of_threads_that_exited(self):
+        counter = Counter()
+        counter.increment()
+        for _ in range(100):
+            thread = threading.Thread(target=counter.increment)
+            thread.start()
+            thread.join()
+        counter.increment()
+        assert counter.value == 102
+        # Only this thread's counts are still kept apart.
+        assert len(counter._shards) == 1
+
+
+class TestHistogramMetrics(object):
+    def test_does_export_snapshot(self):
+        metrics = HistogramMetrics()
+        metrics.on_backend_call('put', 0.01)
+        metrics.on_condition_failed('put')
+        metrics.on_acquire('foo', 3, 2.0, 1.5)
+        metrics.on_refresh('foo', 15.0, 20)
+        metrics.on_lock_lost('foo')
+        snapshot = metrics.snapshot()
+        assert snapshot['backend.put.seconds']['count'] == 1
+        assert snapshot['backend.put.seconds']['p50'] == pytest.approx(
+            0.01, rel=0.016)
+        assert snapshot['backend.put.condition_failures'] == 1
+        assert snapshot['backend.get.seconds'] == {'count': 0}
+        assert snapshot['backend.get.condition_failures'] == 0
+        assert snapshot['acquire.attempts']['max'] == 3
+        assert snapshot['acquire.seconds']['mean'] == 2.0
+        assert snapshot['acquire.slept_seconds']['mean'] == 1.5
+        assert snapshot['refresh.age_seconds']['mean'] == 15.0
+        assert snapshot['refresh.lease_used']['mean'] == 0.75
+        assert snapshot['locks_lost'] == 1
+
+
+class TestInstrumentedBackend(object):
+    def test_does_report_latency(self, create_backend):
+        backend, instrumented, metrics = create_backend()
+        backend.get.return_value = {'versionNumber': 'a'}
+        result = instrumented.get({'lockKey': 'foo'}, ['versionNumber'])
+        assert result == {'versionNumber': 'a'}
+        backend.get.assert_called_once_with(
+            {'lockKey': 'foo'}, ['versionNumber'], consistent=True)
+        metrics.on_backend_call.assert_called_once_with('get', 0.25)
+        assert not metrics.on_condition_failed.called
+
+    def test_does_report_failed_conditions(self, create_backend):
+        backend, instrumented, metrics = create_backend()
+        backend.put.side_effect = ConditionFailedError()
+        with pytest.raises(ConditionFailedError):
+            instrumented.put({'lockKey': 'foo'}, condition='condition')
+        metrics.on_condition_failed.assert_called_once_with('put')
+        metrics.on_backend_call.assert_called_once_with('put', 0.25)
+
+    def test_does_report_conflicting_transactions(self, create_backend):
+        backend, instrumented, metrics = create_backend()
+        backend.transact_write.side_effect = TransactionConflictError([0])
+        with pytest.raises(TransactionConflictError):
+            instrumented.transact_write([])
+        metrics.on_condition_failed.assert_called_once_with('transact_write')
+
+    def test_does_not_count_other_errors(self, create_backend):
+        backend, instrumented, metrics = create_backend()
+        backend.delete.side_effect = ValueError()
+        with pytest.raises(ValueError):
+            instrumented.delete({'lockKey': 'foo'})
+        assert not metrics.on_condition_failed.called
+        metrics.on_backend_call.assert_called_once_with('delete', 0.25)
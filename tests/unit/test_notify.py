@@ -0,0 +1,76 @@
+import threading
+
+from lynk.notify import LocalNotifier
+
+
+class TestLocalNotifier(object):
+    def test_does_notify_longest_waiting_subscriber(self):
+        notifier = LocalNotifier()
+        first = notifier.subscribe('lock')
+        second = notifier.subscribe('lock')
+        notifier.publish('lock')
+        assert first.wait(0) is True
+        assert second.wait(0) is False
+
+    def test_does_notify_next_subscriber_on_each_publish(self):
+        notifier = LocalNotifier()
+        first = notifier.subscribe('lock')
+        second = notifier.subscribe('lock')
+        notifier.publish('lock')
+        notifier.publish('lock')
+        assert first.wait(0) is True
+        assert second.wait(0) is True
+
+    def test_can_notify_all_subscribers(self):
+        notifier = LocalNotifier(wake_all=True)
+        first = notifier.subscribe('lock')
+        second = notifier.subscribe('lock')
+        notifier.publish('lock')
+        assert first.wait(0) is True
+        assert second.wait(0) is True
+
+    def test_can_notify_all_subscribers_of_one_release(self):
+        notifier = LocalNotifier()
+        first = notifier.subscribe('lock')
+        second = notifier.subscribe('lock')
+        notifier.publish('lock', wake_all=True)
+        assert first.wait(0) is True
+        assert second.wait(0) is True
+
+    def test_does_not_notify_other_locks(self):
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe('lock')
+        notifier.publish('other lock')
+        assert subscription.wait(0) is False
+
+    def test_does_reset_after_wait(self):
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe('lock')
+        notifier.publish('lock')
+        assert subscription.wait(0) is True
+        assert subscription.wait(0) is False
+
+    def test_does_not_notify_closed_subscription(self):
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe('lock')
+        subscription.close()
+        notifier.publish('lock')
+        assert subscription.wait(0) is False
+        assert notifier._subscriptions == {}
+
+    def test_can_close_subscription_twice(self):
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe('lock')
+        subscription.close()
+        subscription.close()
+
+    def test_does_wake_waiting_thread(self):
+        notifier = LocalNotifier()
+        subscription = notifier.subscribe('lock')
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(subscription.wait(10)))
+        thread.start()
+        notifier.publish('lock')
+        thread.join(5)
+        assert results == [True]
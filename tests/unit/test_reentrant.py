@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from lynk.reentrant import LocalHolds
+from lynk.exceptions import NoSuchLockError
+
+
+class TestLocalHolds(object):
+    def test_does_not_enter_unheld_name(self):
+        holds = LocalHolds()
+        assert holds.enter('foo') is False
+
+    def test_can_enter_claimed_name(self):
+        holds = LocalHolds()
+        holds.claim('foo', 'lock')
+        assert holds.enter('foo') is True
+
+    def test_only_outermost_exit_returns_holder(self):
+        holds = LocalHolds()
+        holds.claim('foo', 'lock')
+        holds.enter('foo')
+        holds.enter('foo')
+        assert holds.exit('foo') is None
+        assert holds.exit('foo') is None
+        assert holds.exit('foo') == 'lock'
+        assert holds.holder('foo') is None
+
+    def test_exit_unheld_name_does_raise(self):
+        holds = LocalHolds()
+        with pytest.raises(NoSuchLockError):
+            holds.exit('foo')
+
+    def test_does_not_enter_name_held_by_another_owner(self):
+        holds = LocalHolds()
+        holds.claim('foo', 'lock')
+        entered = []
+        thread = threading.Thread(
+            target=lambda: entered.append(holds.enter('foo')))
+        thread.start()
+        thread.join()
+        assert entered == [False]
+
+    def test_other_owner_cannot_exit(self):
+        holds = LocalHolds()
+        holds.claim('foo', 'lock')
+        errors = []
+
+        def exit_name():
+            try:
+                holds.exit('foo')
+            except NoSuchLockError as e:
+                errors.append(e)
+        thread = threading.Thread(target=exit_name)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        assert holds.holder('foo') == 'lock'
+
+    def test_does_not_give_holder_to_other_owners(self):
+        owner = ['task a']
+        holds = LocalHolds(get_owner=lambda: owner[0])
+        holds.claim('foo', 'lock')
+        owner[0] = 'task b'
+        assert holds.holder('foo') is None
+        assert holds.holder('foo', 'other lock') is None
+        # The lock holding the name may use it from anywhere.
+        assert holds.holder('foo', 'lock') == 'lock'
+
+    def test_can_use_custom_owner(self):
+        owner = ['task a']
+        holds = LocalHolds(get_owner=lambda: owner[0])
+        holds.claim('foo', 'lock')
+        owner[0] = 'task b'
+        assert holds.enter('foo') is False
+        owner[0] = 'task a'
+        assert holds.enter('foo') is True
+
+    def test_owners_can_hold_name_at_once(self):
+        owner = ['task a']
+        holds = LocalHolds(get_owner=lambda: owner[0])
+        holds.claim('foo', 'lock a')
+        owner[0] = 'task b'
+        holds.claim('foo', 'lock b')
+        assert holds.exit('foo') == 'lock b'
+        owner[0] = 'task a'
+        assert holds.holder('foo') == 'lock a'
+        assert holds.exit('foo') == 'lock a'
+
+    def test_does_not_find_holder_through_other_names(self):
+        owner = ['task a']
+        holds = LocalHolds(get_owner=lambda: owner[0])
+        holds.claim('bar', 'lock')
+        owner[0] = 'task b'
+        assert holds.holder('foo', 'lock') is None
+
+    def test_does_forget_name_once_released(self):
+        holds = LocalHolds()
+        for name in ('foo', 'bar'):
+            holds.claim(name, 'lock')
+        holds.exit('foo')
+        holds.exit('bar')
+        assert holds._holds == {}
@@ -2,9 +2,21 @@ import time
 from threading import Thread
 
 import mock
+import pytest
 
 from lynk.refresh import LockRefresher
 from lynk.refresh import LockRefresherFactory
+from lynk.refresh import LockRefreshScheduler
+from lynk.refresh import ScheduledLockRefresher
+from lynk.refresh import BatchLockRefresher
+from lynk.lock import LockGroup
+from lynk.techniques import VersionLeaseTechinque
+from lynk.techniques import PendingRefresh
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Update
+from lynk.exceptions import LockLostError
+from lynk.exceptions import RequestThrottledError
+from lynk.exceptions import TransactionConflictError
 
 
 class TestLockRefresher(object):
@@ -19,11 +31,11 @@ class TestLockRefresher(object):
     def test_can_stop_thread(self):
         refresher = LockRefresher(lambda: None)
         refresher.start()
-        assert refresher.isAlive()
+        assert refresher.is_alive()
         refresher.stop()
         # Schedule other thread so it can stop itself
         time.sleep(0.1)
-        assert refresher.isAlive() is False
+        assert refresher.is_alive() is False
 
     def test_does_call_refresh_fn(self):
         refresh_fn = mock.Mock()
@@ -40,3 +52,344 @@ class TestLockRefresherFactory(object):
         factory = LockRefresherFactory()
         refresher = factory.create_lock_refresher(mock_lock, 5)
         assert isinstance(refresher, LockRefresher)
+
+
+class FakeTime(object):
+    def __init__(self, now=0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = LockRefreshScheduler(time_utils=FakeTime())
+    yield scheduler
+    scheduler.stop()
+
+
+class TestLockRefreshScheduler(object):
+    def test_does_create_scheduled_refresher(self, scheduler):
+        mock_lock = mock.Mock()
+        refresher = scheduler.create_lock_refresher(mock_lock, 5)
+        assert isinstance(refresher, ScheduledLockRefresher)
+        assert refresher.lock == mock_lock
+
+    def test_start_does_register_refresher(self, scheduler):
+        refresher = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        refresher.start()
+        assert len(scheduler) == 1
+        assert refresher.deadline == 1000
+
+    def test_stop_does_unregister_refresher(self, scheduler):
+        refresher = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        refresher.start()
+        refresher.stop()
+        assert len(scheduler) == 0
+
+    def test_stop_is_idempotent(self, scheduler):
+        refreshers = [
+            scheduler.create_lock_refresher(mock.Mock(), 1000)
+            for _ in range(3)
+        ]
+        for refresher in refreshers:
+            refresher.start()
+        refreshers[0].stop()
+        refreshers[0].stop()
+        assert len(scheduler) == 2
+
+    def test_stop_without_start_does_nothing(self, scheduler):
+        refresher = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        refresher.stop()
+        assert len(scheduler) == 0
+
+    def test_does_compact_cancelled_refreshers(self, scheduler):
+        refreshers = [
+            scheduler.create_lock_refresher(mock.Mock(), 1000 + i)
+            for i in range(10)
+        ]
+        for refresher in refreshers:
+            refresher.start()
+        for refresher in refreshers[:6]:
+            refresher.stop()
+        assert len(scheduler) == 4
+        # Once more than half the heap was cancelled it should have been
+        # rebuilt without the cancelled entries.
+        assert len(scheduler._heap) < 10
+
+    def test_does_use_one_thread_for_all_refreshers(self, scheduler):
+        for _ in range(10):
+            scheduler.create_lock_refresher(mock.Mock(), 1000).start()
+        assert scheduler._thread is not None
+        assert scheduler._thread.daemon
+
+    def test_does_pop_only_due_refreshers(self, scheduler):
+        early = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        late = scheduler.create_lock_refresher(mock.Mock(), 2000)
+        late.start()
+        early.start()
+        with scheduler._condition:
+            due = scheduler._pop_due(1500)
+        assert due == [early]
+
+    def test_does_reschedule_after_refresh(self, scheduler):
+        mock_lock = mock.Mock()
+        refresher = scheduler.create_lock_refresher(mock_lock, 1000)
+        refresher.start()
+        with scheduler._condition:
+            scheduler._pop_due(1000)
+        scheduler._time_utils.now = 1000
+        scheduler._refresh(refresher)
+        mock_lock.refresh.assert_called_once_with()
+        assert refresher.deadline == 2000
+        assert len(scheduler) == 1
+
+    def test_does_drop_refresher_that_fails(self, scheduler):
+        mock_lock = mock.Mock()
+        mock_lock.refresh.side_effect = LockLostError()
+        refresher = scheduler.create_lock_refresher(mock_lock, 1000)
+        refresher.start()
+        with scheduler._condition:
+            scheduler._pop_due(1000)
+        scheduler._refresh(refresher)
+        assert len(scheduler) == 0
+
+    def test_does_retry_refresh_that_fails_transiently(self, scheduler):
+        mock_lock = mock.Mock()
+        mock_lock.refresh.side_effect = RequestThrottledError()
+        refresher = scheduler.create_lock_refresher(mock_lock, 1000)
+        refresher.start()
+        with scheduler._condition:
+            scheduler._pop_due(1000)
+        scheduler._time_utils.now = 1000
+        scheduler._refresh(refresher)
+        assert len(scheduler) == 1
+        # Tried again well before the lease runs out.
+        assert refresher.deadline == 1100
+
+    def test_does_not_reschedule_refresher_stopped_during_refresh(
+            self, scheduler):
+        refresher = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        refresher.start()
+        with scheduler._condition:
+            scheduler._pop_due(1000)
+        refresher.stop()
+        scheduler._refresh(refresher)
+        assert len(scheduler) == 0
+
+    def test_does_batch_refreshers_due_in_window(self):
+        batch_refresher = mock.Mock(spec=BatchLockRefresher)
+        batch_refresher.refresh.return_value = {}
+        scheduler = LockRefreshScheduler(
+            time_utils=FakeTime(),
+            batch_refresher=batch_refresher,
+            batch_window=10,
+        )
+        first = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        second = scheduler.create_lock_refresher(mock.Mock(), 1005)
+        third = scheduler.create_lock_refresher(mock.Mock(), 2000)
+        for refresher in (first, second, third):
+            refresher.start()
+        with scheduler._condition:
+            due = scheduler._pop_due(1000 + 10)
+        scheduler.stop()
+        scheduler._refresh_batch(due)
+
+        batch_refresher.refresh.assert_called_once_with(
+            [first.lock, second.lock])
+        assert len(scheduler) == 3
+
+    def test_does_drop_refreshers_that_fail_in_batch(self):
+        batch_refresher = mock.Mock(spec=BatchLockRefresher)
+        scheduler = LockRefreshScheduler(
+            time_utils=FakeTime(),
+            batch_refresher=batch_refresher,
+        )
+        first = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        second = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        first.start()
+        second.start()
+        batch_refresher.refresh.return_value = {first.lock: LockLostError()}
+        with scheduler._condition:
+            due = scheduler._pop_due(1000)
+        scheduler.stop()
+        scheduler._refresh_batch(due)
+        assert len(scheduler) == 1
+        assert second.scheduled
+
+    def test_does_retry_refreshers_that_fail_transiently_in_batch(self):
+        batch_refresher = mock.Mock(spec=BatchLockRefresher)
+        scheduler = LockRefreshScheduler(
+            time_utils=FakeTime(),
+            batch_refresher=batch_refresher,
+        )
+        first = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        second = scheduler.create_lock_refresher(mock.Mock(), 1000)
+        first.start()
+        second.start()
+        batch_refresher.refresh.return_value = {
+            first.lock: RequestThrottledError()}
+        with scheduler._condition:
+            due = scheduler._pop_due(1000)
+        scheduler.stop()
+        scheduler._time_utils.now = 1000
+        scheduler._refresh_batch(due)
+        assert len(scheduler) == 2
+        assert first.deadline == 1100
+        assert second.deadline == 2000
+
+
+class ConditionFailedError(Exception):
+    pass
+
+
+class FakeBatchBackend(BaseBackend):
+    MAX_TRANSACTION_ITEMS = 2
+    SUPPORTS_TRANSACTIONS = True
+
+    def __init__(self, errors=None, lost=None):
+        self.transactions = []
+        self.updates = []
+        self._errors = errors or []
+        self._lost = lost or []
+
+    def update(self, key, updates, condition=None):
+        self.updates.append(key['lockKey'])
+        if key['lockKey'] in self._lost:
+            raise ConditionFailedError()
+
+    def transact_write(self, operations):
+        self.transactions.append(
+            [operation.key['lockKey'] for operation in operations])
+        if self._errors:
+            raise self._errors.pop(0)
+
+
+def create_batchable_lock(backend, name):
+    lock = mock.Mock()
+    lock.succeeded = False
+
+    def on_success():
+        lock.succeeded = True
+
+    lock.prepare_refresh.return_value = PendingRefresh(
+        backend, Update({'lockKey': name}, {}, 'condition'), on_success,
+        condition_failed_error=ConditionFailedError)
+    return lock
+
+
+class TestBatchLockRefresher(object):
+    def test_does_refresh_locks_in_one_transaction(self):
+        backend = FakeBatchBackend()
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        failures = BatchLockRefresher().refresh(locks)
+
+        assert failures == {}
+        assert backend.transactions == [[0, 1]]
+        assert all(lock.succeeded for lock in locks)
+        assert not any(lock.refresh.called for lock in locks)
+
+    def test_does_split_transactions_at_max_size(self):
+        backend = FakeBatchBackend()
+        locks = [create_batchable_lock(backend, i) for i in range(5)]
+        BatchLockRefresher().refresh(locks)
+        assert backend.transactions == [[0, 1], [2, 3]]
+        # The lock left over is not worth a transaction, its prepared
+        # refresh is sent on its own.
+        assert backend.updates == [4]
+        assert locks[4].succeeded
+        assert not locks[4].refresh.called
+
+    def test_does_group_locks_by_backend(self):
+        first_backend = FakeBatchBackend()
+        second_backend = FakeBatchBackend()
+        locks = [
+            create_batchable_lock(first_backend, 0),
+            create_batchable_lock(second_backend, 1),
+            create_batchable_lock(first_backend, 2),
+        ]
+        BatchLockRefresher().refresh(locks)
+        assert first_backend.transactions == [[0, 2]]
+        # A group of one is not worth a transaction.
+        assert second_backend.transactions == []
+        assert second_backend.updates == [1]
+        assert locks[1].succeeded
+
+    def test_does_retry_without_failed_locks(self):
+        backend = FakeBatchBackend(errors=[TransactionConflictError([1])])
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        failures = BatchLockRefresher().refresh(locks)
+
+        assert list(failures.keys()) == [locks[1]]
+        assert isinstance(failures[locks[1]], LockLostError)
+        assert backend.transactions == [[0, 1], [0]]
+        assert locks[0].succeeded
+        assert not locks[1].succeeded
+
+    def test_does_tell_lost_locks_of_conflict(self):
+        backend = FakeBatchBackend(errors=[TransactionConflictError([1])])
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        pending = [lock.prepare_refresh.return_value for lock in locks]
+        for refresh in pending:
+            refresh.lost = mock.Mock()
+        BatchLockRefresher().refresh(locks)
+        assert not pending[0].lost.called
+        pending[1].lost.assert_called_once_with()
+
+    def test_does_refresh_one_at_a_time_after_other_errors(self):
+        backend = FakeBatchBackend(
+            errors=[RequestThrottledError()], lost=[1])
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        pending = [lock.prepare_refresh.return_value for lock in locks]
+        for refresh in pending:
+            refresh.lost = mock.Mock()
+        failures = BatchLockRefresher().refresh(locks)
+        # Only the lock that really was lost is reported.
+        assert list(failures) == [locks[1]]
+        assert isinstance(failures[locks[1]], LockLostError)
+        assert backend.updates == [0, 1]
+        assert locks[0].succeeded
+        pending[1].lost.assert_called_once_with()
+        for lock in locks:
+            assert lock.prepare_refresh.call_count == 1
+            assert not lock.refresh.called
+
+    def test_does_report_other_errors_of_single_refresh(self):
+        backend = FakeBatchBackend()
+        lock = create_batchable_lock(backend, 0)
+        error = RequestThrottledError()
+        backend.update = mock.Mock(side_effect=error)
+        failures = BatchLockRefresher().refresh([lock])
+        assert failures == {lock: error}
+        assert not lock.succeeded
+
+    def test_does_fall_back_if_backend_cannot_batch(self):
+        backend = FakeBatchBackend()
+        backend.SUPPORTS_TRANSACTIONS = False
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        failures = BatchLockRefresher().refresh(locks)
+        assert failures == {}
+        assert backend.transactions == []
+        assert backend.updates == [0, 1]
+        assert all(lock.succeeded for lock in locks)
+
+    def test_does_fall_back_if_technique_cannot_batch(self):
+        backend = FakeBatchBackend()
+        locks = [create_batchable_lock(backend, i) for i in range(2)]
+        for lock in locks:
+            lock.supports_batch_refresh = False
+        locks[1].refresh.side_effect = LockLostError()
+        failures = BatchLockRefresher().refresh(locks)
+        assert isinstance(failures[locks[1]], LockLostError)
+        assert backend.transactions == []
+        for lock in locks:
+            assert not lock.prepare_refresh.called
+            lock.refresh.assert_called_once_with()
+
+    def test_does_refresh_lock_group_on_its_own(self):
+        technique = mock.Mock(spec=VersionLeaseTechinque)
+        group = LockGroup(['a', 'b'], technique)
+        failures = BatchLockRefresher().refresh([group])
+        assert failures == {}
+        technique.refresh_many.assert_called_once_with(['a', 'b'])
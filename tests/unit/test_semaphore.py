@@ -0,0 +1,405 @@
+import copy
+import threading
+
+import pytest
+import mock
+
+from lynk.semaphore import Permit
+from lynk.semaphore import Semaphore
+from lynk.semaphore import ShardedSemaphoreTechnique
+from lynk.backends.base import BaseBackend
+from lynk.backends.dynamodb import DynamoDBVersionLeaseBridge
+from lynk.notify import BaseNotifier
+from lynk.metrics import MetricsHook
+from lynk.refresh import LockRefresherFactory
+from lynk.refresh import LockRefresher
+from lynk.exceptions import LockLostError
+from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import NoSuchLockError
+
+
+class ConditionFailedError(Exception):
+    def __init__(self, existing_item=None):
+        self.existing_item = existing_item
+
+
+class DictBackend(BaseBackend):
+    def __init__(self):
+        self.items = {}
+        self.counts = {'put': 0, 'get': 0}
+
+    def put(self, item, condition=None):
+        self.counts['put'] += 1
+        existing = self.items.get(item['lockKey'])
+        kind, version = condition
+        if kind == 'free':
+            holds = existing is None
+        else:
+            holds = existing is not None and \
+                existing['versionNumber'] == version
+        if not holds:
+            raise ConditionFailedError(copy.deepcopy(existing))
+        self.items[item['lockKey']] = copy.deepcopy(item)
+
+    def get(self, key, attributes, consistent=True):
+        self.counts['get'] += 1
+        item = self.items.get(key['lockKey'])
+        if item is None:
+            return None
+        return {a: copy.deepcopy(item[a]) for a in attributes if a in item}
+
+    def permits_held(self):
+        return sum(len(item['holders']) for item in self.items.values())
+
+
+class FakeTime(object):
+    def __init__(self, now=1):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def wait(self, amt, event=None):
+        self.sleeps.append(amt)
+        self.now += amt
+        return False
+
+
+@pytest.fixture
+def semaphore_factory():
+    def wrapped(permits=4, shards=None, backend=None, fake_time=None,
+                notifier=None, poll_with_reads=False, metrics=None):
+        bridge = mock.Mock(spec=DynamoDBVersionLeaseBridge)
+        bridge.ConditionFailedError = ConditionFailedError
+        bridge.lock_free.return_value = ('free', None)
+        bridge.lock_unchanged.side_effect = \
+            lambda version: ('unchanged', version)
+        if backend is None:
+            backend = DictBackend()
+        if fake_time is None:
+            fake_time = FakeTime()
+        technique = ShardedSemaphoreTechnique(
+            'sem', permits, bridge, backend, shards=shards,
+            time_utils=fake_time, notifier=notifier,
+            poll_with_reads=poll_with_reads, metrics=metrics)
+        return technique, backend, fake_time
+    return wrapped
+
+
+class TestShardedSemaphoreTechnique(object):
+    def test_does_divide_permits_between_shards(self, semaphore_factory):
+        technique, _, _ = semaphore_factory(permits=45, shards=4)
+        assert technique._capacities == [12, 11, 11, 11]
+        assert technique.permits == 45
+        technique, _, _ = semaphore_factory(permits=45)
+        assert technique.shards == 3
+
+    @pytest.mark.parametrize('permits,shards', [(0, None), (2, 3), (2, 0)])
+    def test_does_reject_invalid_sizes(self, semaphore_factory, permits,
+                                       shards):
+        with pytest.raises(ValueError):
+            semaphore_factory(permits=permits, shards=shards)
+
+    def test_acquire_is_one_conditional_write(self, semaphore_factory):
+        technique, backend, _ = semaphore_factory(permits=4, shards=2)
+        permit = technique.acquire(5, 200)
+        assert backend.counts == {'put': 1, 'get': 0}
+        shard = [
+            item for item in backend.items.values()
+            if permit in item['holders']
+        ][0]
+        assert shard['holders'][permit] == 6000
+        assert shard['expiresAt'] == 6000
+        assert shard['deleteAfter'] == 3606
+        assert shard['leaseDuration'] == 5
+        assert shard['capacity'] == 2
+
+    def test_does_not_grant_more_than_permits(self, semaphore_factory):
+        backend = DictBackend()
+        first, _, _ = semaphore_factory(3, 2, backend)
+        second, _, _ = semaphore_factory(3, 2, backend)
+        assert first.try_acquire(5) is not None
+        assert second.try_acquire(5) is not None
+        assert first.try_acquire(5) is not None
+        assert second.try_acquire(5) is None
+        assert first.try_acquire(5) is None
+        assert backend.permits_held() == 3
+
+    def test_does_notice_permits_released_elsewhere(self, semaphore_factory):
+        backend = DictBackend()
+        first, _, _ = semaphore_factory(2, 1, backend)
+        second, _, _ = semaphore_factory(2, 1, backend)
+        first.try_acquire(5)
+        permit = second.try_acquire(5)
+        assert first.try_acquire(5) is None
+        second.release(permit)
+        assert first.try_acquire(5) is not None
+
+    def test_does_check_full_shards_again_on_each_call(
+            self, semaphore_factory):
+        technique, backend, _ = semaphore_factory(2, 2)
+        technique.try_acquire(5)
+        technique.try_acquire(5)
+        backend.counts['get'] = 0
+        assert technique.try_acquire(5) is None
+        assert backend.counts['get'] == 2
+        assert technique.try_acquire(5) is None
+        assert backend.counts['get'] == 4
+
+    def test_does_check_full_shards_while_others_acquire(
+            self, semaphore_factory):
+        backend = DictBackend()
+        first, _, _ = semaphore_factory(2, 2, backend)
+        other, _, _ = semaphore_factory(2, 2, backend)
+        permits = [other.try_acquire(5), other.try_acquire(5)]
+        assert first.try_acquire(5) is None
+        # Free a permit on the first shard.
+        other.release(min(permits, key=lambda p: other._permits[p][0]))
+        get = backend.get
+        acquired = []
+        started = []
+
+        def get_during_other_call(key, attributes, consistent=True):
+            if not started:
+                started.append(True)
+                # Another thread finishes a call on the same technique
+                # while this one is still checking shards.
+                thread = threading.Thread(
+                    target=lambda: acquired.append(first.try_acquire(5)))
+                thread.start()
+                thread.join()
+            return get(key, attributes, consistent)
+
+        backend.get = get_during_other_call
+        main_thread = threading.current_thread()
+        # This thread tries the last shard first and the other the first.
+        first._random = mock.Mock()
+        first._random.choice.side_effect = lambda candidates: candidates[
+            -1 if threading.current_thread() is main_thread else 0]
+        assert first.try_acquire(5) is None
+        assert acquired[0] is not None
+        assert backend.permits_held() == 2
+
+    def test_does_reclaim_expired_permits(self, semaphore_factory):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        first, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        second, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        permit = first.try_acquire(5)
+        assert second.try_acquire(5) is None
+        # The lease plus the clock skew margin have to pass.
+        fake_time.now = 8
+        assert second.try_acquire(5) is not None
+        with pytest.raises(LockLostError):
+            first.refresh(permit)
+
+    def test_acquire_does_wait_for_earliest_lease(self, semaphore_factory):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        holder.try_acquire(5)
+        assert waiter.acquire(5, 200) is not None
+        assert fake_time.sleeps == [6.0]
+
+    def test_acquire_does_time_out(self, semaphore_factory):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        holder.try_acquire(50)
+        with pytest.raises(LockNotGrantedError):
+            waiter.acquire(5, 10)
+
+    def test_acquire_does_give_up_at_deadline(self, semaphore_factory):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        holder.try_acquire(50)
+        with pytest.raises(LockNotGrantedError):
+            waiter.acquire(5, 300, deadline=11)
+        assert fake_time.sleeps == []
+
+    def test_acquire_with_notifier_does_wait_until_deadline(
+            self, semaphore_factory):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        notifier = mock.Mock(spec=BaseNotifier)
+        subscription = notifier.subscribe.return_value
+
+        def wait(amt):
+            fake_time.now += amt
+            return False
+        subscription.wait.side_effect = wait
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(
+            1, 1, backend, fake_time, notifier=notifier)
+        holder.try_acquire(50)
+        with pytest.raises(LockNotGrantedError):
+            waiter.acquire(5, 10)
+        subscription.wait.assert_called_once_with(10)
+        subscription.close.assert_called_once_with()
+
+    def test_can_refresh(self, semaphore_factory):
+        technique, backend, fake_time = semaphore_factory(permits=1)
+        permit = technique.acquire(5, 200)
+        fake_time.now = 3
+        technique.refresh(permit)
+        assert backend.items['sem#0']['holders'] == {permit: 8000}
+
+    def test_can_refresh_after_others_change_shard(self, semaphore_factory):
+        backend = DictBackend()
+        first, _, _ = semaphore_factory(2, 1, backend)
+        second, _, _ = semaphore_factory(2, 1, backend)
+        permit = first.acquire(5, 200)
+        second.acquire(5, 200)
+        first.refresh(permit)
+        assert backend.permits_held() == 2
+
+    def test_release_does_publish(self, semaphore_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        technique, backend, _ = semaphore_factory(notifier=notifier)
+        permit = technique.acquire(5, 200)
+        technique.release(permit)
+        notifier.publish.assert_called_once_with('sem')
+        assert backend.permits_held() == 0
+        with pytest.raises(NoSuchLockError):
+            technique.release(permit)
+
+    @pytest.mark.parametrize('poll_with_reads', [False, True])
+    def test_does_poll_full_shards_with_reads(self, semaphore_factory,
+                                              poll_with_reads):
+        backend = DictBackend()
+        fake_time = FakeTime()
+        notifier = mock.Mock(spec=BaseNotifier)
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(
+            1, 1, backend, fake_time, notifier=notifier,
+            poll_with_reads=poll_with_reads)
+        permit = holder.try_acquire(50)
+        notifier.subscribe.return_value.wait.side_effect = \
+            lambda amt: holder.release(permit)
+        original_get = backend.get
+        reads = []
+
+        def get(key, attributes, consistent=True):
+            reads.append(consistent)
+            return original_get(key, attributes, consistent)
+
+        backend.get = get
+        assert waiter.acquire(5, 10) is not None
+        # The first attempt learns the shard is full from its failed write,
+        # the second finds out whether it still is.
+        assert reads == [not poll_with_reads]
+
+
+class TestShardedSemaphoreTechniqueMetrics(object):
+    def test_does_report_uncontended_acquire(self, semaphore_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, _, _ = semaphore_factory(metrics=metrics)
+        technique.acquire(5, 200)
+        metrics.on_acquire.assert_called_once_with('sem', 1, 0, 0)
+
+    def test_does_report_attempts_and_sleeps(self, semaphore_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        backend = DictBackend()
+        fake_time = FakeTime()
+        holder, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        waiter, _, _ = semaphore_factory(
+            1, 1, backend, fake_time, metrics=metrics)
+        holder.try_acquire(5)
+        waiter.acquire(5, 200)
+        metrics.on_acquire.assert_called_once_with('sem', 2, 6.0, 6.0)
+
+    def test_does_report_try_acquire(self, semaphore_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, _, _ = semaphore_factory(1, 1, metrics=metrics)
+        assert technique.try_acquire(5) is not None
+        assert technique.try_acquire(5) is None
+        metrics.on_acquire.assert_called_once_with('sem', 1, 0, 0)
+
+    def test_does_report_refresh_age(self, semaphore_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, _, fake_time = semaphore_factory(metrics=metrics)
+        permit = technique.acquire(5, 200)
+        fake_time.now = 3
+        technique.refresh(permit)
+        metrics.on_refresh.assert_called_once_with('sem', 2, 5)
+        technique.release(permit)
+        assert technique._written_at == {}
+
+    def test_does_report_lost_permit(self, semaphore_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        backend = DictBackend()
+        fake_time = FakeTime()
+        first, _, _ = semaphore_factory(
+            1, 1, backend, fake_time, metrics=metrics)
+        second, _, _ = semaphore_factory(1, 1, backend, fake_time)
+        permit = first.try_acquire(5)
+        fake_time.now = 8
+        second.try_acquire(5)
+        with pytest.raises(LockLostError):
+            first.refresh(permit)
+        metrics.on_lock_lost.assert_called_once_with('sem')
+        assert not metrics.on_refresh.called
+
+
+class TestSemaphore(object):
+    def test_can_acquire_permit(self):
+        technique = mock.Mock(spec=ShardedSemaphoreTechnique)
+        technique.acquire.return_value = 'permit id'
+        semaphore = Semaphore('sem', technique)
+        permit = semaphore.acquire(10, max_wait_seconds=30)
+        assert isinstance(permit, Permit)
+        assert permit.permit_id == 'permit id'
+        technique.acquire.assert_called_once_with(
+            10, max_wait_seconds=30, cancel_event=None,
+            deadline=None)
+        permit.refresh()
+        technique.refresh.assert_called_once_with('permit id')
+        permit.release()
+        technique.release.assert_called_once_with('permit id')
+
+    def test_can_acquire_permit_with_deadline(self):
+        technique = mock.Mock(spec=ShardedSemaphoreTechnique)
+        semaphore = Semaphore('sem', technique)
+        semaphore.acquire(10, deadline=1010)
+        technique.acquire.assert_called_once_with(
+            10, max_wait_seconds=300, cancel_event=None, deadline=1010)
+
+    def test_try_acquire_does_return_none_when_full(self):
+        technique = mock.Mock(spec=ShardedSemaphoreTechnique)
+        technique.try_acquire.return_value = None
+        semaphore = Semaphore('sem', technique)
+        assert semaphore.try_acquire() is None
+
+    def test_permit_is_refreshed_while_held(self):
+        technique = mock.Mock(spec=ShardedSemaphoreTechnique)
+        refresher_factory = mock.Mock(spec=LockRefresherFactory)
+        refresher = mock.Mock(spec=LockRefresher)
+        refresher_factory.create_lock_refresher.return_value = refresher
+        semaphore = Semaphore('sem', technique, refresher_factory)
+        permit = semaphore.acquire(20)
+        refresher_factory.create_lock_refresher.assert_called_once_with(
+            permit, 15)
+        refresher.start.assert_called_once_with()
+        assert not permit.supports_batch_refresh
+        permit.release()
+        refresher.stop.assert_called_once_with()
+
+    def test_can_use_as_context_manager(self):
+        technique = mock.Mock(spec=ShardedSemaphoreTechnique)
+        technique.acquire.return_value = 'permit id'
+        semaphore = Semaphore('sem', technique)
+        with semaphore(lease_duration=5, timeout_seconds=10) as permit:
+            assert permit.permit_id == 'permit id'
+            technique.release.assert_not_called()
+        technique.acquire.assert_called_once_with(
+            5, max_wait_seconds=10, cancel_event=None,
+            deadline=None)
+        technique.release.assert_called_once_with('permit id')
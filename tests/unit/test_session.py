@@ -5,8 +5,18 @@ import mock
 
 import lynk
 from lynk.session import Session
+from lynk.notify import LocalNotifier
 from lynk.lock import Lock
+from lynk.lock import LockGroup
+from lynk.semaphore import Semaphore
+from lynk.techniques import SharedExclusiveTechnique
+from lynk.backends.base import BaseBackend
+from lynk.refresh import LockRefreshScheduler
 from lynk.exceptions import CannotDeserializeError
+from lynk.metrics import InstrumentedBackend
+from lynk.metrics import MetricsHook
+from lynk.throttle import AdaptiveRateLimiter
+from lynk.throttle import RateLimitedBackend
 
 
 class TestSession(object):
@@ -30,6 +40,52 @@ class TestSession(object):
         lock = session.create_lock('foo')
         assert isinstance(lock, Lock)
 
+    def test_does_share_refresher_between_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        first = session.create_lock('foo')
+        second = session.create_lock('bar')
+        assert isinstance(first._refresher_factory, LockRefreshScheduler)
+        assert first._refresher_factory is second._refresher_factory
+
+    def test_can_configure_max_clock_skew(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            max_clock_skew=5,
+        )
+        lock = session.create_lock('foo')
+        assert lock._technique._max_clock_skew == 5
+
+    def test_can_configure_poll_with_reads(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            poll_with_reads=True,
+        )
+        lock = session.create_lock('foo')
+        assert lock._technique._poll_with_reads is True
+
+    def test_does_share_notifier_between_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        first = session.create_lock('foo')
+        second = session.create_lock('bar')
+        assert isinstance(first._technique._notifier, LocalNotifier)
+        assert first._technique._notifier is second._technique._notifier
+
     def test_can_create_lock_without_refresher(self):
         identifier = 'foobar'
         bridge_factory = mock.Mock()
@@ -45,6 +101,256 @@ class TestSession(object):
         # simple unit test we will reach into the private varaible to check.
         assert lock._refresher_factory is None
 
+    def test_can_acquire_many(self):
+        bridge_factory = mock.Mock()
+        backend = mock.Mock(spec=BaseBackend)
+        backend.MAX_TRANSACTION_ITEMS = 100
+        bridge_factory.create.return_value = (mock.Mock(), backend)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        group = session.acquire_many(['foo', 'bar'], auto_refresh=False)
+        assert isinstance(group, LockGroup)
+        assert group.names == ['bar', 'foo']
+        backend.transact_write.assert_called_once()
+        group.release()
+        assert backend.transact_write.call_count == 2
+
+    def test_can_create_shared_and_exclusive_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        shared = session.create_lock('foo', mode='shared')
+        exclusive = session.create_lock('foo', mode='exclusive')
+        plain = session.create_lock('foo')
+        assert isinstance(shared._technique, SharedExclusiveTechnique)
+        assert shared._technique._mode == 'shared'
+        assert exclusive._technique._mode == 'exclusive'
+        assert not isinstance(plain._technique, SharedExclusiveTechnique)
+        with pytest.raises(ValueError):
+            session.create_lock('foo', mode='bar')
+
+    def test_can_deserialize_shared_lock(self):
+        bridge_factory = mock.Mock()
+        backend = mock.Mock()
+        backend.get.return_value = {
+            'versionNumber': 'version',
+            'mode': 'shared',
+            'holders': {'holder': 20000},
+            'intent': {},
+        }
+        bridge_factory.create.return_value = (mock.Mock(), backend)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        lock = session.deserialize_lock(json.dumps({
+            '__version': 'Lock.1',
+            'name': 'foo',
+            'technique': json.dumps({
+                '__version': 'SharedExclusiveTechnique.1',
+                'mode': 'shared',
+                'versions': {'foo': 'holder'},
+                'leases': {'foo': 20},
+            }),
+        }), auto_refresh=False)
+        assert isinstance(lock._technique, SharedExclusiveTechnique)
+        assert lock._technique._mode == 'shared'
+        backend.put.assert_called_once()
+
+    def test_can_create_semaphore(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        semaphore = session.create_semaphore('foo', 200, shards=5)
+        assert isinstance(semaphore, Semaphore)
+        assert semaphore.permits == 200
+        assert semaphore._technique.shards == 5
+        assert isinstance(semaphore._refresher_factory, LockRefreshScheduler)
+
+    def test_can_create_reentrant_lock(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        first = session.create_lock('foo', reentrant=True)
+        second = session.create_lock('foo', reentrant=True)
+        plain = session.create_lock('foo')
+        assert first._holds is not None
+        assert first._holds is second._holds
+        assert plain._holds is None
+
+    def test_can_make_locks_reentrant_by_default(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            reentrant_locks=True,
+        )
+        assert session.create_lock('foo')._holds is not None
+        assert session.create_lock('foo', reentrant=False)._holds is None
+
+    def test_lock_group_does_share_refresher(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        lock = session.create_lock('foo')
+        group = session.create_lock_group(['bar', 'baz'])
+        assert group._refresher_factory is lock._refresher_factory
+
+    def test_does_share_backend_between_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        session.create_lock('foo')
+        session.create_lock('bar')
+        session.deserialize_lock(json.dumps({
+            '__version': 'Lock.1',
+            'name': 'baz',
+            'technique': (
+                '{"__version": "VersionLeaseTechinque.1", '
+                '"versions": {"baz": "version-identifier"}, '
+                '"leases": {"baz": 20}}'
+            ),
+        }), auto_refresh=False)
+        bridge_factory.create.assert_called_once_with('table_name')
+
+    def test_can_rate_limit_backend(self):
+        bridge_factory = mock.Mock()
+        backend = mock.Mock(spec=BaseBackend)
+        bridge_factory.create.return_value = (mock.Mock(), backend)
+        rate_limiter = mock.Mock(spec=AdaptiveRateLimiter)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            rate_limiter=rate_limiter,
+        )
+        _, limited = session._get_bridge_and_backend()
+        assert isinstance(limited, RateLimitedBackend)
+        limited.delete({'lockKey': 'foo'})
+        rate_limiter.acquire.assert_called_once_with(False, None)
+        backend.delete.assert_called_once_with(
+            {'lockKey': 'foo'}, condition=None)
+
+    def test_does_disable_botocore_retries_when_rate_limited(self):
+        session = Session(
+            'table_name', rate_limiter=mock.Mock(spec=AdaptiveRateLimiter))
+        assert session._backend_bridge_factory._max_attempts == 1
+        assert Session('table_name')._backend_bridge_factory._max_attempts \
+            is None
+
+    def test_does_not_rate_limit_backend_by_default(self):
+        bridge_factory = mock.Mock()
+        backend = mock.Mock(spec=BaseBackend)
+        bridge_factory.create.return_value = (mock.Mock(), backend)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+        )
+        assert session._get_bridge_and_backend()[1] is backend
+
+    def test_can_measure_backend(self):
+        bridge_factory = mock.Mock()
+        bridge = mock.Mock()
+        bridge.ConditionFailedError = ValueError
+        backend = mock.Mock(spec=BaseBackend)
+        bridge_factory.create.return_value = (bridge, backend)
+        metrics = mock.Mock(spec=MetricsHook)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            metrics=metrics,
+        )
+        _, measured = session._get_bridge_and_backend()
+        assert isinstance(measured, InstrumentedBackend)
+        backend.delete.side_effect = ValueError()
+        with pytest.raises(ValueError):
+            measured.delete({'lockKey': 'foo'})
+        metrics.on_condition_failed.assert_called_once_with('delete')
+        lock = session.create_lock('foo', auto_refresh=False)
+        assert lock._technique._metrics is metrics
+
+    def test_does_configure_shared_and_exclusive_locks(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        metrics = mock.Mock(spec=MetricsHook)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            poll_with_reads=True,
+            coalesce_waiters=True,
+            metrics=metrics,
+        )
+        lock = session.create_lock('foo', mode='exclusive')
+        assert lock._technique._metrics is metrics
+        assert lock._technique._poll_with_reads is True
+        assert lock._technique._wait_queue is session._wait_queue
+        assert lock._technique._wait_queue is not None
+
+    def test_does_configure_deserialized_shared_lock(self):
+        bridge_factory = mock.Mock()
+        bridge = mock.Mock()
+        bridge.ConditionFailedError = ValueError
+        backend = mock.Mock(spec=BaseBackend)
+        backend.get.return_value = {
+            'versionNumber': 'version',
+            'mode': 'shared',
+            'holders': {'holder': 20000},
+            'intent': {},
+        }
+        bridge_factory.create.return_value = (bridge, backend)
+        metrics = mock.Mock(spec=MetricsHook)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            poll_with_reads=True,
+            coalesce_waiters=True,
+            metrics=metrics,
+        )
+        lock = session.deserialize_lock(json.dumps({
+            '__version': 'Lock.1',
+            'name': 'foo',
+            'technique': json.dumps({
+                '__version': 'SharedExclusiveTechnique.1',
+                'mode': 'shared',
+                'versions': {'foo': 'holder'},
+                'leases': {'foo': 20},
+            }),
+        }), auto_refresh=False)
+        assert lock._technique._metrics is metrics
+        assert lock._technique._poll_with_reads is True
+        assert lock._technique._wait_queue is session._wait_queue
+
+    def test_does_configure_semaphore(self):
+        bridge_factory = mock.Mock()
+        bridge_factory.create.return_value = (mock.Mock(), mock.Mock())
+        metrics = mock.Mock(spec=MetricsHook)
+        session = Session(
+            'table_name',
+            backend_bridge_factory=bridge_factory,
+            poll_with_reads=True,
+            metrics=metrics,
+        )
+        semaphore = session.create_semaphore('foo', 20)
+        assert semaphore._technique._metrics is metrics
+        assert semaphore._technique._poll_with_reads is True
+
     def test_can_deserialize_lock(self):
         bridge_factory = mock.Mock()
         mock_bridge = mock.Mock()
@@ -59,7 +365,8 @@ class TestSession(object):
             'name': 'foo',
             'technique': (
                 '{"__version": "VersionLeaseTechinque.1", '
-                '"versions": {"foo": "version-identifier"}}'
+                '"versions": {"foo": "version-identifier"}, '
+                '"leases": {"foo": 20}}'
             ),
         })
         lock = session.deserialize_lock(serialized_lock)
@@ -88,7 +395,8 @@ class TestSession(object):
             'name': 'foo',
             'technique': (
                 '{"__version": "VersionLeaseTechinque.1", '
-                '"versions": {"foo": "version-identifier"}}'
+                '"versions": {"foo": "version-identifier"}, '
+                '"leases": {"foo": 20}}'
             ),
         })
         lock = session.deserialize_lock(serialized_lock, auto_refresh=False)
@@ -0,0 +1,175 @@
+import pytest
+import mock
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.base import Delete
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.dynamodb_client import DynamoDBClientBackend
+from lynk.backends.dynamodb_client import DynamoDBClientVersionLeaseBridge
+from lynk.backends.sharded import ConsistentHashRing
+from lynk.backends.sharded import ShardedBackend
+from lynk.backends.sharded import ShardedBackendBridgeFactory
+from lynk.backends.sharded import shard_table_names
+
+
+@pytest.fixture
+def create_backend():
+    def wrapped(table_names=('a', 'b', 'c')):
+        backends = {}
+        for name in table_names:
+            backends[name] = mock.Mock(spec=BaseBackend)
+            backends[name].MAX_TRANSACTION_ITEMS = 100
+        ring = ConsistentHashRing(list(table_names))
+        return ShardedBackend(ring, backends), backends, ring
+    return wrapped
+
+
+def _names_on(ring, node, count):
+    names = ('lock %d' % i for i in range(10000))
+    return [name for name in names if ring.node_for(name) == node][:count]
+
+
+class TestShardTableNames(object):
+    def test_does_number_tables(self):
+        assert shard_table_names('locks', 3) == [
+            'locks-0', 'locks-1', 'locks-2']
+
+
+class TestConsistentHashRing(object):
+    def test_does_spread_keys_evenly(self):
+        ring = ConsistentHashRing(['a', 'b', 'c', 'd'])
+        counts = {'a': 0, 'b': 0, 'c': 0, 'd': 0}
+        for i in range(10000):
+            counts[ring.node_for('lock %d' % i)] += 1
+        for count in counts.values():
+            assert 1500 < count < 3500
+
+    def test_does_move_few_keys_when_node_added(self):
+        before = ConsistentHashRing(['a', 'b', 'c', 'd'])
+        after = ConsistentHashRing(['a', 'b', 'c', 'd', 'e'])
+        keys = ['lock %d' % i for i in range(10000)]
+        moved = [key for key in keys
+                 if before.node_for(key) != after.node_for(key)]
+        assert all(after.node_for(key) == 'e' for key in moved)
+        assert len(moved) < 3000
+
+    def test_does_require_unique_nodes(self):
+        with pytest.raises(ValueError):
+            ConsistentHashRing([])
+        with pytest.raises(ValueError):
+            ConsistentHashRing(['a', 'a'])
+
+
+class TestShardedBackend(object):
+    def test_does_route_by_lock_key(self, create_backend):
+        sharded, backends, ring = create_backend()
+        name = _names_on(ring, 'b', 1)[0]
+        key = {'lockKey': name}
+        sharded.put({'lockKey': name}, condition='condition')
+        sharded.update(key, {'a': 1})
+        sharded.delete(key)
+        sharded.get(key, ['versionNumber'])
+        backend = backends['b']
+        backend.put.assert_called_once_with(
+            {'lockKey': name}, condition='condition')
+        backend.update.assert_called_once_with(key, {'a': 1}, condition=None)
+        backend.delete.assert_called_once_with(key, condition=None)
+        backend.get.assert_called_once_with(
+            key, ['versionNumber'], consistent=True)
+        assert not backends['a'].method_calls
+        assert not backends['c'].method_calls
+
+    def test_does_use_smallest_transaction_limit(self, create_backend):
+        _, backends, ring = create_backend()
+        backends['a'].MAX_TRANSACTION_ITEMS = 25
+        assert ShardedBackend(ring, backends).MAX_TRANSACTION_ITEMS == 25
+
+    def test_does_pass_transaction_on_one_shard(self, create_backend):
+        sharded, backends, ring = create_backend()
+        first, second = _names_on(ring, 'c', 2)
+        operations = [
+            Put({'lockKey': first}, None),
+            Delete({'lockKey': second}, None),
+        ]
+        sharded.transact_write(operations)
+        backends['c'].transact_write.assert_called_once_with(operations)
+
+    def test_does_write_transaction_across_shards(self, create_backend):
+        sharded, backends, ring = create_backend()
+        first = _names_on(ring, 'a', 1)[0]
+        second = _names_on(ring, 'b', 1)[0]
+        for backend in backends.values():
+            backend.transact_write_items = mock.Mock()
+            backend.build_transact_item = mock.Mock()
+        operations = [
+            Put({'lockKey': first}, None),
+            Update({'lockKey': second}, {'a': 1}, None),
+        ]
+        sharded.transact_write(operations)
+        backends['a'].transact_write_items.assert_called_once_with([
+            backends['a'].build_transact_item.return_value,
+            backends['b'].build_transact_item.return_value,
+        ])
+        backends['b'].build_transact_item.assert_called_once_with(
+            operations[1])
+
+    def test_does_reject_transaction_across_unsupported_shards(
+            self, create_backend):
+        sharded, _, ring = create_backend()
+        operations = [
+            Put({'lockKey': _names_on(ring, 'a', 1)[0]}, None),
+            Put({'lockKey': _names_on(ring, 'b', 1)[0]}, None),
+        ]
+        with pytest.raises(ValueError):
+            sharded.transact_write(operations)
+
+
+    def test_does_not_support_transactions_across_unsupported_shards(
+            self, create_backend):
+        sharded, _, _ = create_backend()
+        assert sharded.SUPPORTS_TRANSACTIONS is False
+
+    def test_does_support_transactions_across_capable_shards(
+            self, create_backend):
+        _, backends, ring = create_backend()
+        for backend in backends.values():
+            backend.transact_write_items = mock.Mock()
+        assert ShardedBackend(ring, backends).SUPPORTS_TRANSACTIONS is True
+
+    def test_does_support_transactions_on_one_shard(self, create_backend):
+        sharded, _, _ = create_backend(table_names=('a',))
+        assert sharded.SUPPORTS_TRANSACTIONS is True
+
+
+class TestShardedBackendBridgeFactory(object):
+    def test_does_create_backend_per_table(self):
+        inner = mock.Mock()
+        bridge = mock.Mock()
+        inner.create.side_effect = lambda name: (bridge, mock.Mock(
+            spec=BaseBackend, MAX_TRANSACTION_ITEMS=100))
+        factory = ShardedBackendBridgeFactory(
+            ['a', 'b'], backend_bridge_factory=inner)
+        created_bridge, backend = factory.create('locks')
+        assert created_bridge is bridge
+        assert isinstance(backend, ShardedBackend)
+        assert inner.create.call_args_list == [mock.call('a'), mock.call('b')]
+
+    def test_can_write_one_transaction_to_dynamodb_tables(self):
+        client = mock.Mock()
+        bridge = DynamoDBClientVersionLeaseBridge(client)
+        ring = ConsistentHashRing(['a', 'b'])
+        sharded = ShardedBackend(ring, {
+            'a': DynamoDBClientBackend(client, 'a'),
+            'b': DynamoDBClientBackend(client, 'b'),
+        })
+        first = _names_on(ring, 'a', 1)[0]
+        second = _names_on(ring, 'b', 1)[0]
+        sharded.transact_write([
+            Put({'lockKey': first}, bridge.lock_free()),
+            Put({'lockKey': second}, bridge.lock_free()),
+        ])
+        items = client.transact_write_items.call_args[1]['TransactItems']
+        assert [item['Put']['TableName'] for item in items] == ['a', 'b']
+        assert [item['Put']['Item']['lockKey'] for item in items] == [
+            {'S': first}, {'S': second}]
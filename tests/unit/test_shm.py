@@ -0,0 +1,291 @@
+import time
+import threading
+
+import pytest
+
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
+from lynk.backends.shm import SharedMemoryBackendBridgeFactory
+from lynk.backends.shm import SharedMemoryTable
+from lynk.backends.shm import TableFullError
+from lynk.backends.shm import ItemTooLargeError
+from lynk.exceptions import TransactionConflictError
+
+
+@pytest.fixture
+def create_backend(tmpdir):
+    def wrapped(table_name='table name', **kwargs):
+        factory = SharedMemoryBackendBridgeFactory(str(tmpdir), **kwargs)
+        return factory.create(table_name)
+    return wrapped
+
+
+class TestSharedMemoryTable(object):
+    def test_does_keep_sizes_of_existing_table(self, tmpdir):
+        path = str(tmpdir.join('table'))
+        SharedMemoryTable(path, 16, 1024, 4)
+        table = SharedMemoryTable(path, 32, 2048, 8)
+        assert table._slots == 16
+        assert table._slot_size == 1024
+        assert table._probe_limit == 4
+
+    def test_does_reject_other_files(self, tmpdir):
+        path = tmpdir.join('table')
+        path.write('not a lock table, but long enough to have a header' * 2)
+        with pytest.raises(ValueError):
+            SharedMemoryTable(str(path), 16, 1024, 4)
+
+    def test_does_reject_tiny_slots(self, tmpdir):
+        with pytest.raises(ValueError):
+            SharedMemoryTable(str(tmpdir.join('table')), 16, 64, 4)
+
+    def test_can_round_trip_item(self, tmpdir):
+        table = SharedMemoryTable(str(tmpdir.join('table')), 16, 1024, 4)
+        item = {
+            'lockKey': 'foo', 'versionNumber': 'a', 'expiresAt': 1000,
+            'hostIdentifier': 'host', 'leaseDuration': 20,
+            'holders': {'x': 1},
+        }
+        table.write(3, item)
+        assert table.read(3) == item
+        assert table.read(3, full=False) == {
+            'lockKey': 'foo', 'versionNumber': 'a', 'expiresAt': 1000}
+
+    def test_does_reject_items_too_big_for_slot(self, tmpdir):
+        table = SharedMemoryTable(str(tmpdir.join('table')), 16, 1024, 4)
+        with pytest.raises(ItemTooLargeError):
+            table.write(0, {'lockKey': 'foo', 'payload': 'x' * 1024})
+
+    def test_threads_on_distant_names_do_run_in_parallel(self, tmpdir):
+        table = SharedMemoryTable(str(tmpdir.join('table')), 64, 1024, 4)
+        names = ['lock %s' % i for i in range(64)]
+        first = names[0]
+        second = [
+            name for name in names
+            if abs(table.home(name) - table.home(first)) >= 8][0]
+        inside = threading.Event()
+        overlapped = []
+
+        def enter():
+            with table.locked([second]):
+                inside.set()
+
+        with table.locked([first]):
+            thread = threading.Thread(target=enter)
+            thread.start()
+            overlapped.append(inside.wait(5))
+        thread.join()
+        assert overlapped == [True]
+
+    def test_does_exclude_threads_on_overlapping_windows(self, tmpdir):
+        table = SharedMemoryTable(str(tmpdir.join('table')), 64, 1024, 4)
+        names = ['lock %s' % i for i in range(64)]
+        first = names[0]
+        second = [
+            name for name in names
+            if 0 < abs(table.home(name) - table.home(first)) < 4][0]
+        inside = threading.Event()
+
+        def enter():
+            with table.locked([first, second]):
+                inside.set()
+
+        with table.locked([second]):
+            thread = threading.Thread(target=enter)
+            thread.start()
+            assert not inside.wait(0.05)
+        thread.join()
+        assert inside.is_set()
+
+
+class TestSharedMemoryBackend(object):
+    def test_can_put_and_get(self, create_backend):
+        _, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'host': 'h'})
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber', 'gone']) == {
+            'versionNumber': 'a'}
+
+    def test_can_get_no_result(self, create_backend):
+        _, backend = create_backend()
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) is None
+
+    def test_backends_share_table_file(self, tmpdir):
+        _, first = SharedMemoryBackendBridgeFactory(str(tmpdir)).create('t')
+        _, second = SharedMemoryBackendBridgeFactory(str(tmpdir)).create('t')
+        first.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        assert second.get({'lockKey': 'foo'}, ['versionNumber']) == {
+            'versionNumber': 'a'}
+
+    def test_factories_share_one_table_per_file(self, tmpdir):
+        _, first = SharedMemoryBackendBridgeFactory(str(tmpdir)).create('t')
+        _, second = SharedMemoryBackendBridgeFactory(
+            str(tmpdir.join('..', tmpdir.basename))).create('t')
+        assert first._table is second._table
+
+    def test_factories_do_exclude_threads(self, tmpdir):
+        tables = [
+            SharedMemoryBackendBridgeFactory(str(tmpdir)).create('t')[1]._table
+            for _ in range(2)
+        ]
+        active = []
+        overlaps = []
+
+        def enter(table):
+            for _ in range(50):
+                with table.locked(['k']):
+                    active.append(None)
+                    if len(active) > 1:
+                        overlaps.append(None)
+                    time.sleep(0.0001)
+                    active.pop()
+
+        threads = [
+            threading.Thread(target=enter, args=(table,)) for table in tables]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not overlaps
+
+    def test_can_put_if_free(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'},
+                    condition=bridge.lock_free())
+        with pytest.raises(bridge.ConditionFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_free())
+        assert e.value.existing_item == {
+            'lockKey': 'foo', 'versionNumber': 'a'}
+
+    def test_can_put_if_lease_elapsed(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a',
+                     'expiresAt': 100})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_free_or_lease_elapsed(100))
+        backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                    condition=bridge.lock_free_or_lease_elapsed(101))
+
+    def test_failed_put_without_item_does_attach_none(self, create_backend):
+        bridge, backend = create_backend()
+        with pytest.raises(bridge.ConditionFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_expired('a'))
+        assert e.value.existing_item is None
+
+    def test_can_update(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'lease': 1})
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'},
+                       condition=bridge.we_own_lock('a'))
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber', 'lease']) \
+            == {'versionNumber': 'b', 'lease': 1}
+
+    def test_update_does_create_missing_item(self, create_backend):
+        _, backend = create_backend()
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'})
+        assert backend.get({'lockKey': 'foo'}, ['lockKey', 'versionNumber']) \
+            == {'lockKey': 'foo', 'versionNumber': 'b'}
+
+    def test_can_delete_with_condition(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.delete({'lockKey': 'foo'},
+                           condition=bridge.we_own_lock('b'))
+        backend.delete({'lockKey': 'foo'}, condition=bridge.we_own_lock('a'))
+        assert backend.get({'lockKey': 'foo'}, ['lockKey']) is None
+
+    def test_does_probe_past_taken_slots(self, create_backend):
+        _, backend = create_backend(slots=8, probe_limit=3)
+        table = backend._table
+        names = [
+            name for name in ('lock %s' % i for i in range(100))
+            if table.home(name) == table.home('lock 0')
+        ][:3]
+        assert len(names) == 3
+        for name in names:
+            backend.update({'lockKey': name}, {'versionNumber': name})
+        for name in names:
+            assert backend.get({'lockKey': name}, ['versionNumber']) == {
+                'versionNumber': name}
+
+    def test_does_reuse_deleted_slots(self, create_backend):
+        _, backend = create_backend(slots=1, probe_limit=1)
+        backend.put({'lockKey': 'a'})
+        with pytest.raises(TableFullError):
+            backend.put({'lockKey': 'b'})
+        backend.delete({'lockKey': 'a'})
+        backend.put({'lockKey': 'b'})
+
+    def test_can_transact_write(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        backend.put({'lockKey': 'c', 'versionNumber': '1'})
+        backend.transact_write([
+            Put({'lockKey': 'a', 'versionNumber': '2'}, bridge.lock_free()),
+            Update({'lockKey': 'b'}, {'versionNumber': '2'},
+                   bridge.we_own_lock('1')),
+            Delete({'lockKey': 'c'}, bridge.we_own_lock('1')),
+        ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'b'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'c'}, ['versionNumber']) is None
+
+    def test_transact_write_does_raise_conflict(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Put({'lockKey': 'a', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Put({'lockKey': 'b', 'versionNumber': '2'},
+                    bridge.lock_free()),
+            ])
+        assert e.value.failed_indexes == [1]
+        assert e.value.existing_items == {
+            1: {'lockKey': 'b', 'versionNumber': '1'}}
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) is None
+
+    def test_transact_write_does_not_apply_part_of_item_too_large(
+            self, create_backend):
+        bridge, backend = create_backend(slot_size=1024)
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        with pytest.raises(ItemTooLargeError):
+            backend.transact_write([
+                Put({'lockKey': 'a', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Delete({'lockKey': 'b'}, bridge.we_own_lock('1')),
+                Update({'lockKey': 'c'}, {'payload': 'x' * 1024}, None),
+            ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) is None
+        assert backend.get({'lockKey': 'b'}, ['versionNumber']) == {
+            'versionNumber': '1'}
+
+    def test_transact_write_does_not_apply_part_of_full_table(
+            self, create_backend):
+        bridge, backend = create_backend(slots=1, probe_limit=1)
+        with pytest.raises(TableFullError):
+            backend.transact_write([
+                Put({'lockKey': 'a', 'versionNumber': '1'},
+                    bridge.lock_free()),
+                Put({'lockKey': 'b', 'versionNumber': '1'},
+                    bridge.lock_free()),
+            ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) is None
+
+    def test_transact_write_does_put_new_items_in_different_slots(
+            self, create_backend):
+        bridge, backend = create_backend(slots=2, probe_limit=2)
+        backend.transact_write([
+            Put({'lockKey': 'a', 'versionNumber': '1'}, bridge.lock_free()),
+            Put({'lockKey': 'b', 'versionNumber': '2'}, bridge.lock_free()),
+        ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) == {
+            'versionNumber': '1'}
+        assert backend.get({'lockKey': 'b'}, ['versionNumber']) == {
+            'versionNumber': '2'}
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+
+import pytest
+
+from lynk.backends.base import Put
+from lynk.backends.base import Update
+from lynk.backends.base import Delete
+from lynk.backends.sqlite import SQLiteBackendBridgeFactory
+from lynk.backends.sqlite import SQLiteConnectionPool
+from lynk.backends.sqlite import ConditionalCheckFailedError
+from lynk.exceptions import TransactionConflictError
+
+
+@pytest.fixture
+def create_backend(tmpdir):
+    def wrapped(table_name='table name'):
+        factory = SQLiteBackendBridgeFactory(str(tmpdir.join('locks.db')))
+        return factory.create(table_name)
+    return wrapped
+
+
+class TestSQLiteConnectionPool(object):
+    def test_does_reuse_connections(self, tmpdir):
+        pool = SQLiteConnectionPool(str(tmpdir.join('locks.db')))
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        assert first is second
+
+    def test_does_use_wal(self, tmpdir):
+        pool = SQLiteConnectionPool(str(tmpdir.join('locks.db')))
+        with pool.connection() as connection:
+            mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'wal'
+
+    def test_does_limit_idle_connections(self, tmpdir):
+        pool = SQLiteConnectionPool(
+            str(tmpdir.join('locks.db')), max_idle_connections=1)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                pass
+        # The second is returned first, and fills the pool.
+        assert pool._idle == [second]
+        with pytest.raises(sqlite3.ProgrammingError):
+            first.execute('SELECT 1')
+
+    def test_failed_transaction_does_roll_back(self, tmpdir):
+        pool = SQLiteConnectionPool(str(tmpdir.join('locks.db')))
+        with pool.connection() as connection:
+            connection.execute('CREATE TABLE t (x)')
+        with pytest.raises(ValueError):
+            with pool.transaction() as connection:
+                connection.execute('INSERT INTO t VALUES (1)')
+                raise ValueError()
+        with pool.connection() as connection:
+            assert not connection.in_transaction
+            assert connection.execute('SELECT * FROM t').fetchall() == []
+
+    def test_does_not_reuse_connections_of_parent_process(self, tmpdir):
+        pool = SQLiteConnectionPool(str(tmpdir.join('locks.db')))
+        with pool.connection() as inherited:
+            pass
+        pool._pid = os.getpid() + 1
+        with pool.connection() as connection:
+            pass
+        assert connection is not inherited
+
+
+class TestSQLiteBackend(object):
+    def test_can_put_and_get(self, create_backend):
+        _, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'host': 'h'})
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber', 'gone']) == {
+            'versionNumber': 'a'}
+
+    def test_can_get_no_result(self, create_backend):
+        _, backend = create_backend()
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) is None
+
+    def test_can_store_maps(self, create_backend):
+        _, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'holders': {'a': 1000}})
+        assert backend.get({'lockKey': 'foo'}, ['holders']) == {
+            'holders': {'a': 1000}}
+
+    def test_tables_are_separate(self, create_backend):
+        _, first = create_backend('first')
+        _, second = create_backend('second "quoted"')
+        first.put({'lockKey': 'foo'})
+        assert second.get({'lockKey': 'foo'}, ['lockKey']) is None
+
+    def test_can_put_if_free(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'},
+                    condition=bridge.lock_free())
+        with pytest.raises(bridge.ConditionFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_free())
+        assert e.value.existing_item == {
+            'lockKey': 'foo', 'versionNumber': 'a'}
+
+    def test_can_put_if_free_or_expired(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                    condition=bridge.lock_free_or_expired('a'))
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.put({'lockKey': 'foo', 'versionNumber': 'c'},
+                        condition=bridge.lock_free_or_expired('a'))
+        assert backend.get({'lockKey': 'foo'}, ['versionNumber']) == {
+            'versionNumber': 'b'}
+
+    def test_can_put_if_lease_elapsed(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a',
+                     'expiresAt': 100})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_free_or_lease_elapsed(100))
+        backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                    condition=bridge.lock_free_or_lease_elapsed(101))
+
+    def test_failed_put_without_item_does_attach_none(self, create_backend):
+        bridge, backend = create_backend()
+        with pytest.raises(ConditionalCheckFailedError) as e:
+            backend.put({'lockKey': 'foo', 'versionNumber': 'b'},
+                        condition=bridge.lock_expired('a'))
+        assert e.value.existing_item is None
+        assert backend.get({'lockKey': 'foo'}, ['lockKey']) is None
+
+    def test_can_update(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a', 'lease': 1})
+        backend.update({'lockKey': 'foo'},
+                       {'versionNumber': 'b', 'holders': {'x': 1}},
+                       condition=bridge.we_own_lock('a'))
+        assert backend.get(
+            {'lockKey': 'foo'}, ['versionNumber', 'lease', 'holders']) == {
+                'versionNumber': 'b', 'lease': 1, 'holders': {'x': 1}}
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.update({'lockKey': 'foo'}, {'versionNumber': 'c'},
+                           condition=bridge.we_own_lock('a'))
+
+    def test_update_does_create_missing_item(self, create_backend):
+        _, backend = create_backend()
+        backend.update({'lockKey': 'foo'}, {'versionNumber': 'b'})
+        assert backend.get({'lockKey': 'foo'}, ['lockKey', 'versionNumber']) \
+            == {'lockKey': 'foo', 'versionNumber': 'b'}
+
+    def test_can_delete_with_condition(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'foo', 'versionNumber': 'a'})
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.delete({'lockKey': 'foo'},
+                           condition=bridge.we_own_lock('b'))
+        backend.delete({'lockKey': 'foo'}, condition=bridge.we_own_lock('a'))
+        assert backend.get({'lockKey': 'foo'}, ['lockKey']) is None
+        with pytest.raises(bridge.ConditionFailedError):
+            backend.delete({'lockKey': 'foo'},
+                           condition=bridge.we_own_lock('a'))
+
+    def test_can_transact_write(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        backend.put({'lockKey': 'c', 'versionNumber': '1'})
+        backend.transact_write([
+            Put({'lockKey': 'a', 'versionNumber': '2'}, bridge.lock_free()),
+            Update({'lockKey': 'b'}, {'versionNumber': '2'},
+                   bridge.we_own_lock('1')),
+            Delete({'lockKey': 'c'}, bridge.we_own_lock('1')),
+        ])
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'b'}, ['versionNumber']) == {
+            'versionNumber': '2'}
+        assert backend.get({'lockKey': 'c'}, ['versionNumber']) is None
+
+    def test_transact_write_conflict_does_roll_back(self, create_backend):
+        bridge, backend = create_backend()
+        backend.put({'lockKey': 'b', 'versionNumber': '1'})
+        backend.put({'lockKey': 'c', 'versionNumber': '1'})
+        with pytest.raises(TransactionConflictError) as e:
+            backend.transact_write([
+                Put({'lockKey': 'a', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Put({'lockKey': 'b', 'versionNumber': '2'},
+                    bridge.lock_free()),
+                Update({'lockKey': 'c'}, {'versionNumber': '2'},
+                       bridge.we_own_lock('0')),
+            ])
+        assert e.value.failed_indexes == [1, 2]
+        assert e.value.existing_items == {
+            1: {'lockKey': 'b', 'versionNumber': '1'}}
+        assert backend.get({'lockKey': 'a'}, ['versionNumber']) is None
+        assert backend.get({'lockKey': 'c'}, ['versionNumber']) == {
+            'versionNumber': '1'}
@@ -1,15 +1,28 @@
+import copy
 import json
+import time
+import threading
 
 import pytest
 import mock
 
 from lynk.techniques import VersionLeaseTechinque
+from lynk.techniques import SharedExclusiveTechnique
+from lynk.lock import LockGroup
 from lynk.exceptions import NoSuchLockError
 from lynk.exceptions import LockLostError
 from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import LockAcquireCancelledError
 from lynk.exceptions import CannotDeserializeError
+from lynk.exceptions import TransactionConflictError
 from lynk.backends.base import BaseBackend
 from lynk.backends.dynamodb import DynamoDBVersionLeaseBridge
+from lynk.wait import BaseWaitStrategy
+from lynk.notify import BaseNotifier
+from lynk.notify import LocalNotifier
+from lynk.notify import Subscription
+from lynk.coalesce import LocalWaitQueue
+from lynk.metrics import MetricsHook
 
 
 class ConditionFailedError(Exception):
@@ -17,10 +30,13 @@ class ConditionFailedError(Exception):
 
 
 class FakeTime(object):
-    def __init__(self, times=None):
+    def __init__(self, times=None, perf_counters=None):
         if times is None:
             times = []
+        if perf_counters is None:
+            perf_counters = []
         self._times = times
+        self._perf_counters = perf_counters
         self.sleeps = []
 
     def time(self):
@@ -28,22 +44,50 @@ class FakeTime(object):
             return self._times.pop(0)
         return 1
 
+    def perf_counter(self):
+        if self._perf_counters:
+            return self._perf_counters.pop(0)
+        return 0
+
     def sleep(self, amt):
         self.sleeps.append(amt)
 
+    def wait(self, amt, event=None):
+        self.sleeps.append(amt)
+        return event is not None and event.is_set()
+
+
+class FixedWaitStrategy(BaseWaitStrategy):
+    truncate_at_deadline = True
+
+    def __init__(self, wait):
+        self._wait = wait
+        self.calls = []
+
+    def next_wait(self, attempt, previous_wait, remaining_lease):
+        self.calls.append((attempt, previous_wait, remaining_lease))
+        return self._wait
+
 
 @pytest.fixture
 def version_lease_factory():
-    def wrapped(bridge=None, backend=None, host=None, times=None):
+    def wrapped(bridge=None, backend=None, host=None, times=None,
+                wait_strategy=None, poll_with_reads=False, notifier=None,
+                wait_queue=None, metrics=None, perf_counters=None):
         if bridge is None:
             bridge = mock.Mock(spec=DynamoDBVersionLeaseBridge)
             bridge.ConditionFailedError = ConditionFailedError
             bridge.NoSuchLockError = NoSuchLockError
         if backend is None:
             backend = mock.Mock(spec=BaseBackend)
-        fake_time = FakeTime(times)
+        fake_time = FakeTime(times, perf_counters)
         vlt = VersionLeaseTechinque(bridge, backend, host_identifier=host,
-                                    time_utils=fake_time)
+                                    time_utils=fake_time,
+                                    wait_strategy=wait_strategy,
+                                    poll_with_reads=poll_with_reads,
+                                    notifier=notifier,
+                                    wait_queue=wait_queue,
+                                    metrics=metrics)
         return vlt, bridge, backend, fake_time
     return wrapped
 
@@ -69,12 +113,52 @@ class TestVersionLeaseTechnique(object):
             'versions': {
                 'test-lock': 'version-identifier',
             },
+            'leases': {
+                'test-lock': 20,
+            },
         })
         vlt = VersionLeaseTechinque.from_serialized_technique(
             serialized, bridge, backend)
         assert isinstance(vlt, VersionLeaseTechinque)
         vlt.refresh('test-lock')
         bridge.we_own_lock.assert_called_with('version-identifier')
+        backend.get.assert_not_called()
+
+    def test_can_deserialize_technique_without_leases(
+            self, version_lease_factory):
+        _, bridge, backend, _ = version_lease_factory()
+        backend.get.return_value = {'leaseDuration': 20}
+        serialized = json.dumps({
+            '__version': 'VersionLeaseTechinque.1',
+            'versions': {
+                'test-lock': 'version-identifier',
+            },
+        })
+        vlt = VersionLeaseTechinque.from_serialized_technique(
+            serialized, bridge, backend)
+        vlt.refresh('test-lock')
+        vlt.refresh('test-lock')
+        # The lease duration is looked up once so the lease's expiry can be
+        # moved forward on refresh.
+        backend.get.assert_called_once_with(
+            {'lockKey': 'test-lock'},
+            attributes=['leaseDuration'],
+        )
+
+    def test_refresh_deserialized_technique_of_missing_lock_does_raise(
+            self, version_lease_factory):
+        _, bridge, backend, _ = version_lease_factory()
+        backend.get.return_value = None
+        serialized = json.dumps({
+            '__version': 'VersionLeaseTechinque.1',
+            'versions': {
+                'test-lock': 'version-identifier',
+            },
+        })
+        vlt = VersionLeaseTechinque.from_serialized_technique(
+            serialized, bridge, backend)
+        with pytest.raises(LockLostError):
+            vlt.refresh('test-lock')
 
     def test_does_raise_on_invalid_lock(self, version_lease_factory):
         _, bridge, backend, _ = version_lease_factory()
@@ -102,6 +186,9 @@ class TestVersionLeaseTechnique(object):
                 'leaseDuration': 5,
                 'hostIdentifier': mock.ANY,
                 'versionNumber': mock.ANY,
+                'writeTime': 1000,
+                'expiresAt': 6000,
+                'deleteAfter': 3606,
             },
             condition=mock.ANY,
         )
@@ -126,10 +213,40 @@ class TestVersionLeaseTechnique(object):
             updates={
                 'versionNumber': mock.ANY,
                 'hostIdentifier': 'host-ident',
+                'writeTime': 1000,
+                'expiresAt': 6000,
+                'deleteAfter': 3606,
             },
         )
         bridge.we_own_lock.assert_called_with(version)
 
+    def test_can_prepare_refresh(self, version_lease_factory):
+        vlt, bridge, backend, _ = version_lease_factory(host='host-ident')
+        bridge.we_own_lock.return_value = 'we own lock'
+        vlt.acquire('lock name', 5, 200)
+        old_version = backend.put.call_args_list[0][0][0]['versionNumber']
+
+        pending = vlt.prepare_refresh('lock name')
+        assert pending.backend is backend
+        key, updates, condition = pending.operation
+        assert key == {'lockKey': 'lock name'}
+        assert updates['hostIdentifier'] == 'host-ident'
+        assert updates['versionNumber'] != old_version
+        assert condition == 'we own lock'
+        bridge.we_own_lock.assert_called_with(old_version)
+        # Nothing is sent until the refresh is sent by someone else.
+        backend.update.assert_not_called()
+
+        pending.succeeded()
+        vlt.release('lock name')
+        bridge.we_own_lock.assert_called_with(updates['versionNumber'])
+
+    def test_prepare_refresh_unacquired_lock_raises(
+            self, version_lease_factory):
+        vlt, _, _, _ = version_lease_factory()
+        with pytest.raises(NoSuchLockError):
+            vlt.prepare_refresh('my lock')
+
     def test_does_try_to_steal_lock_repeatedly(self, version_lease_factory):
         # This is a fairly complex test that makes a lot of assertions on all
         # the assertions we can check.
@@ -169,6 +286,9 @@ class TestVersionLeaseTechnique(object):
                         'leaseDuration': 200,
                         'hostIdentifier': 'host_ident',
                         'versionNumber': mock.ANY,
+                        'writeTime': mock.ANY,
+                        'expiresAt': mock.ANY,
+                        'deleteAfter': mock.ANY,
                     },
                     condition='lock free',
                 ),
@@ -177,7 +297,10 @@ class TestVersionLeaseTechnique(object):
                         'lockKey': 'lock name',
                         'leaseDuration': 200,
                         'hostIdentifier': 'host_ident',
-                        'versionNumber': mock.ANY
+                        'versionNumber': mock.ANY,
+                        'writeTime': mock.ANY,
+                        'expiresAt': mock.ANY,
+                        'deleteAfter': mock.ANY,
                     },
                     condition='lock free or expired',
                 ),
@@ -186,7 +309,10 @@ class TestVersionLeaseTechnique(object):
                         'lockKey': 'lock name',
                         'leaseDuration': 200,
                         'hostIdentifier': 'host_ident',
-                        'versionNumber': mock.ANY
+                        'versionNumber': mock.ANY,
+                        'writeTime': mock.ANY,
+                        'expiresAt': mock.ANY,
+                        'deleteAfter': mock.ANY,
                     },
                     condition='lock free or expired',
                 ),
@@ -202,13 +328,15 @@ class TestVersionLeaseTechnique(object):
                     {
                         'lockKey': 'lock name',
                     },
-                    attributes=['leaseDuration', 'versionNumber'],
+                    attributes=['leaseDuration', 'versionNumber',
+                                'expiresAt'],
                 ),
                 mock.call(
                     {
                         'lockKey': 'lock name',
                     },
-                    attributes=['leaseDuration', 'versionNumber'],
+                    attributes=['leaseDuration', 'versionNumber',
+                                'expiresAt'],
                 ),
             ],
         )
@@ -228,6 +356,87 @@ class TestVersionLeaseTechnique(object):
             mock.call('second_fail_version'),
         ])
 
+    def test_does_use_existing_item_from_failed_put(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(host='host_ident')
+        bridge.lock_free_or_expired.return_value = 'lock free or expired'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'lockKey': 'lock name',
+            'leaseDuration': 5,
+            'versionNumber': 'first_fail_version',
+            'hostIdentifier': 'other_host',
+        }
+        backend.put.side_effect = [error, {}]
+        vlt.acquire('lock name', 200, 400)
+
+        # The failed put told us everything about the existing lock, so no
+        # extra read is needed to find out how long to wait.
+        backend.get.assert_not_called()
+        assert time.sleeps == [5]
+        bridge.lock_free_or_expired.assert_called_once_with(
+            'first_fail_version')
+
+    def test_does_wait_only_until_lease_expires(self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[100, 100, 100, 100, 100, 100])
+        bridge.lock_free_or_lease_elapsed.return_value = 'lease elapsed'
+        error = bridge.ConditionFailedError()
+        # The existing lock's lease has 4 seconds left of its 20.
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+            'expiresAt': 104000,
+        }
+        backend.put.side_effect = [error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        # Sleep until the lease expires plus the default clock skew margin.
+        assert time.sleeps == [5.0]
+        # Having not waited out the whole lease, the version cannot be used
+        # to take the lock. The expiry is checked instead.
+        bridge.lock_free_or_expired.assert_not_called()
+        bridge.lock_free_or_lease_elapsed.assert_called_once_with(99000)
+        assert backend.put.call_args[1]['condition'] == 'lease elapsed'
+
+    def test_does_wait_out_full_lease_if_expiry_is_far_away(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[100, 100, 100, 100, 100, 100])
+        error = bridge.ConditionFailedError()
+        # The owner's clock is far ahead of ours.
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+            'expiresAt': 500000,
+        }
+        backend.put.side_effect = [error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        assert time.sleeps == [20]
+        bridge.lock_free_or_expired.assert_called_once_with(
+            'existing_version')
+
+    def test_does_fall_back_to_version_after_expiry_attempt_fails(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[100] * 10)
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+            'expiresAt': 110000,
+        }
+        backend.put.side_effect = [error, error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        # First wait for the expiry, the owner's clock must have been behind
+        # so wait the rest of the lease and then use the version.
+        assert time.sleeps == [11.0, 9.0]
+        bridge.lock_free_or_lease_elapsed.assert_called_once_with(99000)
+        bridge.lock_free_or_expired.assert_called_once_with(
+            'existing_version')
+
     def test_does_steal_lock_if_it_vanishes(self, version_lease_factory):
         # in the case where the lock is released between the failed put, and
         # the get for its info about how long to wait.
@@ -262,6 +471,9 @@ class TestVersionLeaseTechnique(object):
                         'leaseDuration': 200,
                         'hostIdentifier': 'host_ident',
                         'versionNumber': mock.ANY,
+                        'writeTime': mock.ANY,
+                        'expiresAt': mock.ANY,
+                        'deleteAfter': mock.ANY,
                     },
                     condition='lock free',
                 ),
@@ -270,7 +482,10 @@ class TestVersionLeaseTechnique(object):
                         'lockKey': 'lock name',
                         'leaseDuration': 200,
                         'hostIdentifier': 'host_ident',
-                        'versionNumber': mock.ANY
+                        'versionNumber': mock.ANY,
+                        'writeTime': mock.ANY,
+                        'expiresAt': mock.ANY,
+                        'deleteAfter': mock.ANY,
                     },
                     condition='lock free',
                 ),
@@ -286,7 +501,8 @@ class TestVersionLeaseTechnique(object):
                     {
                         'lockKey': 'lock name',
                     },
-                    attributes=['leaseDuration', 'versionNumber'],
+                    attributes=['leaseDuration', 'versionNumber',
+                                'expiresAt'],
                 ),
             ],
         )
@@ -355,6 +571,25 @@ class TestVersionLeaseTechnique(object):
             # the lock.
             vlt.acquire('my lock', 10, 10)
 
+    def test_does_wait_until_deadline_on_own_clock(
+            self, version_lease_factory):
+        vlt, bridge, backend, fake_time = version_lease_factory()
+        backend.put.side_effect = [bridge.ConditionFailedError(), None]
+        backend.get.return_value = {
+            'leaseDuration': 20, 'versionNumber': 'prior'}
+        # The technique's clock reads 1, leaving 30 seconds to wait.
+        vlt.acquire('my lock', 10, 300, deadline=31)
+        assert fake_time.sleeps == [20]
+
+    def test_does_give_up_at_deadline(self, version_lease_factory):
+        vlt, bridge, backend, fake_time = version_lease_factory()
+        backend.put.side_effect = bridge.ConditionFailedError()
+        backend.get.return_value = {
+            'leaseDuration': 20, 'versionNumber': 'prior'}
+        with pytest.raises(LockNotGrantedError):
+            vlt.acquire('my lock', 10, 300, deadline=11)
+        assert fake_time.sleeps == []
+
     def test_timeout_on_acquire_exact_does_raise(self, version_lease_factory):
         # In this case our timeout math in a pure world would work out. However
         # with the timings of networks and code execution it will add up to
@@ -379,3 +614,1316 @@ class TestVersionLeaseTechnique(object):
             # the lock since our wall-clock time is going to be 10 and a
             # fraction of a second.
             vlt.acquire('my lock', 10, 10)
+
+    def test_does_use_wait_strategy(self, version_lease_factory):
+        strategy = FixedWaitStrategy(2)
+        vlt, bridge, backend, time = version_lease_factory(
+            wait_strategy=strategy)
+        bridge.lock_free.return_value = 'lock free'
+        bridge.lock_free_or_expired.return_value = 'lock free or expired'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, error, error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        assert time.sleeps == [2, 2, 2]
+        assert strategy.calls == [(1, 0, 5), (2, 2, 3), (3, 2, 1)]
+        # Until the whole lease has been waited out the version cannot be
+        # used to steal the lock, only if it is free.
+        conditions = [c[1]['condition'] for c in backend.put.call_args_list]
+        assert conditions == [
+            'lock free', 'lock free', 'lock free', 'lock free or expired',
+        ]
+
+    def test_does_reset_wait_on_new_version(self, version_lease_factory):
+        strategy = FixedWaitStrategy(3)
+        vlt, bridge, backend, time = version_lease_factory(
+            wait_strategy=strategy)
+        bridge.lock_free.return_value = 'lock free'
+        first_error = bridge.ConditionFailedError()
+        first_error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'first_version',
+        }
+        second_error = bridge.ConditionFailedError()
+        second_error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'second_version',
+        }
+        backend.put.side_effect = [first_error, second_error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        # The second version was only just observed, so the full 5 second
+        # lease is remaining again.
+        assert strategy.calls == [(1, 0, 5), (2, 3, 5)]
+        bridge.lock_free_or_expired.assert_not_called()
+
+    def test_does_make_last_attempt_at_deadline(self, version_lease_factory):
+        strategy = FixedWaitStrategy(4)
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[0, 0, 0, 4, 4, 8, 8, 10, 10],
+            wait_strategy=strategy,
+        )
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 100,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, error, error, error]
+        with pytest.raises(LockNotGrantedError):
+            vlt.acquire('lock name', 10, 10)
+
+        # The last wait is cut short so there is one more attempt exactly at
+        # the deadline before giving up.
+        assert time.sleeps == [4, 4, 2]
+        assert backend.put.call_count == 4
+
+    def test_does_poll_with_reads_until_lease_is_over(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            wait_strategy=FixedWaitStrategy(2), poll_with_reads=True)
+        bridge.lock_free_or_expired.return_value = 'lock free or expired'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, {}]
+        backend.get.return_value = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+        }
+        vlt.acquire('lock name', 10, 400)
+
+        # Only once the version has been seen unchanged for the whole lease is
+        # a write attempted.
+        assert time.sleeps == [2, 2, 2]
+        assert backend.get.call_count == 3
+        backend.get.assert_called_with(
+            {'lockKey': 'lock name'},
+            attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+            consistent=False,
+        )
+        assert backend.put.call_count == 2
+        assert backend.put.call_args[1]['condition'] == 'lock free or expired'
+        bridge.lock_free_or_expired.assert_called_with('existing_version')
+
+    def test_does_poll_with_reads_until_lock_is_gone(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            wait_strategy=FixedWaitStrategy(2), poll_with_reads=True)
+        bridge.lock_free.return_value = 'lock free'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'first_version',
+        }
+        backend.put.side_effect = [error, {}]
+        backend.get.side_effect = [
+            {'leaseDuration': 5, 'versionNumber': 'second_version'},
+            {'leaseDuration': 5, 'versionNumber': 'second_version'},
+            None,
+        ]
+        vlt.acquire('lock name', 10, 400)
+
+        assert time.sleeps == [2, 2, 2]
+        assert backend.put.call_count == 2
+        assert backend.put.call_args[1]['condition'] == 'lock free'
+        bridge.lock_free_or_expired.assert_not_called()
+
+    def test_does_poll_with_reads_until_lease_expires(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[0, 0, 0, 3, 3, 3, 3], poll_with_reads=True)
+        bridge.lock_free_or_lease_elapsed.return_value = 'lease elapsed'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 5,
+            'versionNumber': 'existing_version',
+            'expiresAt': 1000,
+        }
+        backend.put.side_effect = [error, {}]
+        backend.get.return_value = error.existing_item
+        vlt.acquire('lock name', 10, 400)
+
+        assert time.sleeps == [2]
+        assert backend.put.call_args[1]['condition'] == 'lease elapsed'
+
+    def test_release_does_publish(self, version_lease_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        vlt, bridge, backend, _ = version_lease_factory(notifier=notifier)
+        vlt.acquire('lock name', 20, 10)
+        vlt.release('lock name')
+        notifier.publish.assert_called_once_with('lock name')
+
+    def test_lost_lock_release_does_not_publish(self, version_lease_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        vlt, bridge, backend, _ = version_lease_factory(notifier=notifier)
+        vlt.acquire('lock name', 20, 10)
+        backend.delete.side_effect = bridge.ConditionFailedError()
+        with pytest.raises(LockLostError):
+            vlt.release('lock name')
+        notifier.publish.assert_not_called()
+
+    def test_does_wake_on_notification(self, version_lease_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        subscription = mock.Mock(spec=Subscription)
+        subscription.wait.return_value = True
+        notifier.subscribe.return_value = subscription
+        vlt, bridge, backend, time = version_lease_factory(
+            times=[0, 0, 0, 0, 1, 1, 1], notifier=notifier,
+            poll_with_reads=True)
+        bridge.lock_free.return_value = 'lock free'
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, {}]
+        vlt.acquire('lock name', 10, 400)
+
+        notifier.subscribe.assert_called_once_with('lock name')
+        subscription.wait.assert_called_once_with(20)
+        assert time.sleeps == []
+        # The notification is trusted over a read, so the lock is written
+        # straight away.
+        backend.get.assert_not_called()
+        assert backend.put.call_args[1]['condition'] == 'lock free'
+        subscription.close.assert_called_once_with()
+
+    def test_does_close_subscription_on_timeout(self, version_lease_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        subscription = mock.Mock(spec=Subscription)
+        notifier.subscribe.return_value = subscription
+        vlt, bridge, backend, _ = version_lease_factory(
+            times=[0, 0, 11], notifier=notifier)
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = error
+        with pytest.raises(LockNotGrantedError):
+            vlt.acquire('lock name', 10, 10)
+        subscription.close.assert_called_once_with()
+
+    def test_can_try_acquire(self, version_lease_factory):
+        vlt, bridge, backend, _ = version_lease_factory(times=[10])
+        bridge.lock_free_or_lease_elapsed.return_value = 'lease elapsed'
+        assert vlt.try_acquire('lock name', 20) is True
+        bridge.lock_free_or_lease_elapsed.assert_called_once_with(9000)
+        assert backend.put.call_args[1]['condition'] == 'lease elapsed'
+        assert 'lock name' in vlt._versions
+
+    def test_failed_try_acquire_does_return_false(
+            self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory()
+        backend.put.side_effect = bridge.ConditionFailedError()
+        assert vlt.try_acquire('lock name', 20) is False
+        assert backend.put.call_count == 1
+        backend.get.assert_not_called()
+        assert time.sleeps == []
+        assert vlt._versions == {}
+
+    def test_acquire_does_raise_if_already_cancelled(
+            self, version_lease_factory):
+        vlt, bridge, backend, _ = version_lease_factory()
+        event = threading.Event()
+        event.set()
+        with pytest.raises(LockAcquireCancelledError):
+            vlt.acquire('lock name', 20, 10, cancel_event=event)
+        backend.put.assert_not_called()
+
+    def test_can_cancel_acquire(self, version_lease_factory):
+        vlt, bridge, backend, time = version_lease_factory()
+        event = threading.Event()
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+
+        def cancel_and_fail(*args, **kwargs):
+            event.set()
+            raise error
+
+        backend.put.side_effect = cancel_and_fail
+        with pytest.raises(LockAcquireCancelledError):
+            vlt.acquire('lock name', 20, 400, cancel_event=event)
+        assert backend.put.call_count == 1
+        assert time.sleeps == [20]
+
+    def test_can_cancel_acquire_waiting_for_notification(
+            self, version_lease_factory):
+        vlt, bridge, backend, _ = version_lease_factory(
+            notifier=LocalNotifier())
+        event = threading.Event()
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+
+        def cancel_and_fail(*args, **kwargs):
+            event.set()
+            raise error
+
+        backend.put.side_effect = cancel_and_fail
+        with pytest.raises(LockAcquireCancelledError):
+            vlt.acquire('lock name', 20, 400, cancel_event=event)
+        assert backend.put.call_count == 1
+
+
+def wait_for_waiters(queue, name, count):
+    for _ in range(500):
+        entry = queue._entries.get(name)
+        if entry is not None and len(entry.waiters) == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError('Waiters never joined the queue')
+
+
+class TestVersionLeaseTechniqueMetrics(object):
+    def test_does_report_uncontended_acquire(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, _, _, _ = version_lease_factory(
+            perf_counters=[10, 10.5], metrics=metrics)
+        vlt.acquire('lock name', 5, 200)
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 0.5, 0)
+
+    def test_does_report_attempts_and_sleeps(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, bridge, backend, _ = version_lease_factory(
+            wait_strategy=FixedWaitStrategy(2), metrics=metrics)
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = [error, error, None]
+        vlt.acquire('lock name', 5, 200)
+        metrics.on_acquire.assert_called_once_with('lock name', 3, 0, 4)
+
+    def test_does_report_refresh_age(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, _, _, _ = version_lease_factory(
+            times=[1000, 1000, 1003.75], metrics=metrics)
+        vlt.acquire('lock name', 5, 200)
+        vlt.refresh('lock name')
+        metrics.on_refresh.assert_called_once_with('lock name', 3.75, 5)
+        assert not metrics.on_lock_lost.called
+
+    def test_does_report_lost_lock_on_refresh(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, bridge, backend, _ = version_lease_factory(metrics=metrics)
+        vlt.acquire('lock name', 5, 200)
+        backend.update.side_effect = bridge.ConditionFailedError()
+        with pytest.raises(LockLostError):
+            vlt.refresh('lock name')
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+        assert not metrics.on_refresh.called
+
+    def test_does_report_lost_lock_on_release(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, bridge, backend, _ = version_lease_factory(metrics=metrics)
+        vlt.acquire('lock name', 5, 200)
+        backend.delete.side_effect = bridge.ConditionFailedError()
+        with pytest.raises(LockLostError):
+            vlt.release('lock name')
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+
+    def test_does_report_try_acquire(self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, bridge, backend, _ = version_lease_factory(
+            perf_counters=[10, 10.25], metrics=metrics)
+        assert vlt.try_acquire('lock name', 5)
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 0.25, 0)
+        backend.put.side_effect = bridge.ConditionFailedError()
+        assert not vlt.try_acquire('other lock', 5)
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 0.25, 0)
+
+    def test_does_report_each_lock_acquired_together(
+            self, version_lease_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        vlt, _, backend, _ = version_lease_factory(metrics=metrics)
+        backend.MAX_TRANSACTION_ITEMS = 25
+        vlt.acquire_many(['b', 'a'], 5, 200)
+        assert metrics.on_acquire.call_args_list == [
+            mock.call('a', 1, 0, 0),
+            mock.call('b', 1, 0, 0),
+        ]
+
+    def test_does_report_hand_off(self, version_lease_factory):
+        queue = LocalWaitQueue()
+        metrics = mock.Mock(spec=MetricsHook)
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue,
+            perf_counters=[10, 12.5], metrics=metrics)
+        holder.acquire('lock name', 20, 10)
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+
+        metrics.on_acquire.assert_called_once_with(
+            'lock name', 1, 2.5, 2.5)
+
+    def test_does_report_refresh_age_after_hand_off(
+            self, version_lease_factory):
+        queue = LocalWaitQueue()
+        metrics = mock.Mock(spec=MetricsHook)
+        # The holder's clock always reads 1, so it hands off at 1.
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue,
+            times=[1, 4.5], metrics=metrics)
+        holder.acquire('lock name', 20, 10)
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+        waiter.refresh('lock name')
+
+        metrics.on_refresh.assert_called_once_with('lock name', 3.5, 30)
+
+    def test_does_report_lost_lock_on_hand_off(self, version_lease_factory):
+        queue = LocalWaitQueue()
+        metrics = mock.Mock(spec=MetricsHook)
+        holder, bridge, backend, _ = version_lease_factory(
+            wait_queue=queue, metrics=metrics)
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        backend.update.side_effect = bridge.ConditionFailedError()
+        with pytest.raises(LockLostError):
+            holder.release('lock name')
+        thread.join(5)
+
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+        assert holder._written_at == {}
+
+    def test_does_forget_write_time_after_hand_off(
+            self, version_lease_factory):
+        queue = LocalWaitQueue()
+        holder, bridge, backend, _ = version_lease_factory(
+            wait_queue=queue, metrics=mock.Mock(spec=MetricsHook))
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        assert 'lock name' in holder._written_at
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+
+        backend.update.assert_called_once()
+        assert holder._versions == {}
+        assert holder._written_at == {}
+
+
+class TestVersionLeaseTechniqueWaitQueue(object):
+    def test_does_hand_off_to_local_waiter(self, version_lease_factory):
+        queue = LocalWaitQueue()
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        bridge.we_own_lock.return_value = 'we own lock'
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        version = backend.put.call_args[0][0]['versionNumber']
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+
+        # The waiter never went to the backend itself, and the lock was
+        # handed to it by rotating the version rather than deleting it.
+        assert backend.put.call_count == 1
+        backend.delete.assert_not_called()
+        bridge.we_own_lock.assert_called_once_with(version)
+        backend.update.assert_called_once_with(
+            {'lockKey': 'lock name'},
+            updates={
+                'hostIdentifier': mock.ANY,
+                'versionNumber': mock.ANY,
+                'leaseDuration': 30,
+                'writeTime': mock.ANY,
+                'expiresAt': mock.ANY,
+                'deleteAfter': mock.ANY,
+            },
+            condition='we own lock',
+        )
+        new_version = backend.update.call_args[1]['updates']['versionNumber']
+        assert waiter._versions == {'lock name': new_version}
+        assert holder._versions == {}
+
+        waiter.release('lock name')
+        bridge.we_own_lock.assert_called_with(new_version)
+        backend.delete.assert_called_once()
+
+    def test_failed_hand_off_does_promote_waiter(
+            self, version_lease_factory):
+        queue = LocalWaitQueue()
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        backend.update.side_effect = bridge.ConditionFailedError()
+        with pytest.raises(LockLostError):
+            holder.release('lock name')
+        thread.join(5)
+
+        # Since the lock was lost the waiter had to acquire it from the
+        # backend.
+        assert backend.put.call_count == 2
+        assert 'lock name' in waiter._versions
+
+    def test_does_release_to_backend_without_waiters(
+            self, version_lease_factory):
+        queue = LocalWaitQueue()
+        vlt, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        vlt.acquire('lock name', 20, 10)
+        vlt.release('lock name')
+        backend.delete.assert_called_once()
+        backend.update.assert_not_called()
+        assert queue._entries == {}
+
+    def test_does_leave_queue_if_acquire_fails(self, version_lease_factory):
+        queue = LocalWaitQueue()
+        vlt, bridge, backend, _ = version_lease_factory(
+            times=[0, 0, 0, 0, 11], wait_queue=queue)
+        error = bridge.ConditionFailedError()
+        error.existing_item = {
+            'leaseDuration': 20,
+            'versionNumber': 'existing_version',
+        }
+        backend.put.side_effect = error
+        with pytest.raises(LockNotGrantedError):
+            vlt.acquire('lock name', 20, 10)
+        assert queue._entries == {}
+
+    def test_try_acquire_does_not_ask_backend_if_held_locally(
+            self, version_lease_factory):
+        queue = LocalWaitQueue()
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        other, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        assert other.try_acquire('lock name', 20) is False
+        assert backend.put.call_count == 1
+
+    def test_can_cancel_waiting_in_queue(self, version_lease_factory):
+        queue = LocalWaitQueue()
+        holder, bridge, backend, _ = version_lease_factory(wait_queue=queue)
+        waiter, _, _, _ = version_lease_factory(
+            bridge=bridge, backend=backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        event = threading.Event()
+        errors = []
+
+        def acquire():
+            try:
+                waiter.acquire('lock name', 20, 100, cancel_event=event)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        event.set()
+        thread.join(5)
+        assert len(errors) == 1
+        assert isinstance(errors[0], LockAcquireCancelledError)
+        assert len(queue._entries['lock name'].waiters) == 0
+
+
+@pytest.fixture
+def many_factory(version_lease_factory):
+    def wrapped(times=None, wait_strategy=None, notifier=None):
+        backend = mock.Mock(spec=BaseBackend)
+        backend.MAX_TRANSACTION_ITEMS = 3
+        vlt, bridge, backend, fake_time = version_lease_factory(
+            backend=backend, times=times, wait_strategy=wait_strategy,
+            notifier=notifier)
+        bridge.lock_free.return_value = 'lock free'
+        bridge.lock_free_or_expired.side_effect = \
+            lambda version: 'free or expired %s' % version
+        bridge.lock_free_or_lease_elapsed.return_value = 'lease elapsed'
+        bridge.we_own_lock.side_effect = lambda version: 'own %s' % version
+        return vlt, bridge, backend, fake_time
+    return wrapped
+
+
+class TestVersionLeaseTechniqueMany(object):
+    def test_does_support_transactions_if_backend_does(
+            self, version_lease_factory):
+        backend = mock.Mock(spec=BaseBackend)
+        backend.SUPPORTS_TRANSACTIONS = False
+        vlt, _, _, _ = version_lease_factory(backend=backend)
+        assert vlt.SUPPORTS_TRANSACTIONS is False
+        backend.SUPPORTS_TRANSACTIONS = True
+        assert vlt.SUPPORTS_TRANSACTIONS is True
+
+    def test_can_acquire_many_in_one_transaction(self, many_factory):
+        vlt, bridge, backend, _ = many_factory()
+        vlt.acquire_many(['b', 'a', 'b'], 5, 200)
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.item['lockKey'] for op in operations] == ['a', 'b']
+        assert [op.condition for op in operations] == ['lock free'] * 2
+        assert operations[0].item['leaseDuration'] == 5
+        assert operations[0].item['expiresAt'] == 6000
+        assert backend.transact_write.call_count == 1
+        backend.put.assert_not_called()
+
+    def test_acquire_many_does_retry_conflicting_locks(self, many_factory):
+        strategy = FixedWaitStrategy(2)
+        vlt, bridge, backend, fake_time = many_factory(
+            wait_strategy=strategy)
+        backend.transact_write.side_effect = [
+            TransactionConflictError([1], {
+                1: {'leaseDuration': 10, 'versionNumber': 'b-version'},
+            }),
+            None,
+        ]
+        vlt.acquire_many(['a', 'b', 'c'], 5, 200)
+        assert fake_time.sleeps == [2]
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.item['lockKey'] for op in operations] == ['a', 'b', 'c']
+        assert [op.condition for op in operations] == [
+            'lock free', 'lock free', 'lock free']
+        # The item returned with the conflict saves a read.
+        backend.get.assert_not_called()
+
+    def test_acquire_many_does_steal_abandoned_locks(self, many_factory):
+        vlt, bridge, backend, fake_time = many_factory()
+        backend.get.return_value = {
+            'leaseDuration': 10, 'versionNumber': 'b-version'}
+        backend.transact_write.side_effect = [
+            TransactionConflictError([1]),
+            None,
+        ]
+        vlt.acquire_many(['a', 'b'], 5, 200)
+        assert fake_time.sleeps == [10]
+        backend.get.assert_called_once_with(
+            {'lockKey': 'b'},
+            attributes=['leaseDuration', 'versionNumber', 'expiresAt'],
+        )
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.condition for op in operations] == [
+            'lock free', 'free or expired b-version']
+
+    def test_acquire_many_does_wait_for_longest_lease(self, many_factory):
+        vlt, bridge, backend, fake_time = many_factory()
+        backend.transact_write.side_effect = [
+            TransactionConflictError([0, 1], {
+                0: {'leaseDuration': 10, 'versionNumber': 'a-version'},
+                1: {'leaseDuration': 30, 'versionNumber': 'b-version'},
+            }),
+            None,
+        ]
+        vlt.acquire_many(['a', 'b'], 5, 200)
+        assert fake_time.sleeps == [30]
+
+    def test_acquire_many_timeout_does_raise(self, many_factory):
+        vlt, bridge, backend, fake_time = many_factory(times=[0, 0, 5])
+        backend.transact_write.side_effect = TransactionConflictError([0], {
+            0: {'leaseDuration': 5, 'versionNumber': 'a-version'},
+        })
+        with pytest.raises(LockNotGrantedError):
+            vlt.acquire_many(['a', 'b'], 5, 5)
+        with pytest.raises(NoSuchLockError):
+            vlt.release('b')
+
+    def test_acquire_many_does_raise_on_too_many_locks(self, many_factory):
+        vlt, bridge, backend, _ = many_factory()
+        with pytest.raises(ValueError):
+            vlt.acquire_many(['a', 'b', 'c', 'd'], 5, 200)
+        backend.transact_write.assert_not_called()
+
+    def test_can_cancel_acquire_many(self, many_factory):
+        vlt, bridge, backend, _ = many_factory()
+        backend.transact_write.side_effect = TransactionConflictError([0], {
+            0: {'leaseDuration': 5, 'versionNumber': 'a-version'},
+        })
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with pytest.raises(LockAcquireCancelledError):
+            vlt.acquire_many(['a'], 5, 200, cancel_event=cancel_event)
+
+    def test_can_release_many(self, many_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        vlt, bridge, backend, _ = many_factory(notifier=notifier)
+        vlt.acquire_many(['a', 'b'], 5, 200)
+        versions = [
+            op.item['versionNumber']
+            for op in backend.transact_write.call_args[0][0]
+        ]
+        vlt.release_many(['b', 'a'])
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.key for op in operations] == [
+            {'lockKey': 'a'}, {'lockKey': 'b'}]
+        assert [op.condition for op in operations] == [
+            'own %s' % version for version in versions]
+        assert notifier.publish.call_args_list == [
+            mock.call('a'), mock.call('b')]
+
+    def test_release_many_does_release_rest_of_lost_locks(
+            self, many_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        vlt, bridge, backend, _ = many_factory(notifier=notifier)
+        vlt.acquire_many(['a', 'b', 'c'], 5, 200)
+        backend.transact_write.side_effect = [
+            TransactionConflictError([1]),
+            None,
+        ]
+        with pytest.raises(LockLostError):
+            vlt.release_many(['a', 'b', 'c'])
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.key for op in operations] == [
+            {'lockKey': 'a'}, {'lockKey': 'c'}]
+        assert notifier.publish.call_args_list == [
+            mock.call('a'), mock.call('c')]
+
+    def test_can_refresh_many(self, many_factory):
+        vlt, bridge, backend, _ = many_factory()
+        vlt.acquire_many(['a', 'b'], 5, 200)
+        vlt.refresh_many(['a', 'b'])
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.key for op in operations] == [
+            {'lockKey': 'a'}, {'lockKey': 'b'}]
+        new_versions = [op.updates['versionNumber'] for op in operations]
+        vlt.release_many(['a', 'b'])
+        operations = backend.transact_write.call_args[0][0]
+        assert [op.condition for op in operations] == [
+            'own %s' % version for version in new_versions]
+
+    def test_refresh_many_lost_lock_does_raise(self, many_factory):
+        vlt, bridge, backend, _ = many_factory()
+        vlt.acquire_many(['a', 'b'], 5, 200)
+        backend.transact_write.side_effect = [
+            TransactionConflictError([0]),
+            None,
+        ]
+        with pytest.raises(LockLostError):
+            vlt.refresh_many(['a', 'b'])
+        refreshed = backend.transact_write.call_args[0][0]
+        assert [op.key for op in refreshed] == [{'lockKey': 'b'}]
+
+
+class ExistingItemConditionFailedError(ConditionFailedError):
+    def __init__(self, existing_item=None):
+        self.existing_item = existing_item
+
+
+class DictBackend(BaseBackend):
+    """Evaluates the conditions built by a fake bridge against a dict."""
+    def __init__(self):
+        self.items = {}
+        self.writes = 0
+
+    def _check(self, key, condition):
+        item = self.items.get(key['lockKey'])
+        kind, version = condition
+        if kind == 'free':
+            holds = item is None
+        else:
+            holds = item is not None and item['versionNumber'] == version
+        if not holds:
+            raise ExistingItemConditionFailedError(copy.deepcopy(item))
+
+    def put(self, item, condition=None):
+        self._check(item, condition)
+        self.writes += 1
+        self.items[item['lockKey']] = copy.deepcopy(item)
+
+    def delete(self, key, condition=None):
+        self._check(key, condition)
+        self.writes += 1
+        del self.items[key['lockKey']]
+
+    def get(self, key, attributes, consistent=True):
+        item = self.items.get(key['lockKey'])
+        if item is None:
+            return None
+        return {
+            attr: copy.deepcopy(item[attr])
+            for attr in attributes if attr in item
+        }
+
+
+@pytest.fixture
+def shared_exclusive_factory():
+    def wrapped(mode, backend=None, fake_time=None, notifier=None,
+                wait_strategy=None, poll_with_reads=False, wait_queue=None,
+                metrics=None):
+        bridge = mock.Mock(spec=DynamoDBVersionLeaseBridge)
+        bridge.ConditionFailedError = ConditionFailedError
+        bridge.lock_free.return_value = ('free', None)
+        bridge.lock_unchanged.side_effect = \
+            lambda version: ('unchanged', version)
+        if backend is None:
+            backend = DictBackend()
+        if fake_time is None:
+            fake_time = FakeTime()
+        technique = SharedExclusiveTechnique(
+            bridge, backend, time_utils=fake_time, notifier=notifier,
+            wait_strategy=wait_strategy, mode=mode,
+            poll_with_reads=poll_with_reads, wait_queue=wait_queue,
+            metrics=metrics)
+        return technique, backend, fake_time
+    return wrapped
+
+
+class TestSharedExclusiveTechnique(object):
+    def test_does_reject_unknown_mode(self, shared_exclusive_factory):
+        with pytest.raises(ValueError):
+            shared_exclusive_factory('upgradable')
+
+    def test_can_acquire_exclusive(self, shared_exclusive_factory):
+        technique, backend, _ = shared_exclusive_factory('exclusive')
+        technique.acquire('lock name', 5, 200)
+        item = backend.items['lock name']
+        assert item['mode'] == 'exclusive'
+        assert list(item['holders'].values()) == [6000]
+        assert item['intent'] == {}
+        assert item['expiresAt'] == 6000
+        assert item['deleteAfter'] == 3606
+        assert item['leaseDuration'] == 5
+        assert backend.writes == 1
+
+    def test_shared_locks_can_be_held_together(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        first, _, _ = shared_exclusive_factory('shared', backend)
+        second, _, _ = shared_exclusive_factory('shared', backend)
+        first.acquire('lock name', 5, 200)
+        second.acquire('lock name', 5, 200)
+        assert len(backend.items['lock name']['holders']) == 2
+        first.release('lock name')
+        assert len(backend.items['lock name']['holders']) == 1
+        second.release('lock name')
+        assert backend.items == {}
+
+    def test_exclusive_lock_does_exclude_shared(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        writer, _, _ = shared_exclusive_factory('exclusive', backend)
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        writer.acquire('lock name', 5, 200)
+        assert reader.try_acquire('lock name', 5) is False
+        writer.release('lock name')
+        assert reader.try_acquire('lock name', 5) is True
+
+    def test_shared_lock_does_exclude_exclusive(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        writer, _, _ = shared_exclusive_factory('exclusive', backend)
+        reader.acquire('lock name', 5, 200)
+        assert writer.try_acquire('lock name', 5) is False
+
+    def test_waiting_writer_does_block_new_readers(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+
+        class AdvancingTime(FakeTime):
+            now = 1
+
+            def time(self):
+                return self.now
+
+            def wait(self, amt, event=None):
+                # The intent is in place while the writer waits.
+                assert len(backend.items['lock name']['intent']) == 1
+                self.now += amt
+                return False
+
+        writer, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=AdvancingTime(),
+            wait_strategy=FixedWaitStrategy(1))
+        with pytest.raises(LockNotGrantedError):
+            writer.acquire('lock name', 5, 2)
+        late_reader, _, _ = shared_exclusive_factory('shared', backend)
+        # The intent was withdrawn when the writer gave up.
+        assert backend.items['lock name']['intent'] == {}
+        assert late_reader.try_acquire('lock name', 5) is True
+
+    def test_intent_does_block_new_readers(self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+        item = backend.items['lock name']
+        item['intent'] = {'writer': 10000}
+        late_reader, _, _ = shared_exclusive_factory('shared', backend)
+        assert late_reader.try_acquire('lock name', 5) is False
+        # Existing holders can still refresh.
+        reader.refresh('lock name')
+
+    def test_writer_does_take_lock_once_readers_leave(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+
+        class ReleasingTime(FakeTime):
+            def wait(self, amt, event=None):
+                self.sleeps.append(amt)
+                reader.release('lock name')
+                return False
+
+        writer, _, writer_time = shared_exclusive_factory(
+            'exclusive', backend, fake_time=ReleasingTime())
+        writer.acquire('lock name', 5, 200)
+        item = backend.items['lock name']
+        assert item['mode'] == 'exclusive'
+        assert len(item['holders']) == 1
+        assert item['intent'] == {}
+        # The writer waits for the reader's lease plus the clock skew margin.
+        assert writer_time.sleeps == [6.0]
+
+    def test_does_take_over_expired_holders(self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+        writer, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=FakeTime([10] * 10))
+        assert writer.try_acquire('lock name', 5) is True
+        with pytest.raises(LockLostError):
+            reader.refresh('lock name')
+
+    def test_does_retry_after_concurrent_change(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        other, _, _ = shared_exclusive_factory('shared', backend)
+        original_get = backend.get
+
+        def get_then_race(key, attributes, consistent=True):
+            item = original_get(key, attributes, consistent)
+            backend.get = original_get
+            other.acquire('lock name', 5, 200)
+            return item
+
+        backend.get = get_then_race
+        reader.acquire('lock name', 5, 200)
+        assert len(backend.items['lock name']['holders']) == 2
+
+    def test_contended_swap_does_give_up_at_deadline(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        original_put = backend.put
+
+        def put_after_race(item, condition=None):
+            # Every write loses to another agent changing the entry.
+            backend.items['lock name'] = {
+                'lockKey': 'lock name',
+                'versionNumber': str(backend.writes),
+                'mode': 'shared',
+                'holders': {},
+                'intent': {},
+            }
+            backend.writes += 1
+            original_put(item, condition)
+
+        backend.put = put_after_race
+
+        class AdvancingTime(FakeTime):
+            now = 1
+
+            def time(self):
+                self.now += 1
+                return self.now
+
+        technique, _, _ = shared_exclusive_factory(
+            'shared', backend, fake_time=AdvancingTime())
+        with pytest.raises(LockNotGrantedError):
+            technique.acquire('lock name', 5, 10)
+        assert backend.writes < 10
+
+    def test_withdrawing_intent_does_retry_after_concurrent_change(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+        reads_after_deadline = []
+
+        class AdvancingTime(FakeTime):
+            now = 1
+
+            def time(self):
+                return self.now
+
+            def wait(self, amt, event=None):
+                self.now += amt
+                return False
+
+        original_get = backend.get
+
+        def get_then_race(key, attributes, consistent=True):
+            item = original_get(key, attributes, consistent)
+            if writer_time.now >= 3:
+                reads_after_deadline.append(item)
+            if len(reads_after_deadline) == 2:
+                # Change the entry between the withdrawal's read and write.
+                reader.refresh('lock name')
+            return item
+
+        writer, _, writer_time = shared_exclusive_factory(
+            'exclusive', backend, fake_time=AdvancingTime(),
+            wait_strategy=FixedWaitStrategy(1))
+        backend.get = get_then_race
+        with pytest.raises(LockNotGrantedError):
+            writer.acquire('lock name', 5, 2)
+        assert backend.items['lock name']['intent'] == {}
+
+    def test_withdrawing_intent_does_raise_backend_errors(
+            self, shared_exclusive_factory):
+        backend = DictBackend()
+        reader, _, _ = shared_exclusive_factory('shared', backend)
+        reader.acquire('lock name', 5, 200)
+        original_get = backend.get
+        reads = []
+
+        def get_then_fail(key, attributes, consistent=True):
+            reads.append(key)
+            if len(reads) == 3:
+                # The read withdrawing the intent after giving up.
+                raise RuntimeError('throttled')
+            return original_get(key, attributes, consistent)
+
+        class AdvancingTime(FakeTime):
+            now = 1
+
+            def time(self):
+                return self.now
+
+            def wait(self, amt, event=None):
+                self.now += amt
+                return False
+
+        writer, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=AdvancingTime(),
+            wait_strategy=FixedWaitStrategy(1))
+        backend.get = get_then_fail
+        with pytest.raises(RuntimeError):
+            writer.acquire('lock name', 5, 1)
+        assert len(reads) == 3
+
+    def test_does_not_provide_transactions(self, shared_exclusive_factory):
+        technique, _, _ = shared_exclusive_factory('exclusive')
+        assert not isinstance(technique, VersionLeaseTechinque)
+        for method in ('acquire_many', 'release_many', 'refresh_many',
+                       'prepare_refresh'):
+            assert not hasattr(technique, method)
+
+    def test_can_refresh(self, shared_exclusive_factory):
+        technique, backend, fake_time = shared_exclusive_factory(
+            'shared', fake_time=FakeTime([0, 0, 0, 3, 3]))
+        technique.acquire('lock name', 5, 200)
+        version = backend.items['lock name']['versionNumber']
+        technique.refresh('lock name')
+        item = backend.items['lock name']
+        assert list(item['holders'].values()) == [8000]
+        assert item['versionNumber'] != version
+
+    def test_release_lost_lock_does_raise(self, shared_exclusive_factory):
+        technique, backend, _ = shared_exclusive_factory('exclusive')
+        technique.acquire('lock name', 5, 200)
+        backend.items.clear()
+        with pytest.raises(LockLostError):
+            technique.release('lock name')
+
+    def test_release_does_publish(self, shared_exclusive_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        technique, _, _ = shared_exclusive_factory(
+            'shared', notifier=notifier)
+        technique.acquire('lock name', 5, 200)
+        technique.release('lock name')
+        notifier.publish.assert_called_once_with('lock name')
+
+    def test_exclusive_release_does_wake_all(self, shared_exclusive_factory):
+        notifier = mock.Mock(spec=BaseNotifier)
+        technique, _, _ = shared_exclusive_factory(
+            'exclusive', notifier=notifier)
+        technique.acquire('lock name', 5, 200)
+        technique.release('lock name')
+        notifier.publish.assert_called_once_with('lock name', wake_all=True)
+
+    def test_can_serialize(self, shared_exclusive_factory):
+        technique, backend, _ = shared_exclusive_factory('shared')
+        technique.acquire('lock name', 5, 200)
+        serialized = technique.serialize()
+        restored = SharedExclusiveTechnique.from_serialized_technique(
+            serialized, mock.Mock(), backend)
+        assert json.loads(serialized)['mode'] == 'shared'
+        assert restored._mode == 'shared'
+        assert restored._versions == technique._versions
+
+    def test_cannot_be_acquired_in_group(self, shared_exclusive_factory):
+        technique, _, _ = shared_exclusive_factory('exclusive')
+        assert not technique.SUPPORTS_TRANSACTIONS
+        with pytest.raises(ValueError):
+            LockGroup(['a', 'b'], technique)
+
+
+class Clock(FakeTime):
+    """A clock that only moves when set, or when waited on."""
+    def __init__(self, now=1):
+        super(Clock, self).__init__()
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def wait(self, amt, event=None):
+        self.sleeps.append(amt)
+        self.now += amt
+        return False
+
+
+class TestSharedExclusiveTechniqueMetrics(object):
+    def test_does_report_uncontended_acquire(self, shared_exclusive_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, _, _ = shared_exclusive_factory(
+            'exclusive', metrics=metrics)
+        technique.acquire('lock name', 5, 200)
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 0, 0)
+
+    def test_does_report_attempts_and_sleeps(self, shared_exclusive_factory):
+        reader, backend, _ = shared_exclusive_factory('shared')
+        reader.acquire('lock name', 5, 200)
+
+        class ReleasingTime(FakeTime):
+            def wait(self, amt, event=None):
+                self.sleeps.append(amt)
+                if 'lock name' in reader._versions:
+                    reader.release('lock name')
+                return False
+
+        metrics = mock.Mock(spec=MetricsHook)
+        writer, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=ReleasingTime(),
+            wait_strategy=FixedWaitStrategy(1), metrics=metrics)
+        writer.acquire('lock name', 5, 200)
+        metrics.on_acquire.assert_called_once_with('lock name', 2, 0, 1)
+
+    def test_does_report_try_acquire(self, shared_exclusive_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, backend, _ = shared_exclusive_factory(
+            'exclusive', metrics=metrics)
+        other, _, _ = shared_exclusive_factory('exclusive', backend)
+        assert technique.try_acquire('lock name', 5)
+        other.acquire('other lock', 5, 200)
+        assert not technique.try_acquire('other lock', 5)
+        metrics.on_acquire.assert_called_once_with('lock name', 1, 0, 0)
+
+    def test_does_report_refresh_age(self, shared_exclusive_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        clock = Clock(1000)
+        technique, _, _ = shared_exclusive_factory(
+            'shared', fake_time=clock, metrics=metrics)
+        technique.acquire('lock name', 5, 200)
+        clock.now = 1003.75
+        technique.refresh('lock name')
+        metrics.on_refresh.assert_called_once_with('lock name', 3.75, 5)
+        assert not metrics.on_lock_lost.called
+
+    def test_does_report_lost_lock_on_refresh(self, shared_exclusive_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, backend, _ = shared_exclusive_factory(
+            'shared', metrics=metrics)
+        technique.acquire('lock name', 5, 200)
+        backend.items.clear()
+        with pytest.raises(LockLostError):
+            technique.refresh('lock name')
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+        assert not metrics.on_refresh.called
+
+    def test_does_report_lost_lock_on_release(self, shared_exclusive_factory):
+        metrics = mock.Mock(spec=MetricsHook)
+        technique, backend, _ = shared_exclusive_factory(
+            'exclusive', metrics=metrics)
+        technique.acquire('lock name', 5, 200)
+        backend.items.clear()
+        with pytest.raises(LockLostError):
+            technique.release('lock name')
+        metrics.on_lock_lost.assert_called_once_with('lock name')
+
+    def test_does_report_refresh_age_after_hand_off(
+            self, shared_exclusive_factory):
+        queue = LocalWaitQueue()
+        metrics = mock.Mock(spec=MetricsHook)
+        clock = Clock(1000)
+        holder, backend, _ = shared_exclusive_factory(
+            'exclusive', fake_time=clock, wait_queue=queue)
+        waiter, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=clock, wait_queue=queue,
+            metrics=metrics)
+        holder.acquire('lock name', 20, 10)
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+        clock.now = 1004
+        waiter.refresh('lock name')
+
+        metrics.on_refresh.assert_called_once_with('lock name', 4, 30)
+
+
+class TestSharedExclusiveTechniquePolling(object):
+    def test_does_poll_with_eventually_consistent_reads(
+            self, shared_exclusive_factory):
+        reader, backend, _ = shared_exclusive_factory('shared')
+        reader.acquire('lock name', 5, 200)
+        original_get = backend.get
+        reads = []
+
+        def get(key, attributes, consistent=True):
+            reads.append(consistent)
+            return original_get(key, attributes, consistent)
+
+        class ReleasingTime(FakeTime):
+            def wait(self, amt, event=None):
+                if 'lock name' in reader._versions:
+                    reader.release('lock name')
+                return False
+
+        writer, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=ReleasingTime(),
+            wait_strategy=FixedWaitStrategy(1), poll_with_reads=True)
+        backend.get = get
+        writer.acquire('lock name', 5, 200)
+        # The first read decides whether to wait at all. The reader's own
+        # release reads consistently, the poll after waiting does not.
+        assert reads == [True, True, False]
+        assert 'lock name' in writer._versions
+
+
+class TestSharedExclusiveTechniqueWaitQueue(object):
+    def test_does_hand_off_to_local_waiter(self, shared_exclusive_factory):
+        queue = LocalWaitQueue()
+        holder, backend, _ = shared_exclusive_factory(
+            'exclusive', wait_queue=queue)
+        waiter, _, _ = shared_exclusive_factory(
+            'exclusive', backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        writes = backend.writes
+
+        thread = threading.Thread(
+            target=waiter.acquire, args=('lock name', 30, 10))
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+
+        # The waiter never went to the backend itself, the holder swapped
+        # it into the entry in its place.
+        assert backend.writes == writes + 1
+        item = backend.items['lock name']
+        assert list(item['holders']) == [waiter._versions['lock name']]
+        assert item['mode'] == 'exclusive'
+        assert holder._versions == {}
+
+        waiter.release('lock name')
+        assert 'lock name' not in backend.items
+        assert queue._entries == {}
+
+    def test_does_not_hand_off_ahead_of_other_intent(
+            self, shared_exclusive_factory):
+        queue = LocalWaitQueue()
+        holder, backend, _ = shared_exclusive_factory(
+            'exclusive', wait_queue=queue)
+        waiter, _, _ = shared_exclusive_factory(
+            'exclusive', backend, fake_time=Clock(),
+            wait_strategy=FixedWaitStrategy(1), wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        backend.items['lock name']['intent'] = {'elsewhere': 10 ** 12}
+        errors = []
+
+        def acquire():
+            try:
+                waiter.acquire('lock name', 30, 5)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        wait_for_waiters(queue, 'lock name', 1)
+        holder.release('lock name')
+        thread.join(5)
+
+        # The lock was released to the backend, where the other agent's
+        # intent kept the local waiter out.
+        assert len(errors) == 1
+        assert isinstance(errors[0], LockNotGrantedError)
+        item = backend.items['lock name']
+        assert item['holders'] == {}
+        assert item['intent'] == {'elsewhere': 10 ** 12}
+        assert holder._versions == {}
+        assert queue._entries == {}
+
+    def test_shared_locks_do_not_wait_in_line(
+            self, shared_exclusive_factory):
+        queue = LocalWaitQueue()
+        first, backend, _ = shared_exclusive_factory(
+            'shared', wait_queue=queue)
+        second, _, _ = shared_exclusive_factory(
+            'shared', backend, wait_queue=queue)
+        first.acquire('lock name', 20, 10)
+        assert second.try_acquire('lock name', 20)
+        assert len(backend.items['lock name']['holders']) == 2
+        assert queue._entries == {}
+
+    def test_try_acquire_does_not_ask_backend_if_held_locally(
+            self, shared_exclusive_factory):
+        queue = LocalWaitQueue()
+        holder, backend, _ = shared_exclusive_factory(
+            'exclusive', wait_queue=queue)
+        other, _, _ = shared_exclusive_factory(
+            'exclusive', backend, wait_queue=queue)
+        holder.acquire('lock name', 20, 10)
+        writes = backend.writes
+        assert other.try_acquire('lock name', 20) is False
+        assert backend.writes == writes
+
+
+class TestSharedExclusiveTechniqueExpiry(object):
+    def test_lease_ending_at_cutoff_is_not_active(
+            self, shared_exclusive_factory):
+        technique, _, _ = shared_exclusive_factory('exclusive')
+        # With the default clock skew of one second, a lease that ran out
+        # exactly one second ago no longer counts.
+        item = {'holders': {'old': 1000}, 'intent': {'waiting': 1001}}
+        holders, intent = technique._active_entries(item, 2)
+        assert holders == {}
+        assert intent == {'waiting': 1001}
@@ -0,0 +1,313 @@
+import boto3
+import pytest
+import mock
+from botocore.awsrequest import AWSResponse
+
+from lynk.backends.base import BaseBackend
+from lynk.backends.dynamodb_client import DynamoDBClientBackendBridgeFactory
+from lynk.exceptions import RequestThrottledError
+from lynk.throttle import AdaptiveRateLimiter
+from lynk.throttle import RateLimitedBackend
+from lynk.throttle import RetryPolicy
+from lynk.throttle import is_throttling_error
+from lynk.throttle import is_urgent
+from lynk.throttle import urgent
+from lynk.utils import TimeUtils
+from lynk.wait import BaseWaitStrategy
+
+
+class ServiceError(Exception):
+    def __init__(self, code, reasons=None):
+        self.response = {'Error': {'Code': code}}
+        if reasons is not None:
+            self.response['CancellationReasons'] = [
+                {'Code': reason} for reason in reasons]
+
+
+@pytest.fixture
+def create_limiter():
+    def wrapped(**kwargs):
+        time_utils = mock.Mock(spec=TimeUtils)
+        time_utils.time.return_value = 1000.0
+        limiter = AdaptiveRateLimiter(time_utils=time_utils, **kwargs)
+        return limiter, time_utils
+    return wrapped
+
+
+@pytest.fixture
+def create_backend():
+    def wrapped(rate_limiter=None, **kwargs):
+        backend = mock.Mock(spec=BaseBackend)
+        time_utils = mock.Mock(spec=TimeUtils)
+        time_utils.time.return_value = 1000.0
+        backoff = mock.Mock(spec=BaseWaitStrategy)
+        backoff.next_wait.return_value = 0.5
+        policy = RetryPolicy(backoff=backoff, **kwargs)
+        limited = RateLimitedBackend(
+            backend, rate_limiter=rate_limiter, retry_policy=policy,
+            time_utils=time_utils)
+        return backend, limited, time_utils
+    return wrapped
+
+
+class TestUrgent(object):
+    def test_does_mark_requests_in_block(self):
+        assert is_urgent() is False
+        with urgent():
+            assert is_urgent() is True
+            with urgent():
+                assert is_urgent() is True
+            assert is_urgent() is True
+        assert is_urgent() is False
+
+
+class TestIsThrottlingError(object):
+    def test_does_recognize_throttling_codes(self):
+        assert is_throttling_error(
+            ServiceError('ProvisionedThroughputExceededException'))
+        assert not is_throttling_error(
+            ServiceError('ConditionalCheckFailedException'))
+        assert not is_throttling_error(ValueError())
+
+    def test_does_recognize_throttled_transactions(self):
+        assert is_throttling_error(ServiceError(
+            'TransactionCanceledException', ['None', 'ThrottlingError']))
+        assert not is_throttling_error(ServiceError(
+            'TransactionCanceledException', ['None', 'TransactionConflict']))
+
+
+class TestAdaptiveRateLimiter(object):
+    def test_does_allow_burst_of_capacity(self, create_limiter):
+        limiter, _ = create_limiter(rate=4, urgent_reserve=0)
+        for _ in range(4):
+            assert limiter._take(False, 1000.0) == 0
+        assert limiter._take(False, 1000.0) == pytest.approx(0.25)
+
+    def test_does_refill_over_time(self, create_limiter):
+        limiter, _ = create_limiter(rate=4, urgent_reserve=0)
+        for _ in range(4):
+            limiter._take(False, 1000.0)
+        assert limiter._take(False, 1000.25) == 0
+
+    def test_does_keep_reserve_for_urgent_requests(self, create_limiter):
+        limiter, _ = create_limiter(rate=4, urgent_reserve=0.5)
+        assert limiter._take(False, 1000.0) == 0
+        assert limiter._take(False, 1000.0) == 0
+        assert limiter._take(False, 1000.0) > 0
+        assert limiter._take(True, 1000.0) == 0
+        assert limiter._take(True, 1000.0) == 0
+
+    def test_does_hold_back_others_while_urgent_wait(self, create_limiter):
+        limiter, _ = create_limiter(rate=4, urgent_reserve=0)
+        limiter._urgent_waiters = 1
+        assert limiter._take(False, 1000.0) > 0
+        assert limiter._take(True, 1000.0) == 0
+
+    def test_does_raise_at_deadline(self, create_limiter):
+        limiter, _ = create_limiter(rate=1, urgent_reserve=0)
+        limiter.acquire()
+        with pytest.raises(RequestThrottledError):
+            limiter.acquire(deadline=1000.0)
+
+    def test_does_increase_rate_additively(self, create_limiter):
+        limiter, _ = create_limiter(rate=10, increase=2)
+        limiter.on_success()
+        assert limiter.rate == pytest.approx(10.2)
+
+    def test_does_not_exceed_max_rate(self, create_limiter):
+        limiter, _ = create_limiter(rate=10, max_rate=10)
+        limiter.on_success()
+        assert limiter.rate == 10
+
+    def test_does_decrease_rate_multiplicatively(self, create_limiter):
+        limiter, time_utils = create_limiter(rate=10, decrease=0.5)
+        limiter.on_throttle()
+        assert limiter.rate == 5
+        # Throttling right after a cut is caused by earlier requests.
+        limiter.on_throttle()
+        assert limiter.rate == 5
+        time_utils.time.return_value = 1002.0
+        limiter.on_throttle()
+        assert limiter.rate == 2.5
+
+    def test_does_not_go_below_min_rate(self, create_limiter):
+        limiter, _ = create_limiter(rate=2, min_rate=1.5)
+        limiter.on_throttle()
+        assert limiter.rate == 1.5
+
+
+class TestRetryPolicy(object):
+    def test_does_retry_throttling_and_transient_errors(self):
+        policy = RetryPolicy()
+        assert policy.is_retryable(ServiceError('ThrottlingException'))
+        assert policy.is_retryable(ServiceError('InternalServerError'))
+        assert policy.is_retryable(ServiceError(
+            'TransactionCanceledException', ['None', 'TransactionConflict']))
+
+    def test_does_not_retry_other_errors(self):
+        policy = RetryPolicy()
+        assert not policy.is_retryable(
+            ServiceError('ConditionalCheckFailedException'))
+        assert not policy.is_retryable(ServiceError(
+            'TransactionCanceledException',
+            ['None', 'ConditionalCheckFailed']))
+        assert not policy.is_retryable(ValueError())
+
+    def test_does_only_retry_rejected_requests_if_not_idempotent(self):
+        policy = RetryPolicy()
+        assert policy.is_retryable(
+            ServiceError('ThrottlingException'), idempotent=False)
+        assert policy.is_retryable(ServiceError(
+            'TransactionCanceledException', ['ThrottlingError']),
+            idempotent=False)
+        assert not policy.is_retryable(
+            ServiceError('InternalServerError'), idempotent=False)
+
+
+class TestRateLimitedBackend(object):
+    def test_does_pass_requests_through(self, create_backend):
+        backend, limited, _ = create_backend()
+        backend.get.return_value = {'versionNumber': 'a'}
+        limited.put({'lockKey': 'foo'}, condition='condition')
+        assert limited.get({'lockKey': 'foo'}, ['versionNumber']) == {
+            'versionNumber': 'a'}
+        backend.put.assert_called_with(
+            {'lockKey': 'foo'}, condition='condition')
+
+    def test_does_copy_transaction_limit(self):
+        backend = mock.Mock(spec=BaseBackend)
+        backend.MAX_TRANSACTION_ITEMS = 25
+        assert RateLimitedBackend(backend).MAX_TRANSACTION_ITEMS == 25
+
+    def test_does_retry_throttled_requests(self, create_backend):
+        backend, limited, time_utils = create_backend()
+        backend.delete.side_effect = [
+            ServiceError('ProvisionedThroughputExceededException'), None]
+        limited.delete({'lockKey': 'foo'})
+        assert backend.delete.call_count == 2
+        time_utils.sleep.assert_called_once_with(0.5)
+
+    def test_does_not_retry_failed_conditions(self, create_backend):
+        backend, limited, time_utils = create_backend()
+        error = ServiceError('ConditionalCheckFailedException')
+        backend.put.side_effect = error
+        with pytest.raises(ServiceError) as e:
+            limited.put({'lockKey': 'foo'})
+        assert e.value is error
+        assert backend.put.call_count == 1
+        assert not time_utils.sleep.called
+
+    def test_does_not_retry_conditional_writes_after_server_errors(
+            self, create_backend):
+        backend, limited, time_utils = create_backend()
+        error = ServiceError('InternalServerError')
+        backend.put.side_effect = error
+        backend.update.side_effect = error
+        backend.delete.side_effect = error
+        backend.transact_write.side_effect = error
+        with pytest.raises(ServiceError):
+            limited.put({'lockKey': 'foo'}, condition='condition')
+        with pytest.raises(ServiceError):
+            limited.update({'lockKey': 'foo'}, {'a': 1}, condition='condition')
+        with pytest.raises(ServiceError):
+            limited.delete({'lockKey': 'foo'}, condition='condition')
+        with pytest.raises(ServiceError):
+            limited.transact_write([])
+        assert backend.put.call_count == 1
+        assert backend.update.call_count == 1
+        assert backend.delete.call_count == 1
+        assert backend.transact_write.call_count == 1
+        assert not time_utils.sleep.called
+
+    def test_does_retry_throttled_conditional_writes(self, create_backend):
+        backend, limited, _ = create_backend()
+        backend.put.side_effect = [ServiceError('ThrottlingException'), None]
+        limited.put({'lockKey': 'foo'}, condition='condition')
+        assert backend.put.call_count == 2
+
+    def test_does_retry_unconditional_requests_after_server_errors(
+            self, create_backend):
+        backend, limited, _ = create_backend()
+        backend.get.side_effect = [ServiceError('InternalServerError'), None]
+        backend.delete.side_effect = [
+            ServiceError('ServiceUnavailable'), None]
+        limited.get({'lockKey': 'foo'}, ['versionNumber'])
+        limited.delete({'lockKey': 'foo'})
+        assert backend.get.call_count == 2
+        assert backend.delete.call_count == 2
+
+    def test_does_give_up_after_max_attempts(self, create_backend):
+        backend, limited, _ = create_backend(max_attempts=3)
+        backend.update.side_effect = ServiceError('ThrottlingException')
+        with pytest.raises(ServiceError):
+            limited.update({'lockKey': 'foo'}, {'a': 1})
+        assert backend.update.call_count == 3
+
+    def test_does_give_up_at_timeout(self, create_backend):
+        backend, limited, _ = create_backend(timeout=0.25)
+        backend.get.side_effect = ServiceError('ThrottlingException')
+        with pytest.raises(ServiceError):
+            limited.get({'lockKey': 'foo'}, ['versionNumber'])
+        assert backend.get.call_count == 1
+
+    def test_does_report_to_rate_limiter(self, create_backend):
+        limiter = mock.Mock(spec=AdaptiveRateLimiter)
+        backend, limited, _ = create_backend(rate_limiter=limiter)
+        backend.transact_write.side_effect = [
+            ServiceError('TransactionCanceledException', ['ThrottlingError']),
+            None,
+        ]
+        with urgent():
+            limited.transact_write([])
+        assert limiter.acquire.call_args_list == [
+            mock.call(True, None), mock.call(True, None)]
+        limiter.on_throttle.assert_called_once_with()
+        limiter.on_success.assert_called_once_with()
+
+    def test_acquires_are_not_urgent(self, create_backend):
+        limiter = mock.Mock(spec=AdaptiveRateLimiter)
+        _, limited, _ = create_backend(rate_limiter=limiter)
+        limited.put({'lockKey': 'foo'})
+        limiter.acquire.assert_called_once_with(False, None)
+
+
+class FakeRawResponse(object):
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self, **kwargs):
+        yield self._body
+
+
+class TestRateLimitedDynamoDBClient(object):
+    def test_does_see_every_throttled_response(self):
+        session = boto3.session.Session(
+            aws_access_key_id='foo', aws_secret_access_key='bar',
+            region_name='us-west-2')
+        factory = DynamoDBClientBackendBridgeFactory(
+            session=session, max_attempts=1)
+        _, backend = factory.create('table_name')
+        responses = [
+            (400, b'{"__type": "com.amazonaws.dynamodb.v20120810#'
+                  b'ProvisionedThroughputExceededException"}'),
+            (200, b'{}'),
+        ]
+        sent = []
+
+        def send(request, **kwargs):
+            sent.append(request)
+            status, body = responses.pop(0)
+            return AWSResponse(
+                request.url, status, {}, FakeRawResponse(body))
+
+        factory._get_shared_client().meta.events.register(
+            'before-send.dynamodb.PutItem', send)
+        limiter = mock.Mock(spec=AdaptiveRateLimiter)
+        time_utils = mock.Mock(spec=TimeUtils)
+        time_utils.time.return_value = 1000.0
+        limited = RateLimitedBackend(
+            backend, rate_limiter=limiter, time_utils=time_utils)
+        limited.put({'lockKey': 'foo'})
+        assert len(sent) == 2
+        limiter.on_throttle.assert_called_once_with()
+        limiter.on_success.assert_called_once_with()
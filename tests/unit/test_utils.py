@@ -1,3 +1,5 @@
+import threading
+
 from lynk.utils import TimeUtils
 
 
@@ -5,3 +7,22 @@ class TestTimeUtils(object):
     def test_can_create_utils(self):
         utils = TimeUtils()
         assert isinstance(utils, TimeUtils)
+
+    def test_perf_counter_does_not_go_backwards(self):
+        utils = TimeUtils()
+        first = utils.perf_counter()
+        assert utils.perf_counter() >= first
+
+    def test_wait_without_event_does_sleep(self):
+        utils = TimeUtils()
+        assert utils.wait(0) is False
+
+    def test_wait_does_return_when_event_is_set(self):
+        utils = TimeUtils()
+        event = threading.Event()
+        event.set()
+        assert utils.wait(100, event) is True
+
+    def test_wait_does_time_out(self):
+        utils = TimeUtils()
+        assert utils.wait(0.01, threading.Event()) is False
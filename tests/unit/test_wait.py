@@ -0,0 +1,159 @@
+import random
+import threading
+
+import pytest
+
+from lynk.wait import AcquireTimer
+from lynk.wait import LeaseWaitStrategy
+from lynk.wait import ExponentialBackoffWaitStrategy
+from lynk.exceptions import LockNotGrantedError
+from lynk.exceptions import LockAcquireCancelledError
+
+
+class MaxRandom(random.Random):
+    def uniform(self, a, b):
+        return b
+
+
+class FakeTime(object):
+    def __init__(self, now=0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def wait(self, amt, event=None):
+        self.now += amt
+        return event is not None and event.is_set()
+
+
+class FakeSubscription(object):
+    def __init__(self, fake_time, notified_after=None):
+        self._fake_time = fake_time
+        self._notified_after = notified_after
+
+    def wait(self, timeout):
+        if self._notified_after is not None and \
+                self._notified_after <= timeout:
+            self._fake_time.now += self._notified_after
+            return True
+        self._fake_time.now += timeout
+        return False
+
+
+class TestLeaseWaitStrategy(object):
+    def test_does_wait_for_remaining_lease(self):
+        strategy = LeaseWaitStrategy()
+        assert strategy.next_wait(1, 0, 20) == 20
+
+    def test_does_not_truncate_at_deadline(self):
+        assert LeaseWaitStrategy.truncate_at_deadline is False
+
+
+class TestExponentialBackoffWaitStrategy(object):
+    def test_does_truncate_at_deadline(self):
+        assert ExponentialBackoffWaitStrategy.truncate_at_deadline is True
+
+    def test_does_raise_on_unknown_jitter(self):
+        with pytest.raises(ValueError):
+            ExponentialBackoffWaitStrategy(jitter='none')
+
+    def test_full_jitter_does_grow_exponentially(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=100, min_interval=0, rand=MaxRandom())
+        waits = [strategy.next_wait(i, 0, 1000) for i in range(1, 5)]
+        assert waits == [2, 4, 8, 16]
+
+    def test_full_jitter_is_capped(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=5, min_interval=0, rand=MaxRandom())
+        assert strategy.next_wait(10, 0, 1000) == 5
+
+    def test_full_jitter_does_not_overflow(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=5, min_interval=0, rand=MaxRandom())
+        assert strategy.next_wait(100000, 0, 1000) == 5
+
+    def test_full_jitter_is_random(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=100, min_interval=0, rand=random.Random(0))
+        waits = [strategy.next_wait(5, 0, 1000) for _ in range(20)]
+        assert len(set(waits)) == 20
+        assert all(0 <= wait <= 32 for wait in waits)
+
+    def test_decorrelated_jitter_does_grow_from_previous_wait(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=100, min_interval=0, jitter='decorrelated',
+            rand=MaxRandom())
+        assert strategy.next_wait(1, 0, 1000) == 1
+        assert strategy.next_wait(2, 1, 1000) == 3
+        assert strategy.next_wait(3, 3, 1000) == 9
+
+    def test_decorrelated_jitter_is_capped(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=5, min_interval=0, jitter='decorrelated',
+            rand=MaxRandom())
+        assert strategy.next_wait(3, 3, 1000) == 5
+
+    def test_does_ignore_remaining_lease(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=1, cap=100, min_interval=0, rand=MaxRandom())
+        assert strategy.next_wait(4, 0, 3) == 16
+
+    def test_does_wait_at_least_min_interval(self):
+        strategy = ExponentialBackoffWaitStrategy(
+            base=0.1, cap=0.1, min_interval=0.5, rand=MaxRandom())
+        assert strategy.next_wait(4, 0, 1000) == 0.5
+
+
+class TestAcquireTimer(object):
+    def test_does_count_attempts_and_waits(self):
+        fake_time = FakeTime()
+        timer = AcquireTimer(fake_time, LeaseWaitStrategy(), 30)
+        sleep_time = timer.next_sleep(fake_time.now, 10)
+        assert sleep_time == 10
+        assert timer.wait(sleep_time) == (False, 10)
+        assert timer.wait(timer.next_sleep(fake_time.now, 5)) == (False, 5)
+        assert timer.attempts == 2
+        assert timer.slept == 15
+
+    def test_does_give_up_if_wait_runs_past_deadline(self):
+        timer = AcquireTimer(FakeTime(), LeaseWaitStrategy(), 5)
+        with pytest.raises(LockNotGrantedError):
+            timer.next_sleep(0, 10)
+
+    def test_does_give_up_once_deadline_has_passed(self):
+        strategy = ExponentialBackoffWaitStrategy()
+        timer = AcquireTimer(FakeTime(), strategy, 5, start_time=100)
+        with pytest.raises(LockNotGrantedError):
+            timer.next_sleep(105, 0)
+
+    @pytest.mark.parametrize('can_be_woken,strategy', [
+        (True, LeaseWaitStrategy()),
+        (False, ExponentialBackoffWaitStrategy(
+            base=10, cap=10, rand=MaxRandom())),
+    ])
+    def test_does_cut_wait_short_at_deadline(self, can_be_woken, strategy):
+        timer = AcquireTimer(
+            FakeTime(), strategy, 5, can_be_woken=can_be_woken)
+        assert timer.next_sleep(1, 10) == 4
+
+    def test_does_wake_up_on_notification(self):
+        fake_time = FakeTime()
+        timer = AcquireTimer(fake_time, LeaseWaitStrategy(), 30)
+        subscription = FakeSubscription(fake_time, notified_after=2)
+        assert timer.wait(10, subscription) == (True, 2)
+        assert timer.slept == 2
+
+    def test_does_raise_when_cancelled(self):
+        fake_time = FakeTime()
+        timer = AcquireTimer(fake_time, LeaseWaitStrategy(), 30)
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with pytest.raises(LockAcquireCancelledError):
+            timer.wait(10, cancel_event=cancel_event)
+        with pytest.raises(LockAcquireCancelledError):
+            timer.wait(10, FakeSubscription(fake_time), cancel_event)